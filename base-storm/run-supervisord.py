@@ -1,20 +1,601 @@
 #!/usr/bin/env python
 
+from __future__ import print_function
+
 import argparse
+import copy
+import ctypes
+import ctypes.util
+import glob
+import hashlib
+import json
+import multiprocessing
 import os
 import os.path
 import re
+import select
+import signal
+import socket
+import struct
 import subprocess
+import sys
+import tempfile
+import time
 import yaml
 
+try:
+  # Added next to this script in the image
+  import timing
+except ImportError:
+  # Run from the storm-docker repository
+  sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."
+  ))
+  from docker_python_helpers import timing
+
+# Use the LibYAML based loader if PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 STORM_HOME = os.environ["STORM_HOME"]
 
-# Opens the `storm-setup.yaml` file added to this Docker container. The file was
-# copied from the `config/storm-setup.yaml` file in the storm-docker repository
-# during a `make` execution.
-stormSetupConfig = None
-with open(os.environ["STORM_SETUP_YAML"]) as f:
-  stormSetupConfig = yaml.load(f.read())
+# Prefix of the netty transport settings in `storm.yaml`
+NETTY_PREFIX = "storm.messaging.netty."
+
+SUPERVISOR_CONF_DIR = "/etc/supervisor/conf.d"
+STORM_YAML = os.path.join(STORM_HOME, "conf", "storm.yaml")
+DNSMASQ_EXTRA_HOSTS = "/etc/dnsmasq-extra-hosts"
+
+# `storm-setup.yaml` contents the files of this container were last generated
+# from, kept for the `config-reload` program (see `watch_config`)
+APPLIED_SETUP_JSON = "/var/run/storm-setup.applied.json"
+
+# Optional programs of the storm-supervisor image, and the `storm-setup.yaml`
+# section configuring each of them
+OPTIONAL_PROGRAMS = [
+  ("storm.supervisor.metrics", "metrics-exporter"),
+  ("storm.supervisor.logsearch", "log-index"),
+]
+
+# `storm.yaml` keys read by a single Storm daemon. Every other key (eg.
+# `nimbus.host`, `storm.zookeeper.servers`, `topology.*`) is read by all of
+# them.
+STORM_DAEMON_KEY_PREFIXES = {
+  "drpc": "drpc.",
+  "logviewer": "logviewer.",
+  "supervisor": "supervisor.",
+  "ui": "ui.",
+}
+
+# Sections whose changes need the container to be run again, as they change
+# its `docker run` arguments
+NON_RELOADABLE_SECTIONS = ["network_mode", "config.reload",
+  "service.discovery"]
+
+# inotify(7) events which may mean that `storm-setup.yaml` changed. The
+# directory holding it is watched, so that files replaced by a rename (as most
+# editors and `scp` do) are noticed too.
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+INOTIFY_MASK = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+INOTIFY_EVENT = struct.Struct("iIII")
+
+# Seconds without further changes before a changed `storm-setup.yaml` is read
+RELOAD_SETTLE_SECONDS = 1.0
+# Seconds between two checks of `storm-setup.yaml` when inotify is unavailable
+POLL_SECONDS = 5.0
+
+def visible_cpu_count():
+  """Returns the number of CPUs this container may run on, which is less than
+  the host's CPU count if the container was pinned with `--cpuset-cpus`."""
+  try:
+    with open("/proc/self/status") as f:
+      for line in f:
+        if line.startswith("Cpus_allowed_list:"):
+          count = 0
+          for cpuRange in line.split(":", 1)[1].strip().split(","):
+            first, _, last = cpuRange.partition("-")
+            count += int(last or first) - int(first) + 1
+          return count
+  except (IOError, ValueError):
+    pass
+  return multiprocessing.cpu_count()
+
+def netty_profile_settings(profile, cpus):
+  """Returns the netty transport settings of a `netty.profile`.
+
+  Args:
+    profile(str): "throughput" or "latency"
+    cpus(int): number of CPUs visible to this container
+
+  Returns:
+    dict: `storm.yaml` keys (without the `storm.messaging.netty.` prefix) ->
+      values
+  """
+  if profile == "throughput":
+    # Few, busy netty threads moving large batches; workers also need CPUs
+    threads = max(1, cpus // 4)
+    return {
+      "server_worker_threads": threads,
+      "client_worker_threads": threads,
+      "buffer_size": 5242880,
+      "transfer.batch.size": 262144,
+      "max_retries": 30,
+      "min_wait_ms": 100,
+      "max_wait_ms": 1000,
+    }
+  elif profile == "latency":
+    # More netty threads so that messages do not queue behind each other,
+    # small batches, and quick reconnects
+    threads = max(1, cpus // 2)
+    return {
+      "server_worker_threads": threads,
+      "client_worker_threads": threads,
+      "buffer_size": 1048576,
+      "transfer.batch.size": 16384,
+      "max_retries": 10,
+      "min_wait_ms": 50,
+      "max_wait_ms": 500,
+    }
+  raise ValueError(
+    "Unknown netty.profile \"{}\" (use \"throughput\" or \"latency\")".format(
+      profile
+    )
+  )
+
+
+def load_storm_setup_yaml(path):
+  with open(path) as f:
+    return yaml.load(f.read(), Loader=YamlLoader)
+
+def supervisor_hostnames(stormSetupConfig, supervisorHost):
+  """Returns the hostnames of the storm-supervisor containers of a supervisor
+  host, as named by `docker_python_helpers/supervisor_containers.py`:
+  `<host>-supervisor`, or `<host>-supervisor-<n>` for each of the `count`
+  containers of the `storm.supervisor.containers` section."""
+  containersConfig = stormSetupConfig.get("storm.supervisor.containers") or {}
+  override = (containersConfig.get("servers") or {}).get(supervisorHost) or {}
+  count = int(override.get("count", containersConfig.get("count", 1)))
+  if count == 1:
+    return ["{}-supervisor".format(supervisorHost)]
+  return ["{}-supervisor-{}".format(supervisorHost, idx)
+    for idx in range(count)
+  ]
+
+def dnsmasq_extra_hosts(stormSetupConfig, myIpAddresses, myHostname):
+  """Returns the contents of `/etc/dnsmasq-extra-hosts`: the storm-supervisor
+  containers of the hosts whose IP addresses are not equal to that of this
+  host machine, and the other storm-supervisor containers of this container's
+  own host (`myHostname`), reached through the ports they publish on it."""
+  lines = []
+  stormSupervisorHosts = stormSetupConfig["storm.supervisor.hosts"]
+  for supervisor_host in stormSupervisorHosts:
+    ip_address = stormSetupConfig["servers"][supervisor_host]
+    aliases = supervisor_hostnames(stormSetupConfig, supervisor_host)
+    if ip_address in myIpAddresses:
+      if myHostname not in aliases or ip_address.startswith("127."):
+        continue
+      aliases = [alias for alias in aliases if alias != myHostname]
+    for alias in aliases:
+      lines.append("{} {}\n".format(ip_address, alias))
+  return "".join(lines)
+
+def storm_yaml_config(stormSetupConfig, myIpAddresses, supervisorSlotsPorts,
+    hostNetwork):
+  """Returns the dict to write to the `$STORM_HOME/conf/storm.yaml` file.
+
+  Args:
+    stormSetupConfig(dict): the dict defined by the `storm-setup.yaml` file.
+      It is not modified.
+    myIpAddresses(list of str): IP addresses of the host machine
+    supervisorSlotsPorts(list of int): worker slot ports planned for the host
+      machine, if any
+    hostNetwork(bool): True if this container is on the host network
+  """
+  # This dict contains everything that should be written to the
+  # `$STORM_HOME/conf/storm.yaml` file
+  stormYamlConfig = copy.deepcopy(stormSetupConfig["storm.yaml"])
+
+  # Worker slots planned for the host machine by
+  # `docker_python_helpers/slot_planner.py`
+  if supervisorSlotsPorts:
+    stormYamlConfig["supervisor.slots.ports"] = list(supervisorSlotsPorts)
+
+  # Fill in the netty transport settings of the chosen `netty.profile` for the
+  # CPUs of this container. Settings given explicitly under `storm.yaml` win.
+  if stormSetupConfig.get("netty.profile"):
+    nettySettings = netty_profile_settings(stormSetupConfig["netty.profile"],
+      visible_cpu_count()
+    )
+    for key, value in nettySettings.items():
+      stormYamlConfig.setdefault(NETTY_PREFIX + key, value)
+
+  # Build the storm.zookeeper.servers section of the `storm.yaml` file
+  # by replacing the SSH hostnames with actual IP addresses
+  storm_yaml_zk_servers_section = [
+    stormSetupConfig["servers"][zk_server] for
+      zk_server in stormYamlConfig["storm.zookeeper.servers"]
+  ]
+
+  # We're gonna check if a Zookeeper runs on the server hosting our current
+  # Docker container.
+  #
+  # If that's the case, we assume that the Zookeeper is running in a Docker
+  # container, and that this Docker container we're in was run with a link to
+  # the Zookeeper Docker container.
+  # We use the IP address of the Zookeeper Docker container in place of its
+  # global IP address.
+  zk_server_ip_to_replace = None
+  # Loop through the Zookeeper server IP addresses
+  for zk_server_ip in storm_yaml_zk_servers_section:
+    if zk_server_ip in myIpAddresses:
+      # The server hosting our current Docker container has a Zookeeper
+      # running.
+      zk_server_ip_to_replace = zk_server_ip
+      break
+
+  # Zookeeper is running on the same server (and this container is linked to
+  # it, which is never the case on the host network)
+  if zk_server_ip_to_replace is not None and not hostNetwork:
+    # Obtain the index of the Zookeeper IP address we're replacing
+    idx = storm_yaml_zk_servers_section.index(zk_server_ip_to_replace)
+    # Obtain the environment variable name for `storm.zookeeper.port` because
+    # we allow the user to choose the port (so it is no longer the default
+    # 2181)
+    zk_port_env_var = "ZK_PORT_{}_TCP_ADDR".format(
+      stormYamlConfig["storm.zookeeper.port"]
+    )
+    storm_yaml_zk_servers_section.remove(zk_server_ip_to_replace)
+    storm_yaml_zk_servers_section.insert(idx, os.environ[zk_port_env_var])
+
+  # A Zookeeper observer on this server takes the reads (mostly heartbeats) of
+  # this server's Storm daemons off the voting members of the ensemble, so it
+  # is listed first.
+  #
+  # The Zookeeper client shuffles the servers it is given, so with
+  # `local.observer.only` set, the other servers are left out entirely. The
+  # Storm daemons then only fail over once the observer's Docker container is
+  # back.
+  zkMultipleSetup = stormSetupConfig.get("zookeeper.multiple.setup") or {}
+  zkObservers = zkMultipleSetup.get("observers") or []
+  if zk_server_ip_to_replace is not None:
+    localZkIdx = [stormSetupConfig["servers"][zk_server] for zk_server in
+      stormYamlConfig["storm.zookeeper.servers"]
+    ].index(zk_server_ip_to_replace)
+    if stormYamlConfig["storm.zookeeper.servers"][localZkIdx] in zkObservers:
+      localZkServer = storm_yaml_zk_servers_section.pop(localZkIdx)
+      if zkMultipleSetup.get("local.observer.only"):
+        storm_yaml_zk_servers_section = []
+      storm_yaml_zk_servers_section.insert(0, localZkServer)
+
+  stormYamlConfig["storm.zookeeper.servers"] = storm_yaml_zk_servers_section
+
+  # We're gonna check if Storm Nimbus runs on the server hosting our current
+  # Docker container.
+  # If so, we can replace the globally accessible "nimbus.host" IP address
+  # with a "more efficient" IP address (the IP address of the Docker container
+  # running the Storm Nimbus).
+  if not hostNetwork and stormSetupConfig["servers"][
+      stormYamlConfig["nimbus.host"]] in myIpAddresses:
+    # This server has a Storm Nimbus running.
+    # There are 2 possibilities:
+    # 1. This Docker container is the one running the Storm Nimbus.
+    # 2. Storm Nimbus is running on a separate Docker container on the same
+    #    machine, and this Docker container was run with a link to the
+    #    Storm Nimbus Docker container.
+    try:
+      # To determine if it's case number 2, we look for an environment
+      # variable named `NIMBUS_PORT_{XYZ}_TCP_ADDR` where XYZ is the
+      # `nimbus.thrift.port`.
+      # We first construct the name of this environment variable.
+      nimbusEnvVar = "NIMBUS_PORT_{}_TCP_ADDR".format(
+        stormYamlConfig["nimbus.thrift.port"]
+      )
+      # If this Docker container was run with a link to the Storm Nimbus
+      # Docker container, then the environment variable will be present, and
+      # its value is the IP address of the Storm Nimbus Docker container.
+      # We set `nimbus.host` to that value.
+      stormYamlConfig["nimbus.host"] = os.environ[nimbusEnvVar]
+    except KeyError:
+      # The `NIMBUS_PORT_{XYZ}_TCP_ADDR` environment variable does not exist
+      # (there is no Docker link to the Storm Nimbus container), yet the
+      # `nimbus.host` global IP address is one of the IP addresses of this
+      # server.
+      # We assume that this is case 1, and replace the IP address of
+      # `nimbus.host` with the output of `hostname -i`.
+      p = subprocess.Popen(["hostname", "-i"], stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE
+      )
+      out, _ = p.communicate()
+      stormYamlConfig["nimbus.host"] = out.strip()
+  else:
+    # Storm Nimbus not running on the same physical machine (or this container
+    # is on the host network, where Nimbus listens on the host's IP address).
+    # But we have to replace the hostname with the IP address from the server
+    # list
+    stormYamlConfig["nimbus.host"] = \
+      stormSetupConfig["servers"][stormYamlConfig["nimbus.host"]]
+
+  if hostNetwork:
+    # Advertise the host's IP address from the server list to the rest of the
+    # cluster, instead of a container hostname resolved through dnsmasq
+    myIpAddress = advertised_ip_address(stormSetupConfig, myIpAddresses)
+    if myIpAddress is not None:
+      stormYamlConfig.setdefault("storm.local.hostname", myIpAddress)
+  return stormYamlConfig
+
+def program_enabled(stormSetupConfig, section):
+  return (stormSetupConfig.get(section) or {}).get("enabled", True)
+
+def set_program_enabled(program, enabled):
+  """Turns an optional program on or off by renaming its supervisord
+  configuration, which supervisord only reads from `*.conf` files.
+
+  Returns:
+    bool: True if the program was switched
+  """
+  programConf = os.path.join(SUPERVISOR_CONF_DIR, "{}.conf".format(program))
+  disabledConf = programConf + ".disabled"
+  source, dest = (disabledConf, programConf) if enabled else \
+    (programConf, disabledConf)
+  if not os.path.exists(source):
+    return False
+  os.rename(source, dest)
+  return True
+
+def service_discovery_enabled(stormSetupConfig):
+  """Returns True if the supervisors resolve each other through the Zookeeper
+  registry of `storm-service-registry.py`, rather than through the
+  `storm.supervisor.hosts` of `storm-setup.yaml`."""
+  return "service.discovery" in stormSetupConfig and \
+    (stormSetupConfig["service.discovery"] or {}).get("enabled", True) and \
+    stormSetupConfig.get("network_mode") != "host"
+
+def advertised_ip_address(stormSetupConfig, myIpAddresses):
+  """Returns the IP address of the host machine in the server list."""
+  serverIps = set(stormSetupConfig["servers"].values())
+  for myIpAddress in myIpAddresses:
+    if myIpAddress in serverIps:
+      return myIpAddress
+  return None
+
+def write_program_conf(program, command):
+  """Writes the supervisord configuration of a program run as root."""
+  write_if_changed(os.path.join(SUPERVISOR_CONF_DIR, program + ".conf"),
+    "\n".join([
+      "[program:{}]".format(program),
+      "command={}".format(command),
+      "stdout_logfile=/var/log/supervisor/%(program_name)s.log",
+      "stderr_logfile=/var/log/supervisor/%(program_name)s_error.log",
+      "autorestart=true",
+      "user=root",
+    ]) + "\n"
+  )
+
+def remove_program_conf(program):
+  programConf = os.path.join(SUPERVISOR_CONF_DIR, program + ".conf")
+  if os.path.exists(programConf):
+    os.remove(programConf)
+
+def config_reload_enabled(stormSetupConfig):
+  return "config.reload" in stormSetupConfig and \
+    (stormSetupConfig["config.reload"] or {}).get("enabled", True)
+
+def write_if_changed(path, content):
+  """Replaces the contents of `path` (atomically, so that no program reads a
+  partial file) unless they are already equal to `content`.
+
+  Returns:
+    bool: True if the file was written
+  """
+  try:
+    with open(path) as f:
+      if f.read() == content:
+        return False
+  except IOError:
+    pass
+  fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+  with os.fdopen(fd, "w") as f:
+    f.write(content)
+  os.chmod(tmpPath, 0o644)
+  os.rename(tmpPath, path)
+  return True
+
+def storm_programs():
+  """Returns the names of the `storm-<daemon>` supervisord programs of this
+  container."""
+  return sorted(os.path.basename(path)[:-len(".conf")] for path in
+    glob.glob(os.path.join(SUPERVISOR_CONF_DIR, "storm-*.conf"))
+  )
+
+def program_configs(stormSetupConfig, stormYamlConfig):
+  """Returns the configuration each supervisord program of this container
+  effectively runs with: the `storm.yaml` keys its Storm daemon reads, or the
+  `storm-setup.yaml` section of an optional program.
+
+  Returns:
+    dict: program -> JSON string
+  """
+  configs = {}
+  for program in storm_programs():
+    daemon = program[len("storm-"):]
+    otherPrefixes = tuple(prefix for otherDaemon, prefix in
+      STORM_DAEMON_KEY_PREFIXES.items() if otherDaemon != daemon
+    )
+    configs[program] = dict((key, value) for key, value in
+      stormYamlConfig.items() if not key.startswith(otherPrefixes)
+    )
+  for section, program in OPTIONAL_PROGRAMS:
+    configs[program] = stormSetupConfig.get(section)
+  # The registry reads the Zookeeper servers from `storm.yaml`
+  configs["service-registry"] = [stormSetupConfig.get("service.discovery"),
+    stormYamlConfig.get("storm.zookeeper.servers"),
+    stormYamlConfig.get("storm.zookeeper.port"),
+  ]
+  return dict((program, json.dumps(config, sort_keys=True, default=str))
+    for program, config in configs.items()
+  )
+
+def supervisorctl(*args):
+  p = subprocess.Popen(["supervisorctl"] + list(args), stdout=subprocess.PIPE,
+    stderr=subprocess.STDOUT
+  )
+  out, _ = p.communicate()
+  return out.decode("utf-8", "replace").strip()
+
+def reload_config(appliedSetupConfig, stormSetupConfig, parsedArgs):
+  """Brings the configuration of this container from `appliedSetupConfig` to
+  `stormSetupConfig`. Only the files whose contents change are written, and
+  only the programs whose configuration changes are restarted; dnsmasq just
+  re-reads its hosts file.
+
+  Raises:
+    Exception: if `stormSetupConfig` is unusable (eg. a `storm.yaml` key or a
+      server is missing). Nothing is changed in this case.
+  """
+  hostNetwork = appliedSetupConfig.get("network_mode") == "host"
+  for section in NON_RELOADABLE_SECTIONS:
+    if appliedSetupConfig.get(section) != stormSetupConfig.get(section):
+      print("`{}` changed; run this container again to apply it".format(
+        section
+      ))
+
+  myIpAddresses = parsedArgs.my_ip_addresses
+  slotsPorts = parsedArgs.supervisor_slots_ports
+  appliedStormYaml = storm_yaml_config(appliedSetupConfig, myIpAddresses,
+    slotsPorts, hostNetwork
+  )
+  stormYamlConfig = storm_yaml_config(stormSetupConfig, myIpAddresses,
+    slotsPorts, hostNetwork
+  )
+  extraHosts = None
+  # With service discovery, the hosts file is kept by `service-registry`
+  if parsedArgs.is_storm_supervisor and \
+      not service_discovery_enabled(appliedSetupConfig):
+    extraHosts = dnsmasq_extra_hosts(stormSetupConfig, myIpAddresses,
+      socket.gethostname()
+    )
+
+  if extraHosts is not None and \
+      write_if_changed(DNSMASQ_EXTRA_HOSTS, extraHosts) and not hostNetwork:
+    # dnsmasq re-reads its `addn-hosts` files on SIGHUP
+    pid = supervisorctl("pid", "dnsmasq")
+    if pid.isdigit() and int(pid) > 0:
+      os.kill(int(pid), signal.SIGHUP)
+      print("reloaded the hosts of dnsmasq")
+  write_if_changed(STORM_YAML,
+    yaml.dump(stormYamlConfig, default_flow_style=False)
+  )
+
+  # Optional programs turned on or off
+  switched = set()
+  for section, program in OPTIONAL_PROGRAMS:
+    enabled = program_enabled(stormSetupConfig, section)
+    if enabled != program_enabled(appliedSetupConfig, section) and \
+        set_program_enabled(program, enabled):
+      switched.add(program)
+  if switched:
+    supervisorctl("reread")
+    print(supervisorctl("update"))
+
+  appliedConfigs = program_configs(appliedSetupConfig, appliedStormYaml)
+  configs = program_configs(stormSetupConfig, stormYamlConfig)
+  restart = sorted(program for program, config in configs.items()
+    if config != appliedConfigs.get(program) and program not in switched and
+    os.path.exists(os.path.join(SUPERVISOR_CONF_DIR, program + ".conf"))
+  )
+  if restart:
+    print(supervisorctl("restart", *restart))
+
+def save_applied_setup_config(stormSetupConfig):
+  write_if_changed(APPLIED_SETUP_JSON,
+    json.dumps(stormSetupConfig, sort_keys=True, default=str)
+  )
+
+class ConfigFileWatcher(object):
+  """Waits for changes to a file, through inotify(7) on its directory, or by
+  polling the file if inotify is not available."""
+  def __init__(self, path):
+    self.path = path
+    self.fd = None
+    try:
+      libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6",
+        use_errno=True
+      )
+      fd = libc.inotify_init()
+      if fd < 0:
+        raise OSError(ctypes.get_errno(), "inotify_init failed")
+      directory = os.path.dirname(os.path.abspath(path))
+      if libc.inotify_add_watch(fd, directory.encode("utf-8"),
+          INOTIFY_MASK) < 0:
+        os.close(fd)
+        raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+      self.fd = fd
+    except (AttributeError, OSError) as e:
+      print("inotify unavailable ({}); polling {} every {}s".format(e, path,
+        POLL_SECONDS
+      ))
+
+  def _events(self, timeout):
+    """Returns True if an event of the watched directory arrived within
+    `timeout` seconds."""
+    readable, _, _ = select.select([self.fd], [], [], timeout)
+    if not readable:
+      return False
+    # The events are not looked into: the file's contents are compared
+    # afterwards, which also covers symlink swaps of its directory
+    os.read(self.fd, 65536)
+    return True
+
+  def wait(self):
+    """Blocks until the file may have changed, and until it stopped changing
+    for `RELOAD_SETTLE_SECONDS`."""
+    if self.fd is None:
+      time.sleep(POLL_SECONDS)
+      return
+    while not self._events(None):
+      pass
+    while self._events(RELOAD_SETTLE_SECONDS):
+      pass
+
+def file_digest(path):
+  try:
+    with open(path, "rb") as f:
+      return hashlib.sha1(f.read()).hexdigest()
+  except IOError:
+    return None
+
+def watch_config(parsedArgs):
+  """Main loop of the `config-reload` program: applies every change to the
+  `storm-setup.yaml` file to this container, with `reload_config`."""
+  path = os.environ["STORM_SETUP_YAML"]
+  with open(APPLIED_SETUP_JSON) as f:
+    appliedSetupConfig = json.load(f)
+  watcher = ConfigFileWatcher(path)
+  lastDigest = None
+  while True:
+    digest = file_digest(path)
+    if digest is not None and digest != lastDigest:
+      lastDigest = digest
+      try:
+        # Compared with the JSON copy of the configuration applied last
+        stormSetupConfig = json.loads(json.dumps(load_storm_setup_yaml(path),
+          default=str
+        ))
+        if stormSetupConfig != appliedSetupConfig:
+          print("{} changed; reloading".format(path))
+          with timing.span("entrypoint.storm.reload_config"):
+            reload_config(appliedSetupConfig, stormSetupConfig, parsedArgs)
+          appliedSetupConfig = stormSetupConfig
+          save_applied_setup_config(appliedSetupConfig)
+      except Exception as e:
+        # Keep running with the configuration applied last
+        print("not reloading {}: {}: {}".format(path, type(e).__name__, e),
+          file=sys.stderr
+        )
+      sys.stdout.flush()
+    watcher.wait()
 
 parser = argparse.ArgumentParser(
   description="Configures and runs storm-supervisor"
@@ -32,107 +613,106 @@ parser.add_argument("--my-ip-address", action="append",
     """IP address for the host machine"""
   ).strip()
 )
+parser.add_argument("--supervisor-slots-port", action="append",
+  dest="supervisor_slots_ports", type=int,
+  help=re.sub(r"""\s+""", " ",
+    """Port of a worker slot of this storm-supervisor, sized for the host
+    machine. Overrides `supervisor.slots.ports` in `storm-setup.yaml`"""
+  ).strip()
+)
+parser.add_argument("--watch-config", action="store_true", default=False,
+  dest="watch_config",
+  help=re.sub(r"""\s+""", " ",
+    """Instead of running supervisord, watch the `storm-setup.yaml` file and
+    apply its changes to the running programs (used by the `config-reload`
+    supervisord program)"""
+  ).strip()
+)
 
 parsedArgs = parser.parse_args()
 myIpAddresses = parsedArgs.my_ip_addresses
 
+if parsedArgs.watch_config:
+  watch_config(parsedArgs)
+
+# Spans of the phases of this script go to `docker logs` (see `timing.py`)
+timing.set_default_destination("-")
+phases = timing.Phases("entrypoint.storm")
+phases.start("load_config")
+
+# Opens the `storm-setup.yaml` file of this Docker container. The file was
+# copied from the `config/storm-setup.yaml` file in the storm-docker repository
+# during a `make` execution, or is mounted from the host machine (see the
+# `config.reload` section).
+stormSetupConfig = load_storm_setup_yaml(os.environ["STORM_SETUP_YAML"])
+
+phases.start("write_config")
+
+# With `network_mode: host`, this container shares the network stack of the
+# host machine: there are no Docker links, and the host's IP addresses can be
+# bound and advertised directly.
+hostNetwork = stormSetupConfig.get("network_mode") == "host"
+if hostNetwork:
+  # sshd and dnsmasq would compete with the host's own for ports 22 and 53
+  for program in ["ssh", "dnsmasq"]:
+    programConf = os.path.join(SUPERVISOR_CONF_DIR, "{}.conf".format(program))
+    if os.path.exists(programConf):
+      os.remove(programConf)
+
+# The metrics exporter and the log index of the storm-supervisor image can be
+# turned off (and back on by the `config-reload` program)
+for section, program in OPTIONAL_PROGRAMS:
+  if not program_enabled(stormSetupConfig, section):
+    set_program_enabled(program, False)
+
 # For a Docker container running a storm-supervisor.
-# Add to `/etc/dnsmasq-extra-hosts` the storm-supervisor hosts whose
-# IP addresses are not equal to that of this host machine
+# Add to `/etc/dnsmasq-extra-hosts` the storm-supervisor containers of the
+# hosts whose IP addresses are not equal to that of this host machine, and
+# those sharing this host machine with this container
 if parsedArgs.is_storm_supervisor:
-  with open("/etc/dnsmasq-extra-hosts", "w") as f:
-    stormSupervisorHosts = stormSetupConfig["storm.supervisor.hosts"]
-    for supervisor_host in stormSupervisorHosts:
-      ip_address = stormSetupConfig["servers"][supervisor_host]
-      alias = "{}-supervisor".format(supervisor_host)
-      if ip_address not in myIpAddresses:
-        f.write("{} {}\n".format(ip_address, alias))
-
-# This dict contains everything that should be written to the
-# `$STORM_HOME/conf/storm.yaml` file
-stormYamlConfig = stormSetupConfig["storm.yaml"]
-
-# Build the storm.zookeeper.servers section of the `storm.yaml` file
-# by replacing the SSH hostnames with actual IP addresses
-storm_yaml_zk_servers_section = [
-  stormSetupConfig["servers"][zk_server] for
-    zk_server in stormYamlConfig["storm.zookeeper.servers"]
-]
-
-# We're gonna check if a Zookeeper runs on the server hosting our current
-# Docker container.
-#
-# If that's the case, we assume that the Zookeeper is running in a Docker
-# container, and that this Docker container we're in was run with a link to the
-# Zookeeper Docker container.
-# We use the IP address of the Zookeeper Docker container in place of its
-# global IP address.
-zk_server_ip_to_replace = None
-# Loop through the Zookeeper server IP addresses
-for zk_server_ip in storm_yaml_zk_servers_section:
-  if zk_server_ip in myIpAddresses:
-    # The server hosting our current Docker container has a Zookeeper running.
-    zk_server_ip_to_replace = zk_server_ip
-    break
-
-# Zookeeper is running on the same server
-if zk_server_ip_to_replace is not None:
-  # Obtain the index of the Zookeeper IP address we're replacing
-  idx = storm_yaml_zk_servers_section.index(zk_server_ip_to_replace)
-  # Obtain the environment variable name for `storm.zookeeper.port` because
-  # we allow the user to choose the port (so it is no longer the default 2181)
-  zk_port_env_var = "ZK_PORT_{}_TCP_ADDR".format(
-    stormYamlConfig["storm.zookeeper.port"]
+  write_if_changed(DNSMASQ_EXTRA_HOSTS,
+    dnsmasq_extra_hosts(stormSetupConfig, myIpAddresses, socket.gethostname())
   )
-  storm_yaml_zk_servers_section.remove(zk_server_ip_to_replace)
-  storm_yaml_zk_servers_section.insert(idx, os.environ[zk_port_env_var])
-
-stormYamlConfig["storm.zookeeper.servers"] = storm_yaml_zk_servers_section
-
-# We're gonna check if Storm Nimbus runs on the server hosting our current
-# Docker container.
-# If so, we can replace the globally accessible "nimbus.host" IP address with
-# a "more efficient" IP address (the IP address of the Docker container running
-# the Storm Nimbus).
-if stormSetupConfig["servers"][stormYamlConfig["nimbus.host"]] in myIpAddresses:
-  # This server has a Storm Nimbus running.
-  # There are 2 possibilities:
-  # 1. This Docker container is the one running the Storm Nimbus.
-  # 2. Storm Nimbus is running on a separate Docker container on the same
-  #    machine, and this Docker container was run with a link to the
-  #    Storm Nimbus Docker container.
-  try:
-    # To determine if it's case number 2, we look for an environment variable
-    # named `NIMBUS_PORT_{XYZ}_TCP_ADDR` where XYZ is the `nimbus.thrift.port`.
-    # We first construct the name of this environment variable.
-    nimbusEnvVar = "NIMBUS_PORT_{}_TCP_ADDR".format(
-      stormYamlConfig["nimbus.thrift.port"]
-    )
-    # If this Docker container was run with a link to the Storm Nimbus Docker
-    # container, then the environment variable will be present, and its value
-    # is the IP address of the Storm Nimbus Docker container.
-    # We set `nimbus.host` to that value.
-    stormYamlConfig["nimbus.host"] = os.environ[nimbusEnvVar]
-  except KeyError:
-    # The `NIMBUS_PORT_{XYZ}_TCP_ADDR` environment variable does not exist
-    # (there is no Docker link to the Storm Nimbus container), yet the
-    # `nimbus.host` global IP address is one of the IP addresses of this
-    # server.
-    # We assume that this is case 1, and replace the IP address of
-    # `nimbus.host` with the output of `hostname -i`.
-    p = subprocess.Popen(["hostname", "-i"], stdout=subprocess.PIPE,
-      stderr=subprocess.PIPE
-    )
-    out, _ = p.communicate()
-    stormYamlConfig["nimbus.host"] = out.strip()
+
+# With service discovery, the `service-registry` program registers this
+# supervisor in Zookeeper, and replaces the hosts written above (which only
+# serve until it first reads the registry) with the registered supervisors
+if parsedArgs.is_storm_supervisor and \
+    service_discovery_enabled(stormSetupConfig):
+  write_program_conf("service-registry", " ".join(
+    ["/usr/bin/storm-service-registry.py", "--ip",
+      advertised_ip_address(stormSetupConfig, myIpAddresses) or
+        myIpAddresses[0]] +
+    ["--own-ip-address {}".format(ip) for ip in myIpAddresses]
+  ))
 else:
-  # Storm Nimbus not running on the same physical machine.
-  # But we have to replace the hostname with the IP address from the server list
-  stormYamlConfig["nimbus.host"] = \
-    stormSetupConfig["servers"][stormYamlConfig["nimbus.host"]]
+  remove_program_conf("service-registry")
+
+stormYamlConfig = storm_yaml_config(stormSetupConfig, myIpAddresses,
+  parsedArgs.supervisor_slots_ports, hostNetwork
+)
 
 # Write out to `$STORM_HOME/conf/storm.yaml`
-with open(os.path.join(STORM_HOME, "conf", "storm.yaml"), "w") as f:
-  f.write(yaml.dump(stormYamlConfig, default_flow_style=False))
+write_if_changed(STORM_YAML,
+  yaml.dump(stormYamlConfig, default_flow_style=False)
+)
+
+# Run the `config-reload` program next to the Storm daemons, with the
+# arguments of this script
+if config_reload_enabled(stormSetupConfig):
+  save_applied_setup_config(stormSetupConfig)
+  reloadArgs = ["--watch-config"] + \
+    ["--my-ip-address {}".format(ip) for ip in myIpAddresses or []] + \
+    ["--supervisor-slots-port {}".format(port) for port in
+      parsedArgs.supervisor_slots_ports or []
+    ]
+  if parsedArgs.is_storm_supervisor:
+    reloadArgs.append("--is-storm-supervisor")
+  write_program_conf("config-reload",
+    "/usr/bin/run-supervisord.py {}".format(" ".join(reloadArgs))
+  )
+else:
+  remove_program_conf("config-reload")
 
+phases.end()
 os.system("supervisord")
@@ -9,15 +9,36 @@
 # To stop the `nimbus` and `ui` containers:
 #
 #    ./destroy-storm.sh nimbus ui
+#
+# `supervisor` stops every supervisor container of the machine (`supervisor`,
+# and `supervisor-0`, `supervisor-1`, ... with a `storm.supervisor.containers`
+# section); a single one can be stopped by its name, eg. `supervisor-1`.
+
+. scripts/container-state.sh
 
+# Stops and removes a container, if it exists
 function stop_storm_docker {
-  docker stop $1; docker rm $1
+  if docker_container_exists $1
+  then
+    docker stop $1; docker rm $1
+  fi
+}
+
+# Stops and removes every supervisor container
+function stop_storm_supervisors {
+  local name
+  for name in $(docker_container_names_matching '^supervisor(-[0-9]+)?$')
+  do
+    stop_storm_docker $name
+  done
 }
 
+load_container_state
+
 if [ $# -eq 0 ]
 then
   stop_storm_docker ui
-  stop_storm_docker supervisor
+  stop_storm_supervisors
   stop_storm_docker nimbus
   stop_storm_docker zk_ambassador
   stop_storm_docker zookeeper
@@ -36,6 +57,9 @@ else
       ui-on-zk-ambassador-machine)
         stop_storm_docker ui
         ;;
+      supervisor)
+        stop_storm_supervisors
+        ;;
       *)
         stop_storm_docker $component
         ;;
@@ -0,0 +1,100 @@
+# Single entry point for the storm-docker Python helpers.
+#
+# Installing this repository (`pip install -e .`, see the `setup.py` file)
+# provides a `storm-docker` command which dispatches to the various helpers:
+#
+#     storm-docker <COMMAND> <ARGS>
+#
+# Helper modules are only imported once the command is known, and nothing is
+# installed at runtime, so starting a container no longer goes through a
+# virtualenv activation and a `pip install` on every run.
+#
+# When run from the top of a storm-docker checkout whose helpers are not the
+# installed ones (`pip install .` rather than `pip install -e .`, followed by
+# a `git pull`), the helpers of the checkout are run instead, so that the
+# installed copy never runs stale code.
+
+from __future__ import print_function
+
+import importlib
+import os
+import os.path
+import sys
+
+from . import timing
+
+# Command -> (helper module, extra args appended to the user's args, help)
+COMMANDS = {
+  "run": ("docker_run", [],
+    "Run the containers of `--storm-docker-component` components"),
+  "containers": ("container_state", [],
+    "List this machine's containers as `<state> <name> <image>` lines"),
+  "nimbus": ("run_storm_nimbus", [],
+    "Run the Zookeeper ambassador and / or Nimbus containers"),
+  "supervisor": ("run_storm_supervisor", [],
+    "Run the Storm supervisor container"),
+  "zookeeper": ("run_zookeeper", [],
+    "Run the Zookeeper and / or Zookeeper ambassador containers"),
+  "reconcile": ("reconcile", [],
+    "Restart only the containers whose configuration changed"),
+  "ui": ("docker_run", ["--storm-docker-component", "ui"],
+    "Run the Storm UI container"),
+  "drpc": ("docker_run", ["--storm-docker-component", "drpc"],
+    "Run a Storm DRPC container"),
+  "build": ("image_build", [],
+    "Build the Docker images whose inputs changed, in parallel"),
+}
+
+def print_usage(out=sys.stdout):
+  print("Usage: storm-docker <COMMAND> <ARGS>", file=out)
+  print("", file=out)
+  print("Commands:", file=out)
+  for command in sorted(COMMANDS):
+    print("    {:<12}{}".format(command, COMMANDS[command][2]), file=out)
+
+def checkout_package_dir():
+  """Returns the helpers directory of the storm-docker checkout in the
+  current directory if it is not the package running, None otherwise."""
+  checkoutDir = os.path.abspath("docker_python_helpers")
+  ownDir = os.path.dirname(os.path.abspath(__file__))
+  if not os.path.isfile(os.path.join(checkoutDir, "cli.py")) or \
+      os.path.samefile(checkoutDir, ownDir):
+    return None
+  return checkoutDir
+
+def main(argv=None):
+  if argv is None:
+    argv = sys.argv[1:]
+    checkoutDir = checkout_package_dir()
+    if checkoutDir is not None:
+      print("storm-docker: running the helpers of {} instead of the installed "
+        "copy in {}; install with `pip install -e .` to avoid this".format(
+          checkoutDir, os.path.dirname(os.path.abspath(__file__))
+        ), file=sys.stderr
+      )
+      sys.stderr.flush()
+      # `-m` imports the package from the current directory
+      os.execv(sys.executable,
+        [sys.executable, "-m", "docker_python_helpers.cli"] + argv
+      )
+  if not argv or argv[0] in ("-h", "--help", "help"):
+    print_usage()
+    return 0
+  command, args = argv[0], list(argv[1:])
+  if command not in COMMANDS:
+    print("Unknown storm-docker command: \"{}\"".format(command),
+      file=sys.stderr
+    )
+    print_usage(sys.stderr)
+    return 1
+  moduleName, extraArgs, _ = COMMANDS[command]
+  module = importlib.import_module(
+    "{}.{}".format(__package__ or "docker_python_helpers", moduleName)
+  )
+  with timing.span("storm-docker {}".format(command)):
+    module.main(args + extraArgs)
+  return 0
+
+# When run as a main program
+if __name__ == "__main__":
+  sys.exit(main())
@@ -0,0 +1,374 @@
+# Parse-once, compiled view of the `config/storm-setup.yaml` file.
+#
+# The YAML file is parsed (with the LibYAML C loader when PyYAML was built
+# with it) and compiled into a `ClusterModel` holding pre-resolved tables:
+#
+#   - host -> IP address, and IP address -> hosts
+#   - Storm component -> hosts running it
+#   - Storm component -> ports, with the defaults in
+#     `docker_run.STORM_DEFAULT_PORTS` already applied
+#
+# A compiled model is kept in memory for the lifetime of the process, and
+# pickled to an on-disk cache keyed by the SHA-1 of the YAML file's contents,
+# so that later invocations with an unchanged file skip YAML parsing entirely.
+# The `CACHED_MODELS` most recently used models are kept, so that several
+# files used on one machine (eg. by `scripts/remote.py` and
+# `scripts/benchmark_deploy.py`) do not evict each other.
+#
+# The cache directory defaults to `~/.cache/storm-docker` and can be changed
+# through the `STORM_DOCKER_CACHE_DIR` environment variable. Set it to an empty
+# string to disable the on-disk cache.
+
+import errno
+import glob
+import hashlib
+import json
+import os
+import os.path
+import pickle
+import tempfile
+
+import yaml
+
+from . import supervisor_containers
+from . import timing
+
+# Path of the `storm-setup.yaml` file, relative to the storm-docker repository
+DEFAULT_STORM_SETUP_YAML = os.path.join("config", "storm-setup.yaml")
+
+# Label holding `ClusterModel.configHashes[...]` on the containers we run
+CONFIG_HASH_LABEL = "storm-docker.config-hash"
+
+# Default `host.dir` of the `config.reload` section
+DEFAULT_CONFIG_RELOAD_DIR = "/etc/storm-docker"
+
+# Number of compiled models kept in the on-disk cache
+CACHED_MODELS = 8
+
+# Modules of this package whose code shapes the compiled `ClusterModel`
+MODEL_SOURCES = ["cluster_model.py", "docker_run.py"]
+
+def _model_version():
+  """Returns a digest of the code compiling the model, so that models pickled
+  by any other version of it are never read back."""
+  digest = hashlib.sha1()
+  packageDir = os.path.dirname(os.path.abspath(__file__))
+  for name in MODEL_SOURCES:
+    try:
+      with open(os.path.join(packageDir, name), "rb") as f:
+        digest.update(f.read())
+    except (IOError, OSError):
+      digest.update(name.encode("utf-8"))
+  return digest.hexdigest()[:12]
+
+MODEL_VERSION = _model_version()
+
+# Use the LibYAML based loader if available; it is an order of magnitude
+# faster than the pure Python one on large files
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+class ClusterModel(object):
+  """Compiled, read-only view of a `storm-setup.yaml` file."""
+  def __init__(self, config, contentHash):
+    """Constructor for ClusterModel
+
+    Args:
+      config(dict): the dict defined by the `storm-setup.yaml` file
+      contentHash(str): SHA-1 hex digest of the file's contents
+    """
+    self.config = config
+    self.contentHash = contentHash
+
+    # host -> IP address, and the reverse mapping. Several hosts may share
+    # an IP address (eg. in a localhost setup).
+    self.hostIps = dict(config.get("servers") or {})
+    self.ipHosts = {}
+    for host, ipAddress in self.hostIps.items():
+      self.ipHosts.setdefault(ipAddress, []).append(host)
+
+    stormYamlConfig = config.get("storm.yaml") or {}
+    self.zookeeperHosts = list(stormYamlConfig.get("storm.zookeeper.servers")
+      or []
+    )
+    # Zookeeper servers which are observers (non-voting members)
+    self.zookeeperObservers = list(
+      (config.get("zookeeper.multiple.setup") or {}).get("observers") or []
+    )
+    self.nimbusHost = stormYamlConfig.get("nimbus.host")
+    self.supervisorHosts = list(config.get("storm.supervisor.hosts") or [])
+    # True if containers share the network stack of their host machine
+    # (`network_mode: host`) instead of going through Docker's port forwards
+    self.hostNetwork = config.get("network_mode") == "host"
+    # Directory of the host machine holding the `storm-setup.yaml` file which
+    # the Storm containers read and watch (`config.reload` section), or None
+    self.configReloadDir = None
+    if "config.reload" in config:
+      configReload = config["config.reload"] or {}
+      if configReload.get("enabled", True):
+        self.configReloadDir = configReload.get("host.dir",
+          DEFAULT_CONFIG_RELOAD_DIR
+        )
+
+    # Storm component -> list of hosts running it. DRPC and the UI run on the
+    # Nimbus machine, and the logviewer alongside every supervisor.
+    nimbusHosts = [self.nimbusHost] if self.nimbusHost else []
+    self.componentHosts = {
+      "drpc":       nimbusHosts,
+      "logviewer":  self.supervisorHosts,
+      "nimbus":     nimbusHosts,
+      "supervisor": self.supervisorHosts,
+      "ui":         nimbusHosts,
+      "zookeeper":  self.zookeeperHosts,
+    }
+
+    # Storm component -> list of (port section string, list of int ports,
+    # needsUDP)
+    self.componentPorts = _resolve_component_ports(config)
+
+    # Hashes of the parts of the file that end up in the configuration
+    # generated inside each kind of container. Containers are labelled with
+    # them (see `CONFIG_HASH_LABEL`) so that configuration changes can be
+    # detected on running containers. Without `config.reload`, the Storm
+    # containers are labelled with `storm_config_hash` instead, which only
+    # covers what a given container is run with.
+    zookeeperSections = ["storm.yaml", "zookeeper.multiple.setup",
+      "network_mode"]
+    zookeeperStormYamlKeys = ["storm.zookeeper.servers", "storm.zookeeper.port"]
+    if "zookeeper.tuning" in config:
+      # The tuning is derived from the number of supervisors and worker slots
+      zookeeperSections += ["zookeeper.tuning", "storm.supervisor.hosts",
+        "storm.supervisor.slots", "storm.supervisor.containers"]
+      zookeeperStormYamlKeys.append("supervisor.slots.ports")
+    self.configHashes = {
+      # `servers` is only read for the IP addresses of the Zookeeper servers
+      "zookeeper": _hash_sections(config, zookeeperSections,
+        stormYamlKeys=zookeeperStormYamlKeys,
+        extra={"ips": self.ips(self.zookeeperHosts)}),
+    }
+    if self.configReloadDir is not None:
+      # The Storm containers apply changes to the other sections themselves
+      # (see `base-storm/run-supervisord.py`)
+      self.configHashes["storm"] = _hash_sections(config, ["config.reload",
+        "network_mode", "is_localhost_setup", "service.discovery"]
+      )
+
+  def ip(self, host):
+    """Returns the IP address of `host`, or None if it is not in `servers`."""
+    return self.hostIps.get(host)
+
+  def ips(self, hosts):
+    """Returns the IP addresses of `hosts`, skipping unknown hosts."""
+    return [self.hostIps[host] for host in hosts if host in self.hostIps]
+
+  def hosts_with_ips(self, ipAddresses):
+    """Returns the set of hosts whose IP address is in `ipAddresses`."""
+    hosts = set()
+    for ipAddress in ipAddresses:
+      hosts.update(self.ipHosts.get(ipAddress, ()))
+    return hosts
+
+  def runs_on(self, component, ipAddresses):
+    """Returns True if `component` runs on a machine with one of the given IP
+    addresses."""
+    return bool(self.hosts_with_ips(ipAddresses) &
+      set(self.componentHosts.get(component, ()))
+    )
+
+  def ports(self, component):
+    """Returns the flat list of ports used by `component`."""
+    return [port for _, portList, _ in self.componentPorts[component]
+      for port in portList
+    ]
+
+  def storm_config_hash(self, host, container=None):
+    """Returns the hash of the configuration generated inside a Storm
+    container by `base-storm/run-supervisord.py`, so that a change only
+    replaces the containers it reaches.
+
+    Args:
+      host(str): host the container runs on, a key of the `servers` dictionary
+      container(supervisor_containers.SupervisorContainer, optional): the
+        supervisor container. None for the Nimbus, UI and DRPC containers.
+
+    Returns:
+      str: SHA-1 hex digest
+    """
+    if "storm" in self.configHashes:
+      return self.configHashes["storm"]
+    stormYamlConfig = dict(self.config.get("storm.yaml") or {})
+    view = dict((section, self.config.get(section)) for section in [
+      "zookeeper.multiple.setup", "netty.profile", "network_mode",
+      "is_localhost_setup", "service.discovery", "config.reload",
+    ])
+    # `servers` is only read for the IP addresses of these hosts
+    view["ips"] = {
+      "host": self.ip(host),
+      "nimbus": self.ip(self.nimbusHost),
+      "zookeeper": self.ips(self.zookeeperHosts),
+    }
+    if container is not None:
+      stormYamlConfig["supervisor.slots.ports"] = list(container.ports)
+      view["storm.supervisor.metrics"] = \
+        self.config.get("storm.supervisor.metrics")
+      view["storm.supervisor.logsearch"] = \
+        self.config.get("storm.supervisor.logsearch")
+      # The netty settings depend on the CPUs the container is pinned to
+      view["cpus"] = container.node.cpuList \
+        if container.node is not None else None
+      # With service discovery, the hosts come from the Zookeeper registry
+      serviceDiscovery = "service.discovery" in self.config and \
+        (self.config["service.discovery"] or {}).get("enabled", True) and \
+        not self.hostNetwork
+      if not serviceDiscovery:
+        view["extra.hosts"] = supervisor_containers.extra_hosts(self.config,
+          host, container.hostname
+        )
+    view["storm.yaml"] = stormYamlConfig
+    return _hash_view(view)
+
+def _hash_sections(config, sections, stormYamlKeys=None, extra=None):
+  """Returns the SHA-1 of the given top level sections of `config`. If
+  `stormYamlKeys` is given, only those keys of the `storm.yaml` section are
+  included. Values derived from other sections can be added with `extra`."""
+  subset = dict((section, config.get(section)) for section in sections)
+  if stormYamlKeys is not None and subset.get("storm.yaml") is not None:
+    subset["storm.yaml"] = dict((key, subset["storm.yaml"].get(key))
+      for key in stormYamlKeys
+    )
+  subset.update(extra or {})
+  return _hash_view(subset)
+
+def _hash_view(view):
+  """Returns the SHA-1 of the JSON serialization of `view`."""
+  return hashlib.sha1(
+    json.dumps(view, sort_keys=True, default=str).encode("utf-8")
+  ).hexdigest()
+
+def _resolve_component_ports(config):
+  # Imported here as `docker_run` itself depends on this module
+  from . import docker_run
+
+  componentPorts = {}
+  for component, portKeyStringsList in docker_run.STORM_COMPONENT_PORTS.items():
+    resolved = []
+    for portKeyString in portKeyStringsList:
+      stormPortObj = docker_run.STORM_DEFAULT_PORTS[portKeyString]
+      # Fallback to using the default port / ports if the user did not
+      # specify any
+      stormYamlSection = config.get(stormPortObj.section) or {}
+      portNumOrList = stormYamlSection.get(portKeyString, stormPortObj.portList)
+      if isinstance(portNumOrList, int):
+        portNumOrList = [portNumOrList]
+      resolved.append(
+        (portKeyString, [int(port) for port in portNumOrList],
+          stormPortObj.needsUDP)
+      )
+    componentPorts[component] = resolved
+  return componentPorts
+
+def parse_storm_setup_yaml(data):
+  """Parses the contents of a `storm-setup.yaml` file into a dict."""
+  return yaml.load(data, Loader=YamlLoader)
+
+def cache_dir():
+  """Returns the directory of storm-docker's on-disk caches, or an empty string
+  if caching to disk is disabled."""
+  cacheDir = os.environ.get("STORM_DOCKER_CACHE_DIR")
+  if cacheDir is None:
+    cacheDir = os.path.join(os.path.expanduser("~"), ".cache", "storm-docker")
+  return cacheDir
+
+def _cache_path(cacheDir, contentHash):
+  return os.path.join(cacheDir, "cluster-model-v{}-{}.pickle".format(
+    MODEL_VERSION, contentHash
+  ))
+
+def _read_cached_model(cacheDir, contentHash):
+  cachePath = _cache_path(cacheDir, contentHash)
+  try:
+    with open(cachePath, "rb") as f:
+      model = pickle.load(f)
+  except Exception:
+    # Missing, truncated or otherwise unusable cache entry
+    return None
+  if not isinstance(model, ClusterModel) or model.contentHash != contentHash:
+    return None
+  try:
+    # Most recently used entries are the last ones evicted
+    os.utime(cachePath, None)
+  except OSError:
+    pass
+  return model
+
+def _evict_cached_models(cacheDir, keep=CACHED_MODELS):
+  """Removes all but the `keep` most recently used models of the on-disk
+  cache, including those pickled by other versions of this module."""
+  entries = []
+  for cachePath in glob.glob(os.path.join(cacheDir, "cluster-model-*")):
+    try:
+      entries.append((os.path.getmtime(cachePath), cachePath))
+    except OSError:
+      pass
+  for _, cachePath in sorted(entries, reverse=True)[keep:]:
+    try:
+      os.remove(cachePath)
+    except OSError:
+      pass
+
+def _write_cached_model(cacheDir, model):
+  try:
+    os.makedirs(cacheDir)
+  except OSError as e:
+    if e.errno != errno.EEXIST:
+      return
+  try:
+    # Write to a temporary file and rename it, so concurrent readers never see
+    # a partially written pickle
+    fd, tmpPath = tempfile.mkstemp(dir=cacheDir, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+      pickle.dump(model, f, pickle.HIGHEST_PROTOCOL)
+    os.rename(tmpPath, _cache_path(cacheDir, model.contentHash))
+  except (IOError, OSError):
+    return
+  _evict_cached_models(cacheDir)
+
+# Absolute path -> (mtime, size, ClusterModel) for models loaded by this process
+_loadedModels = {}
+
+def load_cluster_model(path=DEFAULT_STORM_SETUP_YAML, useDiskCache=True):
+  """Returns the compiled ClusterModel of a `storm-setup.yaml` file.
+
+  The model is compiled at most once per process (as long as the file is not
+  modified) and is read back from the on-disk cache if the file's contents
+  were already compiled by an earlier invocation.
+
+  Args:
+    path(str, optional): path to the `storm-setup.yaml` file. Defaults to
+      `config/storm-setup.yaml`
+    useDiskCache(bool, optional): set to False to bypass the on-disk cache
+
+  Returns:
+    ClusterModel: the compiled model
+  """
+  absPath = os.path.abspath(path)
+  st = os.stat(absPath)
+  loaded = _loadedModels.get(absPath)
+  if loaded is not None and loaded[:2] == (st.st_mtime, st.st_size):
+    return loaded[2]
+
+  with timing.span("config.load", source="disk cache") as loadSpan:
+    with open(absPath, "rb") as f:
+      data = f.read()
+    contentHash = hashlib.sha1(data).hexdigest()
+
+    cacheDir = cache_dir() if useDiskCache else ""
+    model = None
+    if cacheDir:
+      model = _read_cached_model(cacheDir, contentHash)
+    if model is None:
+      loadSpan.fields["source"] = "yaml"
+      model = ClusterModel(parse_storm_setup_yaml(data), contentHash)
+      if cacheDir:
+        _write_cached_model(cacheDir, model)
+  _loadedModels[absPath] = (st.st_mtime, st.st_size, model)
+  return model
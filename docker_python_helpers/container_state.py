@@ -0,0 +1,163 @@
+# Snapshot of the Docker containers on the current machine.
+#
+# The containers are listed once (a single `GET /containers/json?all=1` API
+# call, or a `docker ps` plus a `docker inspect` when the Docker socket cannot
+# be used) and indexed by exact container name and by image, so that the
+# "is it running?", "does it exist?" and "should I link to it?" decisions made
+# by the helpers in this package are dictionary lookups instead of one
+# `docker ps | grep` pipeline each. `start-storm.sh` and `destroy-storm.sh`
+# build the same index in bash (see `scripts/container-state.sh`).
+#
+# Unlike `grep`, names and images are matched exactly: a container named
+# `zk_ambassador_old` is not mistaken for `zk_ambassador`.
+#
+# Usage:
+#
+#     storm-docker containers [--running]
+#
+# prints one `<state> <name> <image>` line per container.
+
+from __future__ import print_function
+
+import argparse
+import json
+import subprocess
+import sys
+
+from . import docker_api
+from . import timing
+
+parser = argparse.ArgumentParser(
+  prog="storm-docker containers",
+  description="Lists the Docker containers of this machine as "
+    "`<state> <name> <image>` lines",
+)
+parser.add_argument("--running", action="store_true", dest="running",
+  help="Only list running containers"
+)
+
+def normalize_image(image):
+  """Returns `image` without its `:latest` tag, the form images are referred
+  to by throughout this repository."""
+  repo, tag = docker_api.split_image_tag(image)
+  return repo if tag == "latest" else image
+
+class Container(object):
+  """A container of the snapshot."""
+  def __init__(self, containerId, name, image, running):
+    self.containerId = containerId
+    self.name = name
+    self.image = normalize_image(image)
+    self.running = running
+
+  @property
+  def state(self):
+    return "running" if self.running else "stopped"
+
+  def __repr__(self):
+    return "Container({!r}, {!r}, {!r}, running={!r})".format(
+      self.containerId, self.name, self.image, self.running
+    )
+
+  @classmethod
+  def from_api_listing(cls, entry):
+    """Builds a Container from an entry of the `GET /containers/json`
+    listing."""
+    # `Names` also holds the link aliases of the container (eg.
+    # `/ui/nimbus`); the container's own name is the one without a parent
+    names = [name.lstrip("/") for name in entry.get("Names") or []]
+    ownNames = [name for name in names if "/" not in name] or names or [""]
+    if entry.get("State"):
+      running = entry["State"] == "running"
+    else:
+      # Docker API versions before 1.23 only have the human readable status
+      running = (entry.get("Status") or "").startswith("Up")
+    return cls(entry.get("Id"), ownNames[0], entry.get("Image") or "", running)
+
+  @classmethod
+  def from_inspect(cls, inspected):
+    """Builds a Container from the output of `docker inspect`."""
+    return cls(inspected.get("Id"), (inspected.get("Name") or "").lstrip("/"),
+      (inspected.get("Config") or {}).get("Image") or "",
+      bool((inspected.get("State") or {}).get("Running"))
+    )
+
+class ContainerSnapshot(object):
+  """The containers of this machine at the time they were listed, indexed by
+  name and by image."""
+  def __init__(self, containers):
+    self.containers = list(containers)
+    self._byName = dict((c.name, c) for c in self.containers)
+    self._runningImages = {}
+    for c in self.containers:
+      if c.running:
+        self._runningImages.setdefault(c.image, []).append(c)
+
+  def get(self, name):
+    """Returns the Container named exactly `name`, or None."""
+    return self._byName.get(name)
+
+  def exists(self, name):
+    return name in self._byName
+
+  def is_running(self, name):
+    container = self._byName.get(name)
+    return container is not None and container.running
+
+  def image_running(self, image):
+    """Returns True if some running container was created from `image`."""
+    return normalize_image(image) in self._runningImages
+
+  def running_names(self):
+    return sorted(c.name for c in self.containers if c.running)
+
+def _list_containers_with_cli():
+  """Lists every container through the `docker` CLI.
+
+  Returns:
+    list of Container
+  """
+  ids = subprocess.check_output(["docker", "ps", "-a", "-q", "--no-trunc"])
+  ids = ids.decode("utf-8").split()
+  if not ids:
+    return []
+  out = subprocess.check_output(["docker", "inspect"] + ids)
+  return [Container.from_inspect(inspected)
+    for inspected in json.loads(out.decode("utf-8"))
+  ]
+
+def list_containers():
+  """Lists every container (running or not) of this machine, once.
+
+  Returns:
+    list of Container
+  """
+  if docker_api.docker_socket_available():
+    return [Container.from_api_listing(entry)
+      for entry in docker_api.get_client().list_containers(all=True)
+    ]
+  return _list_containers_with_cli()
+
+_snapshot = None
+
+def snapshot(refresh=False):
+  """Returns the ContainerSnapshot of this process, listing the containers on
+  the first call (or if `refresh` is True) only."""
+  global _snapshot
+  if _snapshot is None or refresh:
+    with timing.span("docker.list_containers"):
+      _snapshot = ContainerSnapshot(list_containers())
+  return _snapshot
+
+def main(args=None):
+  if args is None:
+    args = sys.argv[2:]
+  parsedArgs = parser.parse_args(args)
+  for container in snapshot().containers:
+    if parsedArgs.running and not container.running:
+      continue
+    print("{} {} {}".format(container.state, container.name, container.image))
+
+# When run as a main program
+if __name__ == "__main__":
+  main()
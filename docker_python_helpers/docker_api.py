@@ -0,0 +1,452 @@
+# Minimal in-process client for the Docker Engine remote API.
+#
+# Talks HTTP over the Docker daemon's unix socket using a single keep-alive
+# connection, so running a container no longer costs a shell plus a `docker`
+# CLI process. The `docker run` argument model used throughout
+# `docker_python_helpers` (`-p`, `--expose`, `--link`, `-h`, ...) is turned
+# into the payloads of the `POST /containers/create` and
+# `POST /containers/(id)/start` API calls.
+#
+# For the API reference, see:
+#
+#     https://docs.docker.com/reference/api/docker_remote_api/
+
+import json
+import os
+import select
+import socket
+
+try:
+  import http.client as httplib
+except ImportError:
+  import httplib
+
+try:
+  from urllib.parse import quote, urlencode
+except ImportError:
+  from urllib import quote, urlencode
+
+from . import timing
+
+# Default location of the Docker daemon's unix socket
+DEFAULT_DOCKER_SOCKET = "/var/run/docker.sock"
+
+class DockerAPIError(RuntimeError):
+  """Raised when the Docker daemon answers with an error status."""
+  def __init__(self, status, message, method=None, path=None):
+    RuntimeError.__init__(self, "{} {} -> HTTP {}: {}".format(
+      method, path, status, message
+    ))
+    self.status = status
+    self.message = message
+
+class RequestOutcomeUnknown(RuntimeError):
+  """Raised when the connection is lost after a non-idempotent request was
+  sent in full: the daemon may or may not have acted on it, so it is not
+  retried."""
+  def __init__(self, method, path):
+    RuntimeError.__init__(self,
+      "Connection to the Docker daemon lost during {} {}".format(method, path)
+    )
+
+class UnsupportedDockerRunArgument(ValueError):
+  """Raised by `parse_docker_run_args` for `docker run` flags it does not know
+  how to translate into an API payload."""
+  pass
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+  """HTTPConnection over a unix domain socket instead of TCP."""
+  def __init__(self, socketPath, timeout=60):
+    httplib.HTTPConnection.__init__(self, "localhost", timeout=timeout)
+    self._socketPath = socketPath
+
+  def connect(self):
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.settimeout(self.timeout)
+    sock.connect(self._socketPath)
+    self.sock = sock
+
+class RunResult(object):
+  """Outcome of `DockerClient.run`."""
+  def __init__(self, containerId, name, image, warnings=None, pulled=False):
+    self.containerId = containerId
+    self.name = name
+    self.image = image
+    self.warnings = warnings or []
+    # True if the image had to be pulled before the container was created
+    self.pulled = pulled
+
+  def __repr__(self):
+    return "RunResult(containerId={!r}, name={!r}, image={!r})".format(
+      self.containerId, self.name, self.image
+    )
+
+class DockerClient(object):
+  """Client for the Docker Engine API. A single connection is kept open and
+  reused for every request."""
+  def __init__(self, socketPath=DEFAULT_DOCKER_SOCKET, timeout=60):
+    self._socketPath = socketPath
+    self._timeout = timeout
+    self._conn = None
+
+  def close(self):
+    if self._conn is not None:
+      self._conn.close()
+      self._conn = None
+
+  def _connection_is_stale(self):
+    """Returns True if the daemon closed the idle keep-alive connection: the
+    socket is then readable (EOF) before anything was sent on it."""
+    sock = self._conn.sock
+    if sock is None:
+      return False
+    readable, _, _ = select.select([sock], [], [], 0)
+    return bool(readable)
+
+  def _request(self, method, path, body=None, query=None, idempotent=True):
+    """Performs one API request.
+
+    A request which fails on a stale keep-alive connection is retried once on
+    a new connection. A non-idempotent request is only retried if it could
+    not be sent in full, in which case the daemon cannot have acted on it.
+
+    Returns:
+      (int, object): HTTP status and the JSON-decoded response body (None for
+        an empty body, the raw text if it is not JSON)
+
+    Raises:
+      RequestOutcomeUnknown: if the connection is lost after a non-idempotent
+        request was sent
+    """
+    if query:
+      path = "{}?{}".format(path, urlencode(query))
+    headers = {}
+    payload = None
+    if body is not None:
+      payload = json.dumps(body)
+      headers["Content-Type"] = "application/json"
+    for attempt in range(2):
+      if self._conn is not None and not idempotent and \
+          self._connection_is_stale():
+        self.close()
+      if self._conn is None:
+        self._conn = UnixHTTPConnection(self._socketPath, self._timeout)
+      sent = False
+      try:
+        self._conn.request(method, path, payload, headers)
+        sent = True
+        resp = self._conn.getresponse()
+        data = resp.read()
+        break
+      except (httplib.HTTPException, socket.error):
+        self.close()
+        if sent and not idempotent:
+          raise RequestOutcomeUnknown(method, path)
+        if attempt == 1:
+          raise
+    data = data.decode("utf-8", "replace")
+    try:
+      decoded = json.loads(data) if data.strip() else None
+    except ValueError:
+      decoded = data
+    if resp.status >= 400:
+      message = decoded
+      if isinstance(decoded, dict):
+        message = decoded.get("message", decoded)
+      raise DockerAPIError(resp.status, message, method, path)
+    return resp.status, decoded
+
+  def ping(self):
+    """Returns True if the daemon answers on the socket."""
+    try:
+      self._request("GET", "/_ping")
+      return True
+    except (socket.error, httplib.HTTPException, DockerAPIError):
+      return False
+
+  def pull_image(self, image):
+    """Pulls `image` (with an optional `:tag`, defaulting to `latest`)."""
+    repo, tag = split_image_tag(image)
+    self._request("POST", "/images/create",
+      query={"fromImage": repo, "tag": tag}
+    )
+
+  def create_container(self, config, name=None):
+    """Creates a container.
+
+    Returns:
+      dict: API response with the `Id` and `Warnings` keys
+
+    Raises:
+      RequestOutcomeUnknown: if the connection was lost once the request was
+        sent; retrying could create a second container
+    """
+    query = {"name": name} if name else None
+    _, resp = self._request("POST", "/containers/create", config, query,
+      idempotent=False
+    )
+    return resp
+
+  def start_container(self, containerId):
+    self._request("POST", "/containers/{}/start".format(quote(containerId)))
+
+  def stop_container(self, containerId, timeout=10):
+    self._request("POST", "/containers/{}/stop".format(quote(containerId)),
+      query={"t": timeout}
+    )
+
+  def remove_container(self, containerId):
+    self._request("DELETE", "/containers/{}".format(quote(containerId)))
+
+  def inspect_container(self, containerId):
+    _, resp = self._request("GET",
+      "/containers/{}/json".format(quote(containerId))
+    )
+    return resp
+
+  def inspect_image(self, image):
+    _, resp = self._request("GET", "/images/{}/json".format(quote(image)))
+    return resp
+
+  def list_containers(self, all=False):
+    """Returns the `GET /containers/json` listing (running containers only,
+    unless `all` is True)."""
+    _, resp = self._request("GET", "/containers/json",
+      query={"all": 1 if all else 0}
+    )
+    return resp or []
+
+  def run(self, dockerRunArgv):
+    """Equivalent of `docker run -d <dockerRunArgv>`: pulls the image if it is
+    missing, then creates and starts the container.
+
+    Args:
+      dockerRunArgv(list of str): arguments to `docker run`, excluding
+        `docker run` itself
+
+    Returns:
+      RunResult: id, name and warnings of the started container
+    """
+    name, config = parse_docker_run_args(dockerRunArgv)
+    pulled = False
+    try:
+      with timing.span("docker.create"):
+        resp = self.create_container(config, name)
+    except DockerAPIError as e:
+      if e.status != 404:
+        raise
+      # Image not present locally; `docker run` would pull it
+      with timing.span("docker.pull", image=config["Image"]):
+        self.pull_image(config["Image"])
+      pulled = True
+      with timing.span("docker.create"):
+        resp = self.create_container(config, name)
+    with timing.span("docker.start"):
+      self.start_container(resp["Id"])
+    return RunResult(resp["Id"], name, config["Image"],
+      resp.get("Warnings"), pulled
+    )
+
+def split_image_tag(image):
+  """Splits `repo[:tag]` into (repo, tag). Registry host ports are not
+  mistaken for tags."""
+  idx = image.rfind(":")
+  if idx == -1 or "/" in image[idx:]:
+    return image, "latest"
+  return image[:idx], image[idx + 1:]
+
+def _expand_port_spec(spec):
+  """Expands `6700` or `6700-6703` into a list of port number strings."""
+  if "-" in spec:
+    start, end = spec.split("-", 1)
+    return [str(port) for port in range(int(start), int(end) + 1)]
+  return [spec]
+
+def _parse_publish(value):
+  """Parses the value of a `-p` flag.
+
+  Returns:
+    list of (str, str, str): (container port key like "2888/udp", host IP,
+      host port) tuples
+  """
+  proto = "tcp"
+  if "/" in value:
+    value, proto = value.rsplit("/", 1)
+  parts = value.split(":")
+  if len(parts) == 1:
+    hostIp, hostPorts, containerPorts = "", "", parts[0]
+  elif len(parts) == 2:
+    hostIp, (hostPorts, containerPorts) = "", parts
+  else:
+    hostIp, hostPorts, containerPorts = parts
+  containerList = _expand_port_spec(containerPorts)
+  hostList = _expand_port_spec(hostPorts) if hostPorts else \
+    [""] * len(containerList)
+  if len(hostList) != len(containerList):
+    raise UnsupportedDockerRunArgument(
+      "Port ranges in `-p {}` differ in length".format(value)
+    )
+  return [("{}/{}".format(containerPort, proto), hostIp, hostPort)
+    for containerPort, hostPort in zip(containerList, hostList)
+  ]
+
+# `docker run` flags taking a value, mapped to their canonical name
+_VALUE_FLAGS = {
+  "-p": "publish", "--publish": "publish",
+  "--expose": "expose",
+  "--link": "link",
+  "-h": "hostname", "--hostname": "hostname",
+  "--name": "name",
+  "-e": "env", "--env": "env",
+  "--dns": "dns",
+  "-v": "volume", "--volume": "volume",
+  "--net": "net", "--network": "net",
+  "-l": "label", "--label": "label",
+  "--cpuset-cpus": "cpuset_cpus",
+  "--cpuset-mems": "cpuset_mems",
+}
+
+# `docker run` flags without a value. Containers are always run detached.
+_BOOL_FLAGS = {"-d": "detach", "--detach": "detach"}
+
+def parse_docker_run_args(dockerRunArgv):
+  """Translates `docker run` arguments into a `POST /containers/create`
+  payload.
+
+  Args:
+    dockerRunArgv(list of str): arguments to `docker run`, excluding
+      `docker run` itself
+
+  Returns:
+    (str, dict): container name (None if `--name` was not given) and the
+      create payload, including its `HostConfig`
+
+  Raises:
+    UnsupportedDockerRunArgument: for flags not handled here
+  """
+  config = {
+    "Env": [],
+    "ExposedPorts": {},
+    "Labels": {},
+  }
+  hostConfig = {
+    "PortBindings": {},
+    "Links": [],
+    "Dns": [],
+    "Binds": [],
+  }
+  name = None
+  idx = 0
+  while idx < len(dockerRunArgv):
+    arg = dockerRunArgv[idx]
+    if not arg.startswith("-"):
+      break
+    value = None
+    if arg.startswith("--") and "=" in arg:
+      arg, value = arg.split("=", 1)
+    if arg in _BOOL_FLAGS:
+      idx += 1
+      continue
+    if arg not in _VALUE_FLAGS:
+      raise UnsupportedDockerRunArgument(
+        "Unsupported `docker run` flag `{}`".format(arg)
+      )
+    if value is None:
+      idx += 1
+      if idx >= len(dockerRunArgv):
+        raise UnsupportedDockerRunArgument("`{}` requires a value".format(arg))
+      value = dockerRunArgv[idx]
+    idx += 1
+
+    flag = _VALUE_FLAGS[arg]
+    if flag == "publish":
+      for portKey, hostIp, hostPort in _parse_publish(value):
+        config["ExposedPorts"][portKey] = {}
+        hostConfig["PortBindings"].setdefault(portKey, []).append(
+          {"HostIp": hostIp, "HostPort": hostPort}
+        )
+    elif flag == "expose":
+      proto = "tcp"
+      if "/" in value:
+        value, proto = value.rsplit("/", 1)
+      for port in _expand_port_spec(value):
+        config["ExposedPorts"]["{}/{}".format(port, proto)] = {}
+    elif flag == "link":
+      if ":" not in value:
+        value = "{}:{}".format(value, value)
+      hostConfig["Links"].append(value)
+    elif flag == "hostname":
+      config["Hostname"] = value
+    elif flag == "name":
+      name = value
+    elif flag == "env":
+      config["Env"].append(value)
+    elif flag == "dns":
+      hostConfig["Dns"].append(value)
+    elif flag == "volume":
+      hostConfig["Binds"].append(value)
+    elif flag == "net":
+      hostConfig["NetworkMode"] = value
+    elif flag == "label":
+      key, _, labelValue = value.partition("=")
+      config["Labels"][key] = labelValue
+    elif flag == "cpuset_cpus":
+      hostConfig["CpusetCpus"] = value
+    elif flag == "cpuset_mems":
+      hostConfig["CpusetMems"] = value
+
+  if idx >= len(dockerRunArgv):
+    raise UnsupportedDockerRunArgument("No image given to `docker run`")
+  config["Image"] = dockerRunArgv[idx]
+  config["Cmd"] = list(dockerRunArgv[idx + 1:])
+  config["HostConfig"] = hostConfig
+  return name, config
+
+def remove_docker_run_flags(dockerRunArgv, flags):
+  """Returns `dockerRunArgv` without the given flags (and their values).
+  Only the flags before the image are looked at; the command run in the
+  container is left untouched.
+
+  Args:
+    dockerRunArgv(list of str): arguments to `docker run`, excluding
+      `docker run` itself
+    flags(iterable of str): flags to remove, eg. ["-p", "--publish"]
+
+  Returns:
+    list of str: the remaining arguments
+  """
+  flags = set(flags)
+  kept = []
+  idx = 0
+  while idx < len(dockerRunArgv):
+    arg = dockerRunArgv[idx]
+    if not arg.startswith("-"):
+      # The image, followed by the container's command
+      kept.extend(dockerRunArgv[idx:])
+      break
+    flag, hasInlineValue = arg, False
+    if arg.startswith("--") and "=" in arg:
+      flag, hasInlineValue = arg.split("=", 1)[0], True
+    takesValue = flag in _VALUE_FLAGS and not hasInlineValue
+    consumed = dockerRunArgv[idx:idx + (2 if takesValue else 1)]
+    if flag not in flags:
+      kept.extend(consumed)
+    idx += len(consumed)
+  return kept
+
+def docker_socket_available(socketPath=DEFAULT_DOCKER_SOCKET):
+  """Returns True if the Docker unix socket exists and is accessible, and
+  no remote daemon was requested through `DOCKER_HOST`."""
+  if os.environ.get("DOCKER_HOST"):
+    return False
+  return os.access(socketPath, os.R_OK | os.W_OK)
+
+_sharedClient = None
+
+def get_client():
+  """Returns a DockerClient shared by the whole process, so that its
+  connection is reused across calls."""
+  global _sharedClient
+  if _sharedClient is None:
+    _sharedClient = DockerClient()
+  return _sharedClient
@@ -1,11 +1,20 @@
 # Executes the appropriate `docker run` command for different Storm components
 
+from __future__ import print_function
+
 import argparse
+import filecmp
 import os
 import re
+import shlex
+import shutil
 import subprocess
 import sys
-import yaml
+
+from . import cluster_model
+from . import docker_api
+from . import ip_addresses
+from . import timing
 
 # Strings of sections specifying ports in `storm.yaml` for major Storm
 # components
@@ -18,6 +27,8 @@ SUPERVISOR_SLOTS_PORTS_STR = "supervisor.slots.ports"
 ZOOKEEPER_PORT_STR = "storm.zookeeper.port"
 ZOOKEEPER_FOLLOWER_PORT_STR = "follower.port"
 ZOOKEEPER_ELECTION_PORT_STR = "election.port"
+METRICS_EXPORTER_PORT_STR = "exporter.port"
+LOG_SEARCH_PORT_STR = "search.port"
 
 class StormPort:
   """Information on a port type for a Storm component."""
@@ -65,19 +76,33 @@ STORM_DEFAULT_PORTS = {
                                          section="zookeeper.multiple.setup"),
   ZOOKEEPER_ELECTION_PORT_STR: StormPort(3888,
                                          section="zookeeper.multiple.setup"),
+  METRICS_EXPORTER_PORT_STR:   StormPort(9190,
+                                         section="storm.supervisor.metrics"),
+  LOG_SEARCH_PORT_STR:         StormPort(8001,
+                                         section="storm.supervisor.logsearch"),
 }
 
 # Dict of Storm component -> list of sections in `storm.yaml` specifying ports
 STORM_COMPONENT_PORTS = {
   "drpc":       [DRPC_PORT_STR, DRPC_INVOCATIONS_PORT_STR],
-  "logviewer":  [LOGVIEWER_PORT_STR],
+  "logviewer":  [LOGVIEWER_PORT_STR, LOG_SEARCH_PORT_STR],
   "nimbus":     [NIMBUS_THRIFT_PORT_STR],
-  "supervisor": [SUPERVISOR_SLOTS_PORTS_STR],
+  "supervisor": [SUPERVISOR_SLOTS_PORTS_STR, METRICS_EXPORTER_PORT_STR],
   "ui":         [UI_PORT_STR],
   "zookeeper":  [ZOOKEEPER_PORT_STR, ZOOKEEPER_FOLLOWER_PORT_STR,
                  ZOOKEEPER_ELECTION_PORT_STR],
 }
 
+# `docker run` flags left out with `network_mode: host`: ports need neither
+# publishing nor exposing, and Docker rejects links, hostnames and DNS servers
+# for containers sharing the host's network stack
+HOST_NETWORK_DROPPED_FLAGS = ["-p", "--publish", "--expose", "--link", "-h",
+  "--hostname", "--dns"]
+
+# Where the `host.dir` directory of the `config.reload` section is mounted in
+# the Storm containers
+CONFIG_RELOAD_MOUNT_DIR = "/etc/storm-docker"
+
 parser = argparse.ArgumentParser(
   description="Generates the docker run command for the given Storm component",
   # The `-h` flag is in some args passed to this program to specify the Docker
@@ -92,13 +117,22 @@ parser.add_argument("--storm-docker-component",
   help="The Storm component to run",
 )
 
+def get_cluster_model():
+  """Returns the compiled model of the `config/storm-setup.yaml` file. The file
+  is parsed at most once per process; see `cluster_model.load_cluster_model`.
+
+  Returns:
+    cluster_model.ClusterModel: the compiled `config/storm-setup.yaml` file"""
+  return cluster_model.load_cluster_model(
+    cluster_model.DEFAULT_STORM_SETUP_YAML
+  )
+
 def get_storm_config():
   """Returns the Dict defined by the `config/storm-setup.yaml` file.
 
   Returns:
     Dict: the Dict defined by the `config/storm-setup.yaml` file."""
-  with open(os.path.join("config", "storm-setup.yaml")) as f:
-    return yaml.load(f.read())
+  return get_cluster_model().config
 
 def ec2_get_ip(public=True):
   """Returns the public or private IP address for the current EC2 machine.
@@ -107,70 +141,45 @@ def ec2_get_ip(public=True):
 
       http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/using-instance-addressing.html
 
+  Both addresses are looked up together and cached on disk; see
+  `ip_addresses.ec2_ip_addresses`.
+
   Args:
     public(bool, optional): defaults to True. If True, the public IP of the
       EC2 machine is returned. If False, the private IP of the EC2 machine is
       returned.
 
   Returns:
-    str: Public or private IP address for the current EC2 machine
+    str: Public or private IP address for the current EC2 machine, or None if
+      this server is most probably not an EC2 instance
   """
-  urlToQuery = None
-  if public:
-    urlToQuery = "http://169.254.169.254/latest/meta-data/public-ipv4"
-  else:
-    urlToQuery = "http://169.254.169.254/latest/meta-data/local-ipv4"
-  getIpProc = subprocess.Popen(["curl", urlToQuery, "--connect-timeout", "10"],
-    stdout=subprocess.PIPE, stderr=subprocess.PIPE
-  )
-  procOut, _ = getIpProc.communicate()
-  if getIpProc.returncode == 0:
-    mbIpAddr = procOut.strip()
-    if re.match(r"""^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$""", mbIpAddr) \
-        is not None:
-      return mbIpAddr
-    else:
-      raise ValueError(
-        "Return value of `{}` \"{}\" does not look like an IP address".format(
-          "curl {}".format(urlToQuery), mbIpAddr
-        )
-      )
-  else:
-    # Most probably this server is not an EC2 instance
-    return None
+  publicIp, privateIp = ip_addresses.ec2_ip_addresses()
+  return publicIp if public else privateIp
 
 def get_ipv4_addresses(isLocalhostSetup=False,
     allMachinesAreEC2Instances=False):
-  """Returns all possible IPv4 addresses for the machine based on the output of
-  the `ifconfig` command. `127.0.0.1` will be included if True is supplied for
+  """Returns all possible IPv4 addresses for the machine, as configured on its
+  network interfaces. `127.0.0.1` will be included if True is supplied for
   the `isLocalhostSetup` parameter, it will be excluded otherwise.
 
   Args:
     isLocalhostSetup(bool, optional): Set this to True if you are running
       everything on one machine using 127.0.0.1 as the IP address
+    allMachinesAreEC2Instances(bool, optional): Set this to True to also
+      include the public and private IP addresses from the EC2 instance
+      metadata
 
   Returns:
     list of str: List of IPv4 addresses for this machine
   """
-  p = subprocess.Popen(["ifconfig"], stdout=subprocess.PIPE)
-  out, _ = p.communicate()
-  lines = out.split("\n")
-  inetAddrRegex = re.compile(
-    r"""^inet addr:(\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3})"""
-  )
-  ipAddresses = []
-  for line in lines:
-    line = line.strip()
-    matchObj = inetAddrRegex.match(line)
-    if matchObj is not None:
-      ipAddresses.append(matchObj.group(1))
+  with timing.span("ip.interfaces"):
+    ipAddresses = ip_addresses.interface_ipv4_addresses()
   if allMachinesAreEC2Instances:
-    ec2PublicIp = ec2_get_ip(public=True)
-    if ec2PublicIp is not None:
-      ipAddresses.append(ec2PublicIp)
-    ec2PrivateIp = ec2_get_ip(public=False)
-    if ec2PrivateIp is not None:
-      ipAddresses.append(ec2PrivateIp)
+    with timing.span("ip.ec2"):
+      ec2IpAddresses = ip_addresses.ec2_ip_addresses()
+    for ec2Ip in ec2IpAddresses:
+      if ec2Ip is not None and ec2Ip not in ipAddresses:
+        ipAddresses.append(ec2Ip)
   try:
     ipAddresses.remove('127.0.0.1')
   except ValueError:
@@ -210,54 +219,219 @@ def construct_docker_run_args(dockerRunArgv, myIPv4Addresses):
   # strip unnecessary whitespace
   return re.sub(r"""\s+""", " ", dockerRunArgsString).strip()
 
-def construct_docker_run_port_args(stormComponentList):
+def sync_config_reload_file():
+  """Copies `config/storm-setup.yaml` to the `host.dir` directory of the
+  `config.reload` section if their contents differ. The Storm containers of
+  this machine watch the copy and apply its changes.
+
+  Returns:
+    bool: True if the copy was updated
+  """
+  hostDir = get_cluster_model().configReloadDir
+  if hostDir is None:
+    return False
+  source = cluster_model.DEFAULT_STORM_SETUP_YAML
+  dest = os.path.join(hostDir, "storm-setup.yaml")
+  if os.path.exists(dest) and filecmp.cmp(source, dest, shallow=False):
+    return False
+  if not os.path.isdir(hostDir):
+    os.makedirs(hostDir)
+  # Replace the file with a rename, so that it is never read half-written
+  tmpPath = "{}.{}.tmp".format(dest, os.getpid())
+  shutil.copyfile(source, tmpPath)
+  os.rename(tmpPath, dest)
+  return True
+
+def construct_docker_run_config_reload_args():
+  """Returns the `docker run` arguments which mount the `storm-setup.yaml` file
+  of the `config.reload` section into a Storm container, or an empty list if
+  the section is absent.
+
+  Returns:
+    list of str: `docker run` arguments
+  """
+  if get_cluster_model().configReloadDir is None:
+    return []
+  sync_config_reload_file()
+  return [
+    "-v {}:{}:ro".format(get_cluster_model().configReloadDir,
+      CONFIG_RELOAD_MOUNT_DIR
+    ),
+    "-e STORM_SETUP_YAML={}/storm-setup.yaml".format(CONFIG_RELOAD_MOUNT_DIR),
+  ]
+
+def construct_docker_run_port_args(stormComponentList, portOverrides=None,
+    hostPortShift=0):
   """Constructs the arguments used by `docker run` for port forwarding and
   exposing ports.
 
   Args:
     stormComponentList(list of str): List of strings, each of which is a Storm
       component
+    portOverrides(dict, optional): port section string (eg.
+      `SUPERVISOR_SLOTS_PORTS_STR`) -> list of ports to use instead of those
+      in `config/storm-setup.yaml`
+    hostPortShift(int, optional): added to the host side of the published
+      ports, other than those of `portOverrides`, so that several containers
+      of a machine can publish the same container ports (see
+      `supervisor_containers.py`)
 
   Returns:
     list of str: List of arguments to `docker run` for port forwarding and
       exposing ports
   """
-  stormConfig = get_storm_config()
-  portForwardArgs = []
-  portExposeArgs = []
+  clusterModel = get_cluster_model()
+  if clusterModel.hostNetwork:
+    # Containers bind the host's ports directly
+    return []
+  componentPorts = clusterModel.componentPorts
+  # host port shift -> ports
+  tcpPorts = {}
+  udpPorts = {}
 
   # For each Storm component
   for stormComponent in stormComponentList:
-    # We retrieve the list of string keys for sections in
-    # `config/storm-setup.yaml` that specifies a configurable port / list of
-    # ports
-    portKeyStringsList = STORM_COMPONENT_PORTS[stormComponent]
-    # For each section
-    for portKeyString in portKeyStringsList:
-      # Retrieve the `StormPort` object in `STORM_DEFAULT_PORTS`
-      stormPortObj = STORM_DEFAULT_PORTS[portKeyString]
-      # Retrieve the appropriate section in `config/storm-setup.yaml`
-      # containing the port configuration
-      stormYamlSection = stormConfig[stormPortObj.section]
-      # Retrieve the port / list of ports for this section. Fallback to using
-      # the default port / ports if the user did not specify any.
-      portNumOrList = stormYamlSection.get(portKeyString, stormPortObj.portList)
-      # To simplify things, for the case where `portNumOrList` is a single
-      # port, we convert the single port into a singleton list containing that
-      # port.
-      if isinstance(portNumOrList, int):
-        portNumOrList = [portNumOrList]
-      for portNum in portNumOrList:
-        # For each port, construct the port forwarding and expose args for
-        # `docker run`
-        portForwardArgs.append("-p {}:{}".format(portNum, portNum))
-        # For port(s) that need to accept UDP traffic, we add another flag to
-        # indicate it
-        if stormPortObj.needsUDP:
-          portForwardArgs.append("-p {}:{}/udp".format(portNum, portNum))
-        portExposeArgs.append("--expose {}".format(portNum))
+    # We retrieve the ports of each section in `config/storm-setup.yaml` that
+    # specifies a configurable port / list of ports for this component. The
+    # cluster model has already fallen back to the default port / ports for
+    # sections the user did not specify.
+    for portKeyString, portList, needsUDP in componentPorts[stormComponent]:
+      shift = hostPortShift
+      if portOverrides and portKeyString in portOverrides:
+        portList = portOverrides[portKeyString]
+        shift = 0
+      tcpPorts.setdefault(shift, set()).update(portList)
+      # For port(s) that need to accept UDP traffic, we add another flag to
+      # indicate it
+      if needsUDP:
+        udpPorts.setdefault(shift, set()).update(portList)
+
+  # Contiguous ports are given as a single `start-end` range, so that hosts
+  # with hundreds of worker slots do not get hundreds of flags
+  portForwardArgs = []
+  portExposeArgs = []
+  for shift in sorted(tcpPorts):
+    for portRange in coalesce_port_ranges(tcpPorts[shift]):
+      portForwardArgs.append("-p {}:{}".format(
+        shift_port_range(portRange, shift), portRange
+      ))
+      portExposeArgs.append("--expose {}".format(portRange))
+  for shift in sorted(udpPorts):
+    for portRange in coalesce_port_ranges(udpPorts[shift]):
+      portForwardArgs.append("-p {}:{}/udp".format(
+        shift_port_range(portRange, shift), portRange
+      ))
   return portForwardArgs + portExposeArgs
 
+def shift_port_range(portRange, shift):
+  """Adds `shift` to a port range returned by `coalesce_port_ranges`."""
+  if not shift:
+    return portRange
+  return "-".join(str(int(port) + shift) for port in portRange.split("-"))
+
+def coalesce_port_ranges(ports):
+  """Groups ports into runs of consecutive ports.
+
+  Args:
+    ports(iterable of int): ports, in any order, possibly with duplicates
+
+  Returns:
+    list of str: `start-end` for each run of several ports, `port` for a lone
+      port, in increasing order. Eg. [6700, 6701, 6702, 8000] gives
+      ["6700-6702", "8000"].
+  """
+  portRanges = []
+  start = end = None
+  for port in sorted(set(int(port) for port in ports)):
+    if end is not None and port == end + 1:
+      end = port
+      continue
+    if start is not None:
+      portRanges.append((start, end))
+    start = end = port
+  if start is not None:
+    portRanges.append((start, end))
+  return [str(start) if start == end else "{}-{}".format(start, end)
+    for start, end in portRanges
+  ]
+
+def run_docker_container(dockerRunArgs, labels=None):
+  """Runs a Docker container, like `docker run <dockerRunArgs>`.
+
+  The container is created and started through the Docker Engine API over the
+  daemon's unix socket. The `docker` CLI is only used if the socket is not
+  usable (eg. `DOCKER_HOST` points to a remote daemon), if the arguments
+  contain a flag which `docker_api` does not translate, or if the connection
+  to the daemon was lost while the container was being created (`docker run`
+  then fails on the name conflict rather than creating a second container).
+
+  With `network_mode: host`, the container is run with `--net=host` and the
+  flags in `HOST_NETWORK_DROPPED_FLAGS` are left out.
+
+  Args:
+    dockerRunArgs(str): arguments to `docker run`, excluding `docker run`
+    labels(dict, optional): labels to add to the container
+
+  Returns:
+    docker_api.RunResult: the started container. Its `containerId` is None if
+      the `docker` CLI was used.
+  """
+  if labels:
+    dockerRunArgs = "{} {}".format(" ".join(
+      "--label {}={}".format(key, value) for key, value in sorted(labels.items())
+    ), dockerRunArgs)
+  dockerRunArgv = shlex.split(dockerRunArgs)
+  if get_cluster_model().hostNetwork:
+    dockerRunArgv = ["--net=host"] + docker_api.remove_docker_run_flags(
+      dockerRunArgv, HOST_NETWORK_DROPPED_FLAGS
+    )
+    dockerRunArgs = " ".join(dockerRunArgv)
+  print("docker run {}".format(dockerRunArgs))
+  if docker_api.docker_socket_available():
+    try:
+      with timing.span("docker.run", via="api"):
+        result = docker_api.get_client().run(dockerRunArgv)
+      print("started container {} ({})".format(
+        result.name or result.containerId[:12], result.containerId[:12]
+      ))
+      for warning in result.warnings:
+        print("WARNING: {}".format(warning), file=sys.stderr)
+      return result
+    except (docker_api.UnsupportedDockerRunArgument,
+        docker_api.RequestOutcomeUnknown) as e:
+      print("{}; falling back to the docker CLI".format(e), file=sys.stderr)
+  with timing.span("docker.run", via="cli"):
+    returncode = subprocess.call(["docker", "run"] + dockerRunArgv)
+  if returncode != 0:
+    raise RuntimeError("`docker run {}` exited with status {}".format(
+      dockerRunArgs, returncode
+    ))
+  return docker_api.RunResult(None, None, None)
+
+def config_labels(configKind, host=None, container=None):
+  """Returns the labels recording which configuration a container was run
+  with.
+
+  Args:
+    configKind(str): "storm" for the Storm containers, "zookeeper" for the
+      Zookeeper and Zookeeper ambassador containers
+    host(str, optional): host a Storm container runs on. Defaults to the
+      Nimbus host.
+    container(supervisor_containers.SupervisorContainer, optional): the
+      supervisor container being run, if any
+
+  Returns:
+    dict: labels for `run_docker_container`
+  """
+  clusterModel = get_cluster_model()
+  if configKind == "storm":
+    configHash = clusterModel.storm_config_hash(
+      host if host is not None else clusterModel.nimbusHost, container
+    )
+  else:
+    configHash = clusterModel.configHashes[configKind]
+  return {cluster_model.CONFIG_HASH_LABEL: configHash}
+
 def main(args=None):
   if args is None:
     # No args provided, so this script is run as a main program.
@@ -272,18 +446,17 @@ def main(args=None):
   # `config/storm-setup.yaml` file
   portArgs = construct_docker_run_port_args(parsedArgs.storm_components)
 
-  # Prepend port forwarding args to args list
-  remArgList[:0] = portArgs
+  # Prepend port forwarding args to args list, along with the mount of the
+  # watched `storm-setup.yaml` file
+  remArgList[:0] = portArgs + construct_docker_run_config_reload_args()
 
   stormConfig = get_storm_config()
   ipv4Addresses = get_ipv4_addresses(stormConfig["is_localhost_setup"],
     stormConfig.get("all_machines_are_ec2_instances", False)
   )
   dockerRunArgsString = construct_docker_run_args(remArgList, ipv4Addresses)
-  dockerRunCmd = "docker run {}".format(dockerRunArgsString)
-  print(dockerRunCmd)
   # execute `docker run` with the generated args
-  os.system(dockerRunCmd)
+  run_docker_container(dockerRunArgsString, config_labels("storm"))
 
 # When run as a main program
 if __name__ == "__main__":
@@ -0,0 +1,365 @@
+# Builds the storm-docker Docker images in parallel, following their
+# dependency graph:
+#
+#     base-storm ----> storm-nimbus, storm-supervisor, storm-ui
+#     zookeeper
+#     zk-ambassador
+#
+# Images without unbuilt dependencies are built concurrently: base-storm,
+# zookeeper and zk-ambassador first, then the 3 Storm role images together.
+#
+# Each image is tagged with a hash of its inputs (every file of its build
+# context, after the `config/` files it needs are copied in, and the hashes of
+# the images it is built FROM), eg. `viki_data/storm-ui:3f2a9c0d1e4b`, as
+# well as with the plain image name used by `start-storm.sh`. An image whose
+# input hash is already tagged is not built again; it is only tagged with its
+# plain name, so editing `config/zoo.cfg` rebuilds the Zookeeper image only.
+#
+# `config/storm-setup.yaml` is copied into the build context of each Storm role
+# image, rather than into base-storm, and added in their last layer: editing it
+# rebuilds that layer of the 3 role images (and the Zookeeper image), instead
+# of base-storm and, as their parent image changes, every layer of the role
+# images.
+#
+# `docker` is run as a command line, which can be swapped for a fake one with
+# `--docker` (or the `DOCKER` environment variable).
+#
+# Usage, from the top of the storm-docker repository:
+#
+#     python -m docker_python_helpers.image_build [--jobs N] [IMAGE...]
+#
+# or, once installed, `storm-docker build [--jobs N] [IMAGE...]`
+
+from __future__ import print_function
+
+import argparse
+import filecmp
+import hashlib
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+# Prefix of the storm-docker image names
+IMAGE_PREFIX = "viki_data"
+
+# Length of the input hash used as image tag
+TAG_LENGTH = 12
+
+class ImageSpec(object):
+  """A Docker image built from a directory of this repository."""
+  def __init__(self, name, dependencies=None, configFiles=None):
+    """Constructor for ImageSpec
+
+    Args:
+      name(str): name of the image, and of its build context directory
+      dependencies(list of str, optional): images this image is built FROM
+      configFiles(list of (str, str), optional): files from outside the build
+        context (mostly of the `config` directory) copied into it before
+        building, as (source, destination) paths relative to the top of the
+        repository
+    """
+    self.name = name
+    self.dependencies = list(dependencies or [])
+    self.configFiles = list(configFiles or [])
+
+  @property
+  def image(self):
+    return "{}/{}".format(IMAGE_PREFIX, self.name)
+
+# The images of storm-docker, by name
+IMAGES = dict((spec.name, spec) for spec in [
+  ImageSpec("base-storm", configFiles=[
+    ("config/cluster.xml", "base-storm/cluster.xml"),
+    ("docker_python_helpers/timing.py", "base-storm/timing.py"),
+  ]),
+  ImageSpec("zookeeper", configFiles=[
+    ("config/storm-setup.yaml", "zookeeper/storm-setup.yaml"),
+    ("config/zoo.cfg", "zookeeper/zoo.cfg"),
+    ("docker_python_helpers/timing.py", "zookeeper/timing.py"),
+  ]),
+  ImageSpec("zk-ambassador"),
+  ImageSpec("storm-nimbus", ["base-storm"], configFiles=[
+    ("config/storm-setup.yaml", "storm-nimbus/storm-setup.yaml"),
+  ]),
+  ImageSpec("storm-supervisor", ["base-storm"], configFiles=[
+    ("config/storm-setup.yaml", "storm-supervisor/storm-setup.yaml"),
+    ("docker_python_helpers/zk_client.py", "storm-supervisor/zk_client.py"),
+  ]),
+  ImageSpec("storm-ui", ["base-storm"], configFiles=[
+    ("config/storm-setup.yaml", "storm-ui/storm-setup.yaml"),
+  ]),
+])
+
+class BuildError(RuntimeError):
+  """Raised when a `docker` command fails."""
+  def __init__(self, argv, returncode, output=""):
+    RuntimeError.__init__(self, "`{}` exited with status {}".format(
+      " ".join(argv), returncode
+    ))
+    self.argv = argv
+    self.returncode = returncode
+    self.output = output
+
+class BuildResult(object):
+  """Outcome of building one image."""
+  BUILT = "built"
+  CACHED = "cached"
+  FAILED = "failed"
+  SKIPPED = "skipped"
+
+  def __init__(self, name, status, inputHash=None, duration=0.0, error=None):
+    self.name = name
+    self.status = status
+    self.inputHash = inputHash
+    self.duration = duration
+    self.error = error
+
+  @property
+  def succeeded(self):
+    return self.status in (BuildResult.BUILT, BuildResult.CACHED)
+
+  def __str__(self):
+    line = "{}: {}".format(self.name, self.status)
+    if self.inputHash:
+      line += " ({}:{})".format(IMAGES[self.name].image if self.name in IMAGES
+        else self.name, self.inputHash
+      )
+    if self.status == BuildResult.BUILT:
+      line += " in {:.1f}s".format(self.duration)
+    if self.error is not None:
+      line += ": {}".format(self.error)
+    return line
+
+def run_docker(argv):
+  """Runs a `docker` command line.
+
+  Returns:
+    str: combined stdout and stderr
+
+  Raises:
+    BuildError: if the command exits with a non-zero status
+  """
+  proc = subprocess.Popen(argv, stdout=subprocess.PIPE,
+    stderr=subprocess.STDOUT
+  )
+  out, _ = proc.communicate()
+  out = out.decode("utf-8", "replace")
+  if proc.returncode != 0:
+    raise BuildError(argv, proc.returncode, out)
+  return out
+
+def copy_config_files(spec, rootDir="."):
+  """Copies the outside files of an image into its build context, unless the
+  copy is already identical (which would needlessly touch the file)."""
+  for source, dest in spec.configFiles:
+    source = os.path.join(rootDir, source)
+    dest = os.path.join(rootDir, dest)
+    if not os.path.exists(source):
+      if os.path.exists(source + ".sample"):
+        raise IOError("{} does not exist. Please create it from {}.sample "
+          "and try again.".format(source, source)
+        )
+      raise IOError("{} does not exist".format(source))
+    if not os.path.exists(dest) or not filecmp.cmp(source, dest, shallow=False):
+      shutil.copyfile(source, dest)
+
+def context_hash(contextDir):
+  """Returns the SHA-1 of the paths and contents of the files of a build
+  context, leaving out Python bytecode."""
+  sha = hashlib.sha1()
+  for dirPath, dirNames, fileNames in os.walk(contextDir):
+    dirNames[:] = sorted(name for name in dirNames if name != "__pycache__")
+    for fileName in sorted(fileNames):
+      if fileName.endswith((".pyc", ".pyo")):
+        continue
+      path = os.path.join(dirPath, fileName)
+      relPath = os.path.relpath(path, contextDir).replace(os.sep, "/")
+      sha.update(relPath.encode("utf-8") + b"\0")
+      # The executable bit ends up in the image too
+      sha.update(b"x" if os.access(path, os.X_OK) else b"-")
+      with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(65536), b""):
+          sha.update(chunk)
+      sha.update(b"\0")
+  return sha.hexdigest()
+
+def input_hashes(names, rootDir="."):
+  """Returns the input hash of every image of `names` and of their
+  dependencies.
+
+  Returns:
+    dict: image name -> hash
+  """
+  hashes = {}
+
+  def compute(name):
+    if name not in hashes:
+      spec = IMAGES[name]
+      sha = hashlib.sha1(context_hash(os.path.join(rootDir, name)).encode())
+      for dependency in spec.dependencies:
+        sha.update(compute(dependency).encode())
+      hashes[name] = sha.hexdigest()[:TAG_LENGTH]
+    return hashes[name]
+
+  for name in names:
+    compute(name)
+  return hashes
+
+def with_dependencies(names):
+  """Returns `names` along with every image they depend on."""
+  result = set()
+  pending = list(names)
+  while pending:
+    name = pending.pop()
+    if name not in result:
+      result.add(name)
+      pending.extend(IMAGES[name].dependencies)
+  return result
+
+def image_exists(docker, tag, run=run_docker):
+  try:
+    run(docker + ["inspect", "--type=image", tag])
+    return True
+  except BuildError:
+    return False
+
+def build_image(name, inputHash, docker, rootDir=".", force=False,
+    run=run_docker):
+  """Builds one image (unless its input hash is already tagged) and tags it
+  with its plain name.
+
+  Returns:
+    str: BuildResult.BUILT or BuildResult.CACHED
+  """
+  spec = IMAGES[name]
+  hashTag = "{}:{}".format(spec.image, inputHash)
+  status = BuildResult.CACHED
+  if force or not image_exists(docker, hashTag, run):
+    run(docker + ["build", "-t", hashTag, os.path.join(rootDir, name)])
+    status = BuildResult.BUILT
+  run(docker + ["tag", hashTag, spec.image])
+  return status
+
+def build_images(names=None, docker=None, jobs=None, rootDir=".", force=False,
+    run=run_docker, onResult=None):
+  """Builds the given images and their dependencies, in parallel where the
+  dependency graph allows it.
+
+  Args:
+    names(list of str, optional): images to build. Defaults to all of them.
+    docker(list of str, optional): `docker` command line. Defaults to the
+      `DOCKER` environment variable, or `docker`.
+    jobs(int, optional): maximum number of concurrent builds. Defaults to the
+      number of images.
+    rootDir(str, optional): top of the storm-docker repository
+    force(bool, optional): build even if the input hash is already tagged
+    run(callable, optional): `run_docker` stand-in
+    onResult(callable, optional): called with each BuildResult
+
+  Returns:
+    list of BuildResult: in the order the builds finished
+  """
+  if docker is None:
+    docker = os.environ.get("DOCKER", "docker").split()
+  selected = with_dependencies(names or list(IMAGES))
+  for name in selected:
+    copy_config_files(IMAGES[name], rootDir)
+  hashes = input_hashes(selected, rootDir)
+
+  results = []
+  done = {}
+  cond = threading.Condition()
+  pool = ThreadPool(max(1, jobs or len(selected)))
+
+  def finish(result):
+    with cond:
+      done[result.name] = result
+      results.append(result)
+      if onResult is not None:
+        onResult(result)
+      cond.notify_all()
+
+  def build(name):
+    startTime = time.time()
+    try:
+      status = build_image(name, hashes[name], docker, rootDir, force, run)
+      finish(BuildResult(name, status, hashes[name], time.time() - startTime))
+    except Exception as e:
+      finish(BuildResult(name, BuildResult.FAILED, hashes[name],
+        time.time() - startTime, e
+      ))
+
+  try:
+    with cond:
+      started = set()
+      while len(done) < len(selected):
+        for name in sorted(selected - started):
+          dependencies = IMAGES[name].dependencies
+          if any(dependency in done and not done[dependency].succeeded
+              for dependency in dependencies):
+            started.add(name)
+            done[name] = BuildResult(name, BuildResult.SKIPPED,
+              error="a dependency failed"
+            )
+            results.append(done[name])
+            if onResult is not None:
+              onResult(done[name])
+          elif all(dependency in done for dependency in dependencies):
+            started.add(name)
+            pool.apply_async(build, (name,))
+        if len(done) < len(selected):
+          cond.wait(1.0)
+  finally:
+    pool.close()
+    pool.join()
+  return results
+
+def main(args=None):
+  if args is None:
+    args = sys.argv[1:]
+  parser = argparse.ArgumentParser(
+    description="Builds the storm-docker images in parallel, skipping those "
+      "whose inputs did not change"
+  )
+  parser.add_argument("images", nargs="*", metavar="IMAGE",
+    help="Images to build, along with their dependencies (default: all of "
+      "{})".format(", ".join(sorted(IMAGES)))
+  )
+  parser.add_argument("--jobs", "-j", type=int,
+    help="Maximum number of concurrent builds (default: no limit)"
+  )
+  parser.add_argument("--docker",
+    help="docker command line (default: $DOCKER, or docker)"
+  )
+  parser.add_argument("--force", action="store_true",
+    help="Build the images even if their input hash is already tagged"
+  )
+  parsedArgs = parser.parse_args(args)
+  unknown = [name for name in parsedArgs.images if name not in IMAGES]
+  if unknown:
+    parser.error("unknown image(s): {}".format(", ".join(unknown)))
+
+  printLock = threading.Lock()
+  def on_result(result):
+    with printLock:
+      print(result)
+      if isinstance(result.error, BuildError) and result.error.output:
+        print(result.error.output.rstrip(), file=sys.stderr)
+      sys.stdout.flush()
+
+  results = build_images(parsedArgs.images,
+    parsedArgs.docker.split() if parsedArgs.docker else None,
+    parsedArgs.jobs, force=parsedArgs.force, onResult=on_result
+  )
+  if not all(result.succeeded for result in results):
+    sys.exit(1)
+
+# When run as a main program
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,244 @@
+# Discovery of the IPv4 addresses of the current machine without spawning any
+# subprocess.
+#
+# Interface addresses are read straight from the kernel with the SIOCGIFCONF
+# ioctl (what `ifconfig` does under the hood), so we no longer depend on the
+# output format of a particular net-tools version.
+#
+# On Amazon EC2, the public and private IP addresses are fetched from the
+# instance metadata service concurrently, with a short timeout, and the result
+# is cached on disk for `DEFAULT_EC2_CACHE_TTL` seconds so that only the first
+# helper invocation on a machine pays for the lookup. "This is not an EC2
+# instance" is only cached when the metadata service is definitely unreachable
+# (connection refused, no route to it); timeouts and server errors may be
+# transient, so the next invocation asks again. See:
+#
+#     http://docs.aws.amazon.com/AWSEC2/latest/UserGuide/using-instance-addressing.html
+
+import array
+import errno
+import fcntl
+import json
+import os
+import os.path
+import re
+import socket
+import struct
+import tempfile
+import threading
+import time
+
+try:
+  from urllib.error import HTTPError, URLError
+  from urllib.request import urlopen
+except ImportError:
+  from urllib2 import HTTPError, URLError, urlopen
+
+from . import cluster_model
+
+# ioctl request number for SIOCGIFCONF, see <linux/sockios.h>
+SIOCGIFCONF = 0x8912
+
+# `sizeof(struct ifreq)`: a 16 byte interface name followed by a 24 byte union
+# on 64 bit platforms, 16 bytes on 32 bit ones
+IFREQ_SIZE = 40 if struct.calcsize("P") == 8 else 32
+
+# Base URL of the EC2 instance metadata service. Can be overridden through the
+# `STORM_DOCKER_EC2_METADATA_URL` environment variable.
+EC2_METADATA_URL = "http://169.254.169.254/latest/meta-data"
+
+# Timeout in seconds of each EC2 metadata request. The service answers in a
+# few milliseconds on EC2; elsewhere 169.254.169.254 is usually unroutable.
+EC2_METADATA_TIMEOUT = 1.0
+
+# Number of seconds cached EC2 metadata lookups remain valid
+DEFAULT_EC2_CACHE_TTL = 3600
+
+# Errors showing that the metadata service cannot be reached from this machine,
+# as opposed to being slow or failing for a moment
+UNREACHABLE_ERRNOS = frozenset([errno.ECONNREFUSED, errno.ENETUNREACH,
+  errno.EHOSTUNREACH
+])
+
+IPV4_REGEX = re.compile(r"""^\d{1,3}\.\d{1,3}\.\d{1,3}\.\d{1,3}$""")
+
+def interface_ipv4_addresses():
+  """Returns the IPv4 addresses of every configured network interface,
+  including the loopback interface.
+
+  Returns:
+    list of str: IPv4 addresses, in the order the kernel reports them
+  """
+  sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  try:
+    maxInterfaces = 32
+    while True:
+      bufSize = maxInterfaces * IFREQ_SIZE
+      buf = array.array("B", b"\0" * bufSize)
+      bufAddr, _ = buf.buffer_info()
+      # struct ifconf { int ifc_len; char *ifc_buf; }
+      ifconf = fcntl.ioctl(sock.fileno(), SIOCGIFCONF,
+        struct.pack("iL", bufSize, bufAddr)
+      )
+      outSize, _ = struct.unpack("iL", ifconf)
+      # A full buffer means there may be more interfaces than we made room for
+      if outSize < bufSize:
+        break
+      maxInterfaces *= 2
+  finally:
+    sock.close()
+
+  data = buf.tobytes() if hasattr(buf, "tobytes") else buf.tostring()
+  ipAddresses = []
+  for offset in range(0, outSize, IFREQ_SIZE):
+    # The address is a `struct sockaddr_in` right after the interface name;
+    # the IPv4 address sits 4 bytes into it
+    ipAddress = socket.inet_ntoa(data[offset + 20:offset + 24])
+    if ipAddress not in ipAddresses:
+      ipAddresses.append(ipAddress)
+  return ipAddresses
+
+def _metadata_url():
+  return os.environ.get("STORM_DOCKER_EC2_METADATA_URL", EC2_METADATA_URL)
+
+def _is_definitive_failure(error):
+  """Returns True if a failed metadata request will fail the same way when
+  retried: the address is unreachable, or the metadata service answered 404
+  (eg. `public-ipv4` on instances without a public address)."""
+  if isinstance(error, HTTPError):
+    return error.code == 404
+  if isinstance(error, URLError):
+    error = error.reason
+  return getattr(error, "errno", None) in UNREACHABLE_ERRNOS
+
+def _fetch_ec2_ip(public, timeout):
+  """Like `fetch_ec2_ip`, also telling whether the result may be cached.
+
+  Returns:
+    (str, bool): the IP address or None, and False if the lookup failed in a
+      way which may be transient (timeout, server error)
+  """
+  url = "{}/{}".format(_metadata_url(),
+    "public-ipv4" if public else "local-ipv4"
+  )
+  try:
+    resp = urlopen(url, timeout=timeout)
+    try:
+      mbIpAddr = resp.read().decode("utf-8", "replace").strip()
+    finally:
+      resp.close()
+  except (IOError, OSError, socket.error) as e:
+    # Covers connection errors, timeouts and HTTP errors
+    return None, _is_definitive_failure(e)
+  if IPV4_REGEX.match(mbIpAddr) is None:
+    raise ValueError(
+      "Return value of `{}` \"{}\" does not look like an IP address".format(
+        url, mbIpAddr
+      )
+    )
+  return mbIpAddr, True
+
+def fetch_ec2_ip(public=True, timeout=EC2_METADATA_TIMEOUT):
+  """Returns the public or private IP address for the current EC2 machine,
+  straight from the instance metadata service.
+
+  Returns:
+    str: the IP address, or None if the metadata service cannot be reached
+      (most probably this server is not an EC2 instance) or the instance has
+      no such address
+
+  Raises:
+    ValueError: if the metadata service returns something which does not look
+      like an IP address
+  """
+  ipAddress, _ = _fetch_ec2_ip(public, timeout)
+  return ipAddress
+
+def _fetch_ec2_ips(timeout):
+  """Like `fetch_ec2_ips`, also telling whether the result may be cached.
+
+  Returns:
+    (str, str, bool): public and private IP addresses, and False if either
+      lookup failed in a way which may be transient
+  """
+  results = {}
+  errors = []
+
+  def fetch(public):
+    try:
+      results[public] = _fetch_ec2_ip(public, timeout)
+    except ValueError as e:
+      errors.append(e)
+
+  threads = [threading.Thread(target=fetch, args=(public,))
+    for public in (True, False)
+  ]
+  for thread in threads:
+    thread.daemon = True
+    thread.start()
+  for thread in threads:
+    thread.join()
+  if errors:
+    raise errors[0]
+  (publicIp, publicCacheable), (privateIp, privateCacheable) = \
+    results[True], results[False]
+  return publicIp, privateIp, publicCacheable and privateCacheable
+
+def fetch_ec2_ips(timeout=EC2_METADATA_TIMEOUT):
+  """Fetches the public and private IP addresses of the current EC2 machine
+  concurrently.
+
+  Returns:
+    (str, str): public and private IP addresses; each is None if unavailable
+  """
+  publicIp, privateIp, _ = _fetch_ec2_ips(timeout)
+  return publicIp, privateIp
+
+def _ec2_cache_path():
+  cacheDir = cluster_model.cache_dir()
+  if not cacheDir:
+    return None
+  return os.path.join(cacheDir, "ec2-ip-addresses.json")
+
+def _read_ec2_cache(cachePath, ttl):
+  try:
+    with open(cachePath, "r") as f:
+      cached = json.load(f)
+    if time.time() - cached["time"] <= ttl and \
+        cached.get("url") == _metadata_url():
+      return cached["public"], cached["private"]
+  except (IOError, OSError, ValueError, KeyError, TypeError):
+    pass
+  return None
+
+def _write_ec2_cache(cachePath, publicIp, privateIp):
+  cacheDir = os.path.dirname(cachePath)
+  try:
+    if not os.path.isdir(cacheDir):
+      os.makedirs(cacheDir)
+    fd, tmpPath = tempfile.mkstemp(dir=cacheDir, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+      json.dump({"time": time.time(), "url": _metadata_url(),
+        "public": publicIp, "private": privateIp}, f
+      )
+    os.rename(tmpPath, cachePath)
+  except (IOError, OSError):
+    pass
+
+def ec2_ip_addresses(ttl=DEFAULT_EC2_CACHE_TTL):
+  """Returns the public and private IP addresses of the current EC2 machine,
+  using the on-disk cache when it is younger than `ttl` seconds. Lookups which
+  failed in a way which may be transient are not cached.
+
+  Returns:
+    (str, str): public and private IP addresses; each is None if unavailable
+  """
+  cachePath = _ec2_cache_path()
+  if cachePath is not None and ttl > 0:
+    cached = _read_ec2_cache(cachePath, ttl)
+    if cached is not None:
+      return cached
+  publicIp, privateIp, cacheable = _fetch_ec2_ips(EC2_METADATA_TIMEOUT)
+  if cachePath is not None and cacheable:
+    _write_ec2_cache(cachePath, publicIp, privateIp)
+  return publicIp, privateIp
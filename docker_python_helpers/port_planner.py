@@ -0,0 +1,281 @@
+# Per-machine port and capacity planner for a `storm-setup.yaml` file.
+#
+# Builds an index of what each machine of the cluster (each distinct IP
+# address of the `servers` dictionary) would run: the Storm components placed
+# on it, every port they bind (from the same `docker_run.STORM_COMPONENT_PORTS`
+# tables `docker run` arguments are generated from) and the worker slots of its
+# supervisor (see `slot_planner.py`), with the ports of each of its containers
+# (see `supervisor_containers.py`). From the index, it reports:
+#
+#   - port conflicts: one port bound by several components of a machine (or by
+#     the supervisors of several hosts sharing an IP address)
+#   - oversubscription: the worker slots and JVM heaps of a machine against the
+#     cores and memory given for it under `storm.supervisor.slots -> servers`
+#
+# The index is built in a single pass over the hosts and their ports, so that
+# checking a 1,000 machine file takes milliseconds once the file is parsed
+# (`cluster_model` caches that part too).
+
+import collections
+import re
+
+from . import docker_run
+from . import slot_planner
+from . import supervisor_containers
+
+# JVM heaps (in MB) of the Storm daemons and workers when their `*.childopts`
+# do not set `-Xmx`, from Storm's `defaults.yaml`
+DEFAULT_HEAP_MB = {
+  "drpc": 768,
+  "logviewer": 128,
+  "nimbus": 1024,
+  "supervisor": 256,
+  "ui": 768,
+  "worker": 768,
+}
+
+# Heap of the Zookeeper server without `zookeeper.tuning -> heap.mb`, as
+# computed by `zookeeper/run-zookeeper.py`: a fraction of the machine's memory
+# clamped to [min, max]. Without the section, the JVM's own default is also a
+# quarter of the memory.
+DEFAULT_ZK_HEAP_FRACTION = 0.25
+DEFAULT_ZK_MIN_HEAP_MB = 256
+DEFAULT_ZK_MAX_HEAP_MB = 8192
+
+_XMX_REGEX = re.compile(r"-Xmx(\d+)([kKmMgG]?)")
+
+# Component using a port of a machine
+PortUse = collections.namedtuple("PortUse", ["component", "key", "hosts"])
+
+class MachinePlan(object):
+  """What a machine of the cluster runs."""
+  def __init__(self, ipAddress):
+    self.ipAddress = ipAddress
+    # Hosts of the `servers` dictionary with this IP address
+    self.hosts = []
+    # Storm component -> hosts it is placed on for this machine
+    self.components = collections.OrderedDict()
+    # port -> list of PortUse
+    self.ports = {}
+    # Worker slots of the supervisor, if any, and the number of containers
+    # they are split between
+    self.slots = 0
+    self.supervisorContainers = 0
+    # False if the slots were guessed, without knowing the machine's resources
+    self.slotsKnown = True
+    # Resources given under `storm.supervisor.slots -> servers`, or None
+    self.cores = None
+    self.memoryMb = None
+    # Demands on the resources above
+    self.coresDemand = 0.0
+    self.memoryDemandMb = 0
+
+  def add_port(self, port, component, key, hosts):
+    self.ports.setdefault(port, []).append(PortUse(component, key, hosts))
+
+  @property
+  def coresRatio(self):
+    return self.coresDemand / self.cores if self.cores else None
+
+  @property
+  def memoryRatio(self):
+    return float(self.memoryDemandMb) / self.memoryMb if self.memoryMb else \
+      None
+
+  def __str__(self):
+    return "{} ({}): {}; {} ports{}{}".format(self.ipAddress,
+      ", ".join(self.hosts), " ".join(self.components) or "nothing",
+      len(self.ports),
+      "; {} slots".format(self.slots) if "supervisor" in self.components
+        else "",
+      " in {} containers".format(self.supervisorContainers)
+        if self.supervisorContainers > 1 else ""
+    )
+
+class PortConflict(object):
+  """A port of a machine bound more than once."""
+  def __init__(self, machine, port, uses):
+    self.machine = machine
+    self.port = port
+    self.uses = uses
+
+  def __str__(self):
+    return "port {} of {} ({}) is used by {}".format(self.port,
+      self.machine.ipAddress, ", ".join(self.machine.hosts), " and ".join(
+        "{} `{}` of {}".format(use.component, use.key, ", ".join(use.hosts))
+        for use in self.uses
+      )
+    )
+
+class ClusterPlan(object):
+  """Result of `plan_cluster`."""
+  def __init__(self, machines, conflicts, warnings):
+    # IP address -> MachinePlan
+    self.machines = machines
+    self.conflicts = conflicts
+    self.warnings = warnings
+
+  def oversubscribed(self, maxRatio=1.0):
+    """Returns the machines whose cores or memory demand exceeds `maxRatio`
+    times their resources, most oversubscribed first."""
+    machines = [machine for machine in self.machines.values()
+      if max(machine.coresRatio or 0, machine.memoryRatio or 0) > maxRatio
+    ]
+    return sorted(machines, key=lambda machine: -max(machine.coresRatio or 0,
+      machine.memoryRatio or 0
+    ))
+
+def heap_mb(childopts, default):
+  """Returns the `-Xmx` of JVM options, in MB."""
+  match = _XMX_REGEX.search(childopts or "")
+  if match is None:
+    return default
+  value, unit = int(match.group(1)), match.group(2).lower()
+  if unit == "g":
+    return value * 1024
+  if unit == "k":
+    return value // 1024
+  if unit == "":
+    return value // (1024 * 1024)
+  return value
+
+def zookeeper_heap_mb(config, memoryMb):
+  """Returns the heap of the Zookeeper server of a machine, or None if it
+  depends on the machine's unknown memory."""
+  tuning = config.get("zookeeper.tuning") or {}
+  if "heap.mb" in tuning:
+    return int(tuning["heap.mb"])
+  if memoryMb is None:
+    return None
+  heap = int(memoryMb * tuning.get("heap.fraction", DEFAULT_ZK_HEAP_FRACTION))
+  return max(tuning.get("min.heap.mb", DEFAULT_ZK_MIN_HEAP_MB),
+    min(tuning.get("max.heap.mb", DEFAULT_ZK_MAX_HEAP_MB), heap)
+  )
+
+def plan_machine_slots(model, host):
+  """Returns the worker slot plan of the supervisor on `host`, and whether it
+  is known: with a `storm.supervisor.slots` section, the slots of a host whose
+  cores and memory are not given in it depend on the machine itself, and are
+  taken to be `max.slots` (or the length of `supervisor.slots.ports`).
+
+  Returns:
+    (slot_planner.SlotPlan, bool)
+  """
+  slotsConfig = model.config.get(slot_planner.SLOTS_SECTION)
+  override = ((slotsConfig or {}).get("servers") or {}).get(host) or {}
+  if not slotsConfig or "slots" in override or \
+      ("cores" in override and "memory.mb" in override):
+    return slot_planner.plan_slots(model, host), True
+  staticPorts = [port for key, portList, _ in model.componentPorts["supervisor"]
+    if key == docker_run.SUPERVISOR_SLOTS_PORTS_STR for port in portList
+  ]
+  firstPort = slotsConfig.get("first.port", staticPorts[0])
+  count = slotsConfig.get("max.slots") or len(staticPorts)
+  return slot_planner.SlotPlan(host, range(firstPort, firstPort + count)), \
+    False
+
+def plan_cluster(model):
+  """Builds the per-machine index of a cluster and checks it.
+
+  Args:
+    model(cluster_model.ClusterModel): the compiled `storm-setup.yaml`
+
+  Returns:
+    ClusterPlan: the machines, port conflicts and warnings
+  """
+  config = model.config
+  stormYamlConfig = config.get("storm.yaml") or {}
+  slotsConfig = config.get(slot_planner.SLOTS_SECTION) or {}
+  resources = slotsConfig.get("servers") or {}
+  warnings = []
+
+  machines = {}
+  for host, ipAddress in model.hostIps.items():
+    machine = machines.get(ipAddress)
+    if machine is None:
+      machine = machines[ipAddress] = MachinePlan(ipAddress)
+    machine.hosts.append(host)
+    hostResources = resources.get(host) or {}
+    if "cores" in hostResources:
+      machine.cores = hostResources["cores"]
+    if "memory.mb" in hostResources:
+      machine.memoryMb = hostResources["memory.mb"]
+  for machine in machines.values():
+    machine.hosts.sort()
+
+  # Each component runs at most once per machine, whatever the number of its
+  # hosts with that IP address
+  for component in sorted(model.componentHosts):
+    for host in model.componentHosts[component]:
+      ipAddress = model.ip(host)
+      if ipAddress is None:
+        warnings.append("{} host `{}` is not in 'servers'".format(component,
+          host
+        ))
+        continue
+      machines[ipAddress].components.setdefault(component, []).append(host)
+
+  cores_per_slot = slotsConfig.get("cores.per.slot",
+    slot_planner.DEFAULT_CORES_PER_SLOT
+  )
+  workerHeapMb = heap_mb(stormYamlConfig.get("worker.childopts"),
+    DEFAULT_HEAP_MB["worker"]
+  )
+  stride = supervisor_containers.port_stride(config)
+  for machine in machines.values():
+    if "supervisor" in machine.components:
+      machine.supervisorContainers = supervisor_containers.container_count(
+        config, machine.components["supervisor"][-1]
+      )
+    for component, hosts in machine.components.items():
+      if component == "supervisor" and len(hosts) > 1:
+        # `slot_planner.supervisor_host` picks the last one
+        warnings.append("supervisor hosts {} share the IP address {}; only "
+          "`{}` runs a supervisor there".format(", ".join(hosts),
+          machine.ipAddress, hosts[-1]
+        ))
+      # The supervisor and the logviewer run in each supervisor container
+      containerCount = 1
+      if component in ("supervisor", "logviewer"):
+        containerCount = max(1, machine.supervisorContainers)
+      for key, portList, _ in model.componentPorts[component]:
+        if component == "supervisor" and \
+            key == docker_run.SUPERVISOR_SLOTS_PORTS_STR:
+          slotPlan, machine.slotsKnown = plan_machine_slots(model, hosts[-1])
+          machine.slots = slotPlan.slots
+          # Split between the containers, without overlapping
+          for port in slotPlan.ports:
+            machine.add_port(port, component, key, hosts)
+          continue
+        for idx in range(containerCount):
+          # Containers on the host network cannot shift their ports
+          shift = 0 if model.hostNetwork else idx * stride
+          portKey = key if containerCount == 1 else "{} ({})".format(key,
+            supervisor_containers.container_name(idx, containerCount)
+          )
+          for port in portList:
+            machine.add_port(port + shift, component, portKey, hosts)
+
+      # Resources needed by the component
+      if component == "zookeeper":
+        heap = zookeeper_heap_mb(config, machine.memoryMb)
+      else:
+        heap = heap_mb(stormYamlConfig.get("{}.childopts".format(component)),
+          DEFAULT_HEAP_MB[component]
+        ) * containerCount
+      machine.memoryDemandMb += heap or 0
+    machine.memoryDemandMb += machine.slots * workerHeapMb
+    machine.coresDemand = machine.slots * cores_per_slot
+    if machine.slots < machine.supervisorContainers:
+      warnings.append("{} worker slots of {} ({}) cannot be split between {} "
+        "supervisor containers".format(machine.slots, machine.ipAddress,
+        ", ".join(machine.hosts), machine.supervisorContainers
+      ))
+
+  conflicts = []
+  for ipAddress in sorted(machines):
+    machine = machines[ipAddress]
+    for port in sorted(machine.ports):
+      if len(machine.ports[port]) > 1:
+        conflicts.append(PortConflict(machine, port, machine.ports[port]))
+  return ClusterPlan(machines, conflicts, warnings)
@@ -0,0 +1,273 @@
+# Readiness probes for the storm-docker components.
+#
+#   - Zookeeper: the `ruok` and `mntr` four letter words are sent to every
+#     member of the ensemble. The ensemble is ready once a leader (or a
+#     standalone server) exists and a majority of the voting members (ie. not
+#     the observers) are serving.
+#   - Storm Nimbus and UI: a TCP connection to `nimbus.thrift.port` or
+#     `ui.port` succeeds.
+#   - Storm Supervisor: the supervisor registered itself again in Zookeeper,
+#     under `<storm.zookeeper.root>/supervisors`, after being restarted.
+#
+# Probes are polled adaptively by `wait_until`: the first polls are a few tens
+# of milliseconds apart, and the interval grows geometrically up to a cap, so
+# a component that comes up quickly is noticed right away without hammering
+# one that takes a while.
+#
+# For the four letter words, see:
+#
+#     http://zookeeper.apache.org/doc/r3.4.6/zookeeperAdmin.html#sc_zkCommands
+
+import socket
+import struct
+import time
+
+from . import supervisor_containers
+from . import zk_client
+
+# Defaults for `wait_until`
+DEFAULT_TIMEOUT = 300.0
+DEFAULT_INITIAL_INTERVAL = 0.05
+DEFAULT_MAX_INTERVAL = 2.0
+DEFAULT_BACKOFF = 1.5
+
+# Timeout of a single probe, in seconds
+PROBE_TIMEOUT = 1.0
+
+# Zookeeper server states (`zk_server_state` of `mntr`) which serve clients
+ZK_SERVING_STATES = ("leader", "follower", "observer", "standalone")
+
+class ProbeResult(object):
+  """Outcome of one probe."""
+  def __init__(self, ready, detail=""):
+    self.ready = ready
+    self.detail = detail
+
+  def __bool__(self):
+    return self.ready
+  __nonzero__ = __bool__
+
+  def __repr__(self):
+    return "ProbeResult({!r}, {!r})".format(self.ready, self.detail)
+
+class WaitResult(object):
+  """Outcome of `wait_until`."""
+  def __init__(self, name, ready, elapsed, attempts, detail=""):
+    self.name = name
+    self.ready = ready
+    self.elapsed = elapsed
+    self.attempts = attempts
+    # Detail of the last probe
+    self.detail = detail
+
+  def __bool__(self):
+    return self.ready
+  __nonzero__ = __bool__
+
+  def __str__(self):
+    return "{}: {} after {:.2f}s ({} probes){}".format(self.name,
+      "ready" if self.ready else "NOT ready", self.elapsed, self.attempts,
+      ": {}".format(self.detail) if self.detail else ""
+    )
+
+def four_letter_word(host, port, word, timeout=PROBE_TIMEOUT):
+  """Sends a Zookeeper four letter word and returns the server's answer.
+
+  Raises:
+    socket.error: if the server cannot be reached
+  """
+  sock = socket.create_connection((host, port), timeout)
+  try:
+    sock.sendall(word.encode("ascii"))
+    chunks = []
+    while True:
+      chunk = sock.recv(4096)
+      if not chunk:
+        break
+      chunks.append(chunk)
+  finally:
+    sock.close()
+  return b"".join(chunks).decode("utf-8", "replace")
+
+def parse_mntr(output):
+  """Parses the tab separated output of `mntr` into a dict."""
+  stats = {}
+  for line in output.splitlines():
+    key, sep, value = line.partition("\t")
+    if sep:
+      stats[key.strip()] = value.strip()
+  return stats
+
+def zookeeper_server_state(host, port, timeout=PROBE_TIMEOUT):
+  """Returns the state (eg. "leader", "follower") of a Zookeeper server, or
+  None if it is not serving."""
+  try:
+    if four_letter_word(host, port, "ruok", timeout).strip() != "imok":
+      return None
+    return parse_mntr(
+      four_letter_word(host, port, "mntr", timeout)
+    ).get("zk_server_state")
+  except (socket.error, socket.timeout):
+    return None
+
+def probe_zookeeper_ensemble(addresses, timeout=PROBE_TIMEOUT, observers=()):
+  """Probes every member of a Zookeeper ensemble.
+
+  Args:
+    addresses(list of (str, int)): (host, client port) of each member
+    observers(collection of (str, int), optional): the members of `addresses`
+      which are observers; they do not count towards the majority
+
+  Returns:
+    ProbeResult: ready if a leader (or standalone server) exists and a
+      majority of the voting members serve clients
+  """
+  states = [zookeeper_server_state(host, port, timeout)
+    for host, port in addresses
+  ]
+  voterStates = [state for address, state in zip(addresses, states)
+    if address not in observers
+  ]
+  serving = sum(1 for state in voterStates if state in ZK_SERVING_STATES)
+  hasLeader = any(state in ("leader", "standalone") for state in states)
+  detail = ", ".join("{}:{}={}".format(host, port, state or "down")
+    for (host, port), state in zip(addresses, states)
+  )
+  return ProbeResult(hasLeader and serving * 2 > len(voterStates), detail)
+
+def probe_tcp_port(host, port, timeout=PROBE_TIMEOUT):
+  """Returns a ready ProbeResult if a TCP connection to host:port succeeds."""
+  try:
+    socket.create_connection((host, port), timeout).close()
+    return ProbeResult(True, "{}:{} open".format(host, port))
+  except (socket.error, socket.timeout) as e:
+    return ProbeResult(False, "{}:{} {}".format(host, port, e))
+
+def supervisor_hostnames(model, host):
+  """Returns the hostnames the supervisors of `host` register in Zookeeper:
+  the Docker hostnames of its containers (see `supervisor_containers.py`), or
+  the host's IP address on the host network (see `run-supervisord.py`). A
+  `storm.yaml -> storm.local.hostname` set in `storm-setup.yaml` ends up in
+  the `storm.yaml` of every container, and is registered instead."""
+  hostnames = supervisor_containers.container_hostnames(model.config, host)
+  localHostname = (model.config.get("storm.yaml") or {}).get(
+    "storm.local.hostname"
+  )
+  if localHostname:
+    return [localHostname] * len(hostnames)
+  if model.hostNetwork:
+    return [model.ip(host)]
+  return hostnames
+
+def supervisors_zk_path(model):
+  """Returns the Zookeeper node under which Storm supervisors register."""
+  root = (model.config.get("storm.yaml") or {}).get("storm.zookeeper.root",
+    "/storm"
+  )
+  return "{}/supervisors".format(root.rstrip("/"))
+
+def serialized_hostname(hostname):
+  """Returns `hostname` the way it appears in the data of a supervisor's
+  Zookeeper node: Storm serializes its `SupervisorInfo` with Java
+  serialization, where a string is a `TC_STRING` byte followed by the
+  `DataOutput.writeUTF` encoding (2 byte big-endian length, then the bytes).
+
+  The length prefix makes the match exact: `10.0.0.1` does not match the
+  registration of `10.0.0.12`."""
+  encoded = hostname.encode("utf-8")
+  return b"\x74" + struct.pack(">H", len(encoded)) + encoded
+
+def supervisor_registrations(addresses, path, hostname, timeout=PROBE_TIMEOUT):
+  """Returns the registrations of the supervisor of `hostname`.
+
+  Supervisors register as ephemeral children of `path`, whose (serialized)
+  data holds their hostname (see `serialized_hostname`). Each restart of a
+  supervisor creates a new node, with a new creation zxid.
+
+  Args:
+    addresses(list of (str, int)): (host, client port) of the Zookeeper servers
+    path(str): see `supervisors_zk_path`
+    hostname(str): see `supervisor_hostnames`
+
+  Returns:
+    set of int: creation zxids of the nodes of the supervisor
+
+  Raises:
+    socket.error: if no Zookeeper server could be reached
+  """
+  needle = serialized_hostname(hostname)
+  registrations = set()
+  with zk_client.ZookeeperClient(addresses, timeout) as client:
+    try:
+      children = client.get_children(path)
+    except zk_client.NoNodeError:
+      return registrations
+    for child in children:
+      try:
+        data, stat = client.get_data("{}/{}".format(path, child))
+      except zk_client.NoNodeError:
+        continue
+      if data and needle in data:
+        registrations.add(stat.czxid)
+  return registrations
+
+def probe_supervisor_registered(addresses, path, hostname, previous=(),
+    timeout=PROBE_TIMEOUT):
+  """Returns a ready ProbeResult if the supervisor of `hostname` has a
+  registration which is not in `previous`."""
+  try:
+    registrations = supervisor_registrations(addresses, path, hostname, timeout)
+  except (socket.error, socket.timeout, zk_client.ZookeeperError) as e:
+    return ProbeResult(False, "zookeeper: {}".format(e))
+  fresh = registrations - set(previous)
+  if fresh:
+    return ProbeResult(True, "{} registered (zxid {})".format(hostname,
+      max(fresh)
+    ))
+  return ProbeResult(False, "{} not registered again yet".format(hostname))
+
+def wait_until(name, probe, timeout=DEFAULT_TIMEOUT,
+    initialInterval=DEFAULT_INITIAL_INTERVAL, maxInterval=DEFAULT_MAX_INTERVAL,
+    backoff=DEFAULT_BACKOFF, sleep=time.sleep, clock=time.time):
+  """Polls `probe` until it is ready or `timeout` seconds have passed.
+
+  Args:
+    name(str): name of what is waited for, used in the result
+    probe(callable): returns a ProbeResult (or any truthy / falsy value)
+    timeout(float, optional): seconds to wait for at most
+    initialInterval(float, optional): seconds between the first two probes
+    maxInterval(float, optional): cap on the seconds between two probes
+    backoff(float, optional): factor the interval grows by after each probe
+    sleep, clock(callable, optional): `time.sleep` and `time.time` stand-ins
+
+  Returns:
+    WaitResult: whether the probe became ready, and how long it took
+  """
+  start = clock()
+  interval = initialInterval
+  attempts = 0
+  while True:
+    attempts += 1
+    result = probe()
+    detail = getattr(result, "detail", "")
+    elapsed = clock() - start
+    if result:
+      return WaitResult(name, True, elapsed, attempts, detail)
+    if elapsed >= timeout:
+      return WaitResult(name, False, elapsed, attempts, detail)
+    sleep(min(interval, max(0.0, timeout - elapsed)))
+    interval = min(interval * backoff, maxInterval)
+
+def zookeeper_gate(model, timeout=DEFAULT_TIMEOUT):
+  """Returns a callable waiting for the Zookeeper ensemble of `model` (a
+  `cluster_model.ClusterModel`) to be ready."""
+  zkPort = model.ports("zookeeper")[0]
+  addresses = [(ip, zkPort) for ip in model.ips(model.zookeeperHosts)]
+  observers = set((ip, zkPort) for ip in model.ips(model.zookeeperObservers))
+  return lambda: wait_until("zookeeper ensemble",
+    lambda: probe_zookeeper_ensemble(addresses, observers=observers), timeout
+  )
+
+def port_gate(name, host, port, timeout=DEFAULT_TIMEOUT):
+  """Returns a callable waiting for a TCP port to accept connections."""
+  return lambda: wait_until(name, lambda: probe_tcp_port(host, port), timeout)
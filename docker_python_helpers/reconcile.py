@@ -0,0 +1,474 @@
+# Plan / apply reconciler for the storm-docker containers of the current
+# machine.
+#
+# Instead of destroying and re-running every container of a component (which
+# is what `destroy-storm.sh` followed by `start-storm.sh` does), we compute the
+# containers this machine should be running according to
+# `config/storm-setup.yaml`, compare them with the running containers, and only
+# restart the ones that differ. Containers are compared on:
+#
+#   - image (including the image having been rebuilt under the same name)
+#   - published ports
+#   - links to other containers
+#   - hostname
+#   - the NUMA node a supervisor container is pinned to
+#   - the configuration hash label added by `docker_run.config_labels`
+#
+# A container linking to a container that gets restarted is restarted as well,
+# since Docker links are resolved when a container starts.
+#
+# Usage:
+#
+#     storm-docker reconcile [--dry-run] [--component COMPONENT ...]
+
+from __future__ import print_function
+
+import argparse
+import json
+import shlex
+import subprocess
+import sys
+
+from . import cluster_model
+from . import container_state
+from . import docker_api
+from . import docker_run
+from . import rollout
+from . import slot_planner
+from . import supervisor_containers
+
+# Images run by `start-storm.sh`
+ZOOKEEPER_IMAGE = "viki_data/zookeeper"
+ZK_AMBASSADOR_IMAGE = "viki_data/zk-ambassador"
+NIMBUS_IMAGE = "viki_data/storm-nimbus"
+UI_IMAGE = "viki_data/storm-ui"
+SUPERVISOR_IMAGE = "viki_data/storm-supervisor"
+
+# SSH ports published by `start-storm.sh` (and `run_storm_supervisor.py`)
+ZOOKEEPER_SSH_PORT_ARG = "-p 127.0.0.1:49122:22"
+SUPERVISOR_SSH_PORT_ARG = "-p 127.0.0.1:{}:22"
+
+# Order in which `start-storm.sh` components must be started
+COMPONENT_ORDER = [
+  "zookeeper",
+  "zookeeper-with-ambassador",
+  "nimbus",
+  "nimbus-with-zookeeper-ambassador",
+  "ui",
+  "ui-on-zk-ambassador-machine",
+  "supervisor",
+]
+
+parser = argparse.ArgumentParser(
+  prog="storm-docker reconcile",
+  description="Restarts only the storm-docker containers of this machine "
+    "whose configuration changed",
+)
+parser.add_argument("--dry-run", action="store_true", dest="dry_run",
+  help="Only print the plan"
+)
+parser.add_argument("--component", action="append", dest="components",
+  choices=COMPONENT_ORDER,
+  help="Only reconcile the containers of this `start-storm.sh` component. "
+    "Can be given several times; defaults to every component."
+)
+
+class ContainerSpec(object):
+  """Desired state of a single container."""
+  def __init__(self, name, image, component, portArgs=None, links=None,
+      hostname=None, configHash=None, cpusetCpus="", cpusetMems=""):
+    """Constructor for ContainerSpec
+
+    Args:
+      name(str): container name
+      image(str): image name
+      component(str): `start-storm.sh` argument which starts this container
+      portArgs(list of str, optional): `-p` arguments of the container
+      links(list of str, optional): `name:alias` links to other containers
+      hostname(str, optional): container hostname. None if Docker picks it.
+      configHash(str, optional): expected value of the config hash label
+      cpusetCpus(str, optional): `--cpuset-cpus` of the container
+      cpusetMems(str, optional): `--cpuset-mems` of the container
+    """
+    self.name = name
+    self.image = image
+    self.component = component
+    self.portBindings = normalize_port_bindings(
+      _publish_args_to_bindings(portArgs or [])
+    )
+    self.links = sorted(links or [])
+    self.hostname = hostname
+    self.configHash = configHash
+    self.cpusetCpus = cpusetCpus
+    self.cpusetMems = cpusetMems
+
+class PlanItem(object):
+  """Action to take for one container."""
+  KEEP = "keep"
+  CREATE = "create"
+  RECREATE = "recreate"
+  REMOVE = "remove"
+
+  def __init__(self, name, action, component=None, reasons=None):
+    self.name = name
+    self.action = action
+    self.component = component
+    self.reasons = reasons or []
+
+  def __str__(self):
+    line = "{:<16}{}".format(self.name, self.action)
+    if self.reasons:
+      line += ": {}".format("; ".join(self.reasons))
+    return line
+
+def _publish_args_to_bindings(portArgs):
+  """Turns `-p` arguments into a `HostConfig.PortBindings` dict."""
+  argv = shlex.split(" ".join(portArgs)) + ["image"]
+  _, config = docker_api.parse_docker_run_args(argv)
+  return config["HostConfig"]["PortBindings"]
+
+def normalize_port_bindings(portBindings):
+  """Returns `HostConfig.PortBindings` as a sorted list of
+  "hostIp:hostPort->containerPort/proto" strings."""
+  normalized = []
+  for portKey, bindings in (portBindings or {}).items():
+    for binding in bindings or []:
+      hostIp = binding.get("HostIp") or ""
+      if hostIp == "0.0.0.0":
+        hostIp = ""
+      normalized.append("{}:{}->{}".format(
+        hostIp, binding.get("HostPort") or "", portKey
+      ))
+  return sorted(normalized)
+
+def normalize_links(links):
+  """Turns the `HostConfig.Links` of `docker inspect`, such as
+  "/nimbus:/ui/nimbus", into "nimbus:nimbus"."""
+  normalized = []
+  for link in links or []:
+    target, _, alias = link.partition(":")
+    normalized.append("{}:{}".format(target.lstrip("/"),
+      alias.rsplit("/", 1)[-1]
+    ))
+  return sorted(normalized)
+
+def desired_containers(model, ipv4Addresses):
+  """Returns the containers this machine should run, mirroring the logic of
+  `start-storm.sh`, `remote.py` and the helpers in this package.
+
+  Args:
+    model(cluster_model.ClusterModel): the compiled `storm-setup.yaml`
+    ipv4Addresses(list of str): IP addresses of this machine
+
+  Returns:
+    dict: container name -> ContainerSpec
+  """
+  myHosts = model.hosts_with_ips(ipv4Addresses)
+  needAmbassador = not model.hostNetwork and \
+    not rollout.zk_and_nimbus_on_same_host(model.config)
+  zkOnHost = model.runs_on("zookeeper", ipv4Addresses)
+  nimbusOnHost = model.runs_on("nimbus", ipv4Addresses)
+  nimbusHash = model.storm_config_hash(model.nimbusHost)
+  zkHash = model.configHashes["zookeeper"]
+  zkPortArgs = [arg for arg in
+    docker_run.construct_docker_run_port_args(["zookeeper"])
+    if arg.startswith("-p ")
+  ]
+
+  specs = {}
+  if zkOnHost:
+    if needAmbassador and model.zookeeperHosts[0] in myHosts:
+      # The ambassador publishes the Zookeeper ports instead of Zookeeper
+      # (`--no-dash-p`)
+      specs["zookeeper"] = ContainerSpec("zookeeper", ZOOKEEPER_IMAGE,
+        "zookeeper-with-ambassador", [ZOOKEEPER_SSH_PORT_ARG],
+        hostname="zookeeper", configHash=zkHash
+      )
+      specs["zk_ambassador"] = ContainerSpec("zk_ambassador",
+        ZK_AMBASSADOR_IMAGE, "zookeeper-with-ambassador", zkPortArgs,
+        links=["zookeeper:zk"], configHash=zkHash
+      )
+    else:
+      specs["zookeeper"] = ContainerSpec("zookeeper", ZOOKEEPER_IMAGE,
+        "zookeeper", zkPortArgs + [ZOOKEEPER_SSH_PORT_ARG],
+        hostname="zookeeper", configHash=zkHash
+      )
+
+  if nimbusOnHost:
+    nimbusPortArgs = [arg for arg in
+      docker_run.construct_docker_run_port_args(["nimbus", "drpc"])
+      if arg.startswith("-p ")
+    ]
+    uiPortArgs = [arg for arg in
+      docker_run.construct_docker_run_port_args(["ui"])
+      if arg.startswith("-p ")
+    ]
+    if needAmbassador:
+      specs["zk_ambassador"] = ContainerSpec("zk_ambassador",
+        ZK_AMBASSADOR_IMAGE, "nimbus-with-zookeeper-ambassador",
+        hostname="zk_ambassador", configHash=zkHash
+      )
+      specs["nimbus"] = ContainerSpec("nimbus", NIMBUS_IMAGE,
+        "nimbus-with-zookeeper-ambassador", nimbusPortArgs,
+        links=["zk_ambassador:zk"], hostname="nimbus", configHash=nimbusHash
+      )
+      specs["ui"] = ContainerSpec("ui", UI_IMAGE,
+        "ui-on-zk-ambassador-machine", uiPortArgs,
+        links=["nimbus:nimbus", "zk_ambassador:zk"], configHash=nimbusHash
+      )
+    else:
+      specs["nimbus"] = ContainerSpec("nimbus", NIMBUS_IMAGE, "nimbus",
+        nimbusPortArgs, links=["zookeeper:zk"], hostname="nimbus",
+        configHash=nimbusHash
+      )
+      specs["ui"] = ContainerSpec("ui", UI_IMAGE, "ui", uiPortArgs,
+        links=["nimbus:nimbus", "zookeeper:zk"], configHash=nimbusHash
+      )
+
+  supervisorHost = slot_planner.supervisor_host(model, ipv4Addresses)
+  if supervisorHost is not None:
+    links = []
+    if zkOnHost:
+      links.append("zookeeper:zk")
+    elif "zk_ambassador" in specs:
+      links.append("zk_ambassador:zk")
+    if nimbusOnHost:
+      links.append("nimbus:nimbus")
+    containers = supervisor_containers.plan_containers(model.config,
+      supervisorHost, slot_planner.plan_slots(model, supervisorHost).ports,
+      supervisor_containers.numa_nodes()
+    )
+    for container in containers:
+      supervisorPortArgs = [arg for arg in
+        docker_run.construct_docker_run_port_args(["supervisor", "logviewer"], {
+          docker_run.SUPERVISOR_SLOTS_PORTS_STR: container.ports,
+        }, container.portShift)
+        if arg.startswith("-p ")
+      ]
+      node = container.node
+      specs[container.name] = ContainerSpec(container.name, SUPERVISOR_IMAGE,
+        "supervisor", supervisorPortArgs +
+          [SUPERVISOR_SSH_PORT_ARG.format(container.sshPort)],
+        links=links, hostname=container.hostname,
+        configHash=model.storm_config_hash(supervisorHost, container),
+        cpusetCpus=node.cpuList if node is not None else "",
+        cpusetMems=str(node.nodeId) if node is not None else ""
+      )
+
+  if model.hostNetwork:
+    # `docker_run.run_docker_container` leaves out ports, links and hostnames
+    # of containers on the host network
+    for spec in specs.values():
+      spec.portBindings = []
+      spec.links = []
+      spec.hostname = None
+  return specs
+
+def _docker_inspect(name, image=False):
+  """Returns the `docker inspect` dict of a container (or image), or None if
+  it does not exist."""
+  if not image and not container_state.snapshot().exists(name):
+    # Saves an inspect call per container this machine does not have
+    return None
+  if docker_api.docker_socket_available():
+    client = docker_api.get_client()
+    try:
+      if image:
+        return client.inspect_image(name)
+      return client.inspect_container(name)
+    except docker_api.DockerAPIError as e:
+      if e.status == 404:
+        return None
+      raise
+  proc = subprocess.Popen(["docker", "inspect", name], stdout=subprocess.PIPE,
+    stderr=subprocess.PIPE
+  )
+  out, _ = proc.communicate()
+  if proc.returncode != 0:
+    return None
+  return json.loads(out.decode("utf-8"))[0]
+
+def _remove_container(name):
+  if docker_api.docker_socket_available():
+    client = docker_api.get_client()
+    client.stop_container(name)
+    client.remove_container(name)
+  else:
+    subprocess.call(["docker", "stop", name])
+    subprocess.call(["docker", "rm", name])
+
+def diff_container(spec, actual, imageIds):
+  """Returns the reasons why the running container `actual` (a
+  `docker inspect` dict) does not match `spec`; an empty list if it does."""
+  reasons = []
+  config = actual.get("Config") or {}
+  hostConfig = actual.get("HostConfig") or {}
+  if not (actual.get("State") or {}).get("Running"):
+    reasons.append("not running")
+  if config.get("Image") != spec.image:
+    reasons.append("image {} != {}".format(config.get("Image"), spec.image))
+  elif spec.image in imageIds and imageIds[spec.image] != actual.get("Image"):
+    reasons.append("image {} was rebuilt".format(spec.image))
+  actualBindings = normalize_port_bindings(hostConfig.get("PortBindings"))
+  if actualBindings != spec.portBindings:
+    reasons.append("ports differ (+{} -{})".format(
+      ",".join(sorted(set(spec.portBindings) - set(actualBindings))) or "none",
+      ",".join(sorted(set(actualBindings) - set(spec.portBindings))) or "none"
+    ))
+  actualLinks = normalize_links(hostConfig.get("Links"))
+  if actualLinks != spec.links:
+    reasons.append("links {} != {}".format(actualLinks, spec.links))
+  if spec.hostname is not None and config.get("Hostname") != spec.hostname:
+    reasons.append("hostname {} != {}".format(
+      config.get("Hostname"), spec.hostname
+    ))
+  actualHash = (config.get("Labels") or {}).get(cluster_model.CONFIG_HASH_LABEL)
+  if spec.configHash is not None and actualHash != spec.configHash:
+    reasons.append("configuration changed")
+  actualCpuset = (hostConfig.get("CpusetCpus") or "",
+    hostConfig.get("CpusetMems") or ""
+  )
+  if actualCpuset != (spec.cpusetCpus, spec.cpusetMems):
+    reasons.append("cpuset {}/{} != {}/{}".format(actualCpuset[0] or "any",
+      actualCpuset[1] or "any", spec.cpusetCpus or "any",
+      spec.cpusetMems or "any"
+    ))
+  return reasons
+
+def compute_plan(specs, inspect=_docker_inspect, existingNames=None):
+  """Compares the desired containers with the existing ones.
+
+  Args:
+    specs(dict): container name -> ContainerSpec, from `desired_containers`
+    inspect(callable, optional): `inspect(name, image=False)` returning the
+      `docker inspect` dict of a container or image, None if it does not exist
+    existingNames(list of str, optional): names of the containers of this
+      machine, to find supervisor containers left over from a larger
+      `storm.supervisor.containers -> count`. Defaults to those of
+      `container_state.snapshot`.
+
+  Returns:
+    list of PlanItem: one item per desired or stale container
+  """
+  imageIds = {}
+  for image in set(spec.image for spec in specs.values()):
+    inspected = inspect(image, image=True)
+    if inspected is not None:
+      imageIds[image] = inspected.get("Id")
+
+  inspected = {}
+  def inspect_cached(name):
+    if name not in inspected:
+      inspected[name] = inspect(name)
+    return inspected[name]
+
+  plan = {}
+  for name, spec in specs.items():
+    actual = inspect_cached(name)
+    if actual is None:
+      plan[name] = PlanItem(name, PlanItem.CREATE, spec.component)
+      continue
+    reasons = diff_container(spec, actual, imageIds)
+    # A link target restarted after this container (eg. by an earlier
+    # reconcile of another component) leaves a stale link behind
+    startedAt = (actual.get("State") or {}).get("StartedAt") or ""
+    for link in spec.links:
+      target = inspect_cached(link.split(":", 1)[0])
+      if target is not None and \
+          ((target.get("State") or {}).get("StartedAt") or "") > startedAt:
+        reasons.append("linked container {} restarted".format(
+          link.split(":", 1)[0]
+        ))
+    plan[name] = PlanItem(name,
+      PlanItem.RECREATE if reasons else PlanItem.KEEP, spec.component, reasons
+    )
+
+  # Containers linking to a (re)created container must be restarted too
+  changed = True
+  while changed:
+    changed = False
+    for name, item in plan.items():
+      if item.action != PlanItem.KEEP:
+        continue
+      for link in specs[name].links:
+        target = link.split(":", 1)[0]
+        if target in plan and plan[target].action != PlanItem.KEEP:
+          item.action = PlanItem.RECREATE
+          item.reasons.append("linked container {} restarts".format(target))
+          changed = True
+          break
+
+  # storm-docker containers which should no longer run on this machine
+  knownNames = set(["zookeeper", "zk_ambassador", "nimbus", "ui",
+    "supervisor"
+  ])
+  if existingNames is None:
+    existingNames = [c.name for c in container_state.snapshot().containers]
+  knownNames.update(name for name in existingNames
+    if supervisor_containers.is_container_name(name)
+  )
+  for name in sorted(knownNames - set(specs)):
+    if inspect_cached(name) is not None:
+      plan[name] = PlanItem(name, PlanItem.REMOVE,
+        "supervisor" if supervisor_containers.is_container_name(name) else
+          None, ["not part of this machine's configuration"]
+      )
+  return [plan[name] for name in sorted(plan)]
+
+def apply_plan(plan, startComponent=None, removeContainer=_remove_container):
+  """Removes the containers to remove or recreate, then runs `start-storm.sh`
+  for the components whose containers must be (re)created.
+
+  Returns:
+    list of str: `start-storm.sh` components which were started
+  """
+  if startComponent is None:
+    startComponent = lambda component: subprocess.check_call(
+      ["./start-storm.sh", component]
+    )
+  for item in plan:
+    if item.action in (PlanItem.RECREATE, PlanItem.REMOVE):
+      removeContainer(item.name)
+  components = set(item.component for item in plan
+    if item.action in (PlanItem.CREATE, PlanItem.RECREATE)
+  )
+  started = [component for component in COMPONENT_ORDER
+    if component in components
+  ]
+  for component in started:
+    startComponent(component)
+  return started
+
+def main(args=None):
+  if args is None:
+    args = sys.argv[2:]
+  parsedArgs = parser.parse_args(args)
+
+  model = docker_run.get_cluster_model()
+  if model.configReloadDir is not None and not parsedArgs.dry_run and \
+      docker_run.sync_config_reload_file():
+    # Running Storm containers reload it on their own
+    print("updated {}/storm-setup.yaml".format(model.configReloadDir))
+  ipv4Addresses = docker_run.get_ipv4_addresses(
+    model.config["is_localhost_setup"],
+    model.config.get("all_machines_are_ec2_instances", False)
+  )
+  specs = desired_containers(model, ipv4Addresses)
+  if parsedArgs.components:
+    specs = dict((name, spec) for name, spec in specs.items()
+      if spec.component in parsedArgs.components
+    )
+  plan = compute_plan(specs)
+  if parsedArgs.components:
+    # Leave containers of other components alone
+    plan = [item for item in plan if item.name in specs or
+      item.component in parsedArgs.components
+    ]
+  for item in plan:
+    print(item)
+  if not parsedArgs.dry_run:
+    apply_plan(plan)
+
+# When run as a main program
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,482 @@
+# Parallel, wave-based rollout of storm-docker components across the machines
+# of a Storm cluster.
+#
+# Components are started in dependency "waves":
+#
+#   1. Zookeeper (with the Zookeeper ambassador on the first Zookeeper server
+#      if Nimbus does not run on a Zookeeper server)
+#   2. Storm Nimbus (with the Zookeeper ambassador if needed)
+#   3. Storm UI and every Storm Supervisor, all at once
+#
+# Every (host, component) pair of a wave is run on a bounded pool of worker
+# threads. The next wave only starts after every host in the current wave has
+# finished, and after the wave's readiness gate (if any, see `readiness.py`)
+# reports its components as ready; if any host of a wave fails, or its gate
+# times out, the remaining waves are skipped since they depend on it.
+#
+# With a rolling restart (see `split_supervisor_batches`), supervisors are not
+# all restarted at once but in batches of at most `max-unavailable` hosts, each
+# in its own wave; a host of a batch only succeeds once its supervisor
+# registered itself again in Zookeeper (see `rolling_restart_task`), so that
+# the worker slots of the cluster never all disappear at the same time.
+#
+# Commands are run through an "executor", which is any object with a
+# `run(host, command)` method returning the output of `command` on `host` and
+# raising `RemoteCommandError` on failure. `SSHExecutor` is the real one; a
+# fake executor that records the commands it was given is enough to exercise
+# this module without SSH.
+
+from __future__ import print_function
+
+import re
+import subprocess
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from . import readiness
+from . import supervisor_containers
+
+# Default number of hosts a rollout works on concurrently
+DEFAULT_POOL_SIZE = 16
+
+# Directory of the storm-docker repository on each remote machine
+DEFAULT_REMOTE_DIR = "$HOME/storm-docker"
+
+class RemoteCommandError(RuntimeError):
+  """Raised by an executor when a command exits with a non-zero status."""
+  def __init__(self, host, command, returncode, output=""):
+    RuntimeError.__init__(self,
+      "`{}` on host `{}` exited with status {}".format(command, host, returncode)
+    )
+    self.host = host
+    self.command = command
+    self.returncode = returncode
+    self.output = output
+
+class SSHExecutor(object):
+  """Runs commands on remote hosts using the `ssh` binary.
+
+  Hosts are given as SSH host names; like Fabric's `env.use_ssh_config`, the
+  user's SSH config file is used to resolve them. Each call spawns its own
+  `ssh` process, so an `SSHExecutor` can be shared between worker threads.
+  """
+  def __init__(self, sshCommand=None):
+    """Constructor for SSHExecutor
+
+    Args:
+      sshCommand(list of str, optional): Command used to reach a host. The host
+        and the remote command are appended to it. Defaults to
+        `ssh -o BatchMode=yes`.
+    """
+    if sshCommand is None:
+      sshCommand = ["ssh", "-o", "BatchMode=yes"]
+    self._sshCommand = list(sshCommand)
+
+  def run(self, host, command):
+    """Runs `command` on `host`.
+
+    Returns:
+      str: Combined stdout and stderr of the command
+
+    Raises:
+      RemoteCommandError: if the command exits with a non-zero status
+    """
+    proc = subprocess.Popen(self._sshCommand + [host, command],
+      stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+    )
+    out, _ = proc.communicate()
+    out = out.decode("utf-8", "replace")
+    if proc.returncode != 0:
+      raise RemoteCommandError(host, command, proc.returncode, out)
+    return out
+
+class RolloutStep(object):
+  """A storm-docker component (an argument to `start-storm.sh`) to be run on
+  a list of hosts."""
+  def __init__(self, component, hosts):
+    """Constructor for RolloutStep
+
+    Args:
+      component(str): argument to the `start-storm.sh` and `destroy-storm.sh`
+        scripts, eg. "zookeeper-with-ambassador"
+      hosts(list of str): SSH host names to run the component on
+    """
+    self.component = component
+    self.hosts = list(hosts)
+
+  def __repr__(self):
+    return "RolloutStep({!r}, {!r})".format(self.component, self.hosts)
+
+class Wave(object):
+  """A group of steps which may run concurrently. Every step of a wave only
+  depends on the steps of earlier waves."""
+  def __init__(self, name, steps, gate=None):
+    """Constructor for Wave
+
+    Args:
+      name(str): name of the wave
+      steps(list of RolloutStep): steps of the wave. Steps without hosts are
+        left out.
+      gate(callable, optional): called once every step succeeded; returns a
+        `readiness.WaitResult` (or any truthy / falsy value) telling if the
+        wave's components are ready for the next wave
+    """
+    self.name = name
+    self.steps = [step for step in steps if step.hosts]
+    self.gate = gate
+
+  def tasks(self):
+    """Returns a list of (host, component) tuples for this wave."""
+    return [(host, step.component) for step in self.steps
+      for host in step.hosts
+    ]
+
+class HostResult(object):
+  """Outcome of running a single component on a single host."""
+  def __init__(self, host, component, startTime, endTime, output="",
+      error=None):
+    self.host = host
+    self.component = component
+    self.startTime = startTime
+    self.endTime = endTime
+    self.output = output
+    self.error = error
+
+  @property
+  def succeeded(self):
+    return self.error is None
+
+  @property
+  def duration(self):
+    return self.endTime - self.startTime
+
+class RolloutReport(object):
+  """Per-host results of a rollout, grouped by wave."""
+  def __init__(self):
+    # List of (wave name, list of HostResult)
+    self.waves = []
+    # Names of waves which were not run because an earlier wave failed
+    self.skippedWaves = []
+    # List of (wave name, result of the wave's gate)
+    self.gates = []
+
+  @property
+  def results(self):
+    return [result for _, results in self.waves for result in results]
+
+  @property
+  def failures(self):
+    return [result for result in self.results if not result.succeeded]
+
+  @property
+  def succeeded(self):
+    return not self.failures and not self.skippedWaves and \
+      all(result for _, result in self.gates)
+
+def zk_and_nimbus_on_same_host(stormConfig):
+  """Checks if the Nimbus Docker container runs on the same physical machine
+  as some host that any Zookeeper Docker container runs on.
+
+  Args:
+    stormConfig(dict): dictionary loaded from `storm-setup.yaml` file
+
+  Returns:
+    bool: True if Nimbus and some Zookeeper share the same IP address
+  """
+  servers = stormConfig["servers"]
+  zk_ip_addresses = [
+    servers[zk_server] for zk_server in
+      stormConfig["storm.yaml"]["storm.zookeeper.servers"]
+  ]
+  return servers[stormConfig["storm.yaml"]["nimbus.host"]] in zk_ip_addresses
+
+def plan_waves(stormConfig, zookeeper=False, nimbus=False, ui=False,
+    supervisor=False):
+  """Returns the waves needed to run the selected components.
+
+  Args:
+    stormConfig(dict): dictionary loaded from `storm-setup.yaml` file
+    zookeeper, nimbus, ui, supervisor(bool, optional): components to run
+
+  Returns:
+    list of Wave: waves in the order they must be run. Waves without any
+      hosts are left out.
+  """
+  storm_yaml_config = stormConfig["storm.yaml"]
+  nimbus_host = storm_yaml_config["nimbus.host"]
+
+  # Containers on the host network reach Zookeeper without an ambassador
+  need_ambassador = False
+  if (zookeeper or nimbus or ui) and stormConfig.get("network_mode") != "host":
+    need_ambassador = not zk_and_nimbus_on_same_host(stormConfig)
+
+  zk_steps = []
+  if zookeeper:
+    zk_server_list = storm_yaml_config["storm.zookeeper.servers"]
+    if need_ambassador:
+      # Launch ambassador along with zookeeper on the first zookeeper server
+      # listed in `storm.yaml -> storm.zookeeper.servers` if the user wants to
+      # run the Nimbus docker on a machine that is not running a Zookeeper
+      # server.
+      zk_steps.append(
+        RolloutStep("zookeeper-with-ambassador", zk_server_list[:1])
+      )
+      zk_steps.append(RolloutStep("zookeeper", zk_server_list[1:]))
+    else:
+      zk_steps.append(RolloutStep("zookeeper", zk_server_list))
+
+  nimbus_steps = []
+  if nimbus:
+    nimbus_steps.append(RolloutStep(
+      "nimbus-with-zookeeper-ambassador" if need_ambassador else "nimbus",
+      [nimbus_host]
+    ))
+
+  # UI only depends on Nimbus, and supervisors only on Zookeeper and Nimbus,
+  # so they all go in the same wave.
+  worker_steps = []
+  if ui:
+    worker_steps.append(RolloutStep(
+      "ui-on-zk-ambassador-machine" if need_ambassador else "ui",
+      [nimbus_host]
+    ))
+  if supervisor:
+    worker_steps.append(
+      RolloutStep("supervisor", stormConfig["storm.supervisor.hosts"])
+    )
+
+  waves = [
+    Wave("zookeeper", zk_steps),
+    Wave("nimbus", nimbus_steps),
+    Wave("ui-and-supervisors", worker_steps),
+  ]
+  return [wave for wave in waves if wave.steps]
+
+def add_readiness_gates(waves, model, timeout=readiness.DEFAULT_TIMEOUT):
+  """Gates the waves returned by `plan_waves` on their components being ready:
+  the Zookeeper ensemble having a leader, then the Nimbus thrift port and the
+  UI port accepting connections.
+
+  Args:
+    waves(list of Wave): waves returned by `plan_waves`
+    model(cluster_model.ClusterModel): the compiled `storm-setup.yaml`
+    timeout(float, optional): seconds to wait for each gate
+
+  Returns:
+    list of Wave: `waves`, with their `gate` set
+  """
+  nimbusIp = model.ip(model.nimbusHost)
+  for wave in waves:
+    components = set(step.component for step in wave.steps)
+    if wave.name == "zookeeper":
+      wave.gate = readiness.zookeeper_gate(model, timeout)
+    elif wave.name == "nimbus":
+      wave.gate = readiness.port_gate("nimbus thrift port", nimbusIp,
+        model.ports("nimbus")[0], timeout
+      )
+    elif wave.name == "ui-and-supervisors" and \
+        components & set(["ui", "ui-on-zk-ambassador-machine"]):
+      wave.gate = readiness.port_gate("ui port", nimbusIp, model.ports("ui")[0],
+        timeout
+      )
+  return waves
+
+def parse_max_unavailable(value, hostCount):
+  """Parses a `--max-unavailable` value: a number of hosts, or a percentage of
+  `hostCount` (eg. "25%"). The result is at least 1."""
+  value = str(value).strip()
+  if value.endswith("%"):
+    count = int(hostCount * float(value[:-1]) / 100.0)
+  else:
+    count = int(value)
+  return max(1, count)
+
+def split_supervisor_batches(waves, maxUnavailable):
+  """Moves the supervisors of `waves` into waves of their own, of at most
+  `maxUnavailable` hosts each, run after every other wave.
+
+  Args:
+    waves(list of Wave): waves returned by `plan_waves`
+    maxUnavailable(int): maximum number of supervisors restarted at once
+
+  Returns:
+    list of Wave: the new waves
+  """
+  result = []
+  batches = []
+  for wave in waves:
+    supervisorSteps = [step for step in wave.steps
+      if step.component == "supervisor"
+    ]
+    otherSteps = [step for step in wave.steps
+      if step.component != "supervisor"
+    ]
+    for step in supervisorSteps:
+      for idx in range(0, len(step.hosts), maxUnavailable):
+        batches.append(RolloutStep("supervisor",
+          step.hosts[idx:idx + maxUnavailable]
+        ))
+    if otherSteps:
+      wave.steps = otherSteps
+      result.append(wave)
+  for idx, step in enumerate(batches):
+    result.append(Wave("supervisors-{}-of-{}".format(idx + 1, len(batches)),
+      [step]
+    ))
+  return result
+
+def rolling_restart_task(model, task=None, timeout=readiness.DEFAULT_TIMEOUT,
+    zkAddresses=None, wait=readiness.wait_until):
+  """Wraps a rollout task so that restarting the supervisors of a host only
+  succeeds once each of its containers registered itself again in Zookeeper.
+
+  Args:
+    model(cluster_model.ClusterModel): the compiled `storm-setup.yaml`
+    task(callable, optional): task restarting the components, as given to
+      `run_waves`. Defaults to `start_component`.
+    timeout(float, optional): seconds to wait for each supervisor
+    zkAddresses(list of (str, int), optional): Zookeeper servers to check the
+      registrations on. Defaults to those of `model`.
+    wait(callable, optional): `readiness.wait_until` stand-in
+
+  Returns:
+    callable: task for `run_waves`
+  """
+  if task is None:
+    task = start_component
+  if zkAddresses is None:
+    zkPort = model.ports("zookeeper")[0]
+    zkAddresses = [(ip, zkPort) for ip in model.ips(model.zookeeperHosts)]
+  path = readiness.supervisors_zk_path(model)
+
+  def run(executor, host, component):
+    if component != "supervisor":
+      return task(executor, host, component)
+    containers = list(zip(
+      supervisor_containers.container_names(model.config, host),
+      readiness.supervisor_hostnames(model, host)
+    ))
+    previous = {}
+    for _, hostname in containers:
+      try:
+        previous[hostname] = readiness.supervisor_registrations(zkAddresses,
+          path, hostname
+        )
+      except Exception:
+        # Zookeeper is down or unreachable; any registration will do
+        previous[hostname] = set()
+    output = task(executor, host, component)
+    # The reconciler may leave up to date supervisors alone
+    kept = set(re.findall(r"^(supervisor(?:-\d+)?)\s+keep\b", output or "",
+      re.MULTILINE
+    ))
+    lines = [output.rstrip("\n")] if output else []
+    for name, hostname in containers:
+      if name in kept:
+        continue
+      result = wait("supervisor {}".format(hostname),
+        lambda hostname=hostname: readiness.probe_supervisor_registered(
+          zkAddresses, path, hostname, previous[hostname]
+        ), timeout
+      )
+      if not result:
+        error = RuntimeError(str(result))
+        error.output = output
+        raise error
+      lines.append(str(result))
+    return "\n".join(lines)
+  return run
+
+def start_component(executor, host, component, remoteDir=DEFAULT_REMOTE_DIR):
+  """Restarts a storm-docker component on a host: runs `destroy-storm.sh`
+  (whose failure is ignored, the containers may not exist yet) followed by
+  `start-storm.sh`.
+
+  Returns:
+    str: output of the `start-storm.sh` command
+  """
+  try:
+    executor.run(host,
+      "cd {} && ./destroy-storm.sh {}".format(remoteDir, component)
+    )
+  except RemoteCommandError:
+    pass
+  return executor.run(host,
+    "cd {} && ./start-storm.sh {}".format(remoteDir, component)
+  )
+
+def reconcile_component(executor, host, component, remoteDir=DEFAULT_REMOTE_DIR,
+    dryRun=False):
+  """Runs the reconciler (see `reconcile.py`) for a storm-docker component on
+  a host, restarting only the containers whose configuration changed.
+
+  Returns:
+    str: the plan printed by the reconciler
+  """
+  return executor.run(host,
+    "cd {} && scripts/run-reconcile.sh --component {}{}".format(
+      remoteDir, component, " --dry-run" if dryRun else ""
+    )
+  )
+
+def run_waves(waves, executor, poolSize=DEFAULT_POOL_SIZE, task=None,
+    onResult=None, onGate=None):
+  """Runs the given waves, one after another, with up to `poolSize` hosts
+  being worked on at the same time.
+
+  Args:
+    waves(list of Wave): waves returned by `plan_waves`
+    executor: object with a `run(host, command)` method
+    poolSize(int, optional): maximum number of concurrent hosts
+    task(callable, optional): called as `task(executor, host, component)` for
+      every host of a wave. Defaults to `start_component`.
+    onResult(callable, optional): called with each HostResult as soon as it is
+      available
+    onGate(callable, optional): called with the wave name and the result of
+      each wave's gate
+
+  Returns:
+    RolloutReport: per-host results of the rollout
+  """
+  if task is None:
+    task = start_component
+  report = RolloutReport()
+  # `onResult` may print; serialize calls to it
+  resultLock = threading.Lock()
+
+  def run_task(hostAndComponent):
+    host, component = hostAndComponent
+    startTime = time.time()
+    try:
+      output = task(executor, host, component)
+      result = HostResult(host, component, startTime, time.time(), output)
+    except Exception as e:
+      result = HostResult(host, component, startTime, time.time(),
+        getattr(e, "output", ""), e
+      )
+    if onResult is not None:
+      with resultLock:
+        onResult(result)
+    return result
+
+  pool = ThreadPool(max(1, poolSize))
+  try:
+    for idx, wave in enumerate(waves):
+      results = pool.map(run_task, wave.tasks())
+      report.waves.append((wave.name, results))
+      ready = all(result.succeeded for result in results)
+      if ready and wave.gate is not None:
+        gateResult = wave.gate()
+        report.gates.append((wave.name, gateResult))
+        if onGate is not None:
+          onGate(wave.name, gateResult)
+        ready = bool(gateResult)
+      if not ready:
+        report.skippedWaves = [w.name for w in waves[idx + 1:]]
+        break
+  finally:
+    pool.close()
+    pool.join()
+  return report
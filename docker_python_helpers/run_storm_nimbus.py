@@ -6,21 +6,38 @@
 # Usage:
 #
 #     python -m docker_python_helpers/run_storm_nimbus.py <ARGS>
+#
+# or, once installed, `storm-docker nimbus <ARGS>`
 
 from __future__ import print_function
 
 from . import docker_run
 
 import argparse
-import os
 import sys
 
-# When run as a main program
-if __name__ == "__main__":
-  # This script is used like
-  #     `python -m docker_python_helpers/run_storm_nimbus.py <ARGS>`
-  # hence the need for subscripting `sys.argv` from 2
-  actual_args = sys.argv[2:]
+def zk_ensemble_env_args(cluster_model, zk_hosts):
+  """Returns the `-e` arguments letting the Zookeeper ambassador fail client
+  connections over to the given Zookeeper servers (see
+  `zk-ambassador/zk_ambassador.py`)."""
+  zk_port = cluster_model.ports("zookeeper")[0]
+  return [
+    "-e ZK_CLIENT_PORT={}".format(zk_port),
+    "-e ZK_ENSEMBLE={}".format(",".join(
+      "{}:{}".format(ip_address, zk_port)
+      for ip_address in cluster_model.ips(zk_hosts)
+    )),
+  ]
+
+def main(args=None):
+  if args is None:
+    # No args provided, so this script is run as a main program.
+    # This script is used like
+    #     `python -m docker_python_helpers.run_storm_nimbus <ARGS>`
+    # hence the need for subscripting `sys.argv` from 2
+    args = sys.argv[2:]
+
+  actual_args = list(args)
   zk_ambassador_args = None
   storm_nimbus_args = None
   try:
@@ -30,18 +47,19 @@ if __name__ == "__main__":
   except ValueError:
     zk_ambassador_args = actual_args
 
-  storm_config = docker_run.get_storm_config()
+  cluster_model = docker_run.get_cluster_model()
+  storm_config = cluster_model.config
 
-  if zk_ambassador_args is not None:
+  if zk_ambassador_args is not None and cluster_model.hostNetwork:
+    # Nimbus reaches the Zookeeper servers directly on the host network
+    print("network_mode is host; not running the Zookeeper ambassador")
+  elif zk_ambassador_args is not None:
     # Gotta run the Zookeeper ambassador docker container.
     # Based on convention, we pick the 0th Zookeeper server because that server
     # will have a running Zookeeper ambassador docker container as well.
-    servers = storm_config["servers"]
-    storm_yaml_config = storm_config["storm.yaml"]
-    zk_server = servers[storm_yaml_config["storm.zookeeper.servers"][0]]
-    zk_port = storm_yaml_config["storm.zookeeper.port"]
-    zk_follower_port = storm_config["zookeeper.multiple.setup"]["follower.port"]
-    zk_election_port = storm_config["zookeeper.multiple.setup"]["election.port"]
+    zk_server = cluster_model.ip(cluster_model.zookeeperHosts[0])
+    zk_port, zk_follower_port, zk_election_port = \
+      cluster_model.ports("zookeeper")
     # Setup the Zookeeper ambassador docker container's exposed ports and
     # environment variables
     zk_port_and_env_args = [
@@ -58,14 +76,18 @@ if __name__ == "__main__":
       "-e ZK_PORT_{}_TCP=tcp://{}:{}".format(
         zk_election_port, zk_server, zk_election_port
       ),
-    ]
-    zk_ambassador_docker_run_cmd = \
-      "docker run {port_and_env_args} {zk_ambassador_args}".format(
+    ] + zk_ensemble_env_args(cluster_model, cluster_model.zookeeperHosts)
+    docker_run.run_docker_container(
+      "{port_and_env_args} {zk_ambassador_args}".format(
         port_and_env_args=" ".join(zk_port_and_env_args),
         zk_ambassador_args=" ".join(zk_ambassador_args)
-      )
-    print(zk_ambassador_docker_run_cmd)
-    os.system(zk_ambassador_docker_run_cmd)
+      ),
+      docker_run.config_labels("zookeeper")
+    )
 
   if storm_nimbus_args is not None:
     docker_run.main(storm_nimbus_args)
+
+# When run as a main program
+if __name__ == "__main__":
+  main()
@@ -1,85 +1,126 @@
-# This script is used to run a Docker container with `storm-supervisor`.
+# This script is used to run the Docker container(s) with `storm-supervisor`
+# of this machine (see `supervisor_containers.py`).
 # Usage:
 #
 #     python -m docker_python_helpers/run_storm_supervisor.py <ARGS>
+#
+# or, once installed, `storm-docker supervisor <ARGS>`
+
+from __future__ import print_function
 
-import os
-import os.path
 import re
-import subprocess
 import sys
-import yaml
 
+from . import container_state
 from . import docker_run
+from . import slot_planner
+from . import supervisor_containers
 
-if __name__ == "__main__":
-  stormConfig = docker_run.get_storm_config()
+def main(args=None):
+  if args is None:
+    # No args provided, so this script is run as a main program.
+    # This script is used like
+    #     `python -m docker_python_helpers.run_storm_supervisor <ARGS>`
+    # hence the need for subscripting `sys.argv` from 2
+    args = sys.argv[2:]
+
+  clusterModel = docker_run.get_cluster_model()
+  stormConfig = clusterModel.config
   ipv4Addresses = docker_run.get_ipv4_addresses(
     stormConfig["is_localhost_setup"],
     stormConfig.get("all_machines_are_ec2_instances", False)
   )
-  dockerHostname = None
-  for supervisor_host in stormConfig["storm.supervisor.hosts"]:
-    if stormConfig["servers"][supervisor_host] in ipv4Addresses:
-      dockerHostname = "{}-supervisor".format(supervisor_host)
-  if dockerHostname is None:
+  supervisorHost = slot_planner.supervisor_host(clusterModel, ipv4Addresses)
+  if supervisorHost is None:
     raise RuntimeError(re.sub("\s+", " ",
       """IP address of this machine does not match any IP address supplied in
       the `storm_supervisor_hosts` section of `config/storm-supervisor.yaml`.
       """).strip()
     )
 
-  dockerRunArgs = docker_run.construct_docker_run_args(
-    # See the usage of this script at the top of the file... and you'll
-    # understand why we need to subscript `sys.argv` from 2
-    sys.argv[2:], ipv4Addresses
+  # Size the worker slots of this supervisor host (see `slot_planner.py`), and
+  # split them between its containers, each pinned to a NUMA node (see
+  # `supervisor_containers.py`)
+  slotPlan = slot_planner.plan_slots(clusterModel, supervisorHost)
+  containers = supervisor_containers.plan_containers(stormConfig,
+    supervisorHost, slotPlan.ports, supervisor_containers.numa_nodes()
   )
-  # construct appropriate port arguments for Storm supervisor and logviewer
-  # since we run those 2 services in the `storm-supervisor` container
-  dockerPortArgs = docker_run.construct_docker_run_port_args(["supervisor",
-    "logviewer"
-  ])
+  if len(containers) > 1 and clusterModel.hostNetwork:
+    raise RuntimeError("Several supervisor containers per host "
+      "(`{}`) cannot share the host network".format(
+        supervisor_containers.CONTAINERS_SECTION
+      )
+    )
+  if any(not container.ports for container in containers):
+    raise RuntimeError("{} worker slots cannot be split between {} supervisor "
+      "containers".format(slotPlan.slots, len(containers))
+    )
+
+  dockerRunArgs = docker_run.construct_docker_run_args(args, ipv4Addresses)
 
   # Check if any Zookeeper or Nimbus Docker container is running on this host.
   # If so, add links to those Docker containers.
   zookeeperLink = ""
-  stormYamlConfig = stormConfig["storm.yaml"]
-  zk_server_ips = [
-    stormConfig["servers"][zk_server] for zk_server in
-      stormYamlConfig["storm.zookeeper.servers"]
-  ]
-  if any([(myIpAddress in zk_server_ips) for myIpAddress in ipv4Addresses]):
+  if clusterModel.runs_on("zookeeper", ipv4Addresses):
     zookeeperLink = "--link zookeeper:zk"
-  else:
-    # check if zookeeper ambassador runs here.
-    # We use a `docker ps | grep zk_ambassador`. Very crude but it should work.
-    check_zk_amb_proc = subprocess.Popen(
-      ["docker", "ps"], stdout=subprocess.PIPE
-    )
-    proc_output = b""
-    try:
-      proc_output = subprocess.check_output(
-        ["grep", "zk_ambassador"], stdin=check_zk_amb_proc.stdout
-      )
-    except subprocess.CalledProcessError:
-      pass
-    check_zk_amb_proc.wait()
-    if len(proc_output) > 0:
-      zookeeperLink = "--link zk_ambassador:zk"
+  elif container_state.snapshot().is_running("zk_ambassador"):
+    # zookeeper ambassador runs here
+    zookeeperLink = "--link zk_ambassador:zk"
 
   nimbusLink = ""
-  nimbus_ip_address = stormConfig["servers"][stormYamlConfig["nimbus.host"]]
-  if any([(myIpAddress == nimbus_ip_address) for myIpAddress in ipv4Addresses]):
+  if clusterModel.runs_on("nimbus", ipv4Addresses):
     nimbusLink = "--link nimbus:nimbus"
-  dockerRunCmd = re.sub(r"""\s+""", " ",
-    """docker run -h {docker_hostname} {zookeeper_link} {nimbus_link}
-       {docker_port_args} {docker_run_args} --is-storm-supervisor""".format(
-      docker_hostname=dockerHostname,
-      zookeeper_link=zookeeperLink,
-      nimbus_link=nimbusLink,
-      docker_port_args=" ".join(dockerPortArgs),
-      docker_run_args=dockerRunArgs,
+
+  for container in containers:
+    if container_state.snapshot().is_running(container.name):
+      print("storm supervisor Docker container {} already running".format(
+        container.name
+      ))
+      continue
+    print("{}: {} worker slots on ports {}{}".format(container.name,
+      len(container.ports), ", ".join(str(port) for port in container.ports),
+      "; NUMA node {} (CPUs {})".format(container.node.nodeId,
+        container.node.cpuList
+      ) if container.node is not None else ""
+    ))
+
+    # construct appropriate port arguments for Storm supervisor and logviewer
+    # since we run those 2 services in the `storm-supervisor` container
+    dockerPortArgs = docker_run.construct_docker_run_port_args(["supervisor",
+      "logviewer"
+    ], {docker_run.SUPERVISOR_SLOTS_PORTS_STR: container.ports},
+      container.portShift
+    )
+    cpusetArgs = ""
+    if container.node is not None:
+      cpusetArgs = "--cpuset-cpus {} --cpuset-mems {}".format(
+        container.node.cpuList, container.node.nodeId
+      )
+    dockerRunArgString = re.sub(r"""\s+""", " ",
+      """--name {name} -h {docker_hostname} -p 127.0.0.1:{ssh_port}:22
+         {cpuset_args} {zookeeper_link} {nimbus_link}
+         {docker_port_args} {config_reload_args} {docker_run_args}
+         --is-storm-supervisor {slots_port_args}""".format(
+        name=container.name,
+        docker_hostname=container.hostname,
+        ssh_port=container.sshPort,
+        cpuset_args=cpusetArgs,
+        config_reload_args=" ".join(
+          docker_run.construct_docker_run_config_reload_args()
+        ),
+        slots_port_args=" ".join("--supervisor-slots-port {}".format(port)
+          for port in container.ports
+        ),
+        zookeeper_link=zookeeperLink,
+        nimbus_link=nimbusLink,
+        docker_port_args=" ".join(dockerPortArgs),
+        docker_run_args=dockerRunArgs,
+      )
+    ).strip()
+    docker_run.run_docker_container(dockerRunArgString,
+      docker_run.config_labels("storm", supervisorHost, container)
     )
-  ).strip()
-  print(dockerRunCmd)
-  os.system(dockerRunCmd)
+
+# When run as a main program
+if __name__ == "__main__":
+  main()
@@ -6,15 +6,16 @@
 # Usage:
 #
 #     python -m docker_python_helpers/run_zookeeper.py <ARGS>
+#
+# or, once installed, `storm-docker zookeeper <ARGS>`
 from __future__ import print_function
 
 import argparse
-import os
-import os.path
 import re
 import sys
 
 from . import docker_run
+from . import run_storm_nimbus
 
 parser = argparse.ArgumentParser(
   description="runs the Zookeeper Docker container",
@@ -46,19 +47,21 @@ parser.add_argument(
   help="-p arguments to pass to `docker run` command for Zookeeper container"
 )
 
-if __name__ == "__main__":
-  stormConfig = docker_run.get_storm_config()
+def main(args=None):
+  if args is None:
+    # No args provided, so this script is run as a main program.
+    # This script is used like
+    #     `python -m docker_python_helpers.run_zookeeper <ARGS>`
+    # hence the need for subscripting `sys.argv` from 2
+    args = sys.argv[2:]
+
+  clusterModel = docker_run.get_cluster_model()
+  stormConfig = clusterModel.config
   ipv4Addresses = docker_run.get_ipv4_addresses(
     stormConfig["is_localhost_setup"],
     stormConfig.get("all_machines_are_ec2_instances", False)
   )
-  foundCurrentServer = False
-  for zk_server in stormConfig["storm.yaml"]["storm.zookeeper.servers"]:
-    if zk_server in stormConfig["servers"] and \
-        stormConfig["servers"][zk_server] in ipv4Addresses:
-      foundCurrentServer = True
-      break
-  if not foundCurrentServer:
+  if not clusterModel.runs_on("zookeeper", ipv4Addresses):
     raise RuntimeError(re.sub("\s+", " ",
       """IP address of this machine does not match any IP address supplied in
       the `storm.yaml` -> `storm.zookeeper.servers` section of
@@ -66,10 +69,8 @@ if __name__ == "__main__":
       """).strip()
     )
 
-  # See the usage of this script at the top of the file... and you'll
-  # understand why we need to subscript `sys.argv` from 2
-  args_to_parse = list(sys.argv[2:])
-  # Locate "--" in sys.argv[2:] . If "--" is present, that means the user
+  args_to_parse = list(args)
+  # Locate "--" in the args. If "--" is present, that means the user
   # wants to start a Zookeeper ambassador docker container. All the args after
   # "--" are for that container.
   double_dash_idx = None
@@ -115,16 +116,17 @@ if __name__ == "__main__":
       zk_docker_port_args.append(
         " ".join(["-p {}".format(x) for x in zk_args.p])
       )
-    dockerRunCmd = "docker run {} {}".format(" ".join(zk_docker_port_args),
-      zk_docker_run_args
-    )
-    print(dockerRunCmd)
-    os.system(dockerRunCmd)
+    docker_run.run_docker_container("{} {}".format(
+      " ".join(zk_docker_port_args), zk_docker_run_args
+    ), docker_run.config_labels("zookeeper"))
 
-  if ambassador_args is not None:
+  if ambassador_args is not None and clusterModel.hostNetwork:
+    # Zookeeper already listens on the host's ports
+    print("network_mode is host; not running the Zookeeper ambassador")
+  elif ambassador_args is not None:
     # Start Zookeeper ambassador docker container.
     # If the `--no-dash-p` option was supplied to this script AND the `--`
-    # separator is on sys.argv (meaning the user wants to run the Zookeeper
+    # separator is in the args (meaning the user wants to run the Zookeeper
     # ambassador container), we grab every `-p` argument generated by the
     # `docker_run.construct_docker_run_port_args` function (now at `p_args`)
     # and include them in the `docker run` command for the Zookeeper ambassador
@@ -132,6 +134,20 @@ if __name__ == "__main__":
     if p_args is not None:
       ambassador_args = [" ".join(["-p {}".format(x) for x in p_args.p])] + \
         ambassador_args
-    docker_run_cmd = "docker run {}".format(" ".join(ambassador_args))
-    print(docker_run_cmd)
-    os.system(docker_run_cmd)
+    # Clients of the ambassador fail over to the other Zookeeper servers if
+    # the linked one is down. This machine's own IP addresses are left out,
+    # since they lead back to the ambassador itself.
+    other_zk_hosts = [host for host in clusterModel.zookeeperHosts
+      if clusterModel.ip(host) not in ipv4Addresses
+    ]
+    if other_zk_hosts:
+      ambassador_args = run_storm_nimbus.zk_ensemble_env_args(clusterModel,
+        other_zk_hosts
+      ) + ambassador_args
+    docker_run.run_docker_container(" ".join(ambassador_args),
+      docker_run.config_labels("zookeeper")
+    )
+
+# When run as a main program
+if __name__ == "__main__":
+  main()
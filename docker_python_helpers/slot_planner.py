@@ -0,0 +1,123 @@
+# Per-host sizing of `supervisor.slots.ports`.
+#
+# Without a `storm.supervisor.slots` section in `config/storm-setup.yaml`,
+# every supervisor uses the `storm.yaml -> supervisor.slots.ports` list as is.
+# With it, the number of worker slots of each supervisor is derived from the
+# CPU cores and memory of its machine (read from the machine itself, or from
+# per-server overrides in the section), and the slots are given a contiguous
+# range of ports starting at the first port of `supervisor.slots.ports`.
+#
+# The resulting ports are both published by the supervisor container (`-p`)
+# and written to the `storm.yaml` generated inside it (see the
+# `--supervisor-slots-port` argument of `base-storm/run-supervisord.py`).
+
+import os
+
+from . import docker_run
+
+# Name of the `storm-setup.yaml` section configuring the slot planner
+SLOTS_SECTION = "storm.supervisor.slots"
+
+# Defaults for the keys of the `storm.supervisor.slots` section
+DEFAULT_CORES_PER_SLOT = 1
+DEFAULT_MEMORY_MB_PER_SLOT = 1024
+DEFAULT_RESERVED_MEMORY_MB = 1024
+DEFAULT_MIN_SLOTS = 1
+
+class SlotPlan(object):
+  """Worker slots of the supervisor running on a host."""
+  def __init__(self, host, ports, cores=None, memoryMb=None):
+    """Constructor for SlotPlan
+
+    Args:
+      host(str): supervisor host, a key of the `servers` dictionary
+      ports(list of int): port of each worker slot
+      cores(int, optional): CPU cores the plan was derived from
+      memoryMb(int, optional): memory (in MB) the plan was derived from
+    """
+    self.host = host
+    self.ports = list(ports)
+    self.cores = cores
+    self.memoryMb = memoryMb
+
+  @property
+  def slots(self):
+    return len(self.ports)
+
+  def __repr__(self):
+    return "SlotPlan({!r}, slots={}, ports={}-{})".format(self.host,
+      self.slots, self.ports[0] if self.ports else None,
+      self.ports[-1] if self.ports else None
+    )
+
+def host_resources():
+  """Returns the number of online CPU cores and the physical memory (in MB) of
+  this machine."""
+  cores = os.sysconf("SC_NPROCESSORS_ONLN")
+  memoryMb = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") // \
+    (1024 * 1024)
+  return cores, memoryMb
+
+def slot_count(cores, memoryMb, slotsConfig):
+  """Returns the number of worker slots a machine can hold.
+
+  Each slot needs `cores.per.slot` cores and `memory.mb.per.slot` MB of memory,
+  after `reserved.memory.mb` MB are set aside for the supervisor, the
+  logviewer and the OS. The result is clamped to `[min.slots, max.slots]`.
+  """
+  coresPerSlot = slotsConfig.get("cores.per.slot", DEFAULT_CORES_PER_SLOT)
+  memoryMbPerSlot = slotsConfig.get("memory.mb.per.slot",
+    DEFAULT_MEMORY_MB_PER_SLOT
+  )
+  reservedMemoryMb = slotsConfig.get("reserved.memory.mb",
+    DEFAULT_RESERVED_MEMORY_MB
+  )
+  count = min(int(cores // coresPerSlot),
+    int((memoryMb - reservedMemoryMb) // memoryMbPerSlot)
+  )
+  count = max(count, slotsConfig.get("min.slots", DEFAULT_MIN_SLOTS))
+  if slotsConfig.get("max.slots") is not None:
+    count = min(count, slotsConfig["max.slots"])
+  return count
+
+def plan_slots(model, host, resources=None):
+  """Returns the worker slots of the supervisor on `host`.
+
+  Args:
+    model(cluster_model.ClusterModel): the compiled `storm-setup.yaml`
+    host(str): supervisor host, a key of the `servers` dictionary
+    resources(tuple, optional): (cores, memory in MB) of the machine. Defaults
+      to those of the current machine; ignored for values overridden in the
+      `storm.supervisor.slots -> servers` section.
+
+  Returns:
+    SlotPlan: the slots of the supervisor
+  """
+  staticPorts = [port for key, portList, _ in model.componentPorts["supervisor"]
+    if key == docker_run.SUPERVISOR_SLOTS_PORTS_STR for port in portList
+  ]
+  slotsConfig = model.config.get(SLOTS_SECTION)
+  if not slotsConfig:
+    return SlotPlan(host, staticPorts)
+
+  override = (slotsConfig.get("servers") or {}).get(host) or {}
+  firstPort = slotsConfig.get("first.port", staticPorts[0])
+  if "slots" in override:
+    return SlotPlan(host, range(firstPort, firstPort + override["slots"]))
+
+  cores, memoryMb = None, None
+  if "cores" not in override or "memory.mb" not in override:
+    cores, memoryMb = resources if resources is not None else host_resources()
+  cores = override.get("cores", cores)
+  memoryMb = override.get("memory.mb", memoryMb)
+  count = slot_count(cores, memoryMb, slotsConfig)
+  return SlotPlan(host, range(firstPort, firstPort + count), cores, memoryMb)
+
+def supervisor_host(model, ipv4Addresses):
+  """Returns the supervisor host of this machine, or None if it does not run a
+  supervisor. If several supervisor hosts share this machine's IP addresses
+  (eg. in a localhost setup), the last one listed in
+  `storm.supervisor.hosts` is used, as for the container's hostname."""
+  myHosts = model.hosts_with_ips(ipv4Addresses)
+  hosts = [host for host in model.supervisorHosts if host in myHosts]
+  return hosts[-1] if hosts else None
@@ -0,0 +1,240 @@
+# Several storm-supervisor containers per supervisor host, each pinned to a
+# NUMA node of its machine.
+#
+# Without a `storm.supervisor.containers` section in `config/storm-setup.yaml`
+# (or with `count: 1`), a supervisor host runs a single container named
+# `supervisor`, with the hostname `<host>-supervisor`. With `count: N` (N > 1),
+# it runs the containers `supervisor-0` to `supervisor-<N-1>`, with the
+# hostnames `<host>-supervisor-0` to `<host>-supervisor-<N-1>`, and:
+#
+#   - the worker slots of the host (see `slot_planner.py`) are split into N
+#     contiguous, non-overlapping port ranges, one per container
+#   - container n is pinned (`--cpuset-cpus` / `--cpuset-mems`) to the CPUs
+#     and memory of NUMA node n (modulo the number of nodes), read from
+#     `/sys/devices/system/node`, so that its workers stay on one socket
+#   - the host ports of the other ports of container n (logviewer, log search,
+#     metrics exporter and SSH) are shifted by n * `port.stride`; inside the
+#     containers, they are unchanged
+#
+# Container names and hostnames only depend on `storm-setup.yaml`, so that the
+# other machines (dnsmasq entries, see `base-storm/run-supervisord.py`) and
+# `scripts/remote.py` (rolling restarts, timelines) know them too.
+
+import glob
+import os.path
+import re
+
+# Name of the `storm-setup.yaml` section configuring the supervisor containers
+CONTAINERS_SECTION = "storm.supervisor.containers"
+
+# Defaults for the keys of the `storm.supervisor.containers` section
+DEFAULT_COUNT = 1
+DEFAULT_PORT_STRIDE = 10
+
+# Name of the supervisor container of a host running a single one
+CONTAINER_NAME = "supervisor"
+
+# SSH port of the supervisor container published on 127.0.0.1 by
+# `start-storm.sh`
+SSH_PORT = 49022
+
+# Where the NUMA topology of the machine is read from
+NODE_SYSFS_DIR = "/sys/devices/system/node"
+
+_NODE_DIR_REGEX = re.compile(r"node(\d+)$")
+_MEM_TOTAL_REGEX = re.compile(r"MemTotal:\s+(\d+)\s*kB")
+_CONTAINER_NAME_REGEX = re.compile(r"^{}(-\d+)?$".format(CONTAINER_NAME))
+
+class NumaNode(object):
+  """A NUMA node of this machine."""
+  def __init__(self, nodeId, cpuList, memoryMb=None):
+    """Constructor for NumaNode
+
+    Args:
+      nodeId(int): node number, as given to `--cpuset-mems`
+      cpuList(str): CPUs of the node, as given to `--cpuset-cpus` (eg.
+        "0-7,16-23")
+      memoryMb(int, optional): memory of the node, in MB
+    """
+    self.nodeId = nodeId
+    self.cpuList = cpuList
+    self.memoryMb = memoryMb
+
+  @property
+  def cpus(self):
+    return len(parse_cpu_list(self.cpuList))
+
+  def __repr__(self):
+    return "NumaNode({}, cpus={!r}, memoryMb={})".format(self.nodeId,
+      self.cpuList, self.memoryMb
+    )
+
+class SupervisorContainer(object):
+  """A storm-supervisor container of a supervisor host."""
+  def __init__(self, host, index, count, ports=None, node=None, portShift=0):
+    """Constructor for SupervisorContainer
+
+    Args:
+      host(str): supervisor host, a key of the `servers` dictionary
+      index(int): index of the container on the host, from 0
+      count(int): number of supervisor containers of the host
+      ports(list of int, optional): ports of the worker slots of the container
+      node(NumaNode, optional): NUMA node the container is pinned to
+      portShift(int, optional): added to the host side of the published ports
+        other than the worker slots
+    """
+    self.host = host
+    self.index = index
+    self.name = container_name(index, count)
+    self.hostname = container_hostname(host, self.name)
+    self.ports = list(ports or [])
+    self.node = node
+    self.portShift = portShift
+
+  @property
+  def sshPort(self):
+    return SSH_PORT + self.portShift
+
+  def __repr__(self):
+    return "SupervisorContainer({!r}, {!r}, slots={}, node={})".format(
+      self.name, self.hostname, len(self.ports),
+      self.node.nodeId if self.node is not None else None
+    )
+
+def containers_config(config):
+  return config.get(CONTAINERS_SECTION) or {}
+
+def container_count(config, host):
+  """Returns the number of supervisor containers of a supervisor host."""
+  containersConfig = containers_config(config)
+  override = (containersConfig.get("servers") or {}).get(host) or {}
+  return int(override.get("count",
+    containersConfig.get("count", DEFAULT_COUNT)
+  ))
+
+def port_stride(config):
+  return int(containers_config(config).get("port.stride", DEFAULT_PORT_STRIDE))
+
+def container_name(index, count):
+  """Returns the name of the `index`-th of `count` supervisor containers."""
+  if count == 1:
+    return CONTAINER_NAME
+  return "{}-{}".format(CONTAINER_NAME, index)
+
+def container_hostname(host, name):
+  """Returns the Docker hostname of the supervisor container `name` of
+  `host`."""
+  return "{}-{}".format(host, name)
+
+def container_names(config, host):
+  """Returns the names of the supervisor containers of a supervisor host."""
+  count = container_count(config, host)
+  return [container_name(index, count) for index in range(count)]
+
+def container_hostnames(config, host):
+  """Returns the Docker hostnames of the supervisor containers of a supervisor
+  host."""
+  return [container_hostname(host, name)
+    for name in container_names(config, host)
+  ]
+
+def is_container_name(name):
+  """Returns True if `name` is the name of a supervisor container, for any
+  number of containers per host."""
+  return _CONTAINER_NAME_REGEX.match(name) is not None
+
+def parse_cpu_list(cpuList):
+  """Parses a Linux CPU list such as "0-3,8-11" into a list of CPU numbers."""
+  cpus = []
+  for cpuRange in cpuList.strip().split(","):
+    if not cpuRange:
+      continue
+    first, _, last = cpuRange.partition("-")
+    cpus.extend(range(int(first), int(last or first) + 1))
+  return cpus
+
+def numa_nodes(sysfsDir=NODE_SYSFS_DIR):
+  """Returns the NUMA nodes of this machine which have CPUs, in order, or an
+  empty list if the topology cannot be read."""
+  nodes = []
+  for nodeDir in glob.glob(os.path.join(sysfsDir, "node*")):
+    match = _NODE_DIR_REGEX.search(nodeDir)
+    if match is None:
+      continue
+    try:
+      with open(os.path.join(nodeDir, "cpulist")) as f:
+        cpuList = f.read().strip()
+    except IOError:
+      continue
+    if not parse_cpu_list(cpuList):
+      # Memory-only node
+      continue
+    memoryMb = None
+    try:
+      with open(os.path.join(nodeDir, "meminfo")) as f:
+        memMatch = _MEM_TOTAL_REGEX.search(f.read())
+      if memMatch is not None:
+        memoryMb = int(memMatch.group(1)) // 1024
+    except IOError:
+      pass
+    nodes.append(NumaNode(int(match.group(1)), cpuList, memoryMb))
+  return sorted(nodes, key=lambda node: node.nodeId)
+
+def split_ports(ports, count):
+  """Splits `ports` into `count` contiguous parts, the first ones being one
+  port longer when they cannot all be of the same length."""
+  ports = list(ports)
+  parts = []
+  start = 0
+  for index in range(count):
+    length = len(ports) // count + (1 if index < len(ports) % count else 0)
+    parts.append(ports[start:start + length])
+    start += length
+  return parts
+
+def plan_containers(config, host, slotPorts=(), nodes=()):
+  """Returns the supervisor containers of a supervisor host.
+
+  Args:
+    config(dict): the dict defined by the `storm-setup.yaml` file
+    host(str): supervisor host, a key of the `servers` dictionary
+    slotPorts(list of int, optional): worker slot ports of the host, split
+      between its containers
+    nodes(list of NumaNode, optional): NUMA nodes the containers are pinned
+      to, in turn. The containers are not pinned if it is empty, or if
+      `numa.pinning` is false.
+
+  Returns:
+    list of SupervisorContainer
+  """
+  count = container_count(config, host)
+  if not containers_config(config).get("numa.pinning", True):
+    nodes = ()
+  stride = port_stride(config)
+  return [SupervisorContainer(host, index, count, ports,
+      nodes[index % len(nodes)] if nodes and count > 1 else None,
+      index * stride
+    ) for index, ports in enumerate(split_ports(slotPorts, count))
+  ]
+
+def extra_hosts(config, host, hostname):
+  """Returns the `/etc/dnsmasq-extra-hosts` entries written by
+  `base-storm/run-supervisord.py` in the supervisor container `hostname` of
+  `host`: the supervisor containers of the other machines, and the other
+  supervisor containers of its own machine.
+
+  Returns:
+    list of str: "<IP address> <hostname>" entries
+  """
+  servers = config.get("servers") or {}
+  myIpAddress = servers.get(host)
+  entries = []
+  for supervisorHost in config.get("storm.supervisor.hosts") or []:
+    ipAddress = servers.get(supervisorHost)
+    hostnames = container_hostnames(config, supervisorHost)
+    if ipAddress == myIpAddress:
+      if hostname not in hostnames or ipAddress.startswith("127."):
+        continue
+      hostnames = [other for other in hostnames if other != hostname]
+    entries.extend("{} {}".format(ipAddress, other) for other in hostnames)
+  return entries
@@ -0,0 +1,372 @@
+# Merged timeline of a rollout (see `rollout.py`), built from the spans of
+# `timing.py` emitted on every host, and the critical path through it.
+#
+# With `scripts/remote.py --timeline FILE`:
+#
+#   - every remote command is run with `STORM_DOCKER_TIMING=-`, and the span
+#     lines of its output are collected (and left out of the output printed
+#     by `remote.py`). The command itself is timed as an `ssh` span, and each
+#     (host, component) of the rollout as a `task` span.
+#   - the readiness gate of each wave is timed as a `gate` span
+#   - once the rollout is over, the spans of the container entrypoints are
+#     read from the `docker logs` of the containers started on each host
+#
+# The spans are written to FILE as JSON lines, in the order they started, with
+# the SSH `host` and the rollout `component` they belong to and their
+# `offset_s` from the start of the rollout.
+#
+# Clocks of the hosts may differ from the local one: the spans of a remote
+# command which do not fit in the time window of its `ssh` span are shifted to
+# its middle, and the shift is kept for the container spans of that host.
+
+from __future__ import print_function
+
+import json
+import threading
+import time
+
+from multiprocessing.pool import ThreadPool
+
+from . import rollout
+from . import supervisor_containers
+from . import timing
+
+# Containers started for each argument of `start-storm.sh` whose entrypoint
+# emits spans (see `base-storm/run-supervisord.py` and
+# `zookeeper/run-zookeeper.py`). Those of `supervisor` depend on the host (see
+# `component_containers`).
+COMPONENT_CONTAINERS = {
+  "nimbus": ["nimbus"],
+  "nimbus-with-zookeeper-ambassador": ["nimbus"],
+  "supervisor": ["supervisor"],
+  "ui": ["ui"],
+  "ui-on-zk-ambassador-machine": ["ui"],
+  "zookeeper": ["zookeeper"],
+  "zookeeper-with-ambassador": ["zookeeper"],
+}
+
+# Number of spans read from the end of the `docker logs` of a container
+CONTAINER_LOG_SPANS = 100
+
+# Number of phases listed under "slowest phases" by `Timeline.summary`
+SLOWEST_PHASES = 8
+
+def parse_spans(output):
+  """Splits the output of a command into its spans and its other lines.
+
+  Returns:
+    (list of dict, str): the spans, and the output without them
+  """
+  spans = []
+  lines = []
+  for line in (output or "").splitlines(True):
+    stripped = line.strip()
+    if stripped.startswith("{") and '"{}"'.format(timing.SPAN_KEY) in stripped:
+      try:
+        record = json.loads(stripped)
+      except ValueError:
+        record = None
+      if isinstance(record, dict) and timing.SPAN_KEY in record and \
+          "start" in record and "end" in record:
+        spans.append(record)
+        continue
+    lines.append(line)
+  return spans, "".join(lines)
+
+def component_containers(model, host, component):
+  """Returns the containers started on `host` by a `start-storm.sh`
+  argument."""
+  if component == "supervisor" and model is not None:
+    return supervisor_containers.container_names(model.config, host)
+  return COMPONENT_CONTAINERS.get(component, [])
+
+def _duration(span):
+  return span["end"] - span["start"]
+
+def _describe_spans(spans):
+  """Returns `name 1.2s` for each span without a parent, followed by its
+  children (the spans of the same process naming it as `parent`) in
+  parentheses."""
+  children = {}
+  for span in spans:
+    if "parent" in span:
+      children.setdefault((span.get("pid"), span["parent"]), []).append(span)
+  parts = []
+  for span in spans:
+    if "parent" in span:
+      continue
+    part = "{} {:.1f}s".format(span[timing.SPAN_KEY], _duration(span))
+    spanChildren = children.get((span.get("pid"), span[timing.SPAN_KEY]))
+    if spanChildren:
+      part += " ({})".format(", ".join("{} {:.1f}s".format(
+        child[timing.SPAN_KEY], _duration(child)) for child in spanChildren
+      ))
+    parts.append(part)
+  return ", ".join(parts)
+
+class _TimedExecutor(object):
+  """Executor running commands with spans turned on, and collecting them into
+  a Timeline."""
+  def __init__(self, timeline, executor, component):
+    self.timeline = timeline
+    self.executor = executor
+    self.component = component
+
+  def run(self, host, command):
+    start = time.time()
+    try:
+      output = self.executor.run(host, "export {}=- && {}".format(
+        timing.TIMING_ENV, command
+      ))
+    except rollout.RemoteCommandError as e:
+      end = time.time()
+      spans, e.output = parse_spans(e.output)
+      self.timeline.add_remote_spans(host, self.component, spans, start, end)
+      self.timeline.add({timing.SPAN_KEY: "ssh", "start": start, "end": end,
+        "command": command, "error": type(e).__name__}, host, self.component
+      )
+      raise
+    end = time.time()
+    spans, output = parse_spans(output)
+    self.timeline.add_remote_spans(host, self.component, spans, start, end)
+    self.timeline.add({timing.SPAN_KEY: "ssh", "start": start, "end": end,
+      "command": command}, host, self.component
+    )
+    return output
+
+class Timeline(object):
+  """Spans of a rollout, from every host."""
+  def __init__(self, startTime=None):
+    """Constructor for Timeline
+
+    Args:
+      startTime(float, optional): start of the rollout, in seconds since the
+        epoch. Defaults to now.
+    """
+    self.startTime = time.time() if startTime is None else startTime
+    self.spans = []
+    # SSH host -> seconds added to the times of its spans
+    self._offsets = {}
+    self._lock = threading.Lock()
+
+  def add(self, span, host=None, component=None, offset=0.0):
+    """Adds a span, tagged with the SSH host and rollout component it belongs
+    to."""
+    span = dict(span)
+    span["start"] += offset
+    span["end"] += offset
+    if host is not None:
+      span["host"] = host
+    if component is not None:
+      span["component"] = component
+    with self._lock:
+      self.spans.append(span)
+
+  def add_remote_spans(self, host, component, spans, windowStart, windowEnd):
+    """Adds the spans of a remote command run from `windowStart` to
+    `windowEnd` (local time), correcting the clock of `host` if needed."""
+    if not spans:
+      return
+    remoteStart = min(span["start"] for span in spans)
+    remoteEnd = max(span["end"] for span in spans)
+    offset = 0.0
+    if remoteStart < windowStart or remoteEnd > windowEnd:
+      offset = (windowStart + windowEnd - remoteStart - remoteEnd) / 2.0
+    with self._lock:
+      self._offsets[host] = offset
+    for span in spans:
+      self.add(span, host, component, offset)
+
+  def wrap_task(self, task):
+    """Wraps a task of `rollout.run_waves` so that its commands are timed."""
+    def run(executor, host, component):
+      with _TaskSpan(self, host, component):
+        return task(_TimedExecutor(self, executor, component), host,
+          component
+        )
+    return run
+
+  def wrap_gates(self, waves):
+    """Times the readiness gates of `waves`."""
+    for wave in waves:
+      if wave.gate is not None:
+        wave.gate = self._timed_gate(wave.name, wave.gate)
+
+  def _timed_gate(self, waveName, gate):
+    def run():
+      start = time.time()
+      result = gate()
+      self.add({timing.SPAN_KEY: "gate", "start": start, "end": time.time(),
+        "wave": waveName, "ready": bool(result)}
+      )
+      return result
+    return run
+
+  def collect_container_spans(self, executor, report,
+      poolSize=rollout.DEFAULT_POOL_SIZE, model=None):
+    """Reads the spans of the containers started by the rollout from their
+    `docker logs`.
+
+    Args:
+      executor: object with a `run(host, command)` method
+      report(rollout.RolloutReport): report of the rollout
+      poolSize(int, optional): maximum number of concurrent hosts
+      model(cluster_model.ClusterModel, optional): the compiled
+        `storm-setup.yaml`, naming the supervisor containers of each host.
+        Without it, a single `supervisor` container is assumed.
+    """
+    tasks = []
+    for result in report.results:
+      if result.succeeded:
+        for container in component_containers(model, result.host,
+            result.component):
+          tasks.append((result, container))
+
+    def collect(resultAndContainer):
+      result, container = resultAndContainer
+      try:
+        output = executor.run(result.host,
+          "docker logs {} 2>&1 | grep -F '\"{}\"' | tail -n {}".format(
+            container, timing.SPAN_KEY, CONTAINER_LOG_SPANS
+          )
+        )
+      except rollout.RemoteCommandError:
+        return
+      spans, _ = parse_spans(output)
+      offset = self._offsets.get(result.host, 0.0)
+      for span in spans:
+        # Left by an earlier run of a container which was kept as is
+        if span["end"] + offset < result.startTime:
+          continue
+        span["container"] = container
+        self.add(span, result.host, result.component, offset)
+
+    if not tasks:
+      return
+    pool = ThreadPool(max(1, min(poolSize, len(tasks))))
+    try:
+      pool.map(collect, tasks)
+    finally:
+      pool.close()
+      pool.join()
+
+  def sorted_spans(self):
+    """Returns the spans in the order they started, with their `offset_s`."""
+    spans = []
+    for span in sorted(self.spans, key=lambda span: span["start"]):
+      span = dict(span)
+      span["offset_s"] = round(span["start"] - self.startTime, 6)
+      spans.append(span)
+    return spans
+
+  def write(self, path):
+    """Writes the timeline to `path`, as JSON lines."""
+    with open(path, "w") as f:
+      for span in self.sorted_spans():
+        f.write(json.dumps(span, sort_keys=True) + "\n")
+
+  def task_spans(self, host, component):
+    """Returns the spans of a (host, component) task of the rollout, other
+    than the `task` span itself, in the order they started."""
+    return [span for span in self.sorted_spans()
+      if span.get("host") == host and span.get("component") == component
+      and span[timing.SPAN_KEY] != "task"
+    ]
+
+  def _task_lines(self, host, component):
+    """Returns a line per remote command of a task, and per container, with
+    their spans (nested spans in parentheses)."""
+    spans = self.task_spans(host, component)
+    commands = [span for span in spans if span[timing.SPAN_KEY] == "ssh"]
+    lines = []
+    for command in commands:
+      inner = [span for span in spans if span[timing.SPAN_KEY] != "ssh" and
+        "container" not in span and
+        command["start"] <= span["start"] <= command["end"]
+      ]
+      lines.append("{}: {:.1f}s{}".format(
+        command["command"].split("&& ")[-1], _duration(command),
+        "; " + _describe_spans(inner) if inner else ""
+      ))
+    containers = {}
+    for span in spans:
+      if "container" in span:
+        containers.setdefault(span["container"], []).append(span)
+    for container in sorted(containers):
+      lines.append("container {}: {}".format(container,
+        _describe_spans(containers[container])
+      ))
+    return lines
+
+  def summary(self, report):
+    """Returns the lines of a summary of the rollout: the critical path (in
+    each wave, the task which finished last, then the wave's gate) with the
+    phases of those tasks, and the slowest phases across hosts.
+
+    Args:
+      report(rollout.RolloutReport): report of the rollout
+
+    Returns:
+      list of str
+    """
+    gates = dict((span["wave"], span) for span in self.spans
+      if span[timing.SPAN_KEY] == "gate"
+    )
+    results = report.results
+    end = max([result.endTime for result in results] +
+      [span["end"] for span in gates.values()] + [self.startTime]
+    )
+    lines = ["rollout: {:.1f}s; critical path:".format(end - self.startTime)]
+    for waveName, waveResults in report.waves:
+      if not waveResults:
+        continue
+      last = max(waveResults, key=lambda result: result.endTime)
+      lines.append("  {}: {:.1f}s, waiting on {} {} ({:.1f}s)".format(
+        waveName, last.endTime - min(result.startTime for result in
+          waveResults), last.host, last.component, last.duration
+      ))
+      lines.extend("    " + line
+        for line in self._task_lines(last.host, last.component)
+      )
+      if waveName in gates:
+        lines.append("  {} gate: {:.1f}s".format(waveName,
+          _duration(gates[waveName])
+        ))
+
+    byName = {}
+    for span in self.spans:
+      if span[timing.SPAN_KEY] not in ("task", "gate"):
+        byName.setdefault(span[timing.SPAN_KEY], []).append(span)
+    slowest = sorted(byName.items(),
+      key=lambda item: -max(_duration(span) for span in item[1])
+    )[:SLOWEST_PHASES]
+    if slowest:
+      lines.append("slowest phases:")
+    for name, spans in slowest:
+      durations = sorted(_duration(span) for span in spans)
+      longest = max(spans, key=_duration)
+      lines.append("  {}: max {:.1f}s ({} {}), median {:.1f}s over {} "
+        "spans".format(name, durations[-1], longest.get("host"),
+        longest.get("component"), durations[len(durations) // 2],
+        len(durations)
+      ))
+    return lines
+
+class _TaskSpan(object):
+  """Times a (host, component) task of the rollout as a `task` span."""
+  def __init__(self, timeline, host, component):
+    self.timeline = timeline
+    self.host = host
+    self.component = component
+    self.start = None
+
+  def __enter__(self):
+    self.start = time.time()
+    return self
+
+  def __exit__(self, excType, excValue, traceback):
+    span = {timing.SPAN_KEY: "task", "start": self.start, "end": time.time()}
+    if excType is not None:
+      span["error"] = excType.__name__
+    self.timeline.add(span, self.host, self.component)
+    return False
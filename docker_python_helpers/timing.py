@@ -0,0 +1,174 @@
+# Span-style timing of the phases of the storm-docker helpers and of the
+# container entrypoints, emitted as JSON lines like:
+#
+#     {"duration_ms": 412.5, "end": 1419580800.912, "hostname": "server-one",
+#      "pid": 4242, "span": "docker.create", "start": 1419580800.5}
+#
+# (one line per span). Where the spans go is set by the `STORM_DOCKER_TIMING`
+# environment variable:
+#
+#   - `-`: stderr
+#   - any other value: a file the spans are appended to
+#   - unset or empty: nowhere. This is the default of the helpers, some of
+#     whose output is parsed by the shell scripts. The container entrypoints
+#     default to stderr instead (see `set_default_destination`), which ends up
+#     in `docker logs`.
+#
+# The `scripts/run-*.sh` wrappers export `STORM_DOCKER_START_TIME` when they
+# start; the time until this module is imported (virtualenv activation,
+# `pip install`, Python startup) is emitted as a `bootstrap` span along with
+# the first span of the process.
+#
+# `scripts/remote.py --timeline` turns the spans on for every host, and merges
+# them into a timeline of the rollout (see `timeline.py`).
+#
+# Only depends on the standard library, as the file is also copied into the
+# base-storm and zookeeper images, next to their entrypoints.
+
+from __future__ import print_function
+
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+# Environment variable telling where spans go
+TIMING_ENV = "STORM_DOCKER_TIMING"
+
+# Environment variable holding the time (in seconds since the epoch) at which
+# a `scripts/run-*.sh` wrapper started
+START_TIME_ENV = "STORM_DOCKER_START_TIME"
+
+# Key present in every span, used to tell spans apart from other output
+SPAN_KEY = "span"
+
+_IMPORT_TIME = time.time()
+_HOSTNAME = socket.gethostname()
+
+_lock = threading.Lock()
+_local = threading.local()
+_defaultDestination = None
+_bootstrapEmitted = False
+
+def set_default_destination(destination):
+  """Sets where spans go when `STORM_DOCKER_TIMING` is not set: `-` for
+  stderr, or a file path."""
+  global _defaultDestination
+  _defaultDestination = destination
+
+def destination():
+  """Returns where spans go, or None if they are not emitted."""
+  return os.environ.get(TIMING_ENV, _defaultDestination) or None
+
+def enabled():
+  return destination() is not None
+
+def _write(dest, lines):
+  data = "".join(lines)
+  if dest == "-":
+    sys.stderr.write(data)
+    sys.stderr.flush()
+  else:
+    with open(dest, "a") as f:
+      f.write(data)
+
+def _record(name, start, end, fields):
+  record = {
+    SPAN_KEY: name,
+    "start": round(start, 6),
+    "end": round(end, 6),
+    "duration_ms": round((end - start) * 1000.0, 3),
+    "hostname": _HOSTNAME,
+    "pid": os.getpid(),
+  }
+  record.update(fields)
+  return json.dumps(record, sort_keys=True) + "\n"
+
+def emit(name, start, end, **fields):
+  """Emits a span which ran from `start` to `end` (seconds since the epoch),
+  with extra `fields`."""
+  global _bootstrapEmitted
+  dest = destination()
+  if dest is None:
+    return
+  parents = getattr(_local, "stack", None)
+  if parents and "parent" not in fields:
+    fields["parent"] = parents[-1]
+  lines = []
+  with _lock:
+    if not _bootstrapEmitted:
+      _bootstrapEmitted = True
+      try:
+        startTime = float(os.environ[START_TIME_ENV])
+        lines.append(_record("bootstrap", startTime, _IMPORT_TIME, {}))
+      except (KeyError, ValueError):
+        pass
+    lines.append(_record(name, start, end, fields))
+    try:
+      _write(dest, lines)
+    except (IOError, OSError):
+      # Timing must never break what is being timed
+      pass
+
+class Span(object):
+  """Times a block of code (see `span`):
+
+      with timing.span("config.load") as s:
+        ...
+        s.fields["source"] = "disk"
+
+  The span is emitted when the block exits, with an `error` field if it
+  raised. Spans started inside the block get its name as `parent`.
+  """
+  def __init__(self, name, **fields):
+    self.name = name
+    self.fields = fields
+    self.start = None
+
+  def __enter__(self):
+    self.start = time.time()
+    stack = getattr(_local, "stack", None)
+    if stack is None:
+      stack = _local.stack = []
+    stack.append(self.name)
+    return self
+
+  def __exit__(self, excType, excValue, traceback):
+    end = time.time()
+    _local.stack.pop()
+    if excType is not None:
+      self.fields["error"] = excType.__name__
+    emit(self.name, self.start, end, **self.fields)
+    return False
+
+def span(name, **fields):
+  """Returns a Span, to be used in a `with` statement."""
+  return Span(name, **fields)
+
+class Phases(object):
+  """Times the consecutive phases of a script, without nesting its code in
+  `with` blocks: each `start` ends the previous phase.
+
+      phases = timing.Phases("entrypoint")
+      phases.start("load_config")
+      ...
+      phases.start("write_config")
+      ...
+      phases.end()
+  """
+  def __init__(self, prefix):
+    self.prefix = prefix
+    self._name = None
+    self._start = None
+
+  def start(self, name):
+    self.end()
+    self._name = name
+    self._start = time.time()
+
+  def end(self):
+    if self._name is not None:
+      emit("{}.{}".format(self.prefix, self._name), self._start, time.time())
+      self._name = None
@@ -0,0 +1,356 @@
+# Minimal, blocking Zookeeper client: just enough of Zookeeper's wire protocol
+# to read the nodes Storm registers (eg. `/storm/supervisors`), and to keep the
+# ephemeral nodes of the storm-docker service registry (see
+# `storm-supervisor/storm_service_registry.py`), so that storm-docker does not
+# depend on a Zookeeper library.
+#
+# Each request is a length-prefixed frame holding a request header (xid and
+# operation type) followed by the jute-serialized request. Responses carry a
+# reply header (xid, zxid and error code). See `zookeeper.jute` in the
+# Zookeeper source tree:
+#
+#     https://github.com/apache/zookeeper/blob/release-3.4.6/src/zookeeper.jute
+
+import collections
+import select
+import socket
+import struct
+import time
+
+# Operation types
+OP_CREATE = 1
+OP_DELETE = 2
+OP_EXISTS = 3
+OP_GET_DATA = 4
+OP_GET_CHILDREN = 8
+OP_PING = 11
+OP_CLOSE = -11
+
+# xids of the frames the server sends on its own
+WATCH_EVENT_XID = -1
+PING_XID = -2
+
+# Error codes
+ERR_OK = 0
+ERR_NO_NODE = -101
+ERR_NODE_EXISTS = -110
+ERR_NOT_EMPTY = -111
+
+# Watch event types
+EVENT_NODE_CREATED = 1
+EVENT_NODE_DELETED = 2
+EVENT_NODE_DATA_CHANGED = 3
+EVENT_NODE_CHILDREN_CHANGED = 4
+
+# Keeper state of the watch events of a live session
+STATE_SYNC_CONNECTED = 3
+
+# Create mode flag of ephemeral nodes
+CREATE_EPHEMERAL = 1
+
+# `world:anyone` with all permissions (OPEN_ACL_UNSAFE)
+PERMS_ALL = 31
+
+DEFAULT_TIMEOUT = 5.0
+DEFAULT_SESSION_TIMEOUT_MS = 10000
+
+Stat = collections.namedtuple("Stat", ["czxid", "mzxid", "ctime", "mtime",
+  "version", "cversion", "aversion", "ephemeralOwner", "dataLength",
+  "numChildren", "pzxid"]
+)
+# Event of a watch set by `get_children`, `get_data` or `exists`
+WatchEvent = collections.namedtuple("WatchEvent", ["type", "state", "path"])
+_STAT = struct.Struct(">qqqqiiiqiiq")
+_INT = struct.Struct(">i")
+_REPLY_HEADER = struct.Struct(">iqi")
+_EVENT_HEADER = struct.Struct(">ii")
+
+class ZookeeperError(Exception):
+  """Raised when the server answers a request with an error code."""
+  def __init__(self, path, code):
+    Exception.__init__(self, "Zookeeper error {} for `{}`".format(code, path))
+    self.path = path
+    self.code = code
+
+class NoNodeError(ZookeeperError):
+  """Raised when the requested node does not exist."""
+
+class NodeExistsError(ZookeeperError):
+  """Raised when creating a node which already exists."""
+
+_ERRORS = {
+  ERR_NO_NODE: NoNodeError,
+  ERR_NODE_EXISTS: NodeExistsError,
+}
+
+def _pack_buffer(data):
+  if data is None:
+    return _INT.pack(-1)
+  return _INT.pack(len(data)) + data
+
+def _pack_string(value):
+  return _pack_buffer(value.encode("utf-8"))
+
+def _pack_bool(value):
+  return b"\x01" if value else b"\x00"
+
+class _Reader(object):
+  """Reads jute-serialized values out of a response."""
+  def __init__(self, data, offset=0):
+    self.data = data
+    self.offset = offset
+
+  def unpack(self, fmt):
+    values = fmt.unpack_from(self.data, self.offset)
+    self.offset += fmt.size
+    return values
+
+  def buffer(self):
+    length, = self.unpack(_INT)
+    if length < 0:
+      return None
+    value = self.data[self.offset:self.offset + length]
+    self.offset += length
+    return value
+
+  def string(self):
+    value = self.buffer()
+    return None if value is None else value.decode("utf-8")
+
+  def stat(self):
+    return Stat(*self.unpack(_STAT))
+
+class ZookeeperClient(object):
+  """Session to one server of a Zookeeper ensemble.
+
+  Usable as a context manager:
+
+      with ZookeeperClient([("10.0.0.1", 2181)]) as client:
+        print(client.get_children("/storm/supervisors"))
+  """
+  def __init__(self, addresses, timeout=DEFAULT_TIMEOUT,
+      sessionTimeoutMs=DEFAULT_SESSION_TIMEOUT_MS):
+    """Constructor for ZookeeperClient
+
+    Args:
+      addresses(list of (str, int)): (host, client port) of the servers, tried
+        in order until one accepts the session
+      timeout(float, optional): socket timeout, in seconds
+      sessionTimeoutMs(int, optional): requested session timeout
+    """
+    self.addresses = list(addresses)
+    self.timeout = timeout
+    self.sessionTimeoutMs = sessionTimeoutMs
+    self.sessionId = None
+    self.negotiatedTimeoutMs = None
+    self._sock = None
+    self._xid = 0
+    self._lastSend = 0.0
+    # Watch events received while waiting for the reply to a request
+    self._events = collections.deque()
+
+  def __enter__(self):
+    self.connect()
+    return self
+
+  def __exit__(self, *excInfo):
+    self.close()
+
+  def _recv_exactly(self, size):
+    chunks = []
+    while size > 0:
+      chunk = self._sock.recv(size)
+      if not chunk:
+        raise socket.error("Connection closed by the Zookeeper server")
+      chunks.append(chunk)
+      size -= len(chunk)
+    return b"".join(chunks)
+
+  def _send_frame(self, payload):
+    self._sock.sendall(_INT.pack(len(payload)) + payload)
+    self._lastSend = time.time()
+
+  def _recv_frame(self):
+    length, = _INT.unpack(self._recv_exactly(_INT.size))
+    return self._recv_exactly(length)
+
+  def connect(self):
+    """Opens a session with the first server which accepts one.
+
+    Raises:
+      socket.error: if no server could be reached
+    """
+    lastError = socket.error("No Zookeeper server given")
+    for host, port in self.addresses:
+      try:
+        self._sock = socket.create_connection((host, port), self.timeout)
+        # protocolVersion, lastZxidSeen, timeOut, sessionId, passwd
+        self._send_frame(struct.pack(">iqiq", 0, 0, self.sessionTimeoutMs, 0) +
+          _pack_buffer(b"\x00" * 16)
+        )
+        reader = _Reader(self._recv_frame())
+        _, self.negotiatedTimeoutMs, self.sessionId = reader.unpack(
+          struct.Struct(">iiq")
+        )
+        if self.sessionId == 0:
+          raise socket.error("Session refused by {}:{}".format(host, port))
+        return
+      except (socket.error, socket.timeout, struct.error) as e:
+        lastError = e
+        self._close_socket()
+    raise lastError
+
+  def _close_socket(self):
+    if self._sock is not None:
+      self._sock.close()
+      self._sock = None
+
+  def _read_reply(self):
+    """Returns the reply header and a reader of the next frame which is not a
+    watch event; watch events are queued for `wait_event`."""
+    reader = _Reader(self._recv_frame())
+    xid, _, err = reader.unpack(_REPLY_HEADER)
+    if xid == WATCH_EVENT_XID:
+      self._events.append(WatchEvent(*(reader.unpack(_EVENT_HEADER) +
+        (reader.string(),)
+      )))
+    return xid, err, reader
+
+  def _request(self, opType, path, payload):
+    self._xid += 1
+    self._send_frame(struct.pack(">ii", self._xid, opType) + payload)
+    while True:
+      xid, err, reader = self._read_reply()
+      if xid in (WATCH_EVENT_XID, PING_XID):
+        continue
+      if err != ERR_OK:
+        raise _ERRORS.get(err, ZookeeperError)(path, err)
+      return reader
+
+  def get_children(self, path, watch=False):
+    """Returns the names of the children of `path`.
+
+    Args:
+      path(str): path of the node
+      watch(bool, optional): set to True to get a
+        `EVENT_NODE_CHILDREN_CHANGED` (or `EVENT_NODE_DELETED`) event from
+        `wait_event` once the children of `path` change
+
+    Raises:
+      NoNodeError: if `path` does not exist
+    """
+    reader = self._request(OP_GET_CHILDREN, path,
+      _pack_string(path) + _pack_bool(watch)
+    )
+    count, = reader.unpack(_INT)
+    return [reader.string() for _ in range(max(0, count))]
+
+  def get_data(self, path, watch=False):
+    """Returns the (data, Stat) of `path`.
+
+    Args:
+      path(str): path of the node
+      watch(bool, optional): set to True to get a `EVENT_NODE_DATA_CHANGED`
+        (or `EVENT_NODE_DELETED`) event from `wait_event` once `path` changes
+
+    Raises:
+      NoNodeError: if `path` does not exist
+    """
+    reader = self._request(OP_GET_DATA, path,
+      _pack_string(path) + _pack_bool(watch)
+    )
+    data = reader.buffer()
+    return data, reader.stat()
+
+  def exists(self, path):
+    """Returns the Stat of `path`, or None if it does not exist."""
+    try:
+      return self._request(OP_EXISTS, path,
+        _pack_string(path) + _pack_bool(False)
+      ).stat()
+    except NoNodeError:
+      return None
+
+  def create(self, path, data=b"", ephemeral=False):
+    """Creates the node `path`, readable and writable by everyone. An
+    ephemeral node is deleted by the server once this session ends.
+
+    Returns:
+      str: path of the created node
+
+    Raises:
+      NodeExistsError: if `path` already exists
+      NoNodeError: if the parent of `path` does not exist
+    """
+    if not isinstance(data, bytes):
+      data = data.encode("utf-8")
+    acl = _INT.pack(1) + _INT.pack(PERMS_ALL) + _pack_string("world") + \
+      _pack_string("anyone")
+    reader = self._request(OP_CREATE, path, _pack_string(path) +
+      _pack_buffer(data) + acl +
+      _INT.pack(CREATE_EPHEMERAL if ephemeral else 0)
+    )
+    return reader.string()
+
+  def ensure_path(self, path):
+    """Creates `path` and its missing parents as persistent nodes."""
+    parts = [part for part in path.split("/") if part]
+    for i in range(1, len(parts) + 1):
+      try:
+        self.create("/" + "/".join(parts[:i]))
+      except NodeExistsError:
+        pass
+
+  def delete(self, path, version=-1):
+    """Deletes the node `path` (whatever its version by default).
+
+    Raises:
+      NoNodeError: if `path` does not exist
+    """
+    self._request(OP_DELETE, path, _pack_string(path) + _INT.pack(version))
+
+  def ping_interval(self):
+    """Returns the seconds between two pings keeping this session alive."""
+    timeoutMs = self.negotiatedTimeoutMs or self.sessionTimeoutMs
+    return max(0.1, timeoutMs / 3000.0)
+
+  def wait_event(self, timeout=None):
+    """Waits for the event of a watch, pinging the server meanwhile so that
+    the session does not expire.
+
+    Args:
+      timeout(float, optional): seconds to wait for. Waits forever if None.
+
+    Returns:
+      WatchEvent: the event, or None if none arrived within `timeout`
+
+    Raises:
+      socket.error: if the connection to the server is lost
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    while not self._events:
+      now = time.time()
+      if deadline is not None and now >= deadline:
+        return None
+      nextPing = self._lastSend + self.ping_interval()
+      if now >= nextPing:
+        self._send_frame(struct.pack(">ii", PING_XID, OP_PING))
+        continue
+      wait = nextPing - now
+      if deadline is not None:
+        wait = min(wait, deadline - now)
+      readable, _, _ = select.select([self._sock], [], [], wait)
+      if readable:
+        self._read_reply()
+    return self._events.popleft()
+
+  def close(self):
+    """Closes the session."""
+    if self._sock is None:
+      return
+    try:
+      self._xid += 1
+      self._send_frame(struct.pack(">ii", self._xid, OP_CLOSE))
+    except socket.error:
+      pass
+    self._close_socket()
@@ -0,0 +1,277 @@
+# Benchmarks what a deploy spends outside of Docker itself, on synthetic
+# `storm-setup.yaml` files with growing numbers of servers (3 Zookeeper
+# servers, Nimbus / DRPC / UI on the first of them, and a supervisor on every
+# other server):
+#
+#   - config parse: compiling the file into a `cluster_model.ClusterModel`
+#     without any cache, from the on-disk cache (a new process), and from the
+#     per-process cache (`docker_run.get_storm_config`)
+#   - argument generation: `docker_run.construct_docker_run_port_args` for the
+#     containers of every server, and the per-machine port check of
+#     `port_planner.plan_cluster` which gates `scripts/remote.py`
+#   - IP discovery: `docker_run.get_ipv4_addresses`, and the lookup of the
+#     hosts of the current machine done by every container start
+#   - rollout: the startup and wall time of `scripts/remote.py --all` (without
+#     readiness gates, as with `--no-wait`), run against a fake SSH executor
+#     which sleeps `--ssh-latency` seconds per command, plus `--docker-latency`
+#     seconds for the `docker run` of each `start-storm.sh`
+#
+# Run from the top of the storm-docker repository:
+#
+#     python scripts/benchmark_deploy.py --servers 5 --servers 100 \
+#       --servers 1000 --output benchmark.json
+#
+# Results are printed as a single JSON object (and written to `--output`), so
+# that runs can be compared.
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import os.path
+import platform
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import yaml
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+  ".."
+))
+
+from docker_python_helpers import cluster_model
+from docker_python_helpers import docker_run
+from docker_python_helpers import port_planner
+from docker_python_helpers import rollout
+from docker_python_helpers import slot_planner
+from docker_python_helpers import supervisor_containers
+
+parser = argparse.ArgumentParser(
+  description="Benchmarks config parsing, docker run argument generation, IP "
+    "discovery and rollouts on synthetic storm-setup.yaml files"
+)
+parser.add_argument("--servers", type=int, action="append", dest="servers",
+  help="Number of servers of a synthetic file; can be given several times "
+    "(default: 5, 100 and 1000)"
+)
+parser.add_argument("--storm-setup-yaml", dest="storm_setup_yaml",
+  default=os.path.join("config", "storm-setup.yaml.sample"),
+  help="storm-setup.yaml file the synthetic files are derived from "
+    "(default: %(default)s)"
+)
+parser.add_argument("--runs", type=int, default=5,
+  help="Number of timed runs of each measurement (default: %(default)s)"
+)
+parser.add_argument("--ssh-latency", type=float, dest="ssh_latency",
+  default=0.02,
+  help="Seconds taken by the fake SSH executor per command "
+    "(default: %(default)s)"
+)
+parser.add_argument("--docker-latency", type=float, dest="docker_latency",
+  default=0.05,
+  help="Extra seconds taken by each `start-storm.sh` command "
+    "(default: %(default)s)"
+)
+parser.add_argument("--pool-size", type=int, dest="pool_size",
+  default=rollout.DEFAULT_POOL_SIZE,
+  help="Maximum number of hosts worked on concurrently during the rollout "
+    "(default: %(default)s)"
+)
+parser.add_argument("--output",
+  help="File to also write the results to"
+)
+
+# Number of Zookeeper servers of the synthetic files
+ZOOKEEPER_SERVERS = 3
+
+class FakeSSHExecutor(object):
+  """Executor (see `rollout.py`) which only records the commands it is given,
+  taking a fixed time for each."""
+  def __init__(self, sshLatency, dockerLatency):
+    self.sshLatency = sshLatency
+    self.dockerLatency = dockerLatency
+    self.commands = []
+    self._lock = threading.Lock()
+
+  def run(self, host, command):
+    with self._lock:
+      self.commands.append((host, command))
+    delay = self.sshLatency
+    if "start-storm.sh" in command:
+      delay += self.dockerLatency
+    time.sleep(delay)
+    return ""
+
+def synthetic_config(baseConfig, serverCount):
+  """Returns a copy of `baseConfig` with `serverCount` servers."""
+  config = dict(baseConfig)
+  hosts = ["server-{}".format(idx) for idx in range(serverCount)]
+  config["servers"] = dict((host, "10.{}.{}.{}".format(idx // 65536,
+    idx // 256 % 256, idx % 256 + 1)) for idx, host in enumerate(hosts)
+  )
+  config["is_localhost_setup"] = False
+  zookeeperCount = min(ZOOKEEPER_SERVERS, serverCount)
+  config["storm.yaml"] = dict(config.get("storm.yaml") or {})
+  config["storm.yaml"]["storm.zookeeper.servers"] = hosts[:zookeeperCount]
+  config["storm.yaml"]["nimbus.host"] = hosts[0]
+  config["storm.supervisor.hosts"] = hosts[zookeeperCount:] or hosts[-1:]
+  zookeeperSetup = dict(config.get("zookeeper.multiple.setup") or {})
+  zookeeperSetup.pop("observers", None)
+  config["zookeeper.multiple.setup"] = zookeeperSetup
+  return config
+
+def _time(fn, runs):
+  """Runs `fn` `runs` times.
+
+  Returns:
+    dict: timings of the runs, in ms
+  """
+  timings = []
+  for _ in range(runs):
+    start = time.time()
+    fn()
+    timings.append((time.time() - start) * 1000.0)
+  timings.sort()
+  return {
+    "runs": runs,
+    "min_ms": timings[0],
+    "median_ms": timings[len(timings) // 2],
+  }
+
+def _load_uncached(path):
+  with open(path, "rb") as f:
+    data = f.read()
+  return cluster_model.ClusterModel(cluster_model.parse_storm_setup_yaml(data),
+    "benchmark"
+  )
+
+def _load_from_disk_cache(path):
+  # As in a new process
+  cluster_model._loadedModels.clear()
+  return cluster_model.load_cluster_model(path)
+
+def _component_lists(model, host):
+  """Returns the `--storm-docker-component` lists of the containers started
+  on `host`."""
+  componentLists = []
+  if host in model.zookeeperHosts:
+    componentLists.append(["zookeeper"])
+  if host == model.nimbusHost:
+    componentLists.extend([["nimbus", "drpc"], ["ui"]])
+  if host in model.supervisorHosts:
+    componentLists.append(["supervisor", "logviewer"])
+  return componentLists
+
+def _generate_port_args(model):
+  for host in model.hostIps:
+    for components in _component_lists(model, host):
+      if "supervisor" not in components:
+        docker_run.construct_docker_run_port_args(components)
+        continue
+      # One set of arguments per supervisor container of the host
+      for container in supervisor_containers.plan_containers(model.config,
+          host, slot_planner.plan_slots(model, host, (8, 16384)).ports):
+        docker_run.construct_docker_run_port_args(components, {
+          docker_run.SUPERVISOR_SLOTS_PORTS_STR: container.ports,
+        }, container.portShift)
+
+def _resolve_hosts(model):
+  for ipAddress in model.ipHosts:
+    model.hosts_with_ips([ipAddress])
+    slot_planner.supervisor_host(model, [ipAddress])
+
+def _rollout(path, args):
+  """Runs `scripts/remote.py --all --no-wait` against a fake SSH executor.
+
+  Returns:
+    dict: startup and wall times of the rollout
+  """
+  executor = FakeSSHExecutor(args.ssh_latency, args.docker_latency)
+  start = time.time()
+  model = _load_from_disk_cache(path)
+  conflicts = port_planner.plan_cluster(model).conflicts
+  waves = rollout.plan_waves(model.config, zookeeper=True, nimbus=True,
+    ui=True, supervisor=True
+  )
+  startupTime = time.time() - start
+  report = rollout.run_waves(waves, executor, poolSize=args.pool_size)
+  wallTime = time.time() - start
+  if conflicts or not report.succeeded:
+    raise RuntimeError("rollout of {} failed".format(path))
+  # Time the rollout would take with no overhead: each wave takes as long as
+  # its slowest round of `pool_size` hosts
+  idealTime = 0.0
+  for wave in waves:
+    rounds = -(-len(wave.tasks()) // max(1, args.pool_size))
+    idealTime += rounds * (2 * args.ssh_latency + args.docker_latency)
+  return {
+    "waves": len(waves),
+    "tasks": len(report.results),
+    "commands": len(executor.commands),
+    "startup_ms": startupTime * 1000.0,
+    "wall_s": wallTime,
+    "ideal_s": idealTime,
+    "overhead_s": wallTime - idealTime,
+  }
+
+def _benchmark(path, args):
+  runs = args.runs
+  cluster_model.DEFAULT_STORM_SETUP_YAML = path
+  results = {
+    "parse": {
+      "uncached": _time(lambda: _load_uncached(path), runs),
+      "disk_cache": _time(lambda: _load_from_disk_cache(path), runs),
+      "process_cache": _time(docker_run.get_storm_config, runs),
+    },
+  }
+  model = docker_run.get_cluster_model()
+  results["port_args"] = {
+    "containers": sum(len(_component_lists(model, host))
+      for host in model.hostIps
+    ),
+    "all_hosts": _time(lambda: _generate_port_args(model), runs),
+    "port_check": _time(lambda: port_planner.plan_cluster(model), runs),
+  }
+  results["ip_discovery"] = {
+    "get_ipv4_addresses": _time(docker_run.get_ipv4_addresses, runs),
+    "resolve_all_hosts": _time(lambda: _resolve_hosts(model), runs),
+  }
+  results["rollout"] = _rollout(path, args)
+  return results
+
+def _main():
+  args = parser.parse_args()
+  with open(args.storm_setup_yaml) as f:
+    baseConfig = yaml.safe_load(f)
+  tmpDir = tempfile.mkdtemp(prefix="storm-docker-benchmark-")
+  # Keep the user's cache of compiled models out of the measurements
+  os.environ["STORM_DOCKER_CACHE_DIR"] = os.path.join(tmpDir, "cache")
+  results = {
+    "python": platform.python_version(),
+    "settings": {
+      "runs": args.runs,
+      "ssh_latency_s": args.ssh_latency,
+      "docker_latency_s": args.docker_latency,
+      "pool_size": args.pool_size,
+    },
+    "servers": {},
+  }
+  try:
+    for serverCount in args.servers or [5, 100, 1000]:
+      path = os.path.join(tmpDir, "storm-setup-{}.yaml".format(serverCount))
+      with open(path, "w") as f:
+        yaml.safe_dump(synthetic_config(baseConfig, serverCount), f)
+      results["servers"][str(serverCount)] = _benchmark(path, args)
+  finally:
+    shutil.rmtree(tmpDir)
+  output = json.dumps(results, indent=2, sort_keys=True)
+  if args.output:
+    with open(args.output, "w") as f:
+      f.write(output + "\n")
+  print(output)
+
+if __name__ == "__main__":
+  _main()
@@ -0,0 +1,111 @@
+# Counts the `docker run` port arguments generated for a supervisor with large
+# numbers of worker slots, with one flag per port (as storm-docker used to)
+# and with contiguous ports coalesced into ranges (as
+# `docker_run.construct_docker_run_port_args` now does).
+#
+# For each slot count, it reports:
+#
+#   - the number of `-p` / `--expose` flags and the length of the arguments
+#   - the time taken to translate them into a Docker Engine API payload
+#   - the number of docker-proxy processes the Docker daemon starts for the
+#     container. With the userland proxy enabled (Docker's default), there is
+#     one per published host port and protocol, whether the ports were given
+#     one by one or as a range; only `network_mode: host` (or running the
+#     daemon with `--userland-proxy=false`) gets rid of them.
+#
+# Run from the top of the storm-docker repository:
+#
+#     python scripts/benchmark_port_args.py --slots 4 --slots 100 --slots 500
+#
+# Results are printed as a single JSON object.
+
+from __future__ import print_function
+
+import argparse
+import json
+import os.path
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+  ".."
+))
+
+from docker_python_helpers import cluster_model
+from docker_python_helpers import docker_api
+from docker_python_helpers import docker_run
+
+parser = argparse.ArgumentParser(
+  description="Counts the `docker run` port arguments generated for large "
+    "numbers of supervisor worker slots"
+)
+parser.add_argument("--slots", type=int, action="append", dest="slots",
+  help="Number of worker slots; can be given several times "
+    "(default: 4, 32, 128 and 512)"
+)
+parser.add_argument("--storm-setup-yaml", dest="storm_setup_yaml",
+  default=os.path.join("config", "storm-setup.yaml.sample"),
+  help="storm-setup.yaml file to read the other ports from "
+    "(default: %(default)s)"
+)
+parser.add_argument("--runs", type=int, default=20,
+  help="Number of timed payload translations (default: %(default)s)"
+)
+
+def _per_port_args(stormComponentList, portOverrides):
+  """Port arguments with one flag per port, as generated before ports were
+  coalesced into ranges."""
+  forwardArgs = []
+  exposeArgs = []
+  componentPorts = docker_run.get_cluster_model().componentPorts
+  for stormComponent in stormComponentList:
+    for portKeyString, portList, needsUDP in componentPorts[stormComponent]:
+      portList = portOverrides.get(portKeyString, portList)
+      for portNum in portList:
+        forwardArgs.append("-p {}:{}".format(portNum, portNum))
+        if needsUDP:
+          forwardArgs.append("-p {}:{}/udp".format(portNum, portNum))
+        exposeArgs.append("--expose {}".format(portNum))
+  return forwardArgs + exposeArgs
+
+def _measure(portArgs, runs):
+  argv = " ".join(portArgs).split() + ["viki_data/storm-supervisor"]
+  start = time.time()
+  for _ in range(runs):
+    _, config = docker_api.parse_docker_run_args(argv)
+  elapsed = (time.time() - start) / runs
+  portBindings = config["HostConfig"]["PortBindings"]
+  return {
+    "publish_flags": sum(1 for arg in portArgs if arg.startswith("-p ")),
+    "expose_flags": sum(1 for arg in portArgs if arg.startswith("--expose ")),
+    "argument_bytes": len(" ".join(portArgs)),
+    "payload_translation_ms": elapsed * 1000.0,
+    "docker_proxy_processes": sum(len(bindings)
+      for bindings in portBindings.values()
+    ),
+  }
+
+def _main():
+  args = parser.parse_args()
+  cluster_model.DEFAULT_STORM_SETUP_YAML = args.storm_setup_yaml
+  firstPort = docker_run.get_cluster_model().ports("supervisor")[0]
+  results = {}
+  for slots in args.slots or [4, 32, 128, 512]:
+    portOverrides = {
+      docker_run.SUPERVISOR_SLOTS_PORTS_STR:
+        list(range(firstPort, firstPort + slots)),
+    }
+    components = ["supervisor", "logviewer"]
+    results[str(slots)] = {
+      "per_port": _measure(_per_port_args(components, portOverrides),
+        args.runs
+      ),
+      "ranges": _measure(
+        docker_run.construct_docker_run_port_args(components, portOverrides),
+        args.runs
+      ),
+    }
+  print(json.dumps(results, indent=2, sort_keys=True))
+
+if __name__ == "__main__":
+  _main()
@@ -0,0 +1,84 @@
+# Compares the startup overhead of the `scripts/run-*.sh` wrappers' virtualenv
+# and `pip install` bootstrap with that of the installed `storm-docker` entry
+# point.
+#
+# Both variants end by running `storm-docker --help`, which does not touch
+# Docker, so the difference between them is the cost of bootstrapping alone.
+#
+# Run from the top of the storm-docker repository:
+#
+#     python scripts/benchmark_startup.py --runs 10
+#
+# Results are printed as a single JSON object.
+
+from __future__ import print_function
+
+import argparse
+import json
+import os.path
+import subprocess
+import sys
+import time
+
+# Bootstrap performed by every `scripts/run-*.sh` wrapper before the helper
+# itself is run
+LEGACY_COMMAND = """
+if ! [ -d venv ]; then virtualenv venv; fi
+. venv/bin/activate && \
+  pip install -q -r requirements.txt && \
+  python -m docker_python_helpers.cli --help && \
+  deactivate
+"""
+
+parser = argparse.ArgumentParser(
+  description="Compares the startup overhead of the `scripts/run-*.sh` wrappers "
+    "with that of the installed `storm-docker` entry point"
+)
+parser.add_argument("--runs", type=int, default=5,
+  help="Number of timed runs for each variant (default: %(default)s)"
+)
+
+def _entry_point_command():
+  """Returns the command running the installed entry point, falling back to
+  `python -m` if `storm-docker` is not on the PATH."""
+  for directory in os.environ.get("PATH", "").split(os.pathsep):
+    candidate = os.path.join(directory, "storm-docker")
+    if os.access(candidate, os.X_OK):
+      return [candidate, "--help"]
+  return [sys.executable, "-m", "docker_python_helpers.cli", "--help"]
+
+def _time_command(command, runs, shell=False):
+  timings = []
+  with open(os.devnull, "w") as devnull:
+    for _ in range(runs):
+      start = time.time()
+      returncode = subprocess.call(command, shell=shell, stdout=devnull,
+        stderr=devnull, executable="/bin/bash" if shell else None
+      )
+      timings.append(time.time() - start)
+      if returncode != 0:
+        raise RuntimeError("{!r} exited with status {}".format(
+          command, returncode
+        ))
+  timings.sort()
+  return {
+    "runs": runs,
+    "min_s": timings[0],
+    "median_s": timings[len(timings) // 2],
+    "mean_s": sum(timings) / len(timings),
+  }
+
+def _main():
+  args = parser.parse_args()
+  entryPointCommand = _entry_point_command()
+  results = {
+    "legacy_wrapper": _time_command(LEGACY_COMMAND, args.runs, shell=True),
+    "entry_point": _time_command(entryPointCommand, args.runs),
+    "entry_point_command": " ".join(entryPointCommand),
+  }
+  results["speedup_median"] = results["legacy_wrapper"]["median_s"] / \
+    max(results["entry_point"]["median_s"], 1e-9)
+  print(json.dumps(results, indent=2, sort_keys=True))
+
+if __name__ == "__main__":
+  _main()
@@ -0,0 +1,161 @@
+# Benchmarks the Zookeeper ambassador (`zk-ambassador/zk_ambassador.py`)
+# against a local Zookeeper stand-in.
+#
+# The stand-in answers length-prefixed request frames (like Zookeeper's wire
+# protocol) with a response frame of the same size. Clients send requests on
+# concurrent connections:
+#
+#   - directly to the stand-in
+#   - through the relay
+#   - through the relay, with the first upstream down (failover)
+#
+# and the round-trip latencies and throughput of each scenario are printed as a
+# single JSON object, along with the relay's own connection metrics.
+#
+# Requires Python 3.5 or later. Run from the top of the storm-docker
+# repository:
+#
+#     python3 scripts/benchmark_zk_ambassador.py --connections 32 --requests 500
+
+from __future__ import print_function
+
+import argparse
+import asyncio
+import json
+import os.path
+import socket
+import struct
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+  "..", "zk-ambassador"
+))
+
+import zk_ambassador
+
+parser = argparse.ArgumentParser(
+  description="Benchmarks the Zookeeper ambassador against a local Zookeeper "
+    "stand-in"
+)
+parser.add_argument("--connections", type=int, default=16,
+  help="Number of concurrent client connections (default: %(default)s)"
+)
+parser.add_argument("--requests", type=int, default=200,
+  help="Requests sent on each connection (default: %(default)s)"
+)
+parser.add_argument("--payload-size", type=int, default=128,
+  help="Size of each request and response in bytes (default: %(default)s)"
+)
+
+async def _stand_in_handler(reader, writer):
+  """Answers each length-prefixed frame with a frame of the same size."""
+  try:
+    while True:
+      header = await reader.readexactly(4)
+      length, = struct.unpack(">i", header)
+      await reader.readexactly(length)
+      writer.write(header + b"r" * length)
+      await writer.drain()
+  except (asyncio.IncompleteReadError, OSError):
+    pass
+  finally:
+    writer.close()
+
+def _free_port():
+  sock = socket.socket()
+  sock.bind(("127.0.0.1", 0))
+  port = sock.getsockname()[1]
+  sock.close()
+  return port
+
+class _ServerThread(threading.Thread):
+  """Runs the stand-in and the relays on their own event loop, so that they
+  do not share a thread with the benchmark clients."""
+  def __init__(self):
+    threading.Thread.__init__(self)
+    self.daemon = True
+    self.loop = asyncio.new_event_loop()
+    self.metrics = zk_ambassador.Metrics()
+    self.standInPort = _free_port()
+    self.relayPort = _free_port()
+    self.failoverRelayPort = _free_port()
+    # Nothing listens on this port
+    self.deadPort = _free_port()
+    self.ready = threading.Event()
+
+  def run(self):
+    asyncio.set_event_loop(self.loop)
+    self.loop.run_until_complete(asyncio.start_server(_stand_in_handler,
+      "127.0.0.1", self.standInPort
+    ))
+    zk_ambassador.start_relays(self.loop, {
+      self.relayPort: [("127.0.0.1", self.standInPort)],
+      self.failoverRelayPort: [("127.0.0.1", self.deadPort),
+        ("127.0.0.1", self.standInPort)],
+    }, self.metrics, host="127.0.0.1", log=None)
+    self.ready.set()
+    self.loop.run_forever()
+
+async def _client(port, requests, payload, latencies):
+  reader, writer = await asyncio.open_connection("127.0.0.1", port)
+  frame = struct.pack(">i", len(payload)) + payload
+  for _ in range(requests):
+    start = time.time()
+    writer.write(frame)
+    await writer.drain()
+    await reader.readexactly(len(frame))
+    latencies.append(time.time() - start)
+  writer.close()
+
+def _percentile(sortedValues, fraction):
+  return sortedValues[min(len(sortedValues) - 1,
+    int(fraction * len(sortedValues))
+  )]
+
+def _run_scenario(loop, port, args):
+  latencies = []
+  payload = b"q" * args.payload_size
+  start = time.time()
+  loop.run_until_complete(asyncio.gather(*[
+    _client(port, args.requests, payload, latencies)
+    for _ in range(args.connections)
+  ]))
+  elapsed = time.time() - start
+  latencies.sort()
+  return {
+    "requests": len(latencies),
+    "elapsed_s": elapsed,
+    "requests_per_s": len(latencies) / elapsed,
+    "latency_p50_ms": _percentile(latencies, 0.5) * 1000.0,
+    "latency_p99_ms": _percentile(latencies, 0.99) * 1000.0,
+  }
+
+def _main():
+  args = parser.parse_args()
+  servers = _ServerThread()
+  servers.start()
+  servers.ready.wait()
+
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  results = {
+    "connections": args.connections,
+    "requests_per_connection": args.requests,
+    "payload_size": args.payload_size,
+    "direct": _run_scenario(loop, servers.standInPort, args),
+    "relay": _run_scenario(loop, servers.relayPort, args),
+    "relay_failover": _run_scenario(loop, servers.failoverRelayPort, args),
+  }
+  results["relay_overhead_p50_ms"] = results["relay"]["latency_p50_ms"] - \
+    results["direct"]["latency_p50_ms"]
+  # Let the relay account for the connections closed by the clients
+  time.sleep(0.2)
+  results["relay_metrics"] = dict(
+    (port, totals) for port, totals in servers.metrics.snapshot()["ports"].items()
+  )
+  print(json.dumps(results, indent=2, sort_keys=True))
+
+if __name__ == "__main__":
+  _main()
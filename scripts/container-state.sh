@@ -0,0 +1,75 @@
+# Sourced by `start-storm.sh` and `destroy-storm.sh`.
+#
+# Lists the Docker containers of this machine with a single `docker ps` and
+# indexes them by exact name and image, so that checking whether a container
+# is running or exists does not run a `docker ps` pipeline each time.
+
+declare -A EXISTING_CONTAINERS
+declare -A RUNNING_CONTAINERS
+declare -A RUNNING_IMAGES
+
+function load_container_state {
+  EXISTING_CONTAINERS=()
+  RUNNING_CONTAINERS=()
+  RUNNING_IMAGES=()
+  local listing names image status name candidate
+  # `.Status` ("Up 2 hours", "Exited (0) ...") rather than `.State`, which
+  # older Docker versions do not have
+  if ! listing=$(docker ps -a --format '{{.Names}} {{.Image}} {{.Status}}')
+  then
+    echo "Could not list the Docker containers of this machine" 1>&2
+    exit 1
+  fi
+  while read -r names image status
+  do
+    if [ -z "$image" ]
+    then
+      continue
+    fi
+    # Older Docker versions also list a linked container under the
+    # `<linking container>/<alias>` names of its links
+    name=
+    for candidate in ${names//,/ }
+    do
+      if [[ $candidate != */* ]]
+      then
+        name=$candidate
+      fi
+    done
+    if [ -z "$name" ]
+    then
+      continue
+    fi
+    EXISTING_CONTAINERS[$name]=1
+    if [[ $status == Up* ]]
+    then
+      RUNNING_CONTAINERS[$name]=1
+      # Images are referred to without their `:latest` tag
+      RUNNING_IMAGES[${image%:latest}]=1
+    fi
+  done <<< "$listing"
+}
+
+# Checks if a running container is named exactly $1, or was created from the
+# image $1
+function is_docker_container_running {
+  [ -n "${RUNNING_CONTAINERS[$1]}" ] || [ -n "${RUNNING_IMAGES[$1]}" ]
+}
+
+# Checks if a container (running or not) is named exactly $1
+function docker_container_exists {
+  [ -n "${EXISTING_CONTAINERS[$1]}" ]
+}
+
+# Prints the names of the existing containers (running or not) matching the
+# extended regular expression $1
+function docker_container_names_matching {
+  local name
+  for name in "${!EXISTING_CONTAINERS[@]}"
+  do
+    if [[ $name =~ $1 ]]
+    then
+      echo "$name"
+    fi
+  done | sort
+}
@@ -1,12 +1,19 @@
 from __future__ import print_function
-from fabric.api import run, env, execute, task
-from fabric.context_managers import cd
 
 import argparse
 import os.path
 import sys
+import time
 
-import yaml
+# This script is run as `python scripts/remote.py` from the top of the
+# storm-docker repository; make the `docker_python_helpers` package importable.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docker_python_helpers import cluster_model
+from docker_python_helpers import port_planner
+from docker_python_helpers import readiness
+from docker_python_helpers import rollout
+from docker_python_helpers import timeline
 
 parser = argparse.ArgumentParser(
   description="Remotely run the various Docker images in storm-docker"
@@ -26,89 +33,153 @@ parser.add_argument("--ui", action="store_true",
 parser.add_argument("--all", action="store_true", dest="all",
   help="Run all available Docker images"
 )
+parser.add_argument("--reconcile", action="store_true", dest="reconcile",
+  help=("Only restart the containers whose image, ports, links, hostname or "
+    "configuration changed, instead of destroying and re-running every "
+    "container")
+)
+parser.add_argument("--plan", action="store_true", dest="plan",
+  help="Print what `--reconcile` would do on each host without doing it"
+)
+parser.add_argument("--no-wait", action="store_true", dest="no_wait",
+  help=("Start each wave as soon as the previous one was started, without "
+    "waiting for Zookeeper to elect a leader or for the Nimbus and UI ports "
+    "to accept connections")
+)
+parser.add_argument("--ready-timeout", type=float, dest="ready_timeout",
+  default=readiness.DEFAULT_TIMEOUT,
+  help="Seconds to wait for the components of a wave to be ready "
+    "(default: %(default)s)"
+)
+parser.add_argument("--rolling", action="store_true", dest="rolling",
+  help=("Restart the supervisors in batches of `--max-unavailable` hosts, "
+    "waiting for every supervisor container of each batch (`supervisor`, or "
+    "`supervisor-0`, `supervisor-1`, ...) to register again in Zookeeper "
+    "before the next")
+)
+parser.add_argument("--max-unavailable", dest="max_unavailable", default="1",
+  help=("Number of supervisors restarted at once by `--rolling`, or a "
+    "percentage of them such as 25%% (default: %(default)s)")
+)
+parser.add_argument("--zookeeper-address", action="append",
+  dest="zookeeper_addresses", metavar="HOST:PORT",
+  help=("Zookeeper server to check the registrations of `--rolling` on, "
+    "instead of those of `config/storm-setup.yaml`; can be given several times")
+)
+parser.add_argument("--pool-size", type=int, dest="pool_size",
+  default=rollout.DEFAULT_POOL_SIZE,
+  help="Maximum number of hosts to work on concurrently (default: %(default)s)"
+)
+parser.add_argument("--skip-port-check", action="store_true",
+  dest="skip_port_check",
+  help=("Start containers even if components of a machine use the same port "
+    "(see `scripts/verify_storm_setup_yaml.py`)")
+)
+parser.add_argument("--timeline", metavar="FILE",
+  help=("Collect the timing spans of every host and container into FILE (JSON "
+    "lines), and print the critical path of the rollout")
+)
 
-# Use settings in SSH config file
-env.use_ssh_config = True
-
-def _zk_and_nimbus_on_same_host(d):
-  """Checks if the Nimbus Docker container runs on the same physical machine
-  as some host that any Zookeeper Docker container runs on.
+def _print_result(result, print_output=False):
+  if result.succeeded:
+    print("[{}] {}: ok ({:.1f}s)".format(
+      result.host, result.component, result.duration
+    ))
+    if print_output:
+      for line in result.output.splitlines():
+        print("[{}]   {}".format(result.host, line))
+  else:
+    print("[{}] {}: FAILED ({:.1f}s): {}".format(
+      result.host, result.component, result.duration, result.error
+    ), file=sys.stderr)
+    if result.output:
+      print(result.output.rstrip(), file=sys.stderr)
 
-  d(dict): dictionary loaded from `storm-setup.yaml` file
-  servers
-  """
-  servers = d["servers"]
-  zk_server_list = d["storm.yaml"]["storm.zookeeper.servers"]
-  zk_ip_addresses = [
-    servers[zk_server] for zk_server in
-      d["storm.yaml"]["storm.zookeeper.servers"]
-  ]
-  return servers[d["storm.yaml"]["nimbus.host"]] in zk_ip_addresses
+def _print_summary(report):
+  for wave_name, results in report.waves:
+    failed = [r for r in results if not r.succeeded]
+    print("wave `{}`: {} host(s), {} failed".format(
+      wave_name, len(results), len(failed)
+    ))
+  for wave_name in report.skippedWaves:
+    print("wave `{}`: skipped".format(wave_name), file=sys.stderr)
 
 def _main():
+  start_time = time.time()
   yaml_file_path = os.path.join("config", "storm-setup.yaml")
   if not os.path.exists(yaml_file_path):
     print("{} does not exist. Exiting.".format(yaml_file_path), file=sys.stderr)
     sys.exit(1)
-  with open(yaml_file_path, "r") as f:
-    d = yaml.load(f.read())
+  model = cluster_model.load_cluster_model(yaml_file_path)
+  d = model.config
 
   args = parser.parse_args()
   if args.all:
     args.zookeeper = args.nimbus = args.ui = args.supervisor = True
 
-  need_ambassador = False
-  if args.zookeeper or args.nimbus or args.ui:
-    need_ambassador = not _zk_and_nimbus_on_same_host(d)
+  if not args.skip_port_check:
+    conflicts = port_planner.plan_cluster(model).conflicts
+    for conflict in conflicts:
+      print("ERROR: {}".format(conflict), file=sys.stderr)
+    if conflicts:
+      print("{} port conflicts in {}; see "
+        "`scripts/verify_storm_setup_yaml.py`. Exiting.".format(
+        len(conflicts), yaml_file_path
+      ), file=sys.stderr)
+      sys.exit(1)
 
-  if args.zookeeper:
-    zk_server_list = d["storm.yaml"]["storm.zookeeper.servers"]
-    if need_ambassador:
-      # Launch ambassador along with zookeeper on the first zookeeper server
-      # listed in `storm.yaml -> storm.zookeeper.servers` if the user wants to
-      # run the Nimbus docker on a machine that is not running a Zookeeper server.
-      execute(
-        _run_docker_component, "zookeeper-with-ambassador",
-        hosts=zk_server_list[:1]
-      )
-      execute(_run_docker_component, "zookeeper", hosts=zk_server_list[1:])
-    else:
-      # Nimbus Docker is on running on the same physical machine as some
-      # Zookeeper docker. So we just run the Zookeeper docker(s) normally.
-      execute(_run_docker_component, "zookeeper", hosts=zk_server_list)
-  if args.nimbus:
-    if need_ambassador:
-      execute(
-        _run_docker_component, "nimbus-with-zookeeper-ambassador",
-        hosts=d["storm.yaml"]["nimbus.host"]
-      )
-    else:
-      execute(
-        _run_docker_component, "nimbus",
-        hosts=d["storm.yaml"]["nimbus.host"]
-      )
-  if args.ui:
-    if need_ambassador:
-      execute(
-        _run_docker_component, "ui-on-zk-ambassador-machine",
-        hosts=d["storm.yaml"]["nimbus.host"]
+  waves = rollout.plan_waves(d, zookeeper=args.zookeeper, nimbus=args.nimbus,
+    ui=args.ui, supervisor=args.supervisor
+  )
+  if not args.no_wait and not args.plan:
+    rollout.add_readiness_gates(waves, model, args.ready_timeout)
+  task = None
+  if args.reconcile or args.plan:
+    task = lambda executor, host, component: rollout.reconcile_component(
+      executor, host, component, dryRun=args.plan
+    )
+  if args.rolling:
+    waves = rollout.split_supervisor_batches(waves,
+      rollout.parse_max_unavailable(args.max_unavailable,
+        len(model.supervisorHosts)
       )
-    else:
-      execute(
-        _run_docker_component, "ui", hosts=d["storm.yaml"]["nimbus.host"]
+    )
+    if not args.no_wait and not args.plan:
+      zk_addresses = None
+      if args.zookeeper_addresses:
+        zk_addresses = [(address.rsplit(":", 1)[0],
+          int(address.rsplit(":", 1)[1])) for address in args.zookeeper_addresses
+        ]
+      task = rollout.rolling_restart_task(model, task, args.ready_timeout,
+        zk_addresses
       )
-  if args.supervisor:
-    execute(
-      _run_docker_component, "supervisor",
-      hosts=d["storm.supervisor.hosts"]
+  rollout_timeline = None
+  if args.timeline:
+    rollout_timeline = timeline.Timeline(start_time)
+    # Loading and checking `storm-setup.yaml`, and planning the waves
+    rollout_timeline.add({"span": "remote.startup", "start": start_time,
+      "end": time.time()
+    })
+    task = rollout_timeline.wrap_task(task or rollout.start_component)
+    rollout_timeline.wrap_gates(waves)
+  print_output = args.reconcile or args.plan or args.rolling
+  executor = rollout.SSHExecutor()
+  report = rollout.run_waves(waves, executor,
+    poolSize=args.pool_size, task=task,
+    onResult=lambda result: _print_result(result, print_output),
+    onGate=lambda wave_name, result: print("[{}] {}".format(wave_name, result))
+  )
+  _print_summary(report)
+  if rollout_timeline is not None:
+    rollout_timeline.collect_container_spans(executor, report, args.pool_size,
+      model
     )
-
-@task
-def _run_docker_component(component):
-  with cd("$HOME"):
-    with cd("storm-docker"):
-      run("./destroy-storm.sh {}".format(component), warn_only=True)
-      run("./start-storm.sh {}".format(component))
+    rollout_timeline.write(args.timeline)
+    for line in rollout_timeline.summary(report):
+      print(line)
+    print("timeline written to {}".format(args.timeline))
+  if not report.succeeded:
+    sys.exit(1)
 
 if __name__ == "__main__":
   _main()
@@ -0,0 +1,22 @@
+#!/bin/bash
+
+# Start of the `bootstrap` span (see `docker_python_helpers/timing.py`)
+export STORM_DOCKER_START_TIME=$(date +%s.%N)
+
+# Prefer the installed `storm-docker` entry point (see `setup.py`); it needs
+# neither a virtualenv activation nor a `pip install` on every run.
+if command -v storm-docker > /dev/null
+then
+  exec storm-docker reconcile "$@"
+fi
+
+if ! [ -d venv ]
+then
+  virtualenv venv
+fi
+
+. venv/bin/activate && \
+  pip install -r requirements.txt && \
+  python -m docker_python_helpers.reconcile \
+    docker_python_helpers/reconcile.py $@ && \
+  deactivate
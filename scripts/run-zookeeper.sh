@@ -1,5 +1,15 @@
 #!/bin/bash
 
+# Start of the `bootstrap` span (see `docker_python_helpers/timing.py`)
+export STORM_DOCKER_START_TIME=$(date +%s.%N)
+
+# Prefer the installed `storm-docker` entry point (see `setup.py`); it needs
+# neither a virtualenv activation nor a `pip install` on every run.
+if command -v storm-docker > /dev/null
+then
+  exec storm-docker zookeeper "$@"
+fi
+
 if ! [ -d venv ]
 then
   virtualenv venv
@@ -1,8 +1,29 @@
 from __future__ import print_function
 
+import argparse
 import os.path
+import sys
 
-import yaml
+# This script is run as `python scripts/verify_storm_setup_yaml.py` from the top
+# of the storm-docker repository; make the `docker_python_helpers` package
+# importable.
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from docker_python_helpers import cluster_model
+from docker_python_helpers import port_planner
+
+parser = argparse.ArgumentParser(
+  description="Checks config/storm-setup.yaml for unknown hosts, port "
+    "conflicts and oversubscribed machines"
+)
+parser.add_argument("--hosts", action="store_true",
+  help="Print what each machine runs"
+)
+parser.add_argument("--max-oversubscription", type=float,
+  dest="max_oversubscription",
+  help="Exit with an error if the cores or memory demand of a machine exceeds "
+    "this ratio of its resources (default: only warn)"
+)
 
 def _print_fatal_and_exit(msg):
   print("FATAL: {}".format(msg), file=sys.stderr)
@@ -11,15 +32,50 @@ def _print_fatal_and_exit(msg):
 def _print_warning(msg):
   print("WARNING: {}".format(msg))
 
+def _print_plan(model, args):
+  plan = port_planner.plan_cluster(model)
+  for warning in plan.warnings:
+    _print_warning(warning)
+  if args.hosts:
+    for ipAddress in sorted(plan.machines):
+      print(plan.machines[ipAddress])
+  for conflict in plan.conflicts:
+    print("ERROR: {}".format(conflict), file=sys.stderr)
+  oversubscribed = plan.oversubscribed()
+  for machine in oversubscribed:
+    _print_warning("{} ({}) is oversubscribed: {}".format(machine.ipAddress,
+      ", ".join(machine.hosts), ", ".join(
+        "{} {:g}/{:g} ({:.2f}x)".format(name, demand, available, ratio)
+        for name, demand, available, ratio in [
+          ("cores", machine.coresDemand, machine.cores, machine.coresRatio),
+          ("memory MB", machine.memoryDemandMb, machine.memoryMb,
+            machine.memoryRatio),
+        ] if ratio is not None and ratio > 1.0
+      )
+    ))
+  print("{} machines, {} ports, {} port conflicts, {} oversubscribed "
+    "machines".format(len(plan.machines),
+    sum(len(machine.ports) for machine in plan.machines.values()),
+    len(plan.conflicts), len(oversubscribed)
+  ))
+  if plan.conflicts:
+    _print_fatal_and_exit("{} port conflicts".format(len(plan.conflicts)))
+  if args.max_oversubscription is not None and \
+      plan.oversubscribed(args.max_oversubscription):
+    _print_fatal_and_exit("machines oversubscribed beyond {:g}x".format(
+      args.max_oversubscription
+    ))
+
 def _main():
+  args = parser.parse_args()
   d = None
   storm_yaml_path = os.path.join("config", "storm-setup.yaml")
   if not os.path.exists(storm_yaml_path):
-    print("Configuration file {} does not exist. Exiting.".format(
+    _print_fatal_and_exit("Configuration file {} does not exist.".format(
       storm_yaml_path
     ))
-  with open(storm_yaml_path, "r") as f:
-    d = yaml.load(f.read())
+  model = cluster_model.load_cluster_model(storm_yaml_path)
+  d = model.config
   if "servers" not in d:
     _print_fatal_and_exit("'servers' key not present")
   server_dict = d["servers"]
@@ -38,11 +94,24 @@ def _main():
           zk_server
         )
       )
+  zk_observers = (d.get("zookeeper.multiple.setup") or {}).get("observers") or []
+  for zk_observer in zk_observers:
+    if zk_observer not in storm_yaml_conf["storm.zookeeper.servers"]:
+      _print_warning(
+        "Zookeeper observer `{}` not found in 'storm.zookeeper.servers'".format(
+          zk_observer
+        )
+      )
+  if zk_observers and set(storm_yaml_conf["storm.zookeeper.servers"]) <= \
+      set(zk_observers):
+    _print_fatal_and_exit(
+      "Every server of 'storm.zookeeper.servers' is a Zookeeper observer"
+    )
   if storm_yaml_conf["nimbus.host"] not in server_dict:
     _print_warning("Host `{}` for 'nimbus.host' not found in 'servers'".format(
       storm_yaml_conf["nimbus.host"]
     ))
-  # TODO: Check for drpc server as well
+  _print_plan(model, args)
 
 if __name__ == "__main__":
   _main()
@@ -0,0 +1,315 @@
+# Local stand-in for a Zookeeper server, answering the requests of
+# `docker_python_helpers/zk_client.py` (exists, getData, getChildren, create,
+# delete and ping, with one-shot watches and ephemeral nodes) from an in-memory
+# tree of nodes. Used to try out the supervisor registration checks of
+# `scripts/remote.py --rolling` and the service registry of
+# `storm-supervisor/storm_service_registry.py` without a Storm cluster.
+#
+# The tree can be seeded from a JSON file mapping node paths to their data,
+# which is read again on every request, so that editing the file simulates
+# supervisors (un)registering. A `{"hostname": ...}` object stands for the
+# serialized registration of a supervisor:
+#
+#     {"/storm/supervisors/3f6c...": {"hostname": "server-four-supervisor"}}
+#
+# Parents of the listed nodes exist implicitly. Each node gets a new `czxid`
+# whenever it appears, like a re-created ephemeral node does. Nodes created by
+# clients are left alone by the file; ephemeral ones are deleted when the
+# connection of their session closes. Run from the top of the storm-docker
+# repository:
+#
+#     python scripts/zk_stand_in.py --port 2181 --tree /tmp/zk-tree.json
+#     python scripts/remote.py --supervisor --rolling \
+#       --zookeeper-address 127.0.0.1:2181
+#
+# The `ZookeeperStandIn` class can also be driven from Python.
+
+from __future__ import print_function
+
+import argparse
+import json
+import os.path
+import socket
+import struct
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+  ".."
+))
+
+from docker_python_helpers import readiness
+from docker_python_helpers import zk_client
+
+parser = argparse.ArgumentParser(
+  description="Serves a tree of nodes as a Zookeeper server"
+)
+parser.add_argument("--port", type=int, default=2181,
+  help="Port to listen on (default: %(default)s)"
+)
+parser.add_argument("--tree",
+  help="JSON file mapping node paths to their data"
+)
+
+class _Node(object):
+  def __init__(self, data, czxid, ephemeralOwner=0):
+    self.data = data
+    self.czxid = czxid
+    self.mzxid = czxid
+    self.version = 0
+    self.ephemeralOwner = ephemeralOwner
+
+class _Session(object):
+  """Connection of a client, which replies and watch events are sent on."""
+  def __init__(self, sock, sessionId):
+    self.conn = zk_client.ZookeeperClient([])
+    self.conn._sock = sock
+    self.sessionId = sessionId
+    self.sendLock = threading.Lock()
+
+  def send(self, payload):
+    with self.sendLock:
+      try:
+        self.conn._send_frame(payload)
+      except socket.error:
+        pass
+
+class ZookeeperStandIn(object):
+  """In-memory Zookeeper server."""
+  def __init__(self, host="127.0.0.1", port=0, treeFile=None):
+    self.treeFile = treeFile
+    self._lock = threading.RLock()
+    # path -> _Node
+    self._nodes = {"/": _Node(b"", 0)}
+    # Paths which came from `treeFile`
+    self._treePaths = set()
+    # path -> set of _Session, for data and child watches
+    self._dataWatches = {}
+    self._childWatches = {}
+    self._zxid = 0
+    self._nextSessionId = 0x1000
+    self._server = socket.socket()
+    self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    self._server.bind((host, port))
+    self._server.listen(16)
+    self.address = self._server.getsockname()
+
+  def set_node(self, path, data=b""):
+    """Creates or updates a node (and its missing parents)."""
+    if not isinstance(data, bytes):
+      data = data.encode("utf-8")
+    with self._lock:
+      self._set_node(path, data)
+
+  def _set_node(self, path, data, ephemeralOwner=0):
+    parent = _parent(path)
+    if parent not in self._nodes:
+      self._set_node(parent, b"")
+    node = self._nodes.get(path)
+    if node is None:
+      self._zxid += 1
+      self._nodes[path] = _Node(data, self._zxid, ephemeralOwner)
+      self._fire(self._dataWatches, path, zk_client.EVENT_NODE_CREATED)
+      self._fire(self._childWatches, parent,
+        zk_client.EVENT_NODE_CHILDREN_CHANGED
+      )
+    elif node.data != data:
+      self._zxid += 1
+      node.data = data
+      node.mzxid = self._zxid
+      node.version += 1
+      self._fire(self._dataWatches, path, zk_client.EVENT_NODE_DATA_CHANGED)
+
+  def delete_node(self, path):
+    """Deletes a node and its children."""
+    with self._lock:
+      for nodePath in sorted(self._nodes, reverse=True):
+        if nodePath == path or nodePath.startswith(path.rstrip("/") + "/"):
+          self._delete_node(nodePath)
+
+  def _delete_node(self, path):
+    del self._nodes[path]
+    self._treePaths.discard(path)
+    self._fire(self._dataWatches, path, zk_client.EVENT_NODE_DELETED)
+    self._fire(self._childWatches, path, zk_client.EVENT_NODE_DELETED)
+    self._fire(self._childWatches, _parent(path),
+      zk_client.EVENT_NODE_CHILDREN_CHANGED
+    )
+
+  def _fire(self, watches, path, eventType):
+    # Watches are one-shot
+    for session in watches.pop(path, ()):
+      session.send(struct.pack(">iqi", zk_client.WATCH_EVENT_XID, self._zxid,
+        zk_client.ERR_OK) + struct.pack(">ii", eventType,
+        zk_client.STATE_SYNC_CONNECTED) + zk_client._pack_string(path)
+      )
+
+  def _load_tree(self):
+    if self.treeFile is None:
+      return
+    try:
+      with open(self.treeFile) as f:
+        tree = json.load(f)
+    except (IOError, ValueError):
+      return
+    treePaths = set()
+    for path in tree:
+      while path != "/":
+        treePaths.add(path)
+        path = _parent(path)
+    with self._lock:
+      for path in sorted(self._treePaths - treePaths, reverse=True):
+        if path in self._nodes and not self._children(path):
+          self._delete_node(path)
+      for path, data in sorted(tree.items()):
+        if isinstance(data, dict):
+          data = readiness.serialized_hostname(data["hostname"])
+        data = data or b""
+        self._set_node(path, data if isinstance(data, bytes) else
+          data.encode("utf-8")
+        )
+      self._treePaths |= treePaths
+
+  def _stat(self, path, node):
+    children = self._children(path)
+    return struct.pack(">qqqqiiiqiiq", node.czxid, node.mzxid, 0, 0,
+      node.version, 0, 0, node.ephemeralOwner, len(node.data), len(children),
+      node.czxid
+    )
+
+  def _children(self, path):
+    prefix = path.rstrip("/") + "/"
+    return sorted(nodePath[len(prefix):] for nodePath in self._nodes
+      if nodePath.startswith(prefix) and "/" not in nodePath[len(prefix):]
+      and nodePath != prefix
+    )
+
+  def _answer(self, session, xid, opType, reader):
+    self._load_tree()
+    path = reader.string()
+    with self._lock:
+      node = self._nodes.get(path)
+      error = None
+      if opType == zk_client.OP_CREATE:
+        data = reader.buffer() or b""
+        aclCount, = reader.unpack(zk_client._INT)
+        for _ in range(max(0, aclCount)):
+          reader.unpack(zk_client._INT)
+          reader.string()
+          reader.string()
+        flags, = reader.unpack(zk_client._INT)
+        if node is not None:
+          error = zk_client.ERR_NODE_EXISTS
+        elif _parent(path) not in self._nodes:
+          error = zk_client.ERR_NO_NODE
+        else:
+          self._set_node(path, data, session.sessionId if
+            flags & zk_client.CREATE_EPHEMERAL else 0
+          )
+          return self._header(xid) + zk_client._pack_string(path)
+      elif node is None:
+        error = zk_client.ERR_NO_NODE
+        if opType == zk_client.OP_EXISTS and reader.unpack(_BOOL)[0]:
+          self._dataWatches.setdefault(path, set()).add(session)
+      elif opType == zk_client.OP_DELETE:
+        if self._children(path):
+          error = zk_client.ERR_NOT_EMPTY
+        else:
+          self._delete_node(path)
+          return self._header(xid)
+      if error is not None:
+        return struct.pack(">iqi", xid, self._zxid, error)
+
+      watch = reader.unpack(_BOOL)[0]
+      header = self._header(xid)
+      if opType == zk_client.OP_EXISTS:
+        if watch:
+          self._dataWatches.setdefault(path, set()).add(session)
+        return header + self._stat(path, node)
+      if opType == zk_client.OP_GET_DATA:
+        if watch:
+          self._dataWatches.setdefault(path, set()).add(session)
+        return header + zk_client._pack_buffer(node.data) + \
+          self._stat(path, node)
+      if watch:
+        self._childWatches.setdefault(path, set()).add(session)
+      children = self._children(path)
+      return header + struct.pack(">i", len(children)) + b"".join(
+        zk_client._pack_string(child) for child in children
+      )
+
+  def _header(self, xid):
+    return struct.pack(">iqi", xid, self._zxid, zk_client.ERR_OK)
+
+  def _end_session(self, session):
+    """Deletes the ephemeral nodes and the watches of a session."""
+    with self._lock:
+      for watches in (self._dataWatches, self._childWatches):
+        for sessions in watches.values():
+          sessions.discard(session)
+      for path in sorted(self._nodes, reverse=True):
+        node = self._nodes.get(path)
+        if node is not None and node.ephemeralOwner == session.sessionId:
+          self._delete_node(path)
+
+  def _handle(self, sock):
+    with self._lock:
+      self._nextSessionId += 1
+      session = _Session(sock, self._nextSessionId)
+    conn = session.conn
+    try:
+      conn._recv_frame()
+      session.send(struct.pack(">iiq", 0, 10000, session.sessionId) +
+        zk_client._pack_buffer(b"\x00" * 16)
+      )
+      while True:
+        reader = zk_client._Reader(conn._recv_frame())
+        xid, opType = reader.unpack(struct.Struct(">ii"))
+        if opType == zk_client.OP_CLOSE:
+          session.send(struct.pack(">iqi", xid, self._zxid, 0))
+          break
+        if opType == zk_client.OP_PING:
+          session.send(struct.pack(">iqi", xid, self._zxid, 0))
+          continue
+        session.send(self._answer(session, xid, opType, reader))
+    except (socket.error, struct.error):
+      pass
+    finally:
+      self._end_session(session)
+      sock.close()
+
+  def _accept_loop(self):
+    while True:
+      try:
+        sock, _ = self._server.accept()
+      except socket.error:
+        return
+      thread = threading.Thread(target=self._handle, args=(sock,))
+      thread.daemon = True
+      thread.start()
+
+  def start(self):
+    """Serves requests from a background thread."""
+    thread = threading.Thread(target=self._accept_loop)
+    thread.daemon = True
+    thread.start()
+    return self
+
+  def stop(self):
+    self._server.close()
+
+_BOOL = struct.Struct(">?")
+
+def _parent(path):
+  return os.path.dirname(path) or "/"
+
+def _main():
+  args = parser.parse_args()
+  standIn = ZookeeperStandIn("0.0.0.0", args.port, args.tree)
+  print("Serving {} on port {}".format(args.tree or "an empty tree",
+    standIn.address[1]
+  ))
+  standIn._accept_loop()
+
+if __name__ == "__main__":
+  _main()
@@ -0,0 +1,16 @@
+from setuptools import setup
+
+setup(
+  name="storm-docker",
+  version="0.1.0",
+  description="Helpers for running distributed Storm clusters in Docker",
+  url="https://github.com/viki-org/storm-docker",
+  license="Apache License 2.0",
+  packages=["docker_python_helpers"],
+  install_requires=["PyYAML"],
+  entry_points={
+    "console_scripts": [
+      "storm-docker = docker_python_helpers.cli:main",
+    ],
+  },
+)
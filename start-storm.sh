@@ -3,11 +3,9 @@
 # This is used to run a Docker container in this repository after you have
 # run the `make` command to build the Docker images.
 
-# Inspects the `IMAGE` column of the output of `docker ps` to see if the given
-# Docker container is running
-function is_docker_container_running {
-  docker ps | tail -n+2 | awk '{print $2}' | grep --quiet $1
-}
+# Provides `is_docker_container_running`, which checks the names and images of
+# the running containers listed once by `load_container_state`
+. scripts/container-state.sh
 
 # Starts a given storm-docker Docker container
 function start_storm_docker {
@@ -44,7 +42,7 @@ function start_storm_docker {
     then
       echo "storm nimbus Docker container already running"
       scripts/run-storm-nimbus.sh \
-        --name zk_ambassador -h zk_ambassador -d svendowideit/ambassador
+        --name zk_ambassador -h zk_ambassador -d viki_data/zk-ambassador
     elif is_docker_container_running "zk_ambassador"
     then
       echo "zookeeper ambassador Docker container already running"
@@ -58,7 +56,7 @@ function start_storm_docker {
         --storm-docker-component drpc
     else
       scripts/run-storm-nimbus.sh \
-        --name zk_ambassador -h zk_ambassador -d svendowideit/ambassador \
+        --name zk_ambassador -h zk_ambassador -d viki_data/zk-ambassador \
         --nimbus-args-after-this \
         --name nimbus \
         --link zk_ambassador:zk \
@@ -69,16 +67,13 @@ function start_storm_docker {
     fi
     ;;
   supervisor)
-    if is_docker_container_running "viki_data/storm-supervisor"
-    then
-      echo "storm supervisor Docker container already running"
-    else
-      scripts/run-storm-supervisor.sh \
-        --dns 127.0.0.1 --dns 8.8.8.8 --dns 8.8.4.4 \
-        -p 127.0.0.1:49022:22 \
-        --name supervisor \
-        -d viki_data/storm-supervisor
-    fi
+    # Starts the supervisor containers of this machine which are not running
+    # (`supervisor`, or `supervisor-0`, `supervisor-1`, ... with a
+    # `storm.supervisor.containers` section), naming them and publishing their
+    # SSH ports
+    scripts/run-storm-supervisor.sh \
+      --dns 127.0.0.1 --dns 8.8.8.8 --dns 8.8.4.4 \
+      -d viki_data/storm-supervisor
     ;;
   ui)
     if is_docker_container_running "viki_data/storm-ui"
@@ -130,7 +125,7 @@ function start_storm_docker {
       scripts/run-zookeeper.sh \
         --no-zookeeper \
         -- \
-        --link zookeeper:zk --name zk_ambassador -d svendowideit/ambassador
+        --link zookeeper:zk --name zk_ambassador -d viki_data/zk-ambassador
     elif is_docker_container_running "zk_ambassador"
     then
       scripts/run-zookeeper.sh \
@@ -145,7 +140,7 @@ function start_storm_docker {
         -d viki_data/zookeeper \
         --no-dash-p \
         -- \
-        --link zookeeper:zk --name zk_ambassador -d svendowideit/ambassador
+        --link zookeeper:zk --name zk_ambassador -d viki_data/zk-ambassador
     fi
     ;;
   *)
@@ -167,7 +162,7 @@ then
     "container AND a Zookeeper ambassador container. This is for a machine" \
     "which does NOT have a running Zookeeper container.\n"
   echo -e "    supervisor                          - Runs the supervisor" \
-    "container (components: Storm Supervisor, Storm Logviewer)\n"
+    "container(s) (components: Storm Supervisor, Storm Logviewer)\n"
   echo -e "    ui                                  - Runs the ui container." \
     "This option should be used on the same machine where the 'nimbus'" \
     "argument was used. (components: Storm UI)\n"
@@ -187,6 +182,7 @@ then
   echo ""
 elif [ "$1" = "all" ]
 then
+  load_container_state
   # No arguments supplied to this script; run every component
   start_storm_docker "zookeeper"
   start_storm_docker "nimbus"
@@ -195,6 +191,7 @@ then
 else
   # At least one argument was supplied to this script.
   # We start each Docker container in the arguments.
+  load_container_state
   for component in "$@"
   do
     start_storm_docker $component
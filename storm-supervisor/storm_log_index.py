@@ -0,0 +1,597 @@
+#!/usr/bin/env python
+
+# Indexes the Storm logs of a storm-supervisor container (the worker, supervisor
+# and logviewer logs under `/var/log/storm`, along with their rotated copies
+# `<log>.1` to `<log>.9`), and answers time range and keyword queries without
+# scanning every file:
+#
+#     storm-log-index.py search --since "2014-06-23 10:00" <keyword>...
+#     curl "http://<supervisor>:8001/search?q=<keyword>&since=2014-06-23+10:00"
+#
+# Each log file is cut into blocks of about `BLOCK_BYTES` (on line boundaries).
+# Its index records the time range of each block and, for every token (a run of
+# 3 to 64 letters, digits, `_` or `-`, case-insensitive) the blocks containing
+# it. A query only reads the blocks whose time range overlaps the requested one
+# and which contain every token of the keywords, through mmap.
+#
+# Indexes are incremental:
+#
+#   - a file is identified by its inode and its first bytes, so a rotation
+#     (which renames `<log>` to `<log>.1` and so on) keeps its index valid
+#   - the index of a file is made of segments of about `SEGMENT_BYTES`; only
+#     the last, unfinished segment of a growing file is indexed again, along
+#     with the bytes appended since
+#   - bytes not indexed yet (eg. lines written since the last update) are
+#     scanned directly
+#
+# Settings are read from the `storm.supervisor.logsearch` section of
+# `storm-setup.yaml`; see `config/storm-setup.yaml.sample`.
+
+from __future__ import print_function
+
+import argparse
+import calendar
+import fnmatch
+import glob
+import hashlib
+import heapq
+import mmap
+import os
+import os.path
+import re
+import shutil
+import struct
+import sys
+import threading
+import time
+import yaml
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from urlparse import parse_qs, urlparse
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from urllib.parse import parse_qs, urlparse
+
+# Section of `storm-setup.yaml` with the settings of this program
+LOGSEARCH_SECTION = "storm.supervisor.logsearch"
+
+DEFAULT_LOG_GLOB = "/var/log/storm/*.log*"
+DEFAULT_INDEX_DIR = "/mnt/storm/log-index"
+DEFAULT_PORT = 8001
+DEFAULT_INDEX_INTERVAL = 60
+DEFAULT_LIMIT = 1000
+
+BLOCK_BYTES = 64 * 1024
+SEGMENT_BYTES = 8 * 1024 * 1024
+
+# Files shorter than this are not indexed (but are still searched)
+FINGERPRINT_BYTES = 256
+
+SEGMENT_MAGIC = b"SLOGIX01"
+SEGMENT_HEADER = struct.Struct(">QQII")
+BLOCK_ENTRY = struct.Struct(">Qqq")
+TOKEN_ENTRY = struct.Struct(">IHII")
+LENGTH = struct.Struct(">I")
+
+MIN_TOKEN_LENGTH = 3
+MAX_TOKEN_LENGTH = 64
+TOKEN_REGEX = re.compile(br"[a-z0-9_\-]+")
+
+# Lines start with `%d{yyyy-MM-dd HH:mm:ss}` (see `config/cluster.xml`);
+# timestamps are taken as UTC
+TIMESTAMP_REGEX = re.compile(
+  br"^(\d{4}-\d{2}-\d{2} \d{2}:\d{2}):(\d{2})", re.MULTILINE
+)
+
+# No timestamp
+NO_TIME = -1
+
+_minuteCache = {}
+
+def _minute_epoch(minute):
+  epoch = _minuteCache.get(minute)
+  if epoch is None:
+    epoch = calendar.timegm(time.strptime(minute.decode("ascii"),
+      "%Y-%m-%d %H:%M"
+    ))
+    if len(_minuteCache) > 100000:
+      _minuteCache.clear()
+    _minuteCache[minute] = epoch
+  return epoch
+
+def _match_epoch(match):
+  return _minute_epoch(match.group(1)) + int(match.group(2))
+
+def parse_time(value):
+  """Parses `YYYY-MM-DD[ HH:MM[:SS]]` (UTC) or seconds since the epoch."""
+  value = value.strip()
+  if value.isdigit():
+    return int(value)
+  for timeFormat in ["%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d"]:
+    try:
+      return calendar.timegm(time.strptime(value, timeFormat))
+    except ValueError:
+      pass
+  raise ValueError("Unsupported time `{}`".format(value))
+
+def tokenize(data):
+  """Returns the set of tokens of `data` (bytes)."""
+  return set(token for token in TOKEN_REGEX.findall(data.lower())
+    if MIN_TOKEN_LENGTH <= len(token) <= MAX_TOKEN_LENGTH
+  )
+
+def _encode_varints(numbers):
+  out = bytearray()
+  previous = 0
+  for number in numbers:
+    delta = number - previous
+    previous = number
+    while delta >= 0x80:
+      out.append((delta & 0x7f) | 0x80)
+      delta >>= 7
+    out.append(delta)
+  return bytes(out)
+
+def _decode_varints(data):
+  numbers = []
+  current = shift = previous = 0
+  for byte in bytearray(data):
+    current |= (byte & 0x7f) << shift
+    if byte & 0x80:
+      shift += 7
+      continue
+    previous += current
+    numbers.append(previous)
+    current = shift = 0
+  return numbers
+
+def file_key(path):
+  """Returns the key identifying the contents of a log file across renames, or
+  None if the file is too short to be identified."""
+  with open(path, "rb") as f:
+    head = f.read(FINGERPRINT_BYTES)
+    if len(head) < FINGERPRINT_BYTES:
+      return None
+    return "{}-{}".format(os.fstat(f.fileno()).st_ino,
+      hashlib.sha1(head).hexdigest()[:16]
+    )
+
+def _blocks(data, start, end):
+  """Yields the (start, end) offsets of the blocks of data[start:end], cut
+  after a newline."""
+  while start < end:
+    blockEnd = min(start + BLOCK_BYTES, end)
+    if blockEnd < end:
+      newline = data.rfind(b"\n", start, blockEnd)
+      if newline < start:
+        newline = data.find(b"\n", blockEnd, end)
+      blockEnd = end if newline < 0 else newline + 1
+    yield start, blockEnd
+    start = blockEnd
+
+def build_segment(data, start, end):
+  """Indexes data[start:end] (ending on a line boundary).
+
+  Returns:
+    bytes: the segment
+  """
+  blocks = []
+  postings = {}
+  for blockIdx, (blockStart, blockEnd) in enumerate(_blocks(data, start, end)):
+    block = data[blockStart:blockEnd]
+    timestamps = TIMESTAMP_REGEX.findall(block)
+    if timestamps:
+      minTime = _minute_epoch(timestamps[0][0]) + int(timestamps[0][1])
+      maxTime = _minute_epoch(timestamps[-1][0]) + int(timestamps[-1][1])
+    else:
+      minTime = maxTime = NO_TIME
+    blocks.append((blockStart, minTime, maxTime))
+    for token in tokenize(block):
+      postings.setdefault(token, []).append(blockIdx)
+
+  tokens = sorted(postings)
+  strings = bytearray()
+  postingsBlob = bytearray()
+  directory = []
+  for token in tokens:
+    encoded = _encode_varints(postings[token])
+    directory.append(TOKEN_ENTRY.pack(len(strings), len(token),
+      len(postingsBlob), len(encoded)
+    ))
+    strings += token
+    postingsBlob += encoded
+  return b"".join([SEGMENT_MAGIC,
+    SEGMENT_HEADER.pack(start, end, len(blocks), len(tokens))] +
+    [BLOCK_ENTRY.pack(*block) for block in blocks] + directory +
+    [LENGTH.pack(len(strings)), bytes(strings), bytes(postingsBlob)]
+  )
+
+class Segment(object):
+  """A segment of the index of a log file, read through mmap."""
+  def __init__(self, path):
+    self.path = path
+    with open(path, "rb") as f:
+      self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    if self._mm[:len(SEGMENT_MAGIC)] != SEGMENT_MAGIC:
+      self.close()
+      raise ValueError("{} is not an index segment".format(path))
+    offset = len(SEGMENT_MAGIC)
+    self.start, self.end, self.blockCount, self.tokenCount = \
+      SEGMENT_HEADER.unpack_from(self._mm, offset)
+    self._blocksOffset = offset + SEGMENT_HEADER.size
+    self._directoryOffset = self._blocksOffset + \
+      self.blockCount * BLOCK_ENTRY.size
+    stringsLengthOffset = self._directoryOffset + \
+      self.tokenCount * TOKEN_ENTRY.size
+    stringsLength, = LENGTH.unpack_from(self._mm, stringsLengthOffset)
+    self._stringsOffset = stringsLengthOffset + LENGTH.size
+    self._postingsOffset = self._stringsOffset + stringsLength
+
+  def close(self):
+    self._mm.close()
+
+  def blocks(self):
+    """Returns the (start, end, min time, max time) of every block."""
+    entries = [BLOCK_ENTRY.unpack_from(self._mm,
+        self._blocksOffset + idx * BLOCK_ENTRY.size
+      ) for idx in range(self.blockCount)
+    ]
+    return [(blockStart, entries[idx + 1][0] if idx + 1 < len(entries) else
+        self.end, minTime, maxTime)
+      for idx, (blockStart, minTime, maxTime) in enumerate(entries)
+    ]
+
+  def _token(self, idx):
+    entry = TOKEN_ENTRY.unpack_from(self._mm,
+      self._directoryOffset + idx * TOKEN_ENTRY.size
+    )
+    stringOffset = self._stringsOffset + entry[0]
+    return self._mm[stringOffset:stringOffset + entry[1]], entry
+
+  def postings(self, token):
+    """Returns the set of indices of the blocks containing `token`."""
+    low, high = 0, self.tokenCount
+    while low < high:
+      middle = (low + high) // 2
+      candidate, entry = self._token(middle)
+      if candidate < token:
+        low = middle + 1
+      elif candidate > token:
+        high = middle
+      else:
+        postingsOffset = self._postingsOffset + entry[2]
+        return set(_decode_varints(
+          self._mm[postingsOffset:postingsOffset + entry[3]]
+        ))
+    return set()
+
+class LogIndex(object):
+  """Indexes of the log files matching a glob pattern."""
+  def __init__(self, logGlob=DEFAULT_LOG_GLOB, indexDir=DEFAULT_INDEX_DIR):
+    self.logGlob = logGlob
+    self.indexDir = indexDir
+
+  def log_files(self, fileGlob=None):
+    paths = glob.glob(self.logGlob)
+    if fileGlob:
+      paths = [path for path in paths
+        if fnmatch.fnmatch(os.path.basename(path), fileGlob)
+      ]
+    return sorted(path for path in paths if os.path.isfile(path))
+
+  def _segment_paths(self, key):
+    keyDir = os.path.join(self.indexDir, key)
+    if not os.path.isdir(keyDir):
+      return []
+    return sorted(os.path.join(keyDir, name) for name in os.listdir(keyDir)
+      if name.endswith(".seg")
+    )
+
+  def _segments(self, key):
+    """Returns the contiguous segments of `key` from offset 0, dropping any
+    others."""
+    segments = []
+    for segmentPath in self._segment_paths(key):
+      try:
+        segment = Segment(segmentPath)
+      except (ValueError, struct.error, EnvironmentError):
+        os.remove(segmentPath)
+        continue
+      if segment.start != (segments[-1].end if segments else 0):
+        segment.close()
+        os.remove(segmentPath)
+        continue
+      segments.append(segment)
+    return segments
+
+  def update_file(self, path):
+    """Brings the index of one log file up to date.
+
+    Returns:
+      int: number of bytes indexed
+    """
+    try:
+      key = file_key(path)
+      size = os.path.getsize(path)
+    except EnvironmentError:
+      return 0
+    if key is None:
+      return 0
+    segments = self._segments(key)
+    start = segments[-1].end if segments else 0
+    # The last segment is indexed again if it is unfinished and the file grew
+    if segments and segments[-1].end - segments[-1].start < SEGMENT_BYTES and \
+        size > segments[-1].end:
+      start = segments[-1].start
+      segments[-1].close()
+      os.remove(segments[-1].path)
+      segments.pop()
+    for segment in segments:
+      segment.close()
+    if size <= start:
+      return 0
+
+    keyDir = os.path.join(self.indexDir, key)
+    if not os.path.isdir(keyDir):
+      os.makedirs(keyDir)
+    indexed = 0
+    with open(path, "rb") as f:
+      data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+      try:
+        # Only complete lines are indexed
+        end = data.rfind(b"\n", start, size) + 1
+        while start < end:
+          segmentEnd = min(start + SEGMENT_BYTES, end)
+          if segmentEnd < end:
+            segmentEnd = data.find(b"\n", segmentEnd - 1, end) + 1 or end
+          segmentPath = os.path.join(keyDir, "{:016x}.seg".format(start))
+          with open(segmentPath + ".tmp", "wb") as out:
+            out.write(build_segment(data, start, segmentEnd))
+          os.rename(segmentPath + ".tmp", segmentPath)
+          indexed += segmentEnd - start
+          start = segmentEnd
+      finally:
+        data.close()
+    return indexed
+
+  def update(self):
+    """Brings the indexes of every log file up to date, and removes those of
+    the files which no longer exist.
+
+    Returns:
+      int: number of bytes indexed
+    """
+    indexed = 0
+    liveKeys = set()
+    for path in self.log_files():
+      indexed += self.update_file(path)
+      try:
+        liveKeys.add(file_key(path))
+      except EnvironmentError:
+        pass
+    if os.path.isdir(self.indexDir):
+      for key in os.listdir(self.indexDir):
+        if key not in liveKeys:
+          shutil.rmtree(os.path.join(self.indexDir, key), ignore_errors=True)
+    return indexed
+
+  def _candidate_blocks(self, key, size, since, until, tokens):
+    """Returns the (start, end, time of the line before) of the blocks of a
+    log file which may hold matching lines."""
+    candidates = []
+    indexedEnd = 0
+    previousTime = NO_TIME
+    segments = self._segments(key) if key is not None else []
+    try:
+      for segment in segments:
+        if segment.end > size:
+          break
+        matching = None
+        for token in tokens:
+          postings = segment.postings(token)
+          matching = postings if matching is None else matching & postings
+        for idx, (blockStart, blockEnd, minTime, maxTime) in \
+            enumerate(segment.blocks()):
+          # Lines without a timestamp carry the time of the line before
+          lowTime = minTime if minTime != NO_TIME else previousTime
+          highTime = maxTime if maxTime != NO_TIME else previousTime
+          inRange = highTime == NO_TIME or (
+            (since is None or highTime >= since) and
+            (until is None or lowTime == NO_TIME or lowTime <= until)
+          )
+          if inRange and (matching is None or idx in matching):
+            candidates.append((blockStart, blockEnd, previousTime))
+          if maxTime != NO_TIME:
+            previousTime = maxTime
+        indexedEnd = segment.end
+    finally:
+      for segment in segments:
+        segment.close()
+    if indexedEnd < size:
+      # Not indexed yet; scanned as a whole
+      candidates.append((indexedEnd, size, previousTime))
+    return candidates
+
+  def search(self, keywords=(), since=None, until=None, limit=DEFAULT_LIMIT,
+      fileGlob=None):
+    """Finds the log lines containing every keyword (case-insensitive, and
+    with its words matching whole tokens of the line) and timestamped within
+    [since, until].
+
+    Returns:
+      list of (time, path, offset, line): the `limit` earliest matches
+    """
+    keywords = [keyword.lower().encode("utf-8") for keyword in keywords]
+    tokens = set()
+    for keyword in keywords:
+      tokens.update(tokenize(keyword))
+    return heapq.nsmallest(limit, self._matches(keywords, tokens, since,
+      until, fileGlob
+    ))
+
+  def _matches(self, keywords, tokens, since, until, fileGlob):
+    for path in self.log_files(fileGlob):
+      try:
+        key = file_key(path)
+        f = open(path, "rb")
+      except EnvironmentError:
+        continue
+      with f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+          continue
+        data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+          for blockStart, blockEnd, lineTime in self._candidate_blocks(key,
+              size, since, until, tokens):
+            for match in _match_lines(data, blockStart, blockEnd, lineTime,
+                keywords, tokens, since, until):
+              yield (match[0], path) + match[1:]
+        finally:
+          data.close()
+
+def _match_lines(data, start, end, lineTime, keywords, tokens, since, until):
+  """Yields the (time, offset, line) of the matching lines of data[start:end].
+  """
+  block = data[start:end]
+  lowered = block.lower() if keywords else block
+  offset = 0
+  while offset < len(block):
+    lineEnd = block.find(b"\n", offset)
+    if lineEnd < 0:
+      lineEnd = len(block)
+    match = TIMESTAMP_REGEX.match(block, offset)
+    if match is not None:
+      lineTime = _match_epoch(match)
+    line = lowered[offset:lineEnd]
+    if (since is None or (lineTime != NO_TIME and lineTime >= since)) and \
+        (until is None or (lineTime != NO_TIME and lineTime <= until)) and \
+        all(keyword in line for keyword in keywords) and \
+        (not tokens or tokens <= tokenize(line)):
+      yield (lineTime, start + offset,
+        block[offset:lineEnd].decode("utf-8", "replace")
+      )
+    offset = lineEnd + 1
+
+def format_match(match):
+  _, path, offset, line = match
+  return "{}:{}: {}".format(os.path.basename(path), offset, line)
+
+def _make_handler(logIndex, lock):
+  class SearchHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      url = urlparse(self.path)
+      if url.path != "/search":
+        self.send_error(404)
+        return
+      query = parse_qs(url.query)
+      try:
+        since = parse_time(query["since"][0]) if "since" in query else None
+        until = parse_time(query["until"][0]) if "until" in query else None
+        limit = int(query.get("limit", [DEFAULT_LIMIT])[0])
+      except ValueError as e:
+        self.send_error(400, str(e))
+        return
+      with lock:
+        logIndex.update()
+        matches = logIndex.search(query.get("q", []), since, until, limit,
+          query.get("file", [None])[0]
+        )
+      body = "".join(format_match(match) + "\n" for match in matches)
+      body = body.encode("utf-8")
+      self.send_response(200)
+      self.send_header("Content-Type", "text/plain; charset=utf-8")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, *args):
+      pass
+  return SearchHandler
+
+def serve(logIndex, port, interval):
+  """Serves `/search` on `port`, and updates the index every `interval`
+  seconds."""
+  lock = threading.Lock()
+  server = HTTPServer(("0.0.0.0", port), _make_handler(logIndex, lock))
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  print("Serving searches of {} on port {}".format(logIndex.logGlob, port))
+  sys.stdout.flush()
+  while True:
+    with lock:
+      logIndex.update()
+    time.sleep(interval)
+
+def _logsearch_config():
+  stormSetupYaml = os.environ.get("STORM_SETUP_YAML")
+  if not stormSetupYaml or not os.path.exists(stormSetupYaml):
+    return {}
+  with open(stormSetupYaml) as f:
+    return (yaml.safe_load(f) or {}).get(LOGSEARCH_SECTION) or {}
+
+def main():
+  logsearchConfig = _logsearch_config()
+  parser = argparse.ArgumentParser(
+    description="Indexes and searches the Storm logs of this container"
+  )
+  parser.add_argument("--logs", default=DEFAULT_LOG_GLOB,
+    help="Glob pattern of the log files (default: %(default)s)"
+  )
+  parser.add_argument("--index-dir",
+    default=logsearchConfig.get("index.dir", DEFAULT_INDEX_DIR),
+    help="Directory of the indexes (default: %(default)s)"
+  )
+  subparsers = parser.add_subparsers(dest="command")
+  subparsers.add_parser("index", help="Update the indexes")
+  searchParser = subparsers.add_parser("search",
+    help="Print the lines containing every keyword"
+  )
+  searchParser.add_argument("keywords", nargs="*")
+  searchParser.add_argument("--since", type=parse_time,
+    help="Earliest time, as YYYY-MM-DD[ HH:MM[:SS]] (UTC) or epoch seconds"
+  )
+  searchParser.add_argument("--until", type=parse_time,
+    help="Latest time, in the format of --since"
+  )
+  searchParser.add_argument("--file",
+    help="Only search the log files whose name matches this glob pattern"
+  )
+  searchParser.add_argument("--limit", type=int, default=DEFAULT_LIMIT,
+    help="Print at most this many lines, earliest first (default: %(default)s)"
+  )
+  serveParser = subparsers.add_parser("serve",
+    help="Serve searches over HTTP at /search"
+  )
+  serveParser.add_argument("--port", type=int,
+    default=logsearchConfig.get("search.port", DEFAULT_PORT),
+    help="HTTP port (default: %(default)s)"
+  )
+  serveParser.add_argument("--interval", type=float,
+    default=logsearchConfig.get("index.interval.seconds",
+      DEFAULT_INDEX_INTERVAL
+    ),
+    help="Seconds between two index updates (default: %(default)s)"
+  )
+  args = parser.parse_args()
+
+  logIndex = LogIndex(args.logs, args.index_dir)
+  if args.command == "index":
+    start = time.time()
+    indexed = logIndex.update()
+    print("Indexed {} bytes in {:.2f}s".format(indexed, time.time() - start))
+  elif args.command == "search":
+    logIndex.update()
+    for match in logIndex.search(args.keywords, args.since, args.until,
+        args.limit, args.file):
+      print(format_match(match))
+  elif args.command == "serve":
+    serve(logIndex, args.port, args.interval)
+  else:
+    parser.print_help()
+    sys.exit(1)
+
+if __name__ == "__main__":
+  main()
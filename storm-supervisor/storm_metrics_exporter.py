@@ -0,0 +1,425 @@
+#!/usr/bin/env python
+
+# Follows the `metrics.log` file written by Storm's `LoggingMetricsConsumer`
+# (the `METRICS` appender of `config/cluster.xml`), aggregates the metrics of
+# every topology, component and task into rolling windows, and serves them over
+# HTTP in the Prometheus text format:
+#
+#     curl http://<supervisor>:9190/metrics
+#
+# The file is read incrementally: only the bytes appended since the last read
+# are parsed, and when logback rotates it (`metrics.log` -> `metrics.log.1`),
+# the rest of the old file is read before moving on to the new one.
+#
+# Memory is bounded: each series (one metric of one task, or one key of a map
+# metric) keeps one bucket of count / sum / min / max per `bucket.seconds` of
+# its longest window, and the least recently updated series are dropped beyond
+# `max.series`.
+#
+# Settings are read from the `storm.supervisor.metrics` section of
+# `storm-setup.yaml`; see `config/storm-setup.yaml.sample`.
+
+from __future__ import print_function
+
+import argparse
+import collections
+import os
+import re
+import sys
+import threading
+import time
+import yaml
+
+try:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+except ImportError:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+
+# Section of `storm-setup.yaml` with the settings of this program
+METRICS_SECTION = "storm.supervisor.metrics"
+
+DEFAULT_METRICS_LOG = "/var/log/storm/metrics.log"
+DEFAULT_PORT = 9190
+DEFAULT_WINDOWS = [60, 300, 900]
+DEFAULT_BUCKET_SECONDS = 10
+DEFAULT_MAX_SERIES = 10000
+
+# Seconds between two reads of the file once it has been read to the end
+POLL_INTERVAL = 1.0
+
+READ_SIZE = 65536
+
+# Longest partial line kept while waiting for the rest of it; longer lines are
+# dropped
+MAX_LINE_LENGTH = 65536
+
+# A line of the `METRICS` appender (`%d %-8r %m%n`, optionally with the
+# topology id as `%d %-8r ${storm.id} %m%n`), whose message is written by
+# `LoggingMetricsConsumer` as
+#
+#     <timestamp>\t<worker host>:<worker port>\t<task id>:<component>\t<metric>\t<value>
+METRIC_LINE_REGEX = re.compile(
+  r"^\S+ \S+\s+\d+\s+(?:(?P<topology>\S+)\s+)?(?P<timestamp>\d+)\t"
+  r"\s*(?P<host>[^\s:]+):(?P<port>\d+)\s*\t"
+  r"\s*(?P<task>-?\d+):(?P<component>\S+)\s*\t"
+  r"(?P<metric>[^\t]*?)\s*\t(?P<value>.*?)\s*$"
+)
+
+# Entry of a map metric value, eg. `{default=20, __ack_ack=3}`
+MAP_ENTRY_REGEX = re.compile(r"([^,{}=\s][^,{}=]*)=([^,{}]*)")
+
+MetricSample = collections.namedtuple("MetricSample",
+  ["topology", "component", "task", "workerHost", "workerPort", "metric",
+    "key", "timestamp", "value"]
+)
+
+def _to_float(value):
+  try:
+    return float(value)
+  except ValueError:
+    return None
+
+def parse_metric_value(value):
+  """Parses the value of a metric.
+
+  Returns:
+    list of (str, float): (key, value) pairs; the key is "" for a number, and
+      the map key for each numeric entry of a map. Non-numeric values are left
+      out.
+  """
+  value = value.strip()
+  if value.startswith("{") and value.endswith("}"):
+    entries = []
+    for key, entryValue in MAP_ENTRY_REGEX.findall(value[1:-1]):
+      entryValue = _to_float(entryValue.strip())
+      if entryValue is not None:
+        entries.append((key.strip(), entryValue))
+    return entries
+  number = _to_float(value)
+  return [] if number is None else [("", number)]
+
+def parse_metric_line(line):
+  """Parses a line of `metrics.log`.
+
+  Returns:
+    list of MetricSample, or None if the line is not a metric line
+  """
+  match = METRIC_LINE_REGEX.match(line)
+  if match is None:
+    return None
+  return [MetricSample(match.group("topology") or "",
+      match.group("component"), match.group("task"), match.group("host"),
+      match.group("port"), match.group("metric"), key,
+      int(match.group("timestamp")), value
+    ) for key, value in parse_metric_value(match.group("value"))
+  ]
+
+class LogFollower(object):
+  """Reads the lines appended to a file, across rotations."""
+  def __init__(self, path, fromEnd=False):
+    self.path = path
+    self._file = None
+    self._inode = None
+    self._partial = b""
+    self._fromEnd = fromEnd
+    # Number of times the file was found rotated or truncated
+    self.rotations = 0
+
+  def _open(self):
+    try:
+      self._file = open(self.path, "rb")
+    except IOError:
+      return False
+    self._inode = os.fstat(self._file.fileno()).st_ino
+    if self._fromEnd:
+      self._file.seek(0, os.SEEK_END)
+      self._fromEnd = False
+    return True
+
+  def _read_available(self):
+    lines = []
+    while True:
+      chunk = self._file.read(READ_SIZE)
+      if not chunk:
+        return lines
+      chunkLines = (self._partial + chunk).split(b"\n")
+      self._partial = chunkLines.pop()
+      if len(self._partial) > MAX_LINE_LENGTH:
+        self._partial = b""
+      lines.extend(chunkLines)
+
+  def _rotated(self):
+    try:
+      stat = os.stat(self.path)
+    except OSError:
+      # Renamed away, and the new file is not there yet
+      return False
+    return stat.st_ino != self._inode or stat.st_size < self._file.tell()
+
+  def read_lines(self):
+    """Returns the complete lines (as str) appended since the last call."""
+    if self._file is None and not self._open():
+      return []
+    lines = self._read_available()
+    if self._rotated():
+      # The old file was read to its end above
+      self.rotations += 1
+      if self._partial:
+        lines.append(self._partial)
+        self._partial = b""
+      self._file.close()
+      self._file = None
+      if self._open():
+        lines.extend(self._read_available())
+    return [line.decode("utf-8", "replace").rstrip("\r") for line in lines]
+
+class Series(object):
+  """Rolling buckets of the values of one series."""
+  __slots__ = ["buckets", "last", "lastTimestamp"]
+
+  def __init__(self):
+    # [bucket start, count, sum, min, max], oldest first
+    self.buckets = []
+    self.last = None
+    self.lastTimestamp = None
+
+  def add(self, bucketStart, timestamp, value):
+    # Samples mostly come in order, so the bucket is almost always the last one
+    idx = len(self.buckets)
+    while idx > 0 and self.buckets[idx - 1][0] > bucketStart:
+      idx -= 1
+    if idx > 0 and self.buckets[idx - 1][0] == bucketStart:
+      bucket = self.buckets[idx - 1]
+      bucket[1] += 1
+      bucket[2] += value
+      bucket[3] = min(bucket[3], value)
+      bucket[4] = max(bucket[4], value)
+    else:
+      self.buckets.insert(idx, [bucketStart, 1, value, value, value])
+    if self.lastTimestamp is None or timestamp >= self.lastTimestamp:
+      self.last = value
+      self.lastTimestamp = timestamp
+
+  def prune(self, oldestBucketStart):
+    stale = 0
+    while stale < len(self.buckets) and \
+        self.buckets[stale][0] < oldestBucketStart:
+      stale += 1
+    del self.buckets[:stale]
+
+  def window(self, oldestBucketStart):
+    """Returns (count, sum, min, max) over the buckets from
+    `oldestBucketStart` on, or None if there are none."""
+    count = 0
+    total = 0.0
+    low = high = None
+    for bucketStart, bucketCount, bucketSum, bucketMin, bucketMax in \
+        self.buckets:
+      if bucketStart < oldestBucketStart:
+        continue
+      count += bucketCount
+      total += bucketSum
+      low = bucketMin if low is None else min(low, bucketMin)
+      high = bucketMax if high is None else max(high, bucketMax)
+    return (count, total, low, high) if count else None
+
+class Aggregator(object):
+  """Rolling window aggregates of every series seen in `metrics.log`."""
+  def __init__(self, windows=DEFAULT_WINDOWS,
+      bucketSeconds=DEFAULT_BUCKET_SECONDS, maxSeries=DEFAULT_MAX_SERIES):
+    self.windows = sorted(windows)
+    self.bucketSeconds = bucketSeconds
+    self.maxSeries = maxSeries
+    # Labels tuple -> Series, least recently updated first
+    self.series = collections.OrderedDict()
+    self.lines = 0
+    self.unparsedLines = 0
+    self.evictedSeries = 0
+
+  def _bucket_start(self, timestamp):
+    return timestamp - timestamp % self.bucketSeconds
+
+  def _oldest_bucket_start(self, now, window):
+    return self._bucket_start(now - window + self.bucketSeconds)
+
+  def add_line(self, line, now):
+    self.lines += 1
+    samples = parse_metric_line(line)
+    if samples is None:
+      if line.strip():
+        self.unparsedLines += 1
+      return
+    oldest = self._oldest_bucket_start(now, self.windows[-1])
+    for sample in samples:
+      bucketStart = self._bucket_start(sample.timestamp)
+      if bucketStart < oldest:
+        continue
+      labels = sample[:7]
+      series = self.series.pop(labels, None)
+      if series is None:
+        series = Series()
+        if len(self.series) >= self.maxSeries:
+          self.series.popitem(last=False)
+          self.evictedSeries += 1
+      # (Re)inserted last, as the most recently updated series
+      self.series[labels] = series
+      series.add(bucketStart, sample.timestamp, sample.value)
+
+  def prune(self, now):
+    """Drops the buckets older than the longest window, and the series left
+    without any."""
+    oldest = self._oldest_bucket_start(now, self.windows[-1])
+    for labels in list(self.series):
+      series = self.series[labels]
+      series.prune(oldest)
+      if not series.buckets:
+        del self.series[labels]
+
+  def render(self, now):
+    """Returns the aggregates in the Prometheus text format."""
+    out = []
+    stats = [
+      ("count", "Number of values of a Storm metric over a rolling window"),
+      ("sum", "Sum of the values of a Storm metric over a rolling window"),
+      ("min", "Smallest value of a Storm metric over a rolling window"),
+      ("max", "Largest value of a Storm metric over a rolling window"),
+    ]
+    # (formatted labels, (count, sum, min, max)) of every series and window
+    aggregates = []
+    for labels, series in self.series.items():
+      for window in self.windows:
+        aggregate = series.window(self._oldest_bucket_start(now, window))
+        if aggregate is not None:
+          aggregates.append((_format_labels(labels, window), aggregate))
+    for statIdx, (stat, helpText) in enumerate(stats):
+      name = "storm_metric_{}".format(stat)
+      out.append("# HELP {} {}".format(name, helpText))
+      out.append("# TYPE {} gauge".format(name))
+      for formattedLabels, aggregate in aggregates:
+        out.append("{}{{{}}} {}".format(name, formattedLabels,
+          _format_number(aggregate[statIdx])
+        ))
+    out.append("# HELP storm_metric_last Last value of a Storm metric")
+    out.append("# TYPE storm_metric_last gauge")
+    for labels, series in self.series.items():
+      out.append("storm_metric_last{{{}}} {}".format(_format_labels(labels),
+        _format_number(series.last)
+      ))
+    for name, helpText, metricType, value in [
+        ("storm_metrics_exporter_lines_total",
+          "Lines read from metrics.log", "counter", self.lines),
+        ("storm_metrics_exporter_unparsed_lines_total",
+          "Lines of metrics.log which are not metric lines", "counter",
+          self.unparsedLines),
+        ("storm_metrics_exporter_series",
+          "Series currently aggregated", "gauge", len(self.series)),
+        ("storm_metrics_exporter_evicted_series_total",
+          "Series dropped to stay within max.series", "counter",
+          self.evictedSeries),
+        ]:
+      out.append("# HELP {} {}".format(name, helpText))
+      out.append("# TYPE {} {}".format(name, metricType))
+      out.append("{} {}".format(name, value))
+    return "\n".join(out) + "\n"
+
+LABEL_NAMES = ["topology", "component", "task", "worker_host", "worker_port",
+  "metric", "key"]
+
+def _escape_label_value(value):
+  return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+def _format_labels(labels, window=None):
+  pairs = ["{}=\"{}\"".format(name, _escape_label_value(value))
+    for name, value in zip(LABEL_NAMES, labels)
+  ]
+  if window is not None:
+    pairs.append("window=\"{}s\"".format(window))
+  return ",".join(pairs)
+
+def _format_number(value):
+  if value == int(value):
+    return str(int(value))
+  return repr(value)
+
+def _make_handler(aggregator, lock):
+  class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+      if self.path.split("?", 1)[0] != "/metrics":
+        self.send_error(404)
+        return
+      with lock:
+        body = aggregator.render(time.time()).encode("utf-8")
+      self.send_response(200)
+      self.send_header("Content-Type", "text/plain; version=0.0.4")
+      self.send_header("Content-Length", str(len(body)))
+      self.end_headers()
+      self.wfile.write(body)
+
+    def log_message(self, *args):
+      pass
+  return MetricsHandler
+
+def serve(aggregator, lock, port):
+  """Serves the aggregates on `port` from a background thread."""
+  server = HTTPServer(("0.0.0.0", port), _make_handler(aggregator, lock))
+  thread = threading.Thread(target=server.serve_forever)
+  thread.daemon = True
+  thread.start()
+  return server
+
+def follow(follower, aggregator, lock, sleep=time.sleep, clock=time.time):
+  """Feeds the lines of `follower` to `aggregator` forever."""
+  lastPrune = 0
+  while True:
+    lines = follower.read_lines()
+    now = clock()
+    with lock:
+      for line in lines:
+        aggregator.add_line(line, now)
+      if now - lastPrune >= aggregator.bucketSeconds:
+        aggregator.prune(now)
+        lastPrune = now
+    if not lines:
+      sleep(POLL_INTERVAL)
+
+def _metrics_config():
+  stormSetupYaml = os.environ.get("STORM_SETUP_YAML")
+  if not stormSetupYaml or not os.path.exists(stormSetupYaml):
+    return {}
+  with open(stormSetupYaml) as f:
+    return (yaml.safe_load(f) or {}).get(METRICS_SECTION) or {}
+
+def main():
+  metricsConfig = _metrics_config()
+  parser = argparse.ArgumentParser(
+    description="Serves the metrics of Storm's metrics.log in the Prometheus "
+      "text format"
+  )
+  parser.add_argument("--metrics-log",
+    default=metricsConfig.get("log", DEFAULT_METRICS_LOG),
+    help="metrics.log file to follow (default: %(default)s)"
+  )
+  parser.add_argument("--port", type=int,
+    default=metricsConfig.get("exporter.port", DEFAULT_PORT),
+    help="HTTP port to serve /metrics on (default: %(default)s)"
+  )
+  parser.add_argument("--from-end", action="store_true",
+    help="Skip the lines already in the file"
+  )
+  args = parser.parse_args()
+
+  aggregator = Aggregator(
+    metricsConfig.get("windows.seconds", DEFAULT_WINDOWS),
+    metricsConfig.get("bucket.seconds", DEFAULT_BUCKET_SECONDS),
+    metricsConfig.get("max.series", DEFAULT_MAX_SERIES)
+  )
+  lock = threading.Lock()
+  serve(aggregator, lock, args.port)
+  print("Serving the metrics of {} on port {}".format(args.metrics_log,
+    args.port
+  ))
+  sys.stdout.flush()
+  follow(LogFollower(args.metrics_log, args.from_end), aggregator, lock)
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+
+# Zookeeper-backed registry of the storm-supervisor containers, replacing the
+# static list of `storm.supervisor.hosts` in the hosts file of dnsmasq.
+#
+# Each storm-supervisor container runs this program, which:
+#
+#   - registers the container's hostname (`<host>-supervisor`, or
+#     `<host>-supervisor-<n>` with several supervisor containers per host) and
+#     the IP address of its host machine as an ephemeral node,
+#     `<zk.root>/hosts/<hostname>`, so that the registration disappears with
+#     the container (once its Zookeeper session expires)
+#   - watches `<zk.root>/hosts`, and rewrites `/etc/dnsmasq-extra-hosts` with
+#     the registered supervisors whenever it changes, then has dnsmasq re-read
+#     it (SIGHUP)
+#
+# so that adding or removing a supervisor reaches every other supervisor within
+# seconds, without regenerating or restarting anything.
+#
+# The Zookeeper servers are read from the generated `storm.yaml` file. Settings
+# are read from the `service.discovery` section of `storm-setup.yaml`; see
+# `config/storm-setup.yaml.sample`. To try it out against
+# `scripts/zk_stand_in.py`, from the top of the storm-docker repository:
+#
+#     python scripts/zk_stand_in.py --port 2181 &
+#     python storm-supervisor/storm_service_registry.py --name a-supervisor \
+#       --ip 10.0.0.1 --zookeeper 127.0.0.1:2181 \
+#       --hosts-file /tmp/extra-hosts --no-dnsmasq-reload
+
+from __future__ import print_function
+
+import argparse
+import os
+import os.path
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import yaml
+
+try:
+  # Added next to this program in the storm-supervisor image
+  import zk_client
+except ImportError:
+  # Run from the storm-docker repository
+  sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."
+  ))
+  from docker_python_helpers import zk_client
+
+# Section of `storm-setup.yaml` with the settings of this program
+DISCOVERY_SECTION = "service.discovery"
+
+DEFAULT_ZK_ROOT = "/storm-docker"
+DEFAULT_HOSTS_FILE = "/etc/dnsmasq-extra-hosts"
+DEFAULT_SESSION_TIMEOUT_MS = 10000
+
+# Seconds to wait before connecting again after losing Zookeeper, doubled up
+# to `MAX_RECONNECT_SECONDS` while it stays unreachable
+RECONNECT_SECONDS = 1.0
+MAX_RECONNECT_SECONDS = 30.0
+
+def _discovery_config():
+  try:
+    with open(os.environ["STORM_SETUP_YAML"]) as f:
+      stormSetupConfig = yaml.safe_load(f) or {}
+  except (KeyError, IOError):
+    return {}
+  return stormSetupConfig.get(DISCOVERY_SECTION) or {}
+
+def zookeeper_addresses(stormYamlPath):
+  """Returns the (host, port) of the Zookeeper servers of a `storm.yaml`
+  file."""
+  with open(stormYamlPath) as f:
+    stormYamlConfig = yaml.safe_load(f) or {}
+  port = int(stormYamlConfig.get("storm.zookeeper.port", 2181))
+  return [(server, port) for server in
+    stormYamlConfig.get("storm.zookeeper.servers") or []
+  ]
+
+def parse_address(value):
+  host, _, port = value.rpartition(":")
+  if not host:
+    raise argparse.ArgumentTypeError("expected HOST:PORT, got " + value)
+  return (host, int(port))
+
+def hosts_path(zkRoot):
+  return zkRoot.rstrip("/") + "/hosts"
+
+def register(client, hostsPath, name, ipAddress):
+  """Registers `name` -> `ipAddress` as an ephemeral node of this session."""
+  client.ensure_path(hostsPath)
+  path = "{}/{}".format(hostsPath, name)
+  try:
+    client.create(path, ipAddress, ephemeral=True)
+  except zk_client.NodeExistsError:
+    # Left by the previous session of this container, which has not expired
+    # yet
+    try:
+      client.delete(path)
+    except zk_client.NoNodeError:
+      pass
+    client.create(path, ipAddress, ephemeral=True)
+
+def read_registry(client, hostsPath):
+  """Returns the registered names and IP addresses, watching them for
+  changes.
+
+  Returns:
+    dict: name -> IP address
+  """
+  registry = {}
+  for name in client.get_children(hostsPath, watch=True):
+    try:
+      data, _ = client.get_data("{}/{}".format(hostsPath, name), watch=True)
+    except zk_client.NoNodeError:
+      # Unregistered in the meantime; the child watch fires for it
+      continue
+    if data:
+      registry[name] = data.decode("utf-8").strip()
+  return registry
+
+def hosts_file_contents(registry, ownIpAddresses, ownName):
+  """Returns the dnsmasq hosts file of the registered supervisors, other than
+  this container (`ownName`). Like in `base-storm/run-supervisord.py`, the
+  other supervisor containers of this machine are only kept if they can be
+  reached through its IP address (not a loopback one)."""
+  return "".join("{} {}\n".format(registry[name], name)
+    for name in sorted(registry) if name != ownName and
+    (registry[name] not in ownIpAddresses or
+      not registry[name].startswith("127."))
+  )
+
+def write_if_changed(path, content):
+  """Atomically replaces the contents of `path` unless they are already equal
+  to `content`.
+
+  Returns:
+    bool: True if the file was written
+  """
+  try:
+    with open(path) as f:
+      if f.read() == content:
+        return False
+  except IOError:
+    pass
+  fd, tmpPath = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)),
+    suffix=".tmp"
+  )
+  with os.fdopen(fd, "w") as f:
+    f.write(content)
+  os.chmod(tmpPath, 0o644)
+  os.rename(tmpPath, path)
+  return True
+
+def reload_dnsmasq():
+  """Has the dnsmasq of this container re-read its hosts files."""
+  p = subprocess.Popen(["supervisorctl", "pid", "dnsmasq"],
+    stdout=subprocess.PIPE, stderr=subprocess.STDOUT
+  )
+  out, _ = p.communicate()
+  pid = out.decode("utf-8", "replace").strip()
+  if pid.isdigit() and int(pid) > 0:
+    os.kill(int(pid), signal.SIGHUP)
+
+def run_registry(args):
+  """Keeps this container registered, and the hosts file in sync with the
+  registry, across losses of the Zookeeper connection."""
+  hostsPath = hosts_path(args.zk_root)
+  ownIpAddresses = set(args.own_ip_addresses or []) | set([args.ip])
+  reconnectSeconds = RECONNECT_SECONDS
+  while True:
+    client = zk_client.ZookeeperClient(
+      args.zookeeper or zookeeper_addresses(args.storm_yaml),
+      sessionTimeoutMs=args.session_timeout_ms
+    )
+    try:
+      client.connect()
+      register(client, hostsPath, args.name, args.ip)
+      print("registered {} -> {} in {}".format(args.name, args.ip, hostsPath))
+      reconnectSeconds = RECONNECT_SECONDS
+      while True:
+        registry = read_registry(client, hostsPath)
+        if write_if_changed(args.hosts_file,
+            hosts_file_contents(registry, ownIpAddresses, args.name)):
+          print("{} supervisors registered; updated {}".format(len(registry),
+            args.hosts_file
+          ))
+          if not args.no_dnsmasq_reload:
+            reload_dnsmasq()
+        sys.stdout.flush()
+        client.wait_event()
+        # Changes often come in bursts (eg. a rollout); read them at once
+        while client.wait_event(0.2) is not None:
+          pass
+    except (socket.error, zk_client.ZookeeperError) as e:
+      print("lost Zookeeper ({}: {}); reconnecting in {}s".format(
+        type(e).__name__, e, reconnectSeconds
+      ), file=sys.stderr)
+    finally:
+      client._close_socket()
+    time.sleep(reconnectSeconds)
+    reconnectSeconds = min(MAX_RECONNECT_SECONDS, reconnectSeconds * 2)
+
+def main():
+  discoveryConfig = _discovery_config()
+  parser = argparse.ArgumentParser(
+    description="Registers this storm-supervisor in Zookeeper, and keeps the "
+      "hosts of dnsmasq in sync with the other registered supervisors"
+  )
+  parser.add_argument("--name", default=socket.gethostname(),
+    help="Name to register (default: the hostname, %(default)s)"
+  )
+  parser.add_argument("--ip", required=True,
+    help="IP address to register for the name"
+  )
+  parser.add_argument("--own-ip-address", action="append",
+    dest="own_ip_addresses",
+    help="IP address of this machine; supervisors registered with it are left "
+      "out of the hosts file if it is a loopback address"
+  )
+  parser.add_argument("--zk-root",
+    default=discoveryConfig.get("zk.root", DEFAULT_ZK_ROOT),
+    help="Zookeeper node of the registry (default: %(default)s)"
+  )
+  parser.add_argument("--zookeeper", action="append", type=parse_address,
+    metavar="HOST:PORT",
+    help="Zookeeper server (default: the servers of --storm-yaml)"
+  )
+  parser.add_argument("--storm-yaml",
+    default=os.path.join(os.environ.get("STORM_HOME", ""), "conf",
+      "storm.yaml"
+    ),
+    help="storm.yaml file to read the Zookeeper servers from (default: "
+      "%(default)s)"
+  )
+  parser.add_argument("--session-timeout-ms", type=int,
+    default=discoveryConfig.get("session.timeout.ms",
+      DEFAULT_SESSION_TIMEOUT_MS
+    ),
+    help="Zookeeper session timeout, after which the registration of a dead "
+      "container disappears (default: %(default)s)"
+  )
+  parser.add_argument("--hosts-file", default=DEFAULT_HOSTS_FILE,
+    help="dnsmasq hosts file to write (default: %(default)s)"
+  )
+  parser.add_argument("--no-dnsmasq-reload", action="store_true",
+    help="Do not send SIGHUP to dnsmasq after updating the hosts file"
+  )
+  run_registry(parser.parse_args())
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,6 @@
+# Tests of the storm-docker helpers. Run from the top of the repository with
+#
+#     python -m pytest tests
+#
+# or `python -m unittest discover tests`. They only need the standard library
+# (and PyYAML); Docker, SSH, EC2 and Zookeeper are replaced by local stand-ins.
@@ -0,0 +1,70 @@
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from docker_python_helpers import cli
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Runs the `storm-docker` entry point of the package installed in argv[1]
+ENTRY_POINT = """import sys
+sys.path.insert(0, sys.argv.pop(1))
+from docker_python_helpers import cli
+sys.exit(cli.main())
+"""
+
+class InstalledCopyTest(unittest.TestCase):
+  """Runs `storm-docker --help` from an installed copy of the helpers which
+  lacks the `build` command of the checkout."""
+  def setUp(self):
+    self.tmpDir = tempfile.mkdtemp()
+    self.siteDir = os.path.join(self.tmpDir, "site-packages")
+    shutil.copytree(os.path.join(REPO_DIR, "docker_python_helpers"),
+      os.path.join(self.siteDir, "docker_python_helpers"),
+      ignore=shutil.ignore_patterns("__pycache__", "*.pyc")
+    )
+    cliPath = os.path.join(self.siteDir, "docker_python_helpers", "cli.py")
+    with open(cliPath) as f:
+      source = f.read()
+    with open(cliPath, "w") as f:
+      f.write(source.replace('  "build": (', '  "old-build": ('))
+
+  def tearDown(self):
+    shutil.rmtree(self.tmpDir)
+
+  def _help(self, cwd):
+    proc = subprocess.Popen([sys.executable, "-c", ENTRY_POINT, self.siteDir,
+      "--help"], cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.PIPE
+    )
+    out, err = proc.communicate()
+    self.assertEqual(proc.returncode, 0, err)
+    return out.decode("utf-8"), err.decode("utf-8")
+
+  def test_checkout_helpers_are_run(self):
+    out, err = self._help(REPO_DIR)
+    self.assertIn("    build ", out)
+    self.assertNotIn("old-build", out)
+    self.assertIn("pip install -e .", err)
+
+  def test_installed_copy_outside_a_checkout(self):
+    out, err = self._help(self.tmpDir)
+    self.assertIn("old-build", out)
+    self.assertEqual(err, "")
+
+  def test_checkout_package_dir(self):
+    cwd = os.getcwd()
+    try:
+      os.chdir(REPO_DIR)
+      # The helpers under test are those of the checkout
+      self.assertIsNone(cli.checkout_package_dir())
+      os.chdir(self.tmpDir)
+      self.assertIsNone(cli.checkout_package_dir())
+    finally:
+      os.chdir(cwd)
+
+if __name__ == "__main__":
+  unittest.main()
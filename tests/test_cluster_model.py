@@ -0,0 +1,114 @@
+import glob
+import os
+import os.path
+import shutil
+import tempfile
+import time
+import unittest
+
+from docker_python_helpers import cluster_model
+
+STORM_SETUP_YAML = """
+is_localhost_setup: false
+servers:
+  server-one: 10.0.0.1
+  server-two: 10.0.0.2
+storm.yaml:
+  storm.zookeeper.servers: [server-one]
+  nimbus.host: server-one
+  supervisor.slots.ports: [6700, 6701]
+storm.supervisor.hosts: [{supervisors}]
+"""
+
+class ClusterModelCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpDir = tempfile.mkdtemp()
+    self.cacheDir = os.path.join(self.tmpDir, "cache")
+    self.environ = dict(os.environ)
+    os.environ["STORM_DOCKER_CACHE_DIR"] = self.cacheDir
+    cluster_model._loadedModels.clear()
+
+  def tearDown(self):
+    cluster_model._loadedModels.clear()
+    os.environ.clear()
+    os.environ.update(self.environ)
+    shutil.rmtree(self.tmpDir)
+
+  def _write_yaml(self, name, supervisors="server-two"):
+    path = os.path.join(self.tmpDir, name)
+    with open(path, "w") as f:
+      f.write(STORM_SETUP_YAML.format(supervisors=supervisors))
+    return path
+
+  def _load(self, path):
+    """Loads `path` as a new process would, returning the model and whether
+    it came from the on-disk cache."""
+    cluster_model._loadedModels.clear()
+    parsed = []
+    parse = cluster_model.parse_storm_setup_yaml
+    cluster_model.parse_storm_setup_yaml = lambda data: parsed.append(1) or \
+      parse(data)
+    try:
+      model = cluster_model.load_cluster_model(path)
+    finally:
+      cluster_model.parse_storm_setup_yaml = parse
+    return model, not parsed
+
+  def _cached_models(self):
+    return glob.glob(os.path.join(self.cacheDir, "cluster-model-*"))
+
+  def test_model(self):
+    model, _ = self._load(self._write_yaml("a.yaml"))
+    self.assertEqual(model.ip("server-two"), "10.0.0.2")
+    self.assertEqual(model.supervisorHosts, ["server-two"])
+    self.assertTrue(model.runs_on("nimbus", ["10.0.0.1"]))
+    self.assertFalse(model.runs_on("supervisor", ["10.0.0.1"]))
+
+  def test_files_do_not_evict_each_other(self):
+    first = self._write_yaml("a.yaml")
+    second = self._write_yaml("b.yaml", "server-one, server-two")
+    self.assertFalse(self._load(first)[1])
+    self.assertFalse(self._load(second)[1])
+    for _ in range(2):
+      self.assertTrue(self._load(first)[1])
+      self.assertTrue(self._load(second)[1])
+    self.assertEqual(len(self._cached_models()), 2)
+
+  def test_least_recently_used_models_are_evicted(self):
+    paths = [self._write_yaml("{}.yaml".format(idx), ", ".join(
+      ["server-two"] * (idx + 1)
+    )) for idx in range(cluster_model.CACHED_MODELS + 1)]
+    for idx, path in enumerate(paths):
+      self._load(path)
+      if idx == 0:
+        continue
+      # Keeps the first model the most recently used one
+      time.sleep(0.01)
+      self.assertTrue(self._load(paths[0])[1])
+    self.assertEqual(len(self._cached_models()), cluster_model.CACHED_MODELS)
+    self.assertTrue(self._load(paths[0])[1])
+    self.assertFalse(self._load(paths[1])[1])
+
+  def test_version_is_derived_from_the_code(self):
+    self.assertEqual(cluster_model.MODEL_VERSION,
+      cluster_model._model_version()
+    )
+    self._load(self._write_yaml("a.yaml"))
+    cachePath, = self._cached_models()
+    self.assertIn("-v{}-".format(cluster_model.MODEL_VERSION), cachePath)
+
+    stalePath = os.path.join(self.cacheDir, "cluster-model-v11-0.pickle")
+    open(stalePath, "w").close()
+    os.utime(stalePath, (0, 0))
+    cluster_model._evict_cached_models(self.cacheDir, keep=1)
+    self.assertEqual(self._cached_models(), [cachePath])
+
+  def test_disabled_cache(self):
+    os.environ["STORM_DOCKER_CACHE_DIR"] = ""
+    path = self._write_yaml("a.yaml")
+    self.assertFalse(self._load(path)[1])
+    self.assertFalse(self._load(path)[1])
+    self.assertFalse(os.path.exists(self.cacheDir))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,162 @@
+import json
+import os
+import shutil
+import stat
+import subprocess
+import tempfile
+import unittest
+
+from docker_python_helpers import container_state
+from docker_python_helpers import reconcile
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# (name, image, running) of the containers of the stand-in machine
+CONTAINERS = [
+  ("zookeeper", "viki_data/zookeeper", True),
+  ("nimbus", "viki_data/storm-nimbus", True),
+  ("ui", "viki_data/storm-ui:latest", True),
+  ("supervisor-0", "viki_data/storm-supervisor", True),
+  ("supervisor-1", "viki_data/storm-supervisor", False),
+  ("zk_ambassador_old", "viki_data/zk-ambassador", True),
+]
+
+FAKE_DOCKER = """#!/bin/sh
+# Stand-in for the `docker` CLI, logging its arguments
+echo "$*" >> "{log}"
+case "$*" in
+  "ps -a --format"*)
+    [ -e "{dir}/ps-fails" ] && exit 1
+    cat "{dir}/ps" ;;
+  ps*) cat "{dir}/ids" ;;
+  inspect*) cat "{dir}/inspect.json" ;;
+esac
+"""
+
+class FakeDockerTest(unittest.TestCase):
+  """Puts a stand-in for `docker` on the PATH. The Docker socket is bypassed
+  (`DOCKER_HOST` is set), so containers are listed with `docker ps` and
+  `docker inspect`."""
+  def setUp(self):
+    self.tmpDir = tempfile.mkdtemp()
+    self.dockerLog = os.path.join(self.tmpDir, "docker.log")
+    with open(os.path.join(self.tmpDir, "ps"), "w") as f:
+      # Older Docker versions also list `nimbus` under the name of its link
+      for name, image, running in CONTAINERS:
+        f.write("{} {} {}\n".format(
+          "nimbus,ui/nimbus" if name == "nimbus" else name, image,
+          "Up 2 hours" if running else "Exited (0) 2 hours ago"
+        ))
+    with open(os.path.join(self.tmpDir, "ids"), "w") as f:
+      f.write("\n".join("{:064x}".format(idx)
+        for idx in range(len(CONTAINERS))
+      ) + "\n")
+    with open(os.path.join(self.tmpDir, "inspect.json"), "w") as f:
+      json.dump([{
+        "Id": "{:064x}".format(idx),
+        "Name": "/" + name,
+        "Config": {"Image": image},
+        "State": {"Running": running},
+      } for idx, (name, image, running) in enumerate(CONTAINERS)], f)
+    self._write_script("docker", FAKE_DOCKER.format(log=self.dockerLog,
+      dir=self.tmpDir
+    ))
+    self.environ = dict(os.environ)
+    os.environ["PATH"] = "{}:{}".format(self.tmpDir, os.environ["PATH"])
+    os.environ["DOCKER_HOST"] = "tcp://127.0.0.1:2375"
+    container_state._snapshot = None
+
+  def tearDown(self):
+    container_state._snapshot = None
+    os.environ.clear()
+    os.environ.update(self.environ)
+    shutil.rmtree(self.tmpDir)
+
+  def _write_script(self, name, contents):
+    path = os.path.join(self.tmpDir, name)
+    with open(path, "w") as f:
+      f.write(contents)
+    os.chmod(path, os.stat(path).st_mode | stat.S_IXUSR)
+
+  def _log(self, path):
+    if not os.path.exists(path):
+      return []
+    with open(path) as f:
+      return f.read().splitlines()
+
+  def _docker_calls(self, command):
+    return [line for line in self._log(self.dockerLog)
+      if line.split()[0] == command
+    ]
+
+  def _run_script(self, *args):
+    return subprocess.check_output(["bash"] + list(args), cwd=REPO_DIR,
+      stderr=subprocess.STDOUT
+    ).decode("utf-8")
+
+  def _docker_ps_calls(self):
+    return [line for line in self._docker_calls("ps") if "--format" in line]
+
+class SnapshotTest(FakeDockerTest):
+  def test_several_lookups_list_once(self):
+    # The lookups of `run_storm_supervisor.main`
+    snapshot = container_state.snapshot()
+    self.assertFalse(snapshot.is_running("zk_ambassador"))
+    for name in ("supervisor-0", "supervisor-1"):
+      container_state.snapshot().is_running(name)
+    self.assertTrue(container_state.snapshot().is_running("supervisor-0"))
+    self.assertFalse(container_state.snapshot().is_running("supervisor-1"))
+    self.assertTrue(snapshot.exists("supervisor-1"))
+    self.assertTrue(snapshot.image_running("viki_data/storm-ui"))
+    self.assertEqual(len(self._docker_calls("ps")), 1)
+    self.assertEqual(len(self._docker_calls("inspect")), 1)
+
+    container_state.snapshot(refresh=True)
+    self.assertEqual(len(self._docker_calls("ps")), 2)
+
+  def test_missing_containers_are_not_inspected(self):
+    self.assertIsNone(reconcile._docker_inspect("zk_ambassador"))
+    self.assertIsNone(reconcile._docker_inspect("supervisor"))
+    # Only the `docker inspect` of the listing itself
+    self.assertEqual(len(self._docker_calls("inspect")), 1)
+
+class ShellScriptsTest(FakeDockerTest):
+  def test_destroy_storm_lists_once(self):
+    self._run_script("destroy-storm.sh")
+    self.assertEqual(self._docker_calls("ps"), self._docker_ps_calls())
+    self.assertEqual(len(self._docker_ps_calls()), 1)
+    # Only existing containers are stopped, and matched by exact name
+    self.assertEqual(self._docker_calls("stop"), ["stop ui",
+      "stop supervisor-0", "stop supervisor-1", "stop nimbus",
+      "stop zookeeper"
+    ])
+    self.assertEqual(len(self._docker_calls("rm")), 5)
+
+  def test_destroy_storm_components(self):
+    self._run_script("destroy-storm.sh", "supervisor",
+      "nimbus-with-zookeeper-ambassador"
+    )
+    self.assertEqual(self._docker_calls("stop"), ["stop supervisor-0",
+      "stop supervisor-1", "stop nimbus"
+    ])
+
+  def test_start_storm_lists_once(self):
+    out = self._run_script("start-storm.sh", "zookeeper", "nimbus", "ui")
+    self.assertEqual(len(self._docker_calls("ps")), 1)
+    for component in ("zookeeper", "storm nimbus", "storm ui"):
+      self.assertIn("{} Docker container already running".format(component),
+        out
+      )
+    self.assertEqual(self._docker_calls("run"), [])
+
+  def test_failed_listing_aborts(self):
+    open(os.path.join(self.tmpDir, "ps-fails"), "w").close()
+    with self.assertRaises(subprocess.CalledProcessError) as cm:
+      self._run_script("destroy-storm.sh")
+    self.assertIn("Could not list the Docker containers",
+      cm.exception.output.decode("utf-8")
+    )
+    self.assertEqual(self._docker_calls("stop"), [])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,225 @@
+import json
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+  from http.server import BaseHTTPRequestHandler
+  from socketserver import ThreadingMixIn, UnixStreamServer
+except ImportError:
+  from BaseHTTPServer import BaseHTTPRequestHandler
+  from SocketServer import ThreadingMixIn, UnixStreamServer
+
+from docker_python_helpers import docker_api
+
+class FakeDaemonServer(ThreadingMixIn, UnixStreamServer):
+  """Stand-in for the Docker daemon, answering the few API calls of
+  `DockerClient` on a unix socket."""
+  daemon_threads = True
+
+  def __init__(self, socketPath):
+    UnixStreamServer.__init__(self, socketPath, FakeDaemonHandler)
+    self.requests = []
+    self.connections = 0
+    self.images = set(["storm/base:latest"])
+    self.containers = []
+    # Close the connection after the next response, without telling the
+    # client (leaves it with a stale keep-alive connection)
+    self.dropAfterResponse = False
+    # Close the connection when the next create request is received, without
+    # answering it
+    self.hangUpOnCreate = False
+
+class FakeDaemonHandler(BaseHTTPRequestHandler):
+  protocol_version = "HTTP/1.1"
+
+  def setup(self):
+    BaseHTTPRequestHandler.setup(self)
+    self.server.connections += 1
+
+  def log_message(self, format, *args):
+    pass
+
+  def _reply(self, status, body=None):
+    data = json.dumps(body).encode("utf-8") if body is not None else b""
+    self.send_response(status)
+    self.send_header("Content-Type", "application/json")
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+    if self.server.dropAfterResponse:
+      self.server.dropAfterResponse = False
+      self.close_connection = True
+
+  def _handle(self, method):
+    length = int(self.headers.get("Content-Length") or 0)
+    body = json.loads(self.rfile.read(length).decode("utf-8")) \
+      if length else None
+    self.server.requests.append((method, self.path, body))
+    path, _, query = self.path.partition("?")
+    if method == "GET" and path == "/containers/json":
+      return self._reply(200, self.server.containers)
+    if method == "POST" and path == "/images/create":
+      params = dict(param.split("=", 1) for param in query.split("&"))
+      self.server.images.add("{}:{}".format(params["fromImage"],
+        params["tag"]
+      ).replace("%2F", "/"))
+      return self._reply(200)
+    if method == "POST" and path == "/containers/create":
+      if self.server.hangUpOnCreate:
+        self.server.hangUpOnCreate = False
+        self.close_connection = True
+        return
+      image = body["Image"] if ":" in body["Image"] else \
+        body["Image"] + ":latest"
+      if image not in self.server.images:
+        return self._reply(404, {"message": "No such image: " + image})
+      containerId = "{:064x}".format(len(self.server.containers) + 1)
+      self.server.containers.append({"Id": containerId, "Image": image})
+      return self._reply(201, {"Id": containerId, "Warnings": None})
+    if method == "POST" and path.endswith("/start"):
+      return self._reply(204)
+    self._reply(404, {"message": "unknown path " + path})
+
+  def do_GET(self):
+    self._handle("GET")
+
+  def do_POST(self):
+    self._handle("POST")
+
+class DockerClientTest(unittest.TestCase):
+  def setUp(self):
+    self.tmpDir = tempfile.mkdtemp()
+    socketPath = os.path.join(self.tmpDir, "docker.sock")
+    self.server = FakeDaemonServer(socketPath)
+    self.thread = threading.Thread(target=self.server.serve_forever,
+      kwargs={"poll_interval": 0.05}
+    )
+    self.thread.daemon = True
+    self.thread.start()
+    self.client = docker_api.DockerClient(socketPath, timeout=5)
+
+  def tearDown(self):
+    self.client.close()
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.tmpDir)
+
+  def _creates(self):
+    return [request for request in self.server.requests
+      if request[1].startswith("/containers/create")
+    ]
+
+  def test_run(self):
+    result = self.client.run(["-d", "--name", "nimbus", "-p", "6627:6627",
+      "storm/base", "supervisord"
+    ])
+    self.assertEqual(result.name, "nimbus")
+    self.assertEqual(result.image, "storm/base")
+    self.assertFalse(result.pulled)
+    self.assertEqual([(method, path) for method, path, _ in
+      self.server.requests
+    ], [
+      ("POST", "/containers/create?name=nimbus"),
+      ("POST", "/containers/{}/start".format(result.containerId)),
+    ])
+    config = self._creates()[0][2]
+    self.assertEqual(config["Cmd"], ["supervisord"])
+    self.assertEqual(config["HostConfig"]["PortBindings"],
+      {"6627/tcp": [{"HostIp": "", "HostPort": "6627"}]}
+    )
+    # A single keep-alive connection for both requests
+    self.assertEqual(self.server.connections, 1)
+
+  def test_run_pulls_missing_image(self):
+    result = self.client.run(["--name", "ui", "storm/ui:1.2"])
+    self.assertTrue(result.pulled)
+    self.assertIn("storm/ui:1.2", self.server.images)
+    self.assertEqual(len(self._creates()), 2)
+    self.assertEqual(len(self.server.containers), 1)
+
+  def test_list_containers(self):
+    self.client.run(["--name", "nimbus", "storm/base"])
+    listing = self.client.list_containers(all=True)
+    self.assertEqual([entry["Image"] for entry in listing],
+      ["storm/base:latest"]
+    )
+    self.assertEqual(self.server.requests[-1][1], "/containers/json?all=1")
+
+  def test_error_status(self):
+    with self.assertRaises(docker_api.DockerAPIError) as context:
+      self.client.inspect_container("missing")
+    self.assertEqual(context.exception.status, 404)
+
+  def test_stale_connection_is_retried(self):
+    self.server.dropAfterResponse = True
+    self.client.list_containers()
+    self.assertEqual(self.client.list_containers(), [])
+    self.assertEqual(self.server.connections, 2)
+
+  def test_create_is_not_sent_on_a_stale_connection(self):
+    self.server.dropAfterResponse = True
+    self.client.list_containers()
+    self.client.run(["--name", "nimbus", "storm/base"])
+    self.assertEqual(len(self._creates()), 1)
+    self.assertEqual(len(self.server.containers), 1)
+    self.assertEqual(self.server.connections, 2)
+
+  def test_create_is_not_retried_once_sent(self):
+    self.server.hangUpOnCreate = True
+    with self.assertRaises(docker_api.RequestOutcomeUnknown):
+      self.client.run(["--name", "nimbus", "storm/base"])
+    self.assertEqual(len(self._creates()), 1)
+    # The client reconnects for the next request
+    self.client.run(["--name", "nimbus", "storm/base"])
+    self.assertEqual(len(self.server.containers), 1)
+
+class ParseDockerRunArgsTest(unittest.TestCase):
+  def test_flags(self):
+    name, config = docker_api.parse_docker_run_args([
+      "-d", "--name=supervisor", "-h", "host1-supervisor",
+      "-p", "127.0.0.1:49022:22", "-p", "6700-6701:6700-6701",
+      "--expose", "2888/udp", "--link", "zookeeper", "-e", "A=1",
+      "--dns", "172.17.42.1", "-v", "/data:/data", "--label", "k=v",
+      "--cpuset-cpus", "0-3", "--cpuset-mems", "0",
+      "storm/supervisor", "supervisord", "-n",
+    ])
+    hostConfig = config["HostConfig"]
+    self.assertEqual(name, "supervisor")
+    self.assertEqual(config["Hostname"], "host1-supervisor")
+    self.assertEqual(config["Image"], "storm/supervisor")
+    self.assertEqual(config["Cmd"], ["supervisord", "-n"])
+    self.assertEqual(config["Env"], ["A=1"])
+    self.assertEqual(config["Labels"], {"k": "v"})
+    self.assertEqual(sorted(config["ExposedPorts"]),
+      ["22/tcp", "2888/udp", "6700/tcp", "6701/tcp"]
+    )
+    self.assertEqual(hostConfig["PortBindings"]["22/tcp"],
+      [{"HostIp": "127.0.0.1", "HostPort": "49022"}]
+    )
+    self.assertEqual(hostConfig["PortBindings"]["6701/tcp"],
+      [{"HostIp": "", "HostPort": "6701"}]
+    )
+    self.assertEqual(hostConfig["Links"], ["zookeeper:zookeeper"])
+    self.assertEqual(hostConfig["Dns"], ["172.17.42.1"])
+    self.assertEqual(hostConfig["Binds"], ["/data:/data"])
+    self.assertEqual(hostConfig["CpusetCpus"], "0-3")
+    self.assertEqual(hostConfig["CpusetMems"], "0")
+
+  def test_unsupported(self):
+    for argv in (["--privileged", "storm/base"], ["-p"], ["--name", "x"],
+        ["-p", "6700-6701:6700", "storm/base"]):
+      self.assertRaises(docker_api.UnsupportedDockerRunArgument,
+        docker_api.parse_docker_run_args, argv
+      )
+
+  def test_remove_docker_run_flags(self):
+    self.assertEqual(docker_api.remove_docker_run_flags(
+      ["-p", "1:1", "--publish=2:2", "-h", "x", "img", "-p", "3"],
+      ["-p", "--publish"]
+    ), ["-h", "x", "img", "-p", "3"])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,163 @@
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from docker_python_helpers import image_build
+
+# Files copied into the build contexts (`ImageSpec.configFiles`)
+SOURCE_FILES = [
+  "config/storm-setup.yaml",
+  "config/cluster.xml",
+  "config/zoo.cfg",
+  "docker_python_helpers/timing.py",
+  "docker_python_helpers/zk_client.py",
+]
+
+class FakeDocker(object):
+  """`run` for `build_images`, recording the `docker build` and `docker tag`
+  commands it is given."""
+  def __init__(self, tagged=(), failing=()):
+    self.tagged = set(tagged)
+    self.failing = set(failing)
+    self.events = []
+    self.lock = threading.Lock()
+    # Set when the build of each image starts
+    self.started = dict((name, threading.Event())
+      for name in image_build.IMAGES
+    )
+    # Builds block until the images they name have started building too
+    self.waitFor = {}
+
+  def run(self, argv):
+    command = argv[1]
+    if command == "inspect":
+      if argv[-1] not in self.tagged:
+        raise image_build.BuildError(argv, 1)
+      return ""
+    if command == "tag":
+      self._record("tag", argv[-1])
+      return ""
+    name = os.path.basename(argv[-1])
+    self._record("start", name)
+    self.started[name].set()
+    for other in self.waitFor.get(name, ()):
+      self.started[other].wait(5.0)
+    if name in self.failing:
+      self._record("fail", name)
+      raise image_build.BuildError(argv, 1, "build failed")
+    with self.lock:
+      self.tagged.add(argv[3])
+    self._record("end", name)
+    return ""
+
+  def _record(self, event, name):
+    with self.lock:
+      self.events.append((event, name))
+
+  def index(self, event, name):
+    return self.events.index((event, name))
+
+  def builds(self):
+    return sorted(name for event, name in self.events if event == "start")
+
+class BuildImagesTest(unittest.TestCase):
+  def setUp(self):
+    self.rootDir = tempfile.mkdtemp()
+    for name in image_build.IMAGES:
+      os.makedirs(os.path.join(self.rootDir, name))
+      self._write(os.path.join(name, "Dockerfile"), "FROM scratch\n")
+    for path in SOURCE_FILES:
+      self._write(path, "{}\n".format(path))
+
+  def tearDown(self):
+    shutil.rmtree(self.rootDir)
+
+  def _write(self, path, contents):
+    path = os.path.join(self.rootDir, path)
+    if not os.path.isdir(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    with open(path, "w") as f:
+      f.write(contents)
+
+  def _build(self, docker, names=None):
+    results = image_build.build_images(names, ["docker"],
+      rootDir=self.rootDir, run=docker.run
+    )
+    return dict((result.name, result) for result in results)
+
+  def test_independent_images_build_together(self):
+    docker = FakeDocker()
+    # base-storm only finishes once zookeeper started, and the other way round
+    docker.waitFor = {"base-storm": ["zookeeper"], "zookeeper": ["base-storm"]}
+    results = self._build(docker)
+    self.assertEqual(docker.builds(), sorted(image_build.IMAGES))
+    self.assertTrue(all(result.status == image_build.BuildResult.BUILT
+      for result in results.values()
+    ))
+    self.assertLess(docker.index("start", "zookeeper"),
+      docker.index("end", "base-storm")
+    )
+    self.assertLess(docker.index("start", "base-storm"),
+      docker.index("end", "zookeeper")
+    )
+
+  def test_role_images_wait_for_base_storm(self):
+    docker = FakeDocker()
+    self._build(docker)
+    for name in ("storm-nimbus", "storm-supervisor", "storm-ui"):
+      self.assertLess(docker.index("end", "base-storm"),
+        docker.index("start", name)
+      )
+
+  def test_already_built_images_are_tagged_only(self):
+    docker = FakeDocker()
+    self._build(docker)
+    docker.events = []
+    results = self._build(docker)
+    self.assertEqual(docker.builds(), [])
+    self.assertTrue(all(result.status == image_build.BuildResult.CACHED
+      for result in results.values()
+    ))
+    self.assertEqual(sorted(name for _, name in docker.events),
+      sorted(spec.image for spec in image_build.IMAGES.values())
+    )
+
+  def test_failed_base_storm_skips_its_dependents(self):
+    docker = FakeDocker(failing=["base-storm"])
+    results = self._build(docker)
+    self.assertEqual(docker.builds(), ["base-storm", "zk-ambassador",
+      "zookeeper"
+    ])
+    self.assertEqual(results["base-storm"].status,
+      image_build.BuildResult.FAILED
+    )
+    for name in ("storm-nimbus", "storm-supervisor", "storm-ui"):
+      self.assertEqual(results[name].status, image_build.BuildResult.SKIPPED)
+    self.assertEqual(results["zookeeper"].status,
+      image_build.BuildResult.BUILT
+    )
+
+  def test_selected_images_build_their_dependencies(self):
+    docker = FakeDocker()
+    results = self._build(docker, ["storm-ui"])
+    self.assertEqual(sorted(results), ["base-storm", "storm-ui"])
+
+  def test_storm_setup_yaml_keeps_base_storm(self):
+    docker = FakeDocker()
+    self._build(docker)
+    docker.events = []
+    self._write("config/storm-setup.yaml", "servers: {}\n")
+    results = self._build(docker)
+    self.assertEqual(docker.builds(), ["storm-nimbus", "storm-supervisor",
+      "storm-ui", "zookeeper"
+    ])
+    self.assertEqual(results["base-storm"].status,
+      image_build.BuildResult.CACHED
+    )
+    with open(os.path.join(self.rootDir, "storm-ui", "storm-setup.yaml")) as f:
+      self.assertEqual(f.read(), "servers: {}\n")
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,149 @@
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+try:
+  from http.server import BaseHTTPRequestHandler, HTTPServer
+  from socketserver import ThreadingMixIn
+except ImportError:
+  from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+  from SocketServer import ThreadingMixIn
+
+from docker_python_helpers import ip_addresses
+
+class MetadataHandler(BaseHTTPRequestHandler):
+  def log_message(self, format, *args):
+    pass
+
+  def do_GET(self):
+    server = self.server
+    server.hits += 1
+    if server.delay:
+      time.sleep(server.delay)
+    prefix, _, key = self.path.rpartition("/")
+    if server.status != 200 or prefix != "/latest/meta-data" or \
+        key not in server.addresses:
+      self.send_error(server.status if server.status != 200 else 404)
+      return
+    data = server.addresses[key].encode("utf-8")
+    self.send_response(200)
+    self.send_header("Content-Length", str(len(data)))
+    self.end_headers()
+    self.wfile.write(data)
+
+class FakeMetadataServer(ThreadingMixIn, HTTPServer):
+  """Stand-in for the EC2 instance metadata service."""
+  daemon_threads = True
+
+  def __init__(self):
+    HTTPServer.__init__(self, ("127.0.0.1", 0), MetadataHandler)
+    self.hits = 0
+    self.delay = 0
+    self.status = 200
+    self.addresses = {"public-ipv4": "54.1.2.3", "local-ipv4": "10.0.0.1"}
+
+  def handle_error(self, request, clientAddress):
+    # The client gave up on a delayed answer
+    pass
+
+class EC2IpAddressesTest(unittest.TestCase):
+  def setUp(self):
+    self.server = FakeMetadataServer()
+    self.thread = threading.Thread(target=self.server.serve_forever,
+      kwargs={"poll_interval": 0.05}
+    )
+    self.thread.daemon = True
+    self.thread.start()
+    self.cacheDir = tempfile.mkdtemp()
+    self.environ = dict(os.environ)
+    os.environ["STORM_DOCKER_CACHE_DIR"] = self.cacheDir
+    self._use_url("http://127.0.0.1:{}/latest/meta-data".format(
+      self.server.server_address[1]
+    ))
+    self.timeout = ip_addresses.EC2_METADATA_TIMEOUT
+    ip_addresses.EC2_METADATA_TIMEOUT = 0.2
+
+  def tearDown(self):
+    ip_addresses.EC2_METADATA_TIMEOUT = self.timeout
+    os.environ.clear()
+    os.environ.update(self.environ)
+    self.server.shutdown()
+    self.server.server_close()
+    shutil.rmtree(self.cacheDir)
+
+  def _use_url(self, url):
+    os.environ["STORM_DOCKER_EC2_METADATA_URL"] = url
+
+  def _cache_path(self):
+    return os.path.join(self.cacheDir, "ec2-ip-addresses.json")
+
+  def test_success_is_cached(self):
+    self.assertEqual(ip_addresses.ec2_ip_addresses(),
+      ("54.1.2.3", "10.0.0.1")
+    )
+    self.assertEqual(self.server.hits, 2)
+    self.server.addresses["local-ipv4"] = "10.0.0.2"
+    self.assertEqual(ip_addresses.ec2_ip_addresses(),
+      ("54.1.2.3", "10.0.0.1")
+    )
+    self.assertEqual(self.server.hits, 2)
+
+  def test_missing_public_address_is_cached(self):
+    del self.server.addresses["public-ipv4"]
+    self.assertEqual(ip_addresses.ec2_ip_addresses(), (None, "10.0.0.1"))
+    self.assertTrue(os.path.exists(self._cache_path()))
+
+  def test_cache_expiry(self):
+    ip_addresses.ec2_ip_addresses()
+    self.server.addresses["local-ipv4"] = "10.0.0.2"
+    with open(self._cache_path()) as f:
+      cached = json.load(f)
+    cached["time"] -= ip_addresses.DEFAULT_EC2_CACHE_TTL + 1
+    with open(self._cache_path(), "w") as f:
+      json.dump(cached, f)
+    self.assertEqual(ip_addresses.ec2_ip_addresses(),
+      ("54.1.2.3", "10.0.0.2")
+    )
+    self.assertEqual(self.server.hits, 4)
+
+  def test_timeout_is_not_cached(self):
+    self.server.delay = 0.5
+    self.assertEqual(ip_addresses.ec2_ip_addresses(), (None, None))
+    self.assertFalse(os.path.exists(self._cache_path()))
+    self.server.delay = 0
+    self.assertEqual(ip_addresses.ec2_ip_addresses(),
+      ("54.1.2.3", "10.0.0.1")
+    )
+
+  def test_server_error_is_not_cached(self):
+    self.server.status = 503
+    self.assertEqual(ip_addresses.ec2_ip_addresses(), (None, None))
+    self.assertFalse(os.path.exists(self._cache_path()))
+
+  def test_connection_refused_is_cached(self):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(("127.0.0.1", 0))
+    closedPort = sock.getsockname()[1]
+    sock.close()
+    self._use_url("http://127.0.0.1:{}/latest/meta-data".format(closedPort))
+    self.assertEqual(ip_addresses.ec2_ip_addresses(), (None, None))
+    self.assertTrue(os.path.exists(self._cache_path()))
+
+  def test_cache_is_per_url(self):
+    ip_addresses.ec2_ip_addresses()
+    self._use_url("http://127.0.0.1:{}/other".format(
+      self.server.server_address[1]
+    ))
+    self.assertEqual(ip_addresses.ec2_ip_addresses(), (None, None))
+
+  def test_invalid_answer(self):
+    self.server.addresses["local-ipv4"] = "<html>"
+    self.assertRaises(ValueError, ip_addresses.ec2_ip_addresses)
+
+if __name__ == "__main__":
+  unittest.main()
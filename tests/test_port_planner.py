@@ -0,0 +1,185 @@
+import unittest
+
+from docker_python_helpers import cluster_model
+from docker_python_helpers import port_planner
+
+def _config(**sections):
+  config = {
+    "servers": {
+      "zk-1": "10.0.0.1",
+      "nimbus-1": "10.0.0.2",
+      "sup-1": "10.0.0.3",
+      "sup-2": "10.0.0.4",
+    },
+    "storm.yaml": {
+      "storm.zookeeper.servers": ["zk-1"],
+      "nimbus.host": "nimbus-1",
+    },
+    "storm.supervisor.hosts": ["sup-1", "sup-2"],
+  }
+  config.update(sections)
+  return config
+
+def _plan(config):
+  return port_planner.plan_cluster(cluster_model.ClusterModel(config, "hash"))
+
+def _conflicts(plan):
+  """Returns the conflicts as (IP address, port, [(component, key)])."""
+  return [(conflict.machine.ipAddress, conflict.port,
+      [(use.component, use.key) for use in conflict.uses]
+    ) for conflict in plan.conflicts
+  ]
+
+class PlanClusterTest(unittest.TestCase):
+  def test_machines(self):
+    plan = _plan(_config())
+    self.assertEqual(_conflicts(plan), [])
+    self.assertEqual(plan.warnings, [])
+    nimbus = plan.machines["10.0.0.2"]
+    self.assertEqual(list(nimbus.components), ["drpc", "nimbus", "ui"])
+    self.assertEqual(sorted(nimbus.ports), [3772, 3773, 6627, 8080])
+    supervisor = plan.machines["10.0.0.3"]
+    self.assertEqual(supervisor.slots, 4)
+    self.assertEqual(sorted(supervisor.ports),
+      [6700, 6701, 6702, 6703, 8000, 8001, 9190]
+    )
+
+  def test_port_collisions_on_one_machine(self):
+    config = _config()
+    # Zookeeper, Nimbus and a supervisor on one machine
+    config["servers"].update({"nimbus-1": "10.0.0.1", "sup-1": "10.0.0.1"})
+    config["storm.yaml"].update({
+      "nimbus.thrift.port": 2181,
+      "supervisor.slots.ports": [3888, 3889],
+    })
+    self.assertEqual(_conflicts(_plan(config)), [
+      ("10.0.0.1", 2181, [("nimbus", "nimbus.thrift.port"),
+        ("zookeeper", "storm.zookeeper.port")]),
+      ("10.0.0.1", 3888, [("supervisor", "supervisor.slots.ports"),
+        ("zookeeper", "election.port")]),
+    ])
+
+  def test_components_on_other_machines_do_not_collide(self):
+    config = _config()
+    config["storm.yaml"]["nimbus.thrift.port"] = 2181
+    self.assertEqual(_conflicts(_plan(config)), [])
+
+  def test_hosts_sharing_an_ip_address(self):
+    config = _config(**{"storm.supervisor.slots": {
+      "servers": {"sup-1": {"slots": 2}, "sup-2": {"slots": 3}},
+    }})
+    config["servers"]["sup-2"] = "10.0.0.3"
+    plan = _plan(config)
+    self.assertEqual(sorted(plan.machines), ["10.0.0.1", "10.0.0.2",
+      "10.0.0.3"
+    ])
+    machine = plan.machines["10.0.0.3"]
+    self.assertEqual(machine.hosts, ["sup-1", "sup-2"])
+    # A single supervisor runs there, with the slots of the last host
+    self.assertEqual(_conflicts(plan), [])
+    self.assertEqual(machine.slots, 3)
+    self.assertEqual(plan.warnings, ["supervisor hosts sup-1, sup-2 share the "
+      "IP address 10.0.0.3; only `sup-2` runs a supervisor there"
+    ])
+
+  def test_container_ports_are_shifted_by_the_stride(self):
+    plan = _plan(_config(**{"storm.supervisor.containers": {
+      "count": 2, "port.stride": 100,
+    }}))
+    self.assertEqual(_conflicts(plan), [])
+    machine = plan.machines["10.0.0.3"]
+    self.assertEqual(machine.supervisorContainers, 2)
+    self.assertEqual(sorted(machine.ports), [6700, 6701, 6702, 6703, 8000,
+      8001, 8100, 8101, 9190, 9290
+    ])
+    self.assertEqual([use.key for use in machine.ports[8100]],
+      ["logviewer.port (supervisor-1)"]
+    )
+
+  def test_stride_too_small(self):
+    plan = _plan(_config(**{"storm.supervisor.containers": {
+      "count": 2, "port.stride": 1,
+    }}))
+    # The logviewer of supervisor-1 takes the log search port of supervisor-0
+    self.assertEqual(_conflicts(plan)[:1], [
+      ("10.0.0.3", 8001, [("logviewer", "logviewer.port (supervisor-1)"),
+        ("logviewer", "search.port (supervisor-0)")]),
+    ])
+
+  def test_host_network_does_not_shift(self):
+    plan = _plan(_config(**{
+      "network_mode": "host",
+      "storm.supervisor.containers": {"count": 2},
+    }))
+    conflicts = [conflict for conflict in _conflicts(plan)
+      if conflict[0] == "10.0.0.3"
+    ]
+    self.assertEqual([conflict[1] for conflict in conflicts],
+      [8000, 8001, 9190]
+    )
+    self.assertEqual(conflicts[0][2], [
+      ("logviewer", "logviewer.port (supervisor-0)"),
+      ("logviewer", "logviewer.port (supervisor-1)"),
+    ])
+
+  def test_more_containers_than_slots(self):
+    plan = _plan(_config(**{
+      "storm.supervisor.containers": {"servers": {"sup-2": {"count": 6}}},
+    }))
+    self.assertEqual(plan.warnings, ["4 worker slots of 10.0.0.4 (sup-2) "
+      "cannot be split between 6 supervisor containers"
+    ])
+
+class OversubscriptionTest(unittest.TestCase):
+  def setUp(self):
+    self.config = _config(**{"storm.supervisor.slots": {
+      "servers": {
+        # min(4 cores, (4096 - 1024) MB // 1024) = 3 slots
+        "sup-1": {"cores": 4, "memory.mb": 4096},
+        "sup-2": {"slots": 8, "cores": 4, "memory.mb": 65536},
+      },
+    }})
+
+  def test_ratios(self):
+    plan = _plan(self.config)
+    sup1, sup2 = plan.machines["10.0.0.3"], plan.machines["10.0.0.4"]
+    self.assertEqual(sup1.slots, 3)
+    self.assertEqual(sup1.coresRatio, 0.75)
+    # Supervisor and logviewer daemons, plus 3 default worker heaps
+    self.assertEqual(sup1.memoryDemandMb, 256 + 128 + 3 * 768)
+    self.assertEqual(sup2.coresRatio, 2.0)
+    # Machines without given resources have no ratios
+    self.assertIsNone(plan.machines["10.0.0.2"].coresRatio)
+    self.assertIsNone(plan.machines["10.0.0.2"].memoryRatio)
+    self.assertEqual(plan.oversubscribed(), [sup2])
+
+  def test_worker_heaps(self):
+    self.config["storm.yaml"]["worker.childopts"] = "-Xmx2g -XX:+UseG1GC"
+    plan = _plan(self.config)
+    sup1, sup2 = plan.machines["10.0.0.3"], plan.machines["10.0.0.4"]
+    self.assertEqual(sup1.memoryDemandMb, 256 + 128 + 3 * 2048)
+    self.assertEqual(sup1.memoryRatio, 6528 / 4096.0)
+    # Most oversubscribed first
+    self.assertEqual(plan.oversubscribed(), [sup2, sup1])
+    self.assertEqual(plan.oversubscribed(maxRatio=1.8), [sup2])
+
+  def test_zookeeper_heap(self):
+    self.config["storm.supervisor.slots"]["servers"]["zk-1"] = {
+      "cores": 2, "memory.mb": 8192,
+    }
+    plan = _plan(self.config)
+    self.assertEqual(plan.machines["10.0.0.1"].memoryDemandMb, 2048)
+    self.config["zookeeper.tuning"] = {"heap.mb": 512}
+    plan = _plan(self.config)
+    self.assertEqual(plan.machines["10.0.0.1"].memoryDemandMb, 512)
+
+class HeapMbTest(unittest.TestCase):
+  def test_units(self):
+    self.assertEqual(port_planner.heap_mb("-Xms1g -Xmx2g", 768), 2048)
+    self.assertEqual(port_planner.heap_mb("-Xmx512m", 768), 512)
+    self.assertEqual(port_planner.heap_mb("-Xmx1048576k", 768), 1024)
+    self.assertEqual(port_planner.heap_mb("-Xmx268435456", 768), 256)
+    self.assertEqual(port_planner.heap_mb(None, 768), 768)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,133 @@
+import json
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), "scripts"
+))
+
+import zk_stand_in
+
+from docker_python_helpers import readiness
+
+SUPERVISORS_PATH = "/storm/supervisors"
+
+def _supervisor_info(hostname):
+  """Returns data shaped like a Java-serialized Storm SupervisorInfo record:
+  the hostname string sits among the other fields."""
+  return (b"\xac\xed\x00\x05sr\x00\x1dbacktype.storm.daemon.common."
+    b"SupervisorInfo" + b"\x00" * 12 + b"xp\x00\x00\x00\x00\x54\x3b\x2a\x10" +
+    readiness.serialized_hostname(hostname) +
+    b"sr\x00\x14clojure.lang.PersistentVector"
+  )
+
+class FakeModel(object):
+  def __init__(self, config, hostNetwork=False):
+    self.config = config
+    self.hostNetwork = hostNetwork
+
+  def ip(self, host):
+    return self.config["servers"][host]
+
+class SupervisorHostnamesTest(unittest.TestCase):
+  def setUp(self):
+    self.config = {
+      "servers": {"server-one": "10.0.0.1"},
+      "storm.yaml": {"storm.zookeeper.root": "/storm"},
+    }
+
+  def test_container_hostnames(self):
+    self.assertEqual(readiness.supervisor_hostnames(FakeModel(self.config),
+      "server-one"
+    ), ["server-one-supervisor"])
+    self.config["storm.supervisor.containers"] = {"count": 2}
+    self.assertEqual(readiness.supervisor_hostnames(FakeModel(self.config),
+      "server-one"
+    ), ["server-one-supervisor-0", "server-one-supervisor-1"])
+
+  def test_host_network(self):
+    self.assertEqual(readiness.supervisor_hostnames(
+      FakeModel(self.config, hostNetwork=True), "server-one"
+    ), ["10.0.0.1"])
+
+  def test_storm_local_hostname(self):
+    self.config["storm.yaml"]["storm.local.hostname"] = "storm-1.example.com"
+    for hostNetwork in (True, False):
+      self.assertEqual(readiness.supervisor_hostnames(
+        FakeModel(self.config, hostNetwork), "server-one"
+      ), ["storm-1.example.com"])
+
+class SupervisorRegistrationsTest(unittest.TestCase):
+  def setUp(self):
+    self.zookeeper = zk_stand_in.ZookeeperStandIn().start()
+    self.addresses = [self.zookeeper.address]
+
+  def tearDown(self):
+    self.zookeeper.stop()
+
+  def _register(self, nodeId, hostname):
+    path = "{}/{}".format(SUPERVISORS_PATH, nodeId)
+    self.zookeeper.set_node(path, _supervisor_info(hostname))
+    return self.zookeeper._nodes[path].czxid
+
+  def _registrations(self, hostname):
+    return readiness.supervisor_registrations(self.addresses,
+      SUPERVISORS_PATH, hostname
+    )
+
+  def test_serialized_hostname(self):
+    self.assertEqual(readiness.serialized_hostname("10.0.0.1"),
+      b"\x74\x00\x0810.0.0.1"
+    )
+
+  def test_no_supervisors_node(self):
+    self.assertEqual(self._registrations("10.0.0.1"), set())
+
+  def test_hostname_is_matched_exactly(self):
+    czxid = self._register("a", "10.0.0.1")
+    self._register("b", "10.0.0.12")
+    self._register("c", "10.0.0.100")
+    self._register("d", "110.0.0.1")
+    self.assertEqual(self._registrations("10.0.0.1"), set([czxid]))
+    self.assertEqual(len(self._registrations("10.0.0.12")), 1)
+    self.assertEqual(self._registrations("10.0.0.2"), set())
+
+  def test_probe_waits_for_a_new_registration(self):
+    hostname = "server-one-supervisor"
+    self._register("a", hostname)
+    self._register("b", "server-one-supervisor-0")
+    previous = self._registrations(hostname)
+    probe = lambda: readiness.probe_supervisor_registered(self.addresses,
+      SUPERVISORS_PATH, hostname, previous
+    )
+    self.assertFalse(probe())
+    # Another supervisor whose hostname starts with this one registers
+    self._register("c", "server-one-supervisor-1")
+    self.assertFalse(probe())
+    # The restarted supervisor registers again
+    self.zookeeper.delete_node("{}/a".format(SUPERVISORS_PATH))
+    self._register("d", hostname)
+    self.assertTrue(probe())
+
+  def test_tree_file_registrations(self):
+    tmpDir = tempfile.mkdtemp()
+    try:
+      treeFile = os.path.join(tmpDir, "tree.json")
+      with open(treeFile, "w") as f:
+        json.dump({"/storm/supervisors/a": {"hostname": "10.0.0.1"}}, f)
+      zookeeper = zk_stand_in.ZookeeperStandIn(treeFile=treeFile).start()
+      try:
+        self.assertEqual(len(readiness.supervisor_registrations(
+          [zookeeper.address], SUPERVISORS_PATH, "10.0.0.1"
+        )), 1)
+      finally:
+        zookeeper.stop()
+    finally:
+      shutil.rmtree(tmpDir)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,220 @@
+import copy
+import unittest
+
+from docker_python_helpers import cluster_model
+from docker_python_helpers import docker_run
+from docker_python_helpers import reconcile
+
+def _inspected(spec, imageId="sha256:nimbus", startedAt="2016-01-01T00:00:00"):
+  """Returns the `docker inspect` dict of a container running as `spec`."""
+  bindings = {}
+  for binding in spec.portBindings:
+    host, containerPort = binding.split("->")
+    hostIp, hostPort = host.rsplit(":", 1)
+    bindings.setdefault(containerPort, []).append(
+      {"HostIp": hostIp, "HostPort": hostPort}
+    )
+  return {
+    "Image": imageId,
+    "State": {"Running": True, "StartedAt": startedAt},
+    "Config": {
+      "Image": spec.image,
+      "Hostname": spec.hostname,
+      "Labels": {cluster_model.CONFIG_HASH_LABEL: spec.configHash},
+    },
+    "HostConfig": {
+      "PortBindings": bindings,
+      "Links": ["/{}:/{}/{}".format(link.split(":")[0], spec.name,
+        link.split(":")[1]) for link in spec.links
+      ],
+      "CpusetCpus": spec.cpusetCpus,
+      "CpusetMems": spec.cpusetMems,
+    },
+  }
+
+class FakeDocker(object):
+  """`inspect` for `compute_plan`, recording the names it is asked about."""
+  def __init__(self, containers, images):
+    self.containers = containers
+    self.images = images
+    self.calls = []
+
+  def inspect(self, name, image=False):
+    self.calls.append((name, image))
+    if image:
+      return {"Id": self.images[name]} if name in self.images else None
+    return self.containers.get(name)
+
+class ComputePlanTest(unittest.TestCase):
+  def setUp(self):
+    self.specs = {
+      "nimbus": reconcile.ContainerSpec("nimbus", reconcile.NIMBUS_IMAGE,
+        "nimbus", ["-p 6627:6627"], links=["zookeeper:zk"],
+        hostname="nimbus", configHash="abc"
+      ),
+      "ui": reconcile.ContainerSpec("ui", reconcile.UI_IMAGE, "ui",
+        ["-p 8080:8080"], links=["nimbus:nimbus"], configHash="abc"
+      ),
+    }
+    self.docker = FakeDocker({
+      "nimbus": _inspected(self.specs["nimbus"]),
+      "ui": _inspected(self.specs["ui"], "sha256:ui"),
+    }, {
+      reconcile.NIMBUS_IMAGE: "sha256:nimbus",
+      reconcile.UI_IMAGE: "sha256:ui",
+    })
+
+  def _plan(self, existingNames=()):
+    plan = reconcile.compute_plan(self.specs, self.docker.inspect,
+      list(existingNames)
+    )
+    return dict((item.name, item) for item in plan)
+
+  def test_unchanged_containers_are_kept(self):
+    plan = self._plan()
+    self.assertEqual(sorted(plan), ["nimbus", "ui"])
+    for item in plan.values():
+      self.assertEqual(item.action, reconcile.PlanItem.KEEP)
+      self.assertEqual(item.reasons, [])
+    # Each container and image is inspected once
+    self.assertEqual(len(self.docker.calls), len(set(self.docker.calls)))
+
+  def test_missing_container_is_created(self):
+    del self.docker.containers["ui"]
+    plan = self._plan()
+    self.assertEqual(plan["ui"].action, reconcile.PlanItem.CREATE)
+    self.assertEqual(plan["nimbus"].action, reconcile.PlanItem.KEEP)
+
+  def test_rebuilt_image_restarts_linking_containers(self):
+    self.docker.images[reconcile.NIMBUS_IMAGE] = "sha256:rebuilt"
+    plan = self._plan()
+    self.assertEqual(plan["nimbus"].action, reconcile.PlanItem.RECREATE)
+    self.assertEqual(plan["nimbus"].reasons,
+      ["image {} was rebuilt".format(reconcile.NIMBUS_IMAGE)]
+    )
+    self.assertEqual(plan["ui"].action, reconcile.PlanItem.RECREATE)
+    self.assertEqual(plan["ui"].reasons, ["linked container nimbus restarts"])
+
+  def test_changed_ports_and_config(self):
+    self.specs["ui"] = reconcile.ContainerSpec("ui", reconcile.UI_IMAGE, "ui",
+      ["-p 8081:8080"], links=["nimbus:nimbus"], configHash="def"
+    )
+    reasons = self._plan()["ui"].reasons
+    self.assertEqual(reasons, [
+      "ports differ (+:8081->8080/tcp -:8080->8080/tcp)",
+      "configuration changed",
+    ])
+
+  def test_link_target_restarted_later(self):
+    self.docker.containers["nimbus"]["State"]["StartedAt"] = \
+      "2016-02-01T00:00:00"
+    plan = self._plan()
+    self.assertEqual(plan["nimbus"].action, reconcile.PlanItem.KEEP)
+    self.assertEqual(plan["ui"].reasons, ["linked container nimbus restarted"])
+
+  def test_stale_containers_are_removed(self):
+    self.docker.containers["supervisor-1"] = {"State": {"Running": True}}
+    self.docker.containers["zookeeper"] = {"State": {"Running": True}}
+    plan = self._plan(existingNames=["nimbus", "ui", "supervisor-1", "other"])
+    self.assertEqual(plan["supervisor-1"].action, reconcile.PlanItem.REMOVE)
+    self.assertEqual(plan["supervisor-1"].component, "supervisor")
+    self.assertEqual(plan["zookeeper"].action, reconcile.PlanItem.REMOVE)
+    self.assertIsNone(plan["zookeeper"].component)
+    self.assertNotIn("other", plan)
+
+class DesiredContainersTest(unittest.TestCase):
+  """A change to the configuration only replaces the containers it reaches."""
+  def setUp(self):
+    self.config = {
+      "servers": {
+        "nimbus-1": "10.0.0.1",
+        "sup-1": "10.0.0.2",
+        "sup-2": "10.0.0.3",
+      },
+      "storm.yaml": {
+        "storm.zookeeper.servers": ["nimbus-1"],
+        "nimbus.host": "nimbus-1",
+        "supervisor.slots.ports": [6700, 6701],
+      },
+      "storm.supervisor.hosts": ["sup-1", "sup-2"],
+      "storm.supervisor.slots": {
+        "servers": {"sup-1": {"slots": 4}, "sup-2": {"slots": 4}},
+      },
+      "is_localhost_setup": False,
+    }
+    self.getClusterModel = docker_run.get_cluster_model
+
+  def tearDown(self):
+    docker_run.get_cluster_model = self.getClusterModel
+
+  def _specs(self, config, ipv4Address):
+    model = cluster_model.ClusterModel(config, "hash")
+    # `construct_docker_run_port_args` reads the ports from this model
+    docker_run.get_cluster_model = lambda: model
+    return reconcile.desired_containers(model, [ipv4Address])
+
+  def _plan(self, newConfig, ipv4Address):
+    running = self._specs(self.config, ipv4Address)
+    docker = FakeDocker(dict((name, _inspected(spec))
+      for name, spec in running.items()
+    ), dict((spec.image, "sha256:nimbus") for spec in running.values()))
+    plan = reconcile.compute_plan(self._specs(newConfig, ipv4Address),
+      docker.inspect, list(running)
+    )
+    return dict((item.name, item) for item in plan)
+
+  def test_per_host_slots_only_replace_that_supervisor(self):
+    newConfig = copy.deepcopy(self.config)
+    newConfig["storm.supervisor.slots"]["servers"]["sup-2"]["slots"] = 6
+
+    plan = self._plan(newConfig, "10.0.0.3")
+    self.assertEqual(plan["supervisor"].action, reconcile.PlanItem.RECREATE)
+    self.assertIn("configuration changed", plan["supervisor"].reasons)
+    for ipv4Address in ["10.0.0.1", "10.0.0.2"]:
+      for item in self._plan(newConfig, ipv4Address).values():
+        self.assertEqual(item.action, reconcile.PlanItem.KEEP, item)
+
+  def test_supervisor_sections_keep_nimbus(self):
+    newConfig = copy.deepcopy(self.config)
+    newConfig["storm.supervisor.metrics"] = {"enabled": False}
+
+    plan = self._plan(newConfig, "10.0.0.1")
+    self.assertEqual(sorted(plan), ["nimbus", "ui", "zookeeper"])
+    for item in plan.values():
+      self.assertEqual(item.action, reconcile.PlanItem.KEEP, item)
+    plan = self._plan(newConfig, "10.0.0.2")
+    self.assertEqual(plan["supervisor"].reasons, ["configuration changed"])
+
+  def test_new_supervisor_host(self):
+    newConfig = copy.deepcopy(self.config)
+    newConfig["servers"]["sup-3"] = "10.0.0.4"
+    newConfig["storm.supervisor.hosts"].append("sup-3")
+
+    for item in self._plan(newConfig, "10.0.0.1").values():
+      self.assertEqual(item.action, reconcile.PlanItem.KEEP, item)
+    # The other supervisors resolve the new one through their dnsmasq hosts
+    plan = self._plan(newConfig, "10.0.0.2")
+    self.assertEqual(plan["supervisor"].reasons, ["configuration changed"])
+    newConfig["service.discovery"] = self.config["service.discovery"] = {}
+    plan = self._plan(newConfig, "10.0.0.2")
+    self.assertEqual(plan["supervisor"].action, reconcile.PlanItem.KEEP)
+
+class ApplyPlanTest(unittest.TestCase):
+  def test_removes_then_starts_in_component_order(self):
+    plan = [
+      reconcile.PlanItem("ui", reconcile.PlanItem.RECREATE, "ui"),
+      reconcile.PlanItem("nimbus", reconcile.PlanItem.CREATE, "nimbus"),
+      reconcile.PlanItem("zookeeper", reconcile.PlanItem.KEEP, "zookeeper"),
+      reconcile.PlanItem("supervisor-1", reconcile.PlanItem.REMOVE,
+        "supervisor"
+      ),
+    ]
+    removed, started = [], []
+    self.assertEqual(reconcile.apply_plan(plan, started.append,
+      removed.append
+    ), ["nimbus", "ui"])
+    self.assertEqual(removed, ["ui", "supervisor-1"])
+    self.assertEqual(started, ["nimbus", "ui"])
+
+if __name__ == "__main__":
+  unittest.main()
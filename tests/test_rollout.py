@@ -0,0 +1,166 @@
+import threading
+import unittest
+
+from docker_python_helpers import rollout
+
+class FakeExecutor(object):
+  """Executor recording the commands it is given, failing those of the hosts
+  in `failingHosts` with a RemoteCommandError."""
+  def __init__(self, failingHosts=()):
+    self.failingHosts = set(failingHosts)
+    self.commands = []
+    self._lock = threading.Lock()
+
+  def run(self, host, command):
+    with self._lock:
+      self.commands.append((host, command))
+    if host in self.failingHosts and "start-storm.sh" in command:
+      raise rollout.RemoteCommandError(host, command, 3,
+        "output of {}\n".format(host)
+      )
+    return "started on {}\n".format(host)
+
+def _waves():
+  return [
+    rollout.Wave("zookeeper", [rollout.RolloutStep("zookeeper",
+      ["zk-1", "zk-2", "zk-3"]
+    )]),
+    rollout.Wave("nimbus", [rollout.RolloutStep("nimbus", ["nimbus-1"])]),
+  ]
+
+class RunWavesTest(unittest.TestCase):
+  def test_all_hosts_succeed(self):
+    executor = FakeExecutor()
+    report = rollout.run_waves(_waves(), executor, poolSize=2)
+    self.assertTrue(report.succeeded)
+    self.assertEqual([name for name, _ in report.waves],
+      ["zookeeper", "nimbus"]
+    )
+    self.assertEqual(sorted(result.host for result in report.results),
+      ["nimbus-1", "zk-1", "zk-2", "zk-3"]
+    )
+    # destroy-storm.sh then start-storm.sh on every host
+    self.assertEqual(len(executor.commands), 8)
+
+  def test_failure_is_reported_per_host(self):
+    executor = FakeExecutor(failingHosts=["zk-2"])
+    seen = []
+    report = rollout.run_waves(_waves(), executor, poolSize=2,
+      onResult=seen.append
+    )
+    self.assertFalse(report.succeeded)
+    # The other hosts of the failing wave still ran, and succeeded
+    results = dict((result.host, result) for result in report.results)
+    self.assertEqual(sorted(results), ["zk-1", "zk-2", "zk-3"])
+    self.assertTrue(results["zk-1"].succeeded)
+    self.assertTrue(results["zk-3"].succeeded)
+    self.assertEqual(results["zk-3"].output, "started on zk-3\n")
+    # The failing host keeps its error and the output of its command
+    failure = results["zk-2"]
+    self.assertFalse(failure.succeeded)
+    self.assertIsInstance(failure.error, rollout.RemoteCommandError)
+    self.assertEqual(failure.error.returncode, 3)
+    self.assertEqual(failure.output, "output of zk-2\n")
+    self.assertEqual(report.failures, [failure])
+    # Later waves depend on the failed one
+    self.assertEqual(report.skippedWaves, ["nimbus"])
+    self.assertNotIn("nimbus-1", [host for host, _ in executor.commands])
+    self.assertEqual(sorted(result.host for result in seen),
+      ["zk-1", "zk-2", "zk-3"]
+    )
+
+  def test_failed_gate_skips_later_waves(self):
+    waves = _waves()
+    waves[0].gate = lambda: False
+    report = rollout.run_waves(waves, FakeExecutor())
+    self.assertFalse(report.succeeded)
+    self.assertEqual(report.gates, [("zookeeper", False)])
+    self.assertEqual(report.skippedWaves, ["nimbus"])
+
+  def test_destroy_failure_is_ignored(self):
+    class NoContainersExecutor(FakeExecutor):
+      def run(self, host, command):
+        if "destroy-storm.sh" in command:
+          raise rollout.RemoteCommandError(host, command, 1)
+        return FakeExecutor.run(self, host, command)
+    report = rollout.run_waves(_waves()[1:], NoContainersExecutor())
+    self.assertTrue(report.succeeded)
+
+def _config(nimbusHost, networkMode=None):
+  config = {
+    "servers": {
+      "zk-1": "10.0.0.1", "zk-2": "10.0.0.2", "nimbus-1": "10.0.0.3",
+      "sup-1": "10.0.0.4", "sup-2": "10.0.0.5",
+    },
+    "storm.yaml": {
+      "storm.zookeeper.servers": ["zk-1", "zk-2"],
+      "nimbus.host": nimbusHost,
+    },
+    "storm.supervisor.hosts": ["sup-1", "sup-2"],
+  }
+  if networkMode is not None:
+    config["network_mode"] = networkMode
+  return config
+
+def _steps(waves):
+  return [(wave.name, [(step.component, step.hosts) for step in wave.steps])
+    for wave in waves
+  ]
+
+class PlanWavesTest(unittest.TestCase):
+  def test_nimbus_on_its_own_machine(self):
+    waves = rollout.plan_waves(_config("nimbus-1"), zookeeper=True,
+      nimbus=True, ui=True, supervisor=True
+    )
+    self.assertEqual(_steps(waves), [
+      ("zookeeper", [("zookeeper-with-ambassador", ["zk-1"]),
+        ("zookeeper", ["zk-2"])
+      ]),
+      ("nimbus", [("nimbus-with-zookeeper-ambassador", ["nimbus-1"])]),
+      ("ui-and-supervisors", [("ui-on-zk-ambassador-machine", ["nimbus-1"]),
+        ("supervisor", ["sup-1", "sup-2"])
+      ]),
+    ])
+
+  def test_nimbus_with_zookeeper(self):
+    waves = rollout.plan_waves(_config("zk-2"), zookeeper=True, nimbus=True,
+      ui=True, supervisor=True
+    )
+    self.assertEqual(_steps(waves), [
+      ("zookeeper", [("zookeeper", ["zk-1", "zk-2"])]),
+      ("nimbus", [("nimbus", ["zk-2"])]),
+      ("ui-and-supervisors", [("ui", ["zk-2"]),
+        ("supervisor", ["sup-1", "sup-2"])
+      ]),
+    ])
+
+  def test_host_network_needs_no_ambassador(self):
+    waves = rollout.plan_waves(_config("nimbus-1", "host"), zookeeper=True,
+      nimbus=True, ui=True
+    )
+    self.assertEqual(_steps(waves), [
+      ("zookeeper", [("zookeeper", ["zk-1", "zk-2"])]),
+      ("nimbus", [("nimbus", ["nimbus-1"])]),
+      ("ui-and-supervisors", [("ui", ["nimbus-1"])]),
+    ])
+
+  def test_empty_waves_are_left_out(self):
+    waves = rollout.plan_waves(_config("nimbus-1"), ui=True)
+    self.assertEqual(_steps(waves), [
+      ("ui-and-supervisors", [("ui-on-zk-ambassador-machine", ["nimbus-1"])]),
+    ])
+    self.assertEqual(rollout.plan_waves(_config("nimbus-1")), [])
+
+  def test_split_supervisor_batches(self):
+    waves = rollout.plan_waves(_config("zk-2"), nimbus=True, supervisor=True)
+    waves = rollout.split_supervisor_batches(waves,
+      rollout.parse_max_unavailable("50%", 2)
+    )
+    self.assertEqual(_steps(waves), [
+      ("nimbus", [("nimbus", ["zk-2"])]),
+      ("supervisors-1-of-2", [("supervisor", ["sup-1"])]),
+      ("supervisors-2-of-2", [("supervisor", ["sup-2"])]),
+    ])
+
+if __name__ == "__main__":
+  unittest.main()
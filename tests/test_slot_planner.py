@@ -0,0 +1,111 @@
+import unittest
+
+from docker_python_helpers import cluster_model
+from docker_python_helpers import slot_planner
+
+def _model(slotsConfig=None):
+  config = {
+    "servers": {"sup-1": "10.0.0.1", "sup-2": "10.0.0.2"},
+    "storm.yaml": {"supervisor.slots.ports": [6700, 6701, 6702]},
+    "storm.supervisor.hosts": ["sup-1", "sup-2"],
+  }
+  if slotsConfig is not None:
+    config[slot_planner.SLOTS_SECTION] = slotsConfig
+  return cluster_model.ClusterModel(config, "hash")
+
+class SlotCountTest(unittest.TestCase):
+  def test_defaults(self):
+    # 1 core and 1024 MB per slot, after 1024 MB reserved
+    self.assertEqual(slot_planner.slot_count(8, 16384, {}), 8)
+    self.assertEqual(slot_planner.slot_count(32, 5120, {}), 4)
+
+  def test_cores_and_memory_per_slot(self):
+    slotsConfig = {"cores.per.slot": 2, "memory.mb.per.slot": 3072,
+      "reserved.memory.mb": 4096}
+    # Bound by the cores
+    self.assertEqual(slot_planner.slot_count(8, 65536, slotsConfig), 4)
+    # Bound by the memory: (16384 - 4096) // 3072
+    self.assertEqual(slot_planner.slot_count(16, 16384, slotsConfig), 4)
+    self.assertEqual(slot_planner.slot_count(16, 16383, slotsConfig), 3)
+    # Fractional cores per slot
+    self.assertEqual(slot_planner.slot_count(3, 65536,
+      {"cores.per.slot": 0.5}
+    ), 6)
+
+  def test_clamping(self):
+    self.assertEqual(slot_planner.slot_count(64, 65536, {"max.slots": 10}),
+      10
+    )
+    # No memory left after the reservation
+    self.assertEqual(slot_planner.slot_count(4, 1024, {}), 1)
+    self.assertEqual(slot_planner.slot_count(4, 1024, {"min.slots": 2}), 2)
+    # `max.slots` wins over `min.slots`
+    self.assertEqual(slot_planner.slot_count(4, 1024,
+      {"min.slots": 4, "max.slots": 3}
+    ), 3)
+
+class PlanSlotsTest(unittest.TestCase):
+  def test_without_section(self):
+    plan = slot_planner.plan_slots(_model(), "sup-1", (64, 65536))
+    self.assertEqual(plan.ports, [6700, 6701, 6702])
+    self.assertIsNone(plan.cores)
+
+  def test_from_machine_resources(self):
+    plan = slot_planner.plan_slots(_model({"max.slots": 6}), "sup-1",
+      (4, 8192)
+    )
+    self.assertEqual(plan.ports, [6700, 6701, 6702, 6703])
+    self.assertEqual((plan.cores, plan.memoryMb), (4, 8192))
+    plan = slot_planner.plan_slots(_model({"max.slots": 6}), "sup-1",
+      (16, 65536)
+    )
+    self.assertEqual(plan.slots, 6)
+
+  def test_first_port(self):
+    plan = slot_planner.plan_slots(_model({"first.port": 7000}), "sup-1",
+      (2, 8192)
+    )
+    self.assertEqual(plan.ports, [7000, 7001])
+
+  def test_per_server_overrides(self):
+    model = _model({
+      "max.slots": 8,
+      "servers": {
+        "sup-1": {"slots": 12},
+        "sup-2": {"cores": 3, "memory.mb": 65536},
+      },
+    })
+    # `slots` is used as is, even above `max.slots`
+    plan = slot_planner.plan_slots(model, "sup-1", (1, 1024))
+    self.assertEqual(plan.ports, list(range(6700, 6712)))
+    # Both resources overridden: the machine's are ignored
+    plan = slot_planner.plan_slots(model, "sup-2", (64, 1024))
+    self.assertEqual(plan.ports, [6700, 6701, 6702])
+    self.assertEqual((plan.cores, plan.memoryMb), (3, 65536))
+
+  def test_partial_override(self):
+    model = _model({"servers": {"sup-2": {"memory.mb": 3072}}})
+    plan = slot_planner.plan_slots(model, "sup-2", (16, 65536))
+    self.assertEqual((plan.cores, plan.memoryMb), (16, 3072))
+    self.assertEqual(plan.slots, 2)
+    # Other hosts use their own resources
+    plan = slot_planner.plan_slots(model, "sup-1", (16, 65536))
+    self.assertEqual(plan.slots, 16)
+
+class SupervisorHostTest(unittest.TestCase):
+  def test_last_listed_host_of_the_machine(self):
+    model = cluster_model.ClusterModel({
+      "servers": {
+        "sup-1": "127.0.0.1",
+        "sup-2": "127.0.0.1",
+        "sup-3": "10.0.0.3",
+      },
+      "storm.supervisor.hosts": ["sup-1", "sup-2", "sup-3"],
+    }, "hash")
+    self.assertEqual(slot_planner.supervisor_host(model, ["127.0.0.1"]),
+      "sup-2"
+    )
+    self.assertIsNone(slot_planner.supervisor_host(model, ["10.0.0.9"]))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,142 @@
+import argparse
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(REPO_DIR, "scripts"))
+sys.path.insert(0, os.path.join(REPO_DIR, "storm-supervisor"))
+
+import storm_service_registry
+import zk_stand_in
+
+from docker_python_helpers import zk_client
+
+HOSTS_PATH = storm_service_registry.hosts_path(
+  storm_service_registry.DEFAULT_ZK_ROOT
+)
+
+def _wait_for(predicate, timeout=5.0):
+  """Returns True once `predicate()` is true, or False after `timeout`."""
+  deadline = time.time() + timeout
+  while not predicate():
+    if time.time() >= deadline:
+      return False
+    time.sleep(0.02)
+  return True
+
+class HostsFileContentsTest(unittest.TestCase):
+  def test_leaves_out_own_name_and_local_loopback_containers(self):
+    registry = {
+      "a-supervisor": "10.0.0.1",
+      "b-supervisor": "10.0.0.2",
+      "c-supervisor-0": "127.0.0.1",
+      "c-supervisor-1": "127.0.0.1",
+      "d-supervisor": "10.0.0.1",
+    }
+    self.assertEqual(storm_service_registry.hosts_file_contents(registry,
+      set(["10.0.0.1", "127.0.0.1"]), "c-supervisor-0"
+    ), "10.0.0.1 a-supervisor\n10.0.0.2 b-supervisor\n10.0.0.1 d-supervisor\n")
+
+class RegistryTest(unittest.TestCase):
+  def setUp(self):
+    self.zookeeper = zk_stand_in.ZookeeperStandIn().start()
+    self.clients = []
+    self.tmpDir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    for client in self.clients:
+      client.close()
+    self.zookeeper.stop()
+    shutil.rmtree(self.tmpDir)
+
+  def _client(self):
+    client = zk_client.ZookeeperClient([self.zookeeper.address])
+    client.connect()
+    self.clients.append(client)
+    return client
+
+  def _registry(self):
+    client = zk_client.ZookeeperClient([self.zookeeper.address])
+    with client:
+      try:
+        return storm_service_registry.read_registry(client, HOSTS_PATH)
+      except zk_client.NoNodeError:
+        return {}
+
+  def test_registration_ends_with_its_session(self):
+    client = self._client()
+    storm_service_registry.register(client, HOSTS_PATH, "a-supervisor",
+      "10.0.0.1"
+    )
+    self.assertEqual(self._registry(), {"a-supervisor": "10.0.0.1"})
+    client.close()
+    self.assertTrue(_wait_for(lambda: self._registry() == {}))
+
+  def test_replaces_node_of_previous_session(self):
+    # Left by the previous container, whose session has not expired yet
+    path = HOSTS_PATH + "/a-supervisor"
+    self.zookeeper.set_node(path, "10.0.0.9")
+    client = self._client()
+    storm_service_registry.register(client, HOSTS_PATH, "a-supervisor",
+      "10.0.0.1"
+    )
+    self.assertEqual(self._registry(), {"a-supervisor": "10.0.0.1"})
+    self.assertEqual(self.zookeeper._nodes[path].ephemeralOwner,
+      client.sessionId
+    )
+
+  def test_read_registry_watches_for_registrants(self):
+    client = self._client()
+    storm_service_registry.register(client, HOSTS_PATH, "a-supervisor",
+      "10.0.0.1"
+    )
+    self.assertEqual(storm_service_registry.read_registry(client, HOSTS_PATH),
+      {"a-supervisor": "10.0.0.1"}
+    )
+    storm_service_registry.register(self._client(), HOSTS_PATH,
+      "b-supervisor", "10.0.0.2"
+    )
+    self.assertIsNotNone(client.wait_event(5.0))
+    self.assertEqual(storm_service_registry.read_registry(client, HOSTS_PATH),
+      {"a-supervisor": "10.0.0.1", "b-supervisor": "10.0.0.2"}
+    )
+
+  def test_run_registry_keeps_the_hosts_file(self):
+    hostsFile = os.path.join(self.tmpDir, "extra-hosts")
+    args = argparse.Namespace(name="a-supervisor", ip="10.0.0.1",
+      own_ip_addresses=None, zk_root=storm_service_registry.DEFAULT_ZK_ROOT,
+      zookeeper=[self.zookeeper.address], storm_yaml=None,
+      session_timeout_ms=10000, hosts_file=hostsFile, no_dnsmasq_reload=True
+    )
+    # Blocks on the registry's watches until the process exits
+    thread = threading.Thread(target=storm_service_registry.run_registry,
+      args=(args,)
+    )
+    thread.daemon = True
+    thread.start()
+
+    def hosts():
+      try:
+        with open(hostsFile) as f:
+          return f.read()
+      except IOError:
+        return None
+
+    self.assertTrue(_wait_for(lambda: hosts() == ""))
+    self.assertEqual(self._registry(), {"a-supervisor": "10.0.0.1"})
+    other = self._client()
+    storm_service_registry.register(other, HOSTS_PATH, "b-supervisor",
+      "10.0.0.2"
+    )
+    self.assertTrue(_wait_for(lambda: hosts() == "10.0.0.2 b-supervisor\n"))
+    other.close()
+    self.assertTrue(_wait_for(lambda: hosts() == ""))
+
+if __name__ == "__main__":
+  unittest.main()
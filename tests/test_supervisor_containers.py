@@ -0,0 +1,176 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from docker_python_helpers import supervisor_containers
+
+def _config(**containersConfig):
+  config = {
+    "servers": {"sup-1": "10.0.0.1", "sup-2": "10.0.0.2"},
+    "storm.supervisor.hosts": ["sup-1", "sup-2"],
+  }
+  if containersConfig:
+    config[supervisor_containers.CONTAINERS_SECTION] = containersConfig
+  return config
+
+class SplitPortsTest(unittest.TestCase):
+  def test_even_split(self):
+    self.assertEqual(supervisor_containers.split_ports(range(6700, 6704), 2),
+      [[6700, 6701], [6702, 6703]]
+    )
+
+  def test_uneven_split(self):
+    # The first parts take the remaining ports
+    self.assertEqual(supervisor_containers.split_ports(range(6700, 6707), 3),
+      [[6700, 6701, 6702], [6703, 6704], [6705, 6706]]
+    )
+
+  def test_fewer_ports_than_parts(self):
+    self.assertEqual(supervisor_containers.split_ports([6700, 6701], 3),
+      [[6700], [6701], []]
+    )
+    self.assertEqual(supervisor_containers.split_ports([], 1), [[]])
+
+class ParseCpuListTest(unittest.TestCase):
+  def test_ranges_and_single_cpus(self):
+    self.assertEqual(supervisor_containers.parse_cpu_list("0-3,8,10-11\n"),
+      [0, 1, 2, 3, 8, 10, 11]
+    )
+
+  def test_empty(self):
+    self.assertEqual(supervisor_containers.parse_cpu_list(""), [])
+    self.assertEqual(supervisor_containers.parse_cpu_list("\n"), [])
+
+class NumaNodesTest(unittest.TestCase):
+  def setUp(self):
+    self.sysfsDir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.sysfsDir)
+
+  def _node(self, name, cpuList=None, memTotalKb=None):
+    nodeDir = os.path.join(self.sysfsDir, name)
+    os.makedirs(nodeDir)
+    if cpuList is not None:
+      with open(os.path.join(nodeDir, "cpulist"), "w") as f:
+        f.write(cpuList + "\n")
+    if memTotalKb is not None:
+      with open(os.path.join(nodeDir, "meminfo"), "w") as f:
+        f.write("Node 0 MemTotal:       {} kB\n"
+          "Node 0 MemFree:        1024 kB\n".format(memTotalKb)
+        )
+
+  def test_nodes_with_cpus_in_order(self):
+    self._node("node10", "16-23", 16777216)
+    self._node("node1", "8-15,24-31")
+    self._node("node0", "0-7", 33554432)
+    # Memory-only node, eg. persistent memory or a CXL expander
+    self._node("node2", "", 67108864)
+    # Not a node, or unreadable
+    self._node("nodefoo", "0-3")
+    self._node("node3")
+    open(os.path.join(self.sysfsDir, "possible"), "w").close()
+
+    nodes = supervisor_containers.numa_nodes(self.sysfsDir)
+    self.assertEqual([(node.nodeId, node.cpuList, node.memoryMb)
+      for node in nodes
+    ], [(0, "0-7", 32768), (1, "8-15,24-31", None), (10, "16-23", 16384)])
+    self.assertEqual(nodes[1].cpus, 16)
+
+  def test_missing_topology(self):
+    self.assertEqual(supervisor_containers.numa_nodes(
+      os.path.join(self.sysfsDir, "missing")
+    ), [])
+
+class PlanContainersTest(unittest.TestCase):
+  def setUp(self):
+    self.nodes = [
+      supervisor_containers.NumaNode(0, "0-7"),
+      supervisor_containers.NumaNode(1, "8-15"),
+    ]
+
+  def test_single_container(self):
+    containers = supervisor_containers.plan_containers(_config(), "sup-1",
+      range(6700, 6704), self.nodes
+    )
+    self.assertEqual(len(containers), 1)
+    container = containers[0]
+    self.assertEqual((container.name, container.hostname),
+      ("supervisor", "sup-1-supervisor")
+    )
+    self.assertEqual(container.ports, [6700, 6701, 6702, 6703])
+    # A single container is not pinned
+    self.assertIsNone(container.node)
+    self.assertEqual(container.sshPort, supervisor_containers.SSH_PORT)
+
+  def test_uneven_split_between_containers(self):
+    containers = supervisor_containers.plan_containers(_config(count=3),
+      "sup-1", range(6700, 6705), self.nodes
+    )
+    self.assertEqual([container.name for container in containers],
+      ["supervisor-0", "supervisor-1", "supervisor-2"]
+    )
+    self.assertEqual([container.ports for container in containers],
+      [[6700, 6701], [6702, 6703], [6704]]
+    )
+    self.assertEqual([container.portShift for container in containers],
+      [0, 10, 20]
+    )
+    self.assertEqual(containers[2].sshPort, supervisor_containers.SSH_PORT + 20)
+
+  def test_more_containers_than_nodes_wrap_around(self):
+    containers = supervisor_containers.plan_containers(_config(count=3,
+      **{"port.stride": 100}), "sup-1", range(6700, 6706), self.nodes
+    )
+    self.assertEqual([container.node.nodeId for container in containers],
+      [0, 1, 0]
+    )
+    self.assertEqual(containers[1].portShift, 100)
+
+  def test_without_pinning(self):
+    config = _config(count=2, **{"numa.pinning": False})
+    for nodes in (self.nodes, []):
+      containers = supervisor_containers.plan_containers(config, "sup-1",
+        range(6700, 6704), nodes
+      )
+      self.assertEqual([container.node for container in containers],
+        [None, None]
+      )
+
+  def test_per_server_count(self):
+    config = _config(count=2, servers={"sup-2": {"count": 1}})
+    self.assertEqual(supervisor_containers.container_hostnames(config,
+      "sup-1"
+    ), ["sup-1-supervisor-0", "sup-1-supervisor-1"])
+    self.assertEqual(supervisor_containers.container_hostnames(config,
+      "sup-2"
+    ), ["sup-2-supervisor"])
+
+class ContainerNamesTest(unittest.TestCase):
+  def test_is_container_name(self):
+    for name in ("supervisor", "supervisor-0", "supervisor-12"):
+      self.assertTrue(supervisor_containers.is_container_name(name), name)
+    for name in ("supervisor-", "supervisor-a", "old-supervisor", "nimbus"):
+      self.assertFalse(supervisor_containers.is_container_name(name), name)
+
+class ExtraHostsTest(unittest.TestCase):
+  def test_other_machines_and_own_containers(self):
+    config = _config(count=2, servers={"sup-2": {"count": 1}})
+    self.assertEqual(supervisor_containers.extra_hosts(config, "sup-1",
+      "sup-1-supervisor-0"
+    ), ["10.0.0.1 sup-1-supervisor-1", "10.0.0.2 sup-2-supervisor"])
+    self.assertEqual(supervisor_containers.extra_hosts(config, "sup-2",
+      "sup-2-supervisor"
+    ), ["10.0.0.1 sup-1-supervisor-0", "10.0.0.1 sup-1-supervisor-1"])
+
+  def test_loopback_hosts_are_left_out(self):
+    config = _config(count=2)
+    config["servers"] = {"sup-1": "127.0.0.1", "sup-2": "127.0.0.1"}
+    self.assertEqual(supervisor_containers.extra_hosts(config, "sup-2",
+      "sup-2-supervisor-1"
+    ), [])
+
+if __name__ == "__main__":
+  unittest.main()
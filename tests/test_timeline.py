@@ -0,0 +1,186 @@
+import json
+import time
+import unittest
+
+from docker_python_helpers import rollout
+from docker_python_helpers import timeline
+from docker_python_helpers import timing
+
+def _span_line(name, start, end, **fields):
+  fields.update({timing.SPAN_KEY: name, "start": start, "end": end})
+  return json.dumps(fields) + "\n"
+
+class FakeExecutor(object):
+  """Executor whose commands print the spans of a host whose clock is `skew`
+  seconds ahead of the local one."""
+  def __init__(self, skew=0.0, fail=False, outputs=None):
+    self.skew = skew
+    self.fail = fail
+    # Command -> output, instead of the default one
+    self.outputs = outputs or {}
+    self.commands = []
+
+  def run(self, host, command):
+    self.commands.append((host, command))
+    for key, output in self.outputs.items():
+      if key in command:
+        return output
+    now = time.time() + self.skew
+    output = "starting\n" + _span_line("docker.run", now, now + 0.01) + \
+      "started\n"
+    # The command outlasts its spans
+    time.sleep(0.05)
+    if self.fail:
+      raise rollout.RemoteCommandError(host, command, 1, output)
+    return output
+
+class ParseSpansTest(unittest.TestCase):
+  def test_span_lines_are_stripped(self):
+    output = "".join([
+      "Pulling viki_data/storm-ui\n",
+      _span_line("docker.run", 1.0, 2.0, via="api"),
+      '  {"span": "not json\n',
+      '{"status": "pulled"}\n',
+      _span_line("no end", 1.0, 2.0).replace('"end"', '"stop"'),
+      "done",
+    ])
+    spans, rest = timeline.parse_spans(output)
+    self.assertEqual(spans, [{timing.SPAN_KEY: "docker.run", "start": 1.0,
+      "end": 2.0, "via": "api"
+    }])
+    self.assertEqual(rest.splitlines(), [
+      "Pulling viki_data/storm-ui",
+      '  {"span": "not json',
+      '{"status": "pulled"}',
+      '{"span": "no end", "start": 1.0, "stop": 2.0}',
+      "done",
+    ])
+    self.assertEqual(timeline.parse_spans(None), ([], ""))
+
+class RemoteSpansTest(unittest.TestCase):
+  def test_spans_in_the_window_are_kept(self):
+    t = timeline.Timeline(1000.0)
+    t.add_remote_spans("sup-1", "supervisor", [
+      {timing.SPAN_KEY: "pull", "start": 1001.0, "end": 1004.0},
+    ], 1000.0, 1010.0)
+    self.assertEqual([(span["start"], span["end"]) for span in t.spans],
+      [(1001.0, 1004.0)]
+    )
+    self.assertEqual(t.spans[0]["host"], "sup-1")
+    self.assertEqual(t.spans[0]["component"], "supervisor")
+
+  def test_skewed_spans_are_shifted_into_the_window(self):
+    t = timeline.Timeline(1000.0)
+    # The host's clock is ahead by ~1000s
+    t.add_remote_spans("sup-1", "supervisor", [
+      {timing.SPAN_KEY: "pull", "start": 2000.0, "end": 2002.0},
+      {timing.SPAN_KEY: "run", "start": 2002.0, "end": 2006.0},
+    ], 1000.0, 1010.0)
+    # Centered on the window, keeping their durations and order
+    self.assertEqual([(span["start"], span["end"]) for span in t.spans],
+      [(1002.0, 1004.0), (1004.0, 1008.0)]
+    )
+
+  def test_container_spans_use_the_offset_of_their_host(self):
+    t = timeline.Timeline(1000.0)
+    t.add_remote_spans("sup-1", "supervisor", [
+      {timing.SPAN_KEY: "pull", "start": 2000.0, "end": 2002.0},
+    ], 1000.0, 1010.0)
+    report = rollout.RolloutReport()
+    report.waves.append(("supervisor", [
+      rollout.HostResult("sup-1", "supervisor", 1000.0, 1010.0),
+    ]))
+    executor = FakeExecutor(outputs={"docker logs": "".join([
+      # Left by an earlier run of the container
+      _span_line("entrypoint.storm", 1990.0, 1991.0),
+      _span_line("entrypoint.storm", 2005.0, 2007.0),
+    ])})
+    t.collect_container_spans(executor, report)
+    self.assertEqual(len(executor.commands), 1)
+    self.assertIn("docker logs supervisor", executor.commands[0][1])
+    containerSpans = [span for span in t.spans if "container" in span]
+    self.assertEqual([(span["start"], span["end"], span["container"])
+      for span in containerSpans], [(1009.0, 1011.0, "supervisor")]
+    )
+
+class TimedExecutorTest(unittest.TestCase):
+  def _run(self, executor):
+    t = timeline.Timeline()
+    task = t.wrap_task(lambda executor, host, component:
+      executor.run(host, "./start-storm.sh " + component)
+    )
+    return t, task(executor, "sup-1", "supervisor")
+
+  def test_spans_of_a_skewed_host(self):
+    executor = FakeExecutor(skew=3600.0)
+    t, output = self._run(executor)
+    self.assertEqual(output, "starting\nstarted\n")
+    self.assertEqual(executor.commands, [("sup-1",
+      "export {}=- && ./start-storm.sh supervisor".format(timing.TIMING_ENV)
+    )])
+    spans = dict((span[timing.SPAN_KEY], span) for span in t.spans)
+    self.assertEqual(sorted(spans), ["docker.run", "ssh", "task"])
+    ssh, remote = spans["ssh"], spans["docker.run"]
+    self.assertEqual(ssh["command"], "./start-storm.sh supervisor")
+    self.assertTrue(ssh["start"] <= remote["start"] <= remote["end"] <=
+      ssh["end"]
+    )
+    self.assertTrue(spans["task"]["start"] <= ssh["start"])
+
+  def test_failed_command(self):
+    executor = FakeExecutor(fail=True)
+    with self.assertRaises(rollout.RemoteCommandError) as cm:
+      self._run(executor)
+    self.assertEqual(cm.exception.output, "starting\nstarted\n")
+
+class SummaryTest(unittest.TestCase):
+  def test_critical_path(self):
+    t = timeline.Timeline(1000.0)
+    report = rollout.RolloutReport()
+    report.waves = [
+      ("zookeeper", [
+        rollout.HostResult("zk-1", "zookeeper", 1000.0, 1005.0),
+        rollout.HostResult("zk-2", "zookeeper", 1000.0, 1008.0),
+      ]),
+      ("nimbus", []),
+      ("supervisor", [
+        rollout.HostResult("sup-1", "supervisor", 1010.0, 1020.0),
+        rollout.HostResult("sup-2", "supervisor", 1012.0, 1015.0),
+      ]),
+    ]
+    t.add({timing.SPAN_KEY: "ssh", "start": 1000.5, "end": 1007.5,
+      "command": "export X=- && ./start-storm.sh zookeeper"},
+      "zk-2", "zookeeper"
+    )
+    t.add({timing.SPAN_KEY: "docker.run", "start": 1001.0, "end": 1003.0},
+      "zk-2", "zookeeper"
+    )
+    t.add({timing.SPAN_KEY: "gate", "start": 1008.0, "end": 1010.0,
+      "wave": "zookeeper", "ready": True}
+    )
+    t.add({timing.SPAN_KEY: "ssh", "start": 1010.0, "end": 1019.0,
+      "command": "./start-storm.sh supervisor"}, "sup-1", "supervisor"
+    )
+    t.add({timing.SPAN_KEY: "entrypoint.storm", "start": 1015.0,
+      "end": 1016.5, "container": "supervisor"}, "sup-1", "supervisor"
+    )
+    t.add({timing.SPAN_KEY: "task", "start": 1010.0, "end": 1020.0},
+      "sup-1", "supervisor"
+    )
+    self.assertEqual(t.summary(report), [
+      "rollout: 20.0s; critical path:",
+      "  zookeeper: 8.0s, waiting on zk-2 zookeeper (8.0s)",
+      "    ./start-storm.sh zookeeper: 7.0s; docker.run 2.0s",
+      "  zookeeper gate: 2.0s",
+      "  supervisor: 10.0s, waiting on sup-1 supervisor (10.0s)",
+      "    ./start-storm.sh supervisor: 9.0s",
+      "    container supervisor: entrypoint.storm 1.5s",
+      "slowest phases:",
+      "  ssh: max 9.0s (sup-1 supervisor), median 9.0s over 2 spans",
+      "  docker.run: max 2.0s (zk-2 zookeeper), median 2.0s over 1 spans",
+      "  entrypoint.storm: max 1.5s (sup-1 supervisor), median 1.5s over 1 "
+        "spans",
+    ])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,162 @@
+import os.path
+import socket
+import sys
+import threading
+import time
+import unittest
+
+try:
+  import socketserver
+except ImportError:
+  import SocketServer as socketserver
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(
+  os.path.abspath(__file__))), "zk-ambassador"
+))
+
+if sys.version_info >= (3, 5):
+  import asyncio
+  import zk_ambassador
+else:
+  # The relay runs on Python 3 (see `zk-ambassador/Dockerfile`)
+  zk_ambassador = None
+
+class EchoHandler(socketserver.BaseRequestHandler):
+  def handle(self):
+    while True:
+      data = self.request.recv(4096)
+      if not data:
+        break
+      self.request.sendall(data)
+
+class EchoServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+  """Stand-in Zookeeper server, echoing what it receives."""
+  daemon_threads = True
+  allow_reuse_address = True
+
+  def __init__(self):
+    socketserver.TCPServer.__init__(self, ("127.0.0.1", 0), EchoHandler)
+
+def _closed_port():
+  sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  sock.bind(("127.0.0.1", 0))
+  port = sock.getsockname()[1]
+  sock.close()
+  return port
+
+@unittest.skipIf(zk_ambassador is None, "zk_ambassador needs Python 3.5+")
+class UpstreamsFromEnvironTest(unittest.TestCase):
+  def test_links_and_ensemble(self):
+    upstreams = zk_ambassador.upstreams_from_environ({
+      "ZK_PORT_2181_TCP": "tcp://172.17.0.2:2181",
+      "ZK_PORT_2888_TCP": "tcp://172.17.0.2:2888",
+      "ZK_PORT_2181_TCP_ADDR": "172.17.0.2",
+      "ZK_ENSEMBLE": "10.0.0.1:2181, 172.17.0.2:2181,10.0.0.2:2181",
+    })
+    self.assertEqual(upstreams, {
+      2181: [("172.17.0.2", 2181), ("10.0.0.1", 2181), ("10.0.0.2", 2181)],
+      2888: [("172.17.0.2", 2888)],
+    })
+
+  def test_custom_client_port(self):
+    self.assertEqual(zk_ambassador.upstreams_from_environ({
+      "ZK_ENSEMBLE": "10.0.0.1:2182", "ZK_CLIENT_PORT": "2182",
+    }), {2182: [("10.0.0.1", 2182)]})
+
+@unittest.skipIf(zk_ambassador is None, "zk_ambassador needs Python 3.5+")
+class RelayTest(unittest.TestCase):
+  def setUp(self):
+    self.upstream = EchoServer()
+    self.upstreamThread = threading.Thread(target=self.upstream.serve_forever,
+      kwargs={"poll_interval": 0.05}
+    )
+    self.upstreamThread.daemon = True
+    self.upstreamThread.start()
+    self.upstreamAddress = self.upstream.server_address
+    self.loop = None
+
+  def tearDown(self):
+    if self.loop is not None:
+      self.loop.call_soon_threadsafe(self.loop.stop)
+      self.loopThread.join(5)
+      for server in self.servers:
+        server.close()
+      self.loop.close()
+    self.upstream.shutdown()
+    self.upstream.server_close()
+
+  def _start_relay(self, upstreams):
+    """Starts a relay to `upstreams` on an ephemeral port, returning that
+    port."""
+    self.metrics = zk_ambassador.Metrics()
+    self.loop = asyncio.new_event_loop()
+    self.servers = zk_ambassador.start_relays(self.loop, {0: upstreams},
+      self.metrics, host="127.0.0.1", log=None
+    )
+    self.loopThread = threading.Thread(target=self.loop.run_forever)
+    self.loopThread.daemon = True
+    self.loopThread.start()
+    return self.servers[0].sockets[0].getsockname()[1]
+
+  def _round_trip(self, port, payload=b"ruok"):
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    try:
+      sock.sendall(payload)
+      sock.shutdown(socket.SHUT_WR)
+      received = b""
+      while True:
+        data = sock.recv(4096)
+        if not data:
+          return received
+        received += data
+    finally:
+      sock.close()
+
+  def _closed_connections(self, count):
+    deadline = time.time() + 5
+    while len(self.metrics.recent) < count and time.time() < deadline:
+      time.sleep(0.01)
+    return [stats.as_dict() for stats in self.metrics.recent]
+
+  def test_forwarding(self):
+    port = self._start_relay([self.upstreamAddress])
+    self.assertEqual(self._round_trip(port, b"x" * 100000), b"x" * 100000)
+    closed, = self._closed_connections(1)
+    self.assertEqual(closed["upstream"], "{}:{}".format(*self.upstreamAddress))
+    self.assertEqual(closed["bytes_up"], 100000)
+    self.assertEqual(closed["bytes_down"], 100000)
+    self.assertEqual(closed["failovers"], 0)
+    self.assertFalse(closed["open"])
+
+  def test_failover(self):
+    port = self._start_relay([("127.0.0.1", _closed_port()),
+      self.upstreamAddress
+    ])
+    self.assertEqual(self._round_trip(port), b"ruok")
+    self.assertEqual(self._round_trip(port), b"ruok")
+    first, second = self._closed_connections(2)
+    self.assertEqual(first["failovers"], 1)
+    self.assertEqual(first["upstream"], "{}:{}".format(*self.upstreamAddress))
+    # The upstream which answered is tried first afterwards
+    self.assertEqual(second["failovers"], 0)
+    totals = self.metrics.snapshot()["ports"]["0"]
+    self.assertEqual(totals["connections"], 2)
+    self.assertEqual(totals["failovers"], 1)
+    self.assertEqual(totals["failed_connections"], 0)
+
+  def test_no_upstream_reachable(self):
+    port = self._start_relay([("127.0.0.1", _closed_port())])
+    sock = socket.create_connection(("127.0.0.1", port), timeout=5)
+    try:
+      # The relay hangs up on the client
+      self.assertEqual(sock.recv(4096), b"")
+    finally:
+      sock.close()
+    closed, = self._closed_connections(1)
+    self.assertIsNone(closed["upstream"])
+    self.assertEqual(self.metrics.snapshot()["ports"]["0"]
+      ["failed_connections"], 1
+    )
+
+if __name__ == "__main__":
+  unittest.main()
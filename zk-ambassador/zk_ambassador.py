@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+# TCP relay standing in for Zookeeper on a machine which does not run a
+# Zookeeper Docker container (and exposing Zookeeper's ports on the machine
+# which runs it without `-p` flags). Replaces the `svendowideit/ambassador`
+# image, and is configured the same way, through environment variables:
+#
+#     <ALIAS>_PORT_<PORT>_TCP=tcp://<HOST>:<UPSTREAM PORT>
+#
+# makes the relay listen on <PORT> and forward every connection to
+# <HOST>:<UPSTREAM PORT>. These are the variables set by Docker for a
+# `--link <container>:<alias>`, or given with `-e`.
+#
+# In addition, connections to the Zookeeper client port (`ZK_CLIENT_PORT`,
+# 2181 by default) fail over to the other members of the ensemble, listed as
+#
+#     ZK_ENSEMBLE=<HOST>:<PORT>,<HOST>:<PORT>,...
+#
+# when the upstream they would go to cannot be reached. Any Zookeeper server of
+# the ensemble can serve a client; the follower and election ports are not
+# failed over since they identify one particular server.
+#
+# Per-connection byte counters and upstream connect latencies, along with
+# per-port totals, are served as JSON over HTTP on `AMBASSADOR_METRICS_PORT`
+# (9180 by default; 0 disables it) and logged when each connection closes.
+
+import asyncio
+import collections
+import json
+import os
+import re
+import sys
+import time
+
+# Environment variable set by Docker links (or `-e`) for each relayed port
+PORT_ENV_VAR_REGEX = re.compile(r"^[A-Z0-9_]+_PORT_(\d+)_TCP$")
+
+DEFAULT_ZK_CLIENT_PORT = 2181
+DEFAULT_METRICS_PORT = 9180
+
+# Seconds to wait for an upstream connection before trying the next one
+CONNECT_TIMEOUT = 2.0
+
+# Size of the reads done by the relay
+READ_SIZE = 65536
+
+# Number of closed connections kept for the metrics endpoint
+RECENT_CONNECTIONS = 100
+
+def parse_address(address):
+  """Parses `host:port` or `tcp://host:port` into a (host, int port) tuple."""
+  if "://" in address:
+    address = address.split("://", 1)[1]
+  host, _, port = address.rpartition(":")
+  return host, int(port)
+
+def upstreams_from_environ(environ):
+  """Returns the relay configuration described by the environment.
+
+  Returns:
+    dict: listen port -> list of (host, port) upstreams, in the order they are
+      tried
+  """
+  upstreams = {}
+  for name, value in sorted(environ.items()):
+    match = PORT_ENV_VAR_REGEX.match(name)
+    if match and value.startswith("tcp://"):
+      upstreams.setdefault(int(match.group(1)), []).append(parse_address(value))
+
+  ensemble = [parse_address(member.strip())
+    for member in environ.get("ZK_ENSEMBLE", "").split(",") if member.strip()
+  ]
+  if ensemble:
+    clientPort = int(environ.get("ZK_CLIENT_PORT", DEFAULT_ZK_CLIENT_PORT))
+    clientUpstreams = upstreams.setdefault(clientPort, [])
+    for member in ensemble:
+      if member not in clientUpstreams:
+        clientUpstreams.append(member)
+  return upstreams
+
+class ConnectionStats(object):
+  """Counters of one relayed connection."""
+  def __init__(self, connectionId, listenPort, client):
+    self.connectionId = connectionId
+    self.listenPort = listenPort
+    self.client = client
+    self.upstream = None
+    self.openedAt = time.time()
+    self.closedAt = None
+    # Seconds taken to connect to the upstream
+    self.connectLatency = None
+    # Upstreams which could not be reached before `upstream`
+    self.failovers = 0
+    self.bytesUp = 0
+    self.bytesDown = 0
+
+  def as_dict(self):
+    end = self.closedAt if self.closedAt is not None else time.time()
+    return {
+      "id": self.connectionId,
+      "listen_port": self.listenPort,
+      "client": "{}:{}".format(*self.client[:2]) if self.client else None,
+      "upstream": "{}:{}".format(*self.upstream) if self.upstream else None,
+      "connect_latency_ms": None if self.connectLatency is None else
+        round(self.connectLatency * 1000.0, 3),
+      "failovers": self.failovers,
+      "bytes_up": self.bytesUp,
+      "bytes_down": self.bytesDown,
+      "duration_s": round(end - self.openedAt, 3),
+      "open": self.closedAt is None,
+    }
+
+class Metrics(object):
+  """Connection counters of the whole relay."""
+  def __init__(self):
+    self._nextId = 0
+    self.active = {}
+    self.recent = collections.deque(maxlen=RECENT_CONNECTIONS)
+    # listen port -> totals
+    self.totals = collections.defaultdict(lambda: {
+      "connections": 0, "failed_connections": 0, "failovers": 0,
+      "bytes_up": 0, "bytes_down": 0, "connect_latency_ms_sum": 0.0,
+    })
+
+  def open(self, listenPort, client):
+    self._nextId += 1
+    stats = ConnectionStats(self._nextId, listenPort, client)
+    self.active[stats.connectionId] = stats
+    self.totals[listenPort]["connections"] += 1
+    return stats
+
+  def close(self, stats):
+    stats.closedAt = time.time()
+    self.active.pop(stats.connectionId, None)
+    self.recent.append(stats)
+    totals = self.totals[stats.listenPort]
+    totals["failovers"] += stats.failovers
+    totals["bytes_up"] += stats.bytesUp
+    totals["bytes_down"] += stats.bytesDown
+    if stats.upstream is None:
+      totals["failed_connections"] += 1
+    else:
+      totals["connect_latency_ms_sum"] += stats.connectLatency * 1000.0
+
+  def snapshot(self):
+    return {
+      "ports": dict((str(port), dict(totals))
+        for port, totals in self.totals.items()
+      ),
+      "active": [stats.as_dict() for stats in self.active.values()],
+      "recent": [stats.as_dict() for stats in self.recent],
+    }
+
+class Relay(object):
+  """Relays the connections of one listen port to its upstreams."""
+  def __init__(self, listenPort, upstreams, metrics,
+      connectTimeout=CONNECT_TIMEOUT, log=None):
+    self.listenPort = listenPort
+    self.upstreams = list(upstreams)
+    self.metrics = metrics
+    self.connectTimeout = connectTimeout
+    self.log = log
+    # Index of the upstream which last accepted a connection; tried first
+    self._preferred = 0
+
+  async def _connect_upstream(self, stats):
+    count = len(self.upstreams)
+    for offset in range(count):
+      idx = (self._preferred + offset) % count
+      host, port = self.upstreams[idx]
+      startTime = time.time()
+      try:
+        reader, writer = await asyncio.wait_for(
+          asyncio.open_connection(host, port), self.connectTimeout
+        )
+      except (OSError, asyncio.TimeoutError):
+        stats.failovers += 1
+        continue
+      stats.connectLatency = time.time() - startTime
+      stats.upstream = (host, port)
+      self._preferred = idx
+      return reader, writer
+    return None, None
+
+  async def _pipe(self, reader, writer, stats, counter):
+    try:
+      while True:
+        data = await reader.read(READ_SIZE)
+        if not data:
+          break
+        writer.write(data)
+        setattr(stats, counter, getattr(stats, counter) + len(data))
+        await writer.drain()
+    except (OSError, asyncio.CancelledError):
+      pass
+    finally:
+      # Half-close, so the other side sees the end of the stream
+      try:
+        if writer.can_write_eof():
+          writer.write_eof()
+      except OSError:
+        pass
+
+  async def handle(self, clientReader, clientWriter):
+    stats = self.metrics.open(self.listenPort,
+      clientWriter.get_extra_info("peername")
+    )
+    upstreamReader, upstreamWriter = await self._connect_upstream(stats)
+    try:
+      if upstreamWriter is not None:
+        await asyncio.gather(
+          self._pipe(clientReader, upstreamWriter, stats, "bytesUp"),
+          self._pipe(upstreamReader, clientWriter, stats, "bytesDown"),
+        )
+    finally:
+      for writer in (clientWriter, upstreamWriter):
+        if writer is not None:
+          writer.close()
+      self.metrics.close(stats)
+      if self.log is not None:
+        self.log(stats)
+
+async def serve_metrics(metrics, reader, writer):
+  """Answers any HTTP request with the metrics snapshot."""
+  try:
+    # Read (and ignore) the request line and headers
+    while True:
+      line = await reader.readline()
+      if not line or line in (b"\r\n", b"\n"):
+        break
+    body = json.dumps(metrics.snapshot(), sort_keys=True).encode("utf-8")
+    writer.write(b"HTTP/1.0 200 OK\r\nContent-Type: application/json\r\n" +
+      "Content-Length: {}\r\n\r\n".format(len(body)).encode("ascii") + body
+    )
+    await writer.drain()
+  except OSError:
+    pass
+  finally:
+    writer.close()
+
+def log_connection(stats):
+  print(json.dumps(stats.as_dict(), sort_keys=True))
+
+def start_relays(loop, upstreams, metrics, host="0.0.0.0", log=log_connection):
+  """Starts listening on every relayed port.
+
+  Returns:
+    list of asyncio Server objects
+  """
+  servers = []
+  for listenPort, portUpstreams in sorted(upstreams.items()):
+    relay = Relay(listenPort, portUpstreams, metrics, log=log)
+    servers.append(loop.run_until_complete(
+      asyncio.start_server(relay.handle, host, listenPort)
+    ))
+  return servers
+
+def main():
+  upstreams = upstreams_from_environ(os.environ)
+  if not upstreams:
+    print("No `<ALIAS>_PORT_<PORT>_TCP` environment variables to relay",
+      file=sys.stderr
+    )
+    sys.exit(1)
+  loop = asyncio.new_event_loop()
+  asyncio.set_event_loop(loop)
+  metrics = Metrics()
+  start_relays(loop, upstreams, metrics)
+  for listenPort, portUpstreams in sorted(upstreams.items()):
+    print("relaying port {} to {}".format(listenPort, ", ".join(
+      "{}:{}".format(upstreamHost, upstreamPort)
+      for upstreamHost, upstreamPort in portUpstreams
+    )))
+  metricsPort = int(os.environ.get("AMBASSADOR_METRICS_PORT",
+    DEFAULT_METRICS_PORT
+  ))
+  if metricsPort:
+    loop.run_until_complete(asyncio.start_server(
+      lambda r, w: serve_metrics(metrics, r, w), "0.0.0.0", metricsPort
+    ))
+  loop.run_forever()
+
+if __name__ == "__main__":
+  main()
@@ -5,8 +5,22 @@ import os
 import os.path
 import re
 import subprocess
+import sys
 import yaml
 
+try:
+  # Added next to this script in the image
+  import timing
+except ImportError:
+  # Run from the storm-docker repository
+  sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+    ".."
+  ))
+  from docker_python_helpers import timing
+
+# Use the LibYAML based loader if PyYAML was built with it
+YamlLoader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
 # `storm-setup.yaml` file we added
 STORM_SETUP_YAML = os.environ["STORM_SETUP_YAML"]
 
@@ -16,12 +30,128 @@ ZK_CFG = os.environ["ZK_CFG"]
 # Zookeeper `dataDir`
 ZK_DATADIR = os.environ["ZK_DATADIR"]
 
+# Sourced by Zookeeper's `bin/zkEnv.sh`; used to set the JVM heap
+ZK_JAVA_ENV = os.path.join(os.path.dirname(ZK_CFG), "java.env")
+
+# Defaults for the `zookeeper.tuning` section of `storm-setup.yaml`
+DEFAULT_HEAP_FRACTION = 0.25
+DEFAULT_MIN_HEAP_MB = 256
+DEFAULT_MAX_HEAP_MB = 8192
+
+def memory_mb():
+  """Returns the memory available to this container in MB: the host's memory,
+  or the container's memory limit if it is lower."""
+  with open("/proc/meminfo") as f:
+    for line in f:
+      if line.startswith("MemTotal:"):
+        memoryMb = int(line.split()[1]) // 1024
+        break
+  try:
+    with open("/sys/fs/cgroup/memory/memory.limit_in_bytes") as f:
+      memoryMb = min(memoryMb, int(f.read().strip()) // (1024 * 1024))
+  except (IOError, ValueError):
+    pass
+  return memoryMb
+
+def read_zoo_cfg_keys(path):
+  """Returns the keys set in a `zoo.cfg` file."""
+  keys = set()
+  with open(path) as f:
+    for line in f:
+      line = line.strip()
+      if line and not line.startswith("#") and "=" in line:
+        keys.add(line.split("=", 1)[0].strip())
+  return keys
+
+def zookeeper_tuning(tuningConfig, setupConfig, memoryMb, tickTime):
+  """Derives Zookeeper settings from the host's memory, the ensemble size and
+  the expected number of clients (supervisor hosts x worker slots, plus the
+  supervisors themselves, one per supervisor container, and Nimbus, the UI and
+  DRPC).
+
+  Args:
+    tuningConfig(dict): the `zookeeper.tuning` section of `storm-setup.yaml`
+    setupConfig(dict): the whole `storm-setup.yaml` file
+    memoryMb(int): memory available to this container, in MB
+    tickTime(int): Zookeeper's `tickTime`, in milliseconds
+
+  Returns:
+    (int, dict): JVM heap size in MB, and `zoo.cfg` key -> value
+  """
+  ensembleSize = len(setupConfig["storm.yaml"]["storm.zookeeper.servers"])
+  supervisorHostList = setupConfig.get("storm.supervisor.hosts") or []
+  supervisorHosts = len(supervisorHostList)
+  # Supervisor containers of each supervisor host (see
+  # `docker_python_helpers/supervisor_containers.py`)
+  containersConfig = setupConfig.get("storm.supervisor.containers") or {}
+  containerCounts = [int(((containersConfig.get("servers") or {}).get(host) or
+    {}).get("count", containersConfig.get("count", 1)))
+    for host in supervisorHostList
+  ]
+  slotsPerSupervisor = tuningConfig.get("slots.per.supervisor")
+  if slotsPerSupervisor is None:
+    slotsPerSupervisor = (setupConfig.get("storm.supervisor.slots") or {}).get(
+      "max.slots", len(setupConfig["storm.yaml"].get("supervisor.slots.ports",
+        [6700, 6701, 6702, 6703]
+      ))
+    )
+  expectedClients = tuningConfig.get("expected.clients",
+    supervisorHosts * slotsPerSupervisor + sum(containerCounts) + 3
+  )
+  # Clients are spread over the ensemble, but a server must be able to take
+  # over the clients of a failed one
+  clientsPerServer = min(expectedClients,
+    2 * ((expectedClients + ensembleSize - 1) // ensembleSize)
+  )
+
+  heapMb = tuningConfig.get("heap.mb")
+  if heapMb is None:
+    heapMb = int(memoryMb * tuningConfig.get("heap.fraction",
+      DEFAULT_HEAP_FRACTION
+    ))
+    heapMb = max(tuningConfig.get("min.heap.mb", DEFAULT_MIN_HEAP_MB),
+      min(heapMb, tuningConfig.get("max.heap.mb", DEFAULT_MAX_HEAP_MB))
+    )
+
+  # Worker heartbeats are the bulk of Storm's writes, one every few seconds per
+  # worker: snapshot about every 10 minutes of heartbeats
+  snapCount = max(100000, min(expectedClients * 200, 1000000))
+  settings = {
+    "snapCount": snapCount,
+    # Preallocate the transaction log for a whole snapshot interval, at about
+    # 1 KB per heartbeat (in KB)
+    "preAllocSize": max(65536, min(snapCount, 1048576)),
+    # Room for 10 queued requests per client, bounded by about 10 requests per
+    # MB of heap
+    "globalOutstandingLimit": max(1000,
+      min(clientsPerServer * 10, heapMb * 10)
+    ),
+    # Connections from a single IP address: every worker and the supervisors
+    # of a supervisor host (plus Nimbus, the UI and DRPC), twice over for
+    # reconnects
+    "maxClientCnxns": max(60,
+      2 * (slotsPerSupervisor + max(containerCounts or [1]) + 3)
+    ),
+    # Fsyncs longer than a quarter of a tick delay heartbeats enough to be
+    # worth a warning
+    "fsync.warningthresholdms": max(50, tickTime // 4),
+  }
+  for key in settings:
+    if key in tuningConfig:
+      settings[key] = tuningConfig[key]
+  return heapMb, settings
+
+# Spans of the phases of this script go to `docker logs` (see `timing.py`)
+timing.set_default_destination("-")
+phases = timing.Phases("entrypoint.zookeeper")
+phases.start("load_config")
+
 # Opens the `storm-setup.yaml` file added to this Docker container. The file was
 # copied from the `config/storm-setup.yaml` file in the storm-docker repository
 # during a `make` execution.
 stormSetupConfig = None
 with open(STORM_SETUP_YAML, "r") as f:
-  stormSetupConfig = yaml.load(f.read())
+  stormSetupConfig = yaml.load(f.read(), Loader=YamlLoader)
 
 parser = argparse.ArgumentParser(
   description="Configures and runs Zookeeper"
@@ -35,6 +165,15 @@ parser.add_argument("--my-ip-address", action="append",
 
 parsedArgs = parser.parse_args()
 
+# With `network_mode: host`, this container shares the network stack of the
+# host machine and binds the host's IP address directly
+hostNetwork = stormSetupConfig.get("network_mode") == "host"
+if hostNetwork:
+  # sshd would compete with the host's own for port 22
+  sshConf = "/etc/supervisor/conf.d/ssh.conf"
+  if os.path.exists(sshConf):
+    os.remove(sshConf)
+
 # IP addresses supplied in the `docker run` command
 myIpAddresses = parsedArgs.my_ip_addresses
 
@@ -64,6 +203,8 @@ if myId is None:
     """.format(STORM_SETUP_YAML)
   ))
 
+phases.start("write_config")
+
 # Add `clientPort` to the Zookeeper configuration file at this point, because
 # we allow the user to change the `storm.zookeeper.port`
 with open(ZK_CFG, "a") as f:
@@ -71,6 +212,27 @@ with open(ZK_CFG, "a") as f:
     stormSetupConfig["storm.yaml"]["storm.zookeeper.port"]
   ))
 
+# Tune Zookeeper for this host and the size of the Storm cluster. Keys already
+# present in `config/zoo.cfg`, and values given in the `zookeeper.tuning`
+# section, win over derived ones.
+if "zookeeper.tuning" in stormSetupConfig:
+  zooCfgKeys = read_zoo_cfg_keys(ZK_CFG)
+  tickTime = 2000
+  with open(ZK_CFG) as f:
+    for line in f:
+      if line.strip().startswith("tickTime="):
+        tickTime = int(line.split("=", 1)[1])
+  heapMb, tuningSettings = zookeeper_tuning(
+    stormSetupConfig["zookeeper.tuning"] or {}, stormSetupConfig, memory_mb(),
+    tickTime
+  )
+  with open(ZK_CFG, "a") as f:
+    for key, value in sorted(tuningSettings.items()):
+      if key not in zooCfgKeys:
+        f.write("{}={}\n".format(key, value))
+  with open(ZK_JAVA_ENV, "a") as f:
+    f.write('export JVMFLAGS="-Xms{0}m -Xmx{0}m $JVMFLAGS"\n'.format(heapMb))
+
 # Differentiate between a multiple and single Zookeeper setup
 if len(zkIpAddresses) > 1:
   # A multiple Zookeeper setup requires a `myid` file in the dataDir (whose
@@ -88,28 +250,45 @@ if len(zkIpAddresses) > 1:
   #
   # If we do not use the Docker IP address, Zookeeper will not properly bind to
   # the election port (normally 3888 by convention).
-  proc = subprocess.Popen(["hostname", "-i"], stdout=subprocess.PIPE)
-  dockerIp, _ = proc.communicate()
-  dockerIp = dockerIp.strip()
+  #
+  # On the host network, the host IP address can be bound as is.
+  if hostNetwork:
+    dockerIp = zkIpAddresses[myId]
+  else:
+    proc = subprocess.Popen(["hostname", "-i"], stdout=subprocess.PIPE)
+    dockerIp, _ = proc.communicate()
+    dockerIp = dockerIp.strip()
 
   # Obtain the Zookeeper follower and election ports
-  zkFollowerPort = stormSetupConfig["zookeeper.multiple.setup"]["follower.port"]
-  zkElectionPort = stormSetupConfig["zookeeper.multiple.setup"]["election.port"]
+  zkMultipleSetup = stormSetupConfig["zookeeper.multiple.setup"]
+  zkFollowerPort = zkMultipleSetup["follower.port"]
+  zkElectionPort = zkMultipleSetup["election.port"]
+
+  # Zookeeper servers which are observers: they serve clients and follow the
+  # leader, but do not vote, so that adding them does not slow down writes
+  zkObservers = set(zkMultipleSetup.get("observers") or [])
+  zkServerIsObserver = [zk_server in zkObservers for zk_server in
+    stormSetupConfig["storm.yaml"]["storm.zookeeper.servers"]
+  ]
 
   # Append the list of Zookeeper IP addresses to $ZK_CFG file
   with open(ZK_CFG, "a") as f:
+    if zkServerIsObserver[myId]:
+      f.write("peerType=observer\n")
     for (idx, zkIpAddr) in enumerate(zkIpAddresses):
+      peerTypeSuffix = ":observer" if zkServerIsObserver[idx] else ""
       if idx == myId:
         # This is the entry for the current server. We use the Docker IP address
         # in place of the host IP address.
-        f.write("server.{}={}:{}:{}\n".format(idx + 1, dockerIp, zkFollowerPort,
-          zkElectionPort
+        f.write("server.{}={}:{}:{}{}\n".format(idx + 1, dockerIp,
+          zkFollowerPort, zkElectionPort, peerTypeSuffix
         ))
       else:
         # Zookeeper entry for another server. Use its original IP address.
-        f.write("server.{}={}:{}:{}\n".format(idx + 1, zkIpAddr, zkFollowerPort,
-          zkElectionPort
+        f.write("server.{}={}:{}:{}{}\n".format(idx + 1, zkIpAddr,
+          zkFollowerPort, zkElectionPort, peerTypeSuffix
         ))
 
 # Start supervisord
+phases.end()
 os.system("supervisord")